@@ -0,0 +1,56 @@
+"""Benchmark cold (YAML) vs warm (snapshot) configuration loading.
+
+Run from the source tree with ``python -m benchmarks.config_load``.
+
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+
+from sshoot.config import (
+    Config,
+    yaml_dump,
+)
+
+SIZES = (10, 1000, 50000)
+
+
+def make_profiles(count: int):
+    """Return config for the specified number of profiles."""
+    return {
+        f"profile-{i}": {
+            "subnets": [f"10.{i // 256 % 256}.{i % 256}.0/24"],
+            "remote": f"host-{i}.example.com",
+            "auto-hosts": bool(i % 2),
+            "exclude-subnets": [f"10.{i // 256 % 256}.{i % 256}.128/25"],
+        }
+        for i in range(count)
+    }
+
+
+def timed_load(config: Config) -> float:
+    start = time.perf_counter()
+    config.load()
+    return time.perf_counter() - start
+
+
+def main():
+    print(
+        f"{'profiles':>10} {'cold (ms)':>12} {'warm (ms)':>12} {'speedup':>8}"
+    )
+    for size in SIZES:
+        with TemporaryDirectory() as tempdir:
+            path = Path(tempdir)
+            (path / "profiles.yaml").write_text(yaml_dump(make_profiles(size)))
+            snapshot_file = path / "config.snapshot"
+            cold = timed_load(Config(path, snapshot_file=snapshot_file))
+            warm = timed_load(Config(path, snapshot_file=snapshot_file))
+        print(
+            f"{size:>10} {cold * 1000:>12.2f} {warm * 1000:>12.2f}"
+            f" {cold / warm:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Benchmark single profile lookup with growing inventories.
+
+Run from the source tree with ``python -m benchmarks.profile_lookup``.
+
+"""
+
+from tempfile import TemporaryDirectory
+import timeit
+
+from sshoot.manager import Manager
+from sshoot.profile import Profile
+
+SIZES = (10, 1000, 10000, 100000)
+LOOKUPS = 10000
+
+
+def main():
+    print(f"{'profiles':>10} {'copy (us)':>12} {'lookup (us)':>12}")
+    for size in SIZES:
+        with TemporaryDirectory() as tempdir:
+            manager = Manager(
+                config_path=tempdir, rundir=tempdir, cache_path=tempdir
+            )
+            config = manager._config
+            for i in range(size):
+                config.add_profile(f"profile-{i}", Profile(["10.0.0.0/8"]))
+            name = f"profile-{size // 2}"
+            copy = timeit.timeit(lambda: config.profiles[name], number=LOOKUPS)
+            lookup = timeit.timeit(
+                lambda: manager.get_profile(name), number=LOOKUPS
+            )
+        print(
+            f"{size:>10} {copy / LOOKUPS * 1e6:>12.3f}"
+            f" {lookup / LOOKUPS * 1e6:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark profile restart latency, with and without pidfd support.
+
+A fake sshuttle executable that daemonizes and writes its pidfile is used,
+so the benchmark measures sshoot overhead rather than the SSH connection.
+
+Run from the source tree with ``python -m benchmarks.restart_latency``.
+
+"""
+
+from pathlib import Path
+import statistics
+import sys
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+import time
+from unittest import mock
+
+from sshoot.manager import Manager
+
+RUNS = 10
+
+FAKE_SSHUTTLE = dedent(
+    f"""\
+    #!{sys.executable}
+    import os, signal, sys, time
+
+    def cleanup(*args):
+        os.unlink(pidfile)
+        sys.exit(0)
+
+    pidfile = sys.argv[sys.argv.index("--pidfile") + 1]
+    signal.signal(signal.SIGTERM, cleanup)
+    pid = os.fork()
+    if pid:
+        with open(pidfile, "w") as fh:
+            fh.write(str(pid))
+        sys.exit(0)
+    os.setsid()
+    time.sleep(3600)
+    """
+)
+
+
+def time_restarts(manager: Manager) -> list:
+    manager.start_profile("profile")
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        manager.restart_profile("profile")
+        timings.append(time.perf_counter() - start)
+    manager.stop_profile("profile")
+    return timings
+
+
+def main():
+    with TemporaryDirectory() as tempdir:
+        path = Path(tempdir)
+        executable = path / "sshuttle"
+        executable.write_text(FAKE_SSHUTTLE)
+        executable.chmod(0o755)
+        manager = Manager(config_path=path, rundir=path, cache_path=path)
+        manager.load_config()
+        manager.create_profile("profile", {"subnets": ["10.0.0.0/8"]})
+        manager._get_executable = lambda: str(executable)
+
+        print(f"{'method':>8} {'median (ms)':>12} {'max (ms)':>10}")
+        for method in ("pidfd", "poll"):
+            if method == "poll":
+                with mock.patch("sshoot.manager.pidfd_open") as pidfd_open:
+                    pidfd_open.return_value = None
+                    timings = time_restarts(manager)
+            else:
+                timings = time_restarts(manager)
+            print(
+                f"{method:>8} {statistics.median(timings) * 1000:>12.1f}"
+                f" {max(timings) * 1000:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
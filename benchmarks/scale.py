@@ -0,0 +1,247 @@
+"""Benchmark configuration, listing and completion with large inventories.
+
+Synthetic inventories of profiles are generated for each size, and common
+operations are timed on them. Results can be saved as a JSON baseline, and
+compared against a previous one, reporting operations that got slower by
+more than a threshold (the exit code is 1 if any did).
+
+Run from the source tree with ``python -m benchmarks.scale``, for instance:
+
+    python -m benchmarks.scale --save baseline.json
+    python -m benchmarks.scale --compare baseline.json --threshold 20
+
+"""
+
+from argparse import (
+    ArgumentParser,
+    Namespace,
+)
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+from tempfile import TemporaryDirectory
+import time
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from unittest import mock
+
+from sshoot import manager as manager_module
+from sshoot.autocomplete import (
+    COMPLETION_INDEX,
+    CompletionIndex,
+    profile_completer,
+)
+from sshoot.config import (
+    Config,
+    yaml_dump,
+)
+from sshoot.listing import ProfileListing
+from sshoot.manager import Manager
+
+SIZES = (10, 1000, 10000, 100000)
+
+# Minimum total time and maximum number of runs for each operation
+MIN_TIME = 0.2
+MAX_RUNS = 1000
+
+# Default regression threshold, in percent
+THRESHOLD = 20.0
+
+# Results as operation durations in seconds, by inventory size
+Results = Dict[str, Dict[str, float]]
+
+
+def make_profiles(count: int) -> Dict[str, dict]:
+    """Return config for the specified number of profiles."""
+    return {
+        f"profile-{i}": {
+            "subnets": [f"10.{i // 256 % 256}.{i % 256}.0/24"],
+            "remote": f"host-{i}.example.com",
+            "auto-hosts": bool(i % 2),
+            "exclude-subnets": [f"10.{i // 256 % 256}.{i % 256}.128/25"],
+        }
+        for i in range(count)
+    }
+
+
+def timed(func: Callable[[], object]) -> float:
+    """Return the shortest duration of calls to a function.
+
+    The function is called repeatedly until the total time reaches
+    MIN_TIME, up to MAX_RUNS times. As with timeit, the shortest duration
+    is the least affected by other load on the system.
+
+    """
+    durations: List[float] = []
+    total = 0.0
+    while total < MIN_TIME and len(durations) < MAX_RUNS:
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+        total += durations[-1]
+    return min(durations)
+
+
+def operations(path: Path, size: int) -> Iterator[Tuple[str, float]]:
+    """Time operations on an inventory of the given size in a directory."""
+    config_path = path / "config"
+    rundir = path / "run"
+    config_path.mkdir()
+    (config_path / "profiles.yaml").write_text(yaml_dump(make_profiles(size)))
+
+    yield "config.load", timed(lambda: Config(config_path).load())
+    snapshot_file = rundir / "config.snapshot"
+    rundir.mkdir()
+    Config(config_path, snapshot_file=snapshot_file).load()
+    yield "config.load-snapshot", timed(
+        lambda: Config(config_path, snapshot_file=snapshot_file).load()
+    )
+    source = Config(config_path)
+    source.load()
+    (path / "saved").mkdir()
+    config = Config(path / "saved")
+    for name, profile in source.profiles.items():
+        config.add_profile(name, profile)
+    yield "config.save", timed(config.save)
+
+    manager = Manager(
+        config_path=str(config_path),
+        rundir=str(rundir),
+        cache_path=str(rundir),
+    )
+    manager.load_config()
+    name = f"profile-{size // 2}"
+    yield "manager.get_profile", timed(lambda: manager.get_profile(name))
+    yield "manager.get_cmdline", timed(lambda: manager.get_cmdline(name))
+
+    listing = ProfileListing(manager)
+    for output_format in ProfileListing.supported_formats():
+        yield f"listing.{output_format}", timed(
+            lambda: listing.get_output(output_format)
+        )
+    yield "listing.table-verbose", timed(
+        lambda: listing.get_output("table", verbose=True)
+    )
+
+    prefix = name[:-1]
+    args = Namespace(config=str(config_path))
+    with mock.patch.object(
+        manager_module, "get_rundir", return_value=rundir
+    ), mock.patch.object(manager_module, "DEFAULT_CACHE_PATH", rundir):
+        yield "profile_completer", timed(
+            lambda: list(profile_completer(prefix, args))
+        )
+    index = CompletionIndex(rundir / COMPLETION_INDEX, manager.sessions_path)
+    assert index.complete(config_path / "profiles.yaml", prefix) is not None
+    yield "completion_index", timed(
+        lambda: index.complete(config_path / "profiles.yaml", prefix)
+    )
+
+
+def run(sizes: List[int]) -> Results:
+    """Run benchmarks for inventory sizes, printing out durations."""
+    results: Results = {}
+    for size in sizes:
+        with TemporaryDirectory() as tempdir:
+            results[str(size)] = timings = {}
+            for operation, duration in operations(Path(tempdir), size):
+                timings[operation] = duration
+                print(f"{size:>8} {operation:<24} {duration * 1000:>12.3f}")
+    return results
+
+
+def compare(
+    results: Results, baseline: Results, threshold: float
+) -> List[Tuple[str, str, float]]:
+    """Print out a comparison with baseline results.
+
+    Return regressions, as (size, operation, change percent) for operations
+    that got slower by more than the threshold percentage.
+
+    """
+    regressions = []
+    print(
+        f"{'size':>8} {'operation':<24} {'base (ms)':>12} {'now (ms)':>12}"
+        f" {'change':>8}"
+    )
+    for size, timings in results.items():
+        for operation, duration in timings.items():
+            base = baseline.get(size, {}).get(operation)
+            if not base:
+                continue
+            change = (duration / base - 1) * 100
+            flag = ""
+            if change > threshold:
+                regressions.append((size, operation, change))
+                flag = "  REGRESSION"
+            print(
+                f"{size:>8} {operation:<24} {base * 1000:>12.3f}"
+                f" {duration * 1000:>12.3f} {change:>+7.1f}%{flag}"
+            )
+    return regressions
+
+
+def parse_args(args: Optional[List[str]] = None) -> Namespace:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=list(SIZES),
+        help="inventory sizes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--save", type=Path, help="save results as a JSON baseline"
+    )
+    parser.add_argument(
+        "--compare", type=Path, help="compare results with a JSON baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="slowdown percentage reported as regression "
+        "(default: %(default)s)",
+    )
+    return parser.parse_args(args)
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    options = parse_args(args)
+    print(f"{'size':>8} {'operation':<24} {'time (ms)':>12}")
+    results = run(options.sizes)
+    if options.save:
+        options.save.write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "cpus": os.cpu_count(),
+                    "results": results,
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+    if not options.compare:
+        return 0
+
+    print()
+    baseline = json.loads(options.compare.read_text())["results"]
+    regressions = compare(results, baseline, options.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regressions above {options.threshold}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
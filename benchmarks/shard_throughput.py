@@ -0,0 +1,178 @@
+"""Benchmark throughput of a profile split into a varying number of shards.
+
+A fake sshuttle executable stands in for the real one: like sshuttle, it's
+a single-threaded process relaying connections for its subnets, and it
+compresses the data it forwards to stand in for encryption work. Clients
+for each subnet send data through the shard routing it to a local sink,
+so the benchmark shows how throughput scales with processes rather than
+measuring a real SSH tunnel.
+
+Run from the source tree with ``python -m benchmarks.shard_throughput``.
+
+"""
+
+import json
+import os
+from pathlib import Path
+import socket
+import sys
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+import threading
+import time
+
+from sshoot.manager import Manager
+
+# Duration of each measurement, in seconds
+DURATION = 2.0
+
+SUBNETS = [f"10.0.{i}.0/24" for i in range(8)]
+
+CHUNK = os.urandom(1024) * 64
+
+FAKE_SSHUTTLE = dedent(
+    f"""\
+    #!{sys.executable}
+    import json, os, selectors, signal, socket, sys, zlib
+
+    def cleanup(*args):
+        os.unlink(pidfile)
+        sys.exit(0)
+
+    args = sys.argv[1:]
+    pidfile = args[args.index("--pidfile") + 1]
+    subnets = args[: args.index("--daemon")]
+    server = socket.create_server(("127.0.0.1", 0))
+    pid = os.fork()
+    if pid:
+        with open(pidfile + ".info", "w") as fh:
+            json.dump(
+                {{"port": server.getsockname()[1], "subnets": subnets}}, fh
+            )
+        with open(pidfile, "w") as fh:
+            fh.write(str(pid))
+        sys.exit(0)
+    os.setsid()
+    signal.signal(signal.SIGTERM, cleanup)
+
+    # relay connections to the port sent as first line, in a single thread
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    upstreams = {{}}
+    while True:
+        for key, _ in selector.select():
+            sock = key.fileobj
+            if sock is server:
+                conn, _ = server.accept()
+                port = int(conn.makefile("rb").readline())
+                upstreams[conn] = socket.create_connection(("127.0.0.1", port))
+                selector.register(conn, selectors.EVENT_READ)
+                continue
+            data = sock.recv(65536)
+            if not data:
+                selector.unregister(sock)
+                upstreams.pop(sock).close()
+                sock.close()
+                continue
+            zlib.compress(data, 6)
+            upstreams[sock].sendall(data)
+    """
+)
+
+
+class Sink:
+    """Server discarding received data, counting bytes."""
+
+    def __init__(self):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.received = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            conn, _ = self.server.accept()
+            threading.Thread(
+                target=self._receive, args=(conn,), daemon=True
+            ).start()
+
+    def _receive(self, conn: socket.socket):
+        with conn:
+            while True:
+                size = len(conn.recv(1024 * 1024))
+                if not size:
+                    return
+                with self._lock:
+                    self.received += size
+
+
+def send(port: int, sink_port: int, deadline: float):
+    """Send data through a shard until the deadline."""
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(f"{sink_port}\n".encode())
+        while time.monotonic() < deadline:
+            sock.sendall(CHUNK)
+
+
+def shard_ports(sessions_path: Path) -> dict:
+    """Return a dict mapping subnets to the port of their shard."""
+    ports = {}
+    for path in sessions_path.glob("profile.pid*.info"):
+        info = json.loads(path.read_text())
+        ports.update((subnet, info["port"]) for subnet in info["subnets"])
+    return ports
+
+
+def measure(manager: Manager, sink: Sink, shards: int) -> float:
+    """Return throughput in MB/s for the profile with a number of shards."""
+    manager.get_profile("profile").shards = shards
+    manager.start_profile("profile")
+    try:
+        ports = shard_ports(manager.sessions_path)
+        received = sink.received
+        start = time.monotonic()
+        threads = [
+            threading.Thread(
+                target=send,
+                args=(ports[subnet], sink.port, start + DURATION),
+            )
+            for subnet in SUBNETS
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        return (sink.received - received) / elapsed / 1e6
+    finally:
+        manager.stop_profile("profile")
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    with TemporaryDirectory() as tempdir:
+        path = Path(tempdir)
+        executable = path / "sshuttle"
+        executable.write_text(FAKE_SSHUTTLE)
+        executable.chmod(0o755)
+        manager = Manager(config_path=path, rundir=path, cache_path=path)
+        manager.load_config()
+        manager.create_profile("profile", {"subnets": SUBNETS})
+        manager._get_executable = lambda: str(executable)
+        sink = Sink()
+
+        print(f"{cpus} CPUs")
+        print(f"{'shards':>6} {'MB/s':>8} {'speedup':>8}")
+        baseline = None
+        for shards in (1, 2, 4, 8):
+            throughput = measure(manager, sink, shards)
+            baseline = baseline or throughput
+            print(
+                f"{shards:>6} {throughput:>8.1f}"
+                f" {throughput / baseline:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,8 @@
 """Manage multiple sshuttle VPN sessions."""
 
+from time import perf_counter
+
+# When the package started being imported, to trace import time
+IMPORT_TIME = perf_counter()
+
 __version__ = "1.6.0"
@@ -1,3 +1,3 @@
-from .main import sshoot
+from .cli import sshoot
 
 sshoot()
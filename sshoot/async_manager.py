@@ -0,0 +1,379 @@
+"""Handle sshuttle sessions from asyncio applications."""
+
+import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
+import os
+import signal
+from subprocess import PIPE
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    ContextManager,
+    Dict,
+    List,
+    Optional,
+    TypeVar,
+)
+
+from .i18n import _
+from .manager import (
+    Manager,
+    ManagerProfileError,
+    OutputBuffer,
+    ProcessKillFail,
+    start_failed,
+)
+from .profile import Profile
+from .runtime import (
+    KILL_SIGNALS,
+    pidfd_open,
+)
+
+_T = TypeVar("_T")
+
+# How long to wait for output after a process has exited
+OUTPUT_DRAIN_TIMEOUT = 0.1
+
+
+class AsyncManager:
+    """Profile manager for asyncio applications.
+
+    Configuration is handled by a :class:`Manager`, which can be shared with
+    synchronous code. Operations that involve waiting for processes or
+    accessing files don't block the event loop.
+
+    """
+
+    def __init__(
+        self,
+        manager: Optional[Manager] = None,
+        config_path: Optional[str] = None,
+        rundir: Optional[str] = None,
+        cache_path: Optional[str] = None,
+    ):
+        if manager is None:
+            manager = Manager(
+                config_path=config_path, rundir=rundir, cache_path=cache_path
+            )
+        self.manager = manager
+        self._ssh_master_locks: Dict[Optional[str], asyncio.Lock] = {}
+
+    async def load_config(self):
+        """Load configuration from file."""
+        await _run_in_executor(self.manager.load_config)
+
+    async def create_profile(self, name: str, details: Dict[str, Any]):
+        """Create a profile with provided details."""
+        await _run_in_executor(self.manager.create_profile, name, details)
+
+    async def remove_profile(self, name: str):
+        """Remove profile with given name."""
+        await _run_in_executor(self.manager.remove_profile, name)
+
+    def get_profiles(self) -> Dict[str, Profile]:
+        """Return profiles defined in config."""
+        return self.manager.get_profiles()
+
+    def get_profile(self, name: str) -> Profile:
+        """Return profile with given name."""
+        return self.manager.get_profile(name)
+
+    def get_cmdline(
+        self,
+        name: str,
+        extra_args: Optional[List[str]] = None,
+        disable_global_extra_options: bool = False,
+    ) -> List[str]:
+        """Return the command line for the specified profile."""
+        return self.manager.get_cmdline(
+            name,
+            extra_args=extra_args,
+            disable_global_extra_options=disable_global_extra_options,
+        )
+
+    def get_cmdlines(
+        self,
+        name: str,
+        extra_args: Optional[List[str]] = None,
+        disable_global_extra_options: bool = False,
+    ) -> List[List[str]]:
+        """Return command lines for each shard of the specified profile."""
+        return self.manager.get_cmdlines(
+            name,
+            extra_args=extra_args,
+            disable_global_extra_options=disable_global_extra_options,
+        )
+
+    async def start_profile(
+        self,
+        name: str,
+        extra_args: Optional[List[str]] = None,
+        disable_global_extra_options: bool = False,
+    ):
+        """Start profile with given name."""
+        if await self.is_running(name):
+            raise ManagerProfileError(_("Profile is already running"))
+        if self.manager.conflict_policy == "refuse":
+            await _run_in_executor(self.manager.refuse_conflicts, name)
+
+        cmdlines, subnets_files = self.manager.get_session_cmdlines(
+            name,
+            extra_args=extra_args,
+            disable_global_extra_options=disable_global_extra_options,
+        )
+        remote = self.manager.get_multiplexed_remote(
+            name, extra_args, disable_global_extra_options
+        )
+        await _run_in_executor(
+            self.manager.prepare_session, name, len(cmdlines), subnets_files
+        )
+        start = time.monotonic()
+        try:
+            async with self._ssh_master(name, remote):
+                # the first shard is started last, so that the session is
+                # only running once all shards are
+                for cmdline in reversed(cmdlines):
+                    await self._spawn(name, cmdline)
+        except ManagerProfileError:
+            await _run_in_executor(self.manager.abort_session, name)
+            raise
+
+        await self._record_latency("start", start)
+        await _run_in_executor(self.manager.update_completion_index)
+
+    async def _spawn(self, name: str, cmdline: List[str]):
+        """Run sshuttle for a shard of a profile, until it daemonizes."""
+        loop = asyncio.get_running_loop()
+        with self.manager.output_buffer(name) as output:
+            try:
+                transport, protocol = await loop.subprocess_exec(
+                    partial(_CaptureProtocol, loop, output),
+                    *cmdline,
+                    stdin=None,
+                    stdout=None,
+                    stderr=PIPE,
+                )
+            except OSError as err:
+                # To catch file not found errors
+                raise start_failed(str(err))
+
+            # Wait until process is started (it daemonizes)
+            try:
+                await protocol.wait()
+            finally:
+                transport.close()
+            if transport.get_returncode() != 0:
+                raise start_failed(output.getvalue())
+
+    async def stop_profile(self, name: str, release_ssh_master: bool = True):
+        """Stop profile with given name.
+
+        If `release_ssh_master` is false, the shared SSH master connection
+        for the profile remote is kept running even if no other session
+        uses it.
+
+        """
+        self.get_profile(name)
+
+        pid = await _run_in_executor(self.manager.get_pid, name)
+        if pid is None:
+            raise ManagerProfileError(_("Profile is not running"))
+
+        await _run_in_executor(self.manager.set_stopped, name)
+        start = time.monotonic()
+        try:
+            await kill_and_wait(pid)
+            await _run_in_executor(self.manager.stop_shards, name)
+        except (OSError, ProcessKillFail) as error:
+            raise ManagerProfileError(
+                _("Failed to stop profile: {error}").format(error=error)
+            )
+        await _run_in_executor(self.manager.remove_subnets_files, name)
+        if release_ssh_master:
+            async with self._ssh_master_lock(self.get_profile(name).remote):
+                await _run_in_executor(self.manager.release_ssh_master, name)
+        await self._record_latency("stop", start)
+        await _run_in_executor(self.manager.update_completion_index)
+
+    async def restart_profile(
+        self,
+        name: str,
+        extra_args: Optional[List[str]] = None,
+        disable_global_extra_options: bool = False,
+    ):
+        """Restart profile with given name.
+
+        The shared SSH master connection for the profile is kept running
+        across the restart.
+
+        """
+        if self.manager.conflict_policy == "refuse":
+            # refuse before stopping, so that the profile is kept running
+            await _run_in_executor(self.manager.refuse_conflicts, name)
+        if await self.is_running(name):
+            await self.stop_profile(name, release_ssh_master=False)
+        await self.start_profile(
+            name,
+            extra_args=extra_args,
+            disable_global_extra_options=disable_global_extra_options,
+        )
+
+    async def is_running(self, name: str) -> bool:
+        """Return whether the specified profile is running."""
+        return await _run_in_executor(self.manager.get_pid, name) is not None
+
+    async def get_statuses(self) -> Dict[str, bool]:
+        """Return a dict with running status for all profiles."""
+        return await _run_in_executor(self.manager.get_statuses)
+
+    @asynccontextmanager
+    async def _ssh_master(
+        self, name: str, remote: Optional[str]
+    ) -> AsyncIterator[None]:
+        """Run the master connection for a remote while starting a session.
+
+        The lock for the master is held from executor threads, so tasks
+        wait for it on an asyncio lock first: if they blocked threads while
+        waiting, the holder could be left without a thread to release it.
+
+        """
+        if remote is None:
+            yield
+            return
+        async with self._ssh_master_lock(remote):
+            async with _in_executor(self.manager.ssh_master(name, remote)):
+                yield
+
+    def _ssh_master_lock(self, remote: Optional[str]) -> asyncio.Lock:
+        """Return the lock for operations on the master for a remote."""
+        lock = self._ssh_master_locks.get(remote)
+        if lock is None:
+            lock = self._ssh_master_locks[remote] = asyncio.Lock()
+        return lock
+
+    async def _record_latency(self, operation: str, start: float):
+        """Record the latency of an operation started at the given time."""
+        duration = time.monotonic() - start
+        await _run_in_executor(
+            self.manager.record_latency, operation, duration
+        )
+
+
+class _CaptureProtocol(asyncio.SubprocessProtocol):
+    """Protocol capturing process stderr to a buffer while it runs."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, output: OutputBuffer):
+        self.output = output
+        self._exited = loop.create_future()
+        self._pipe_closed = loop.create_future()
+
+    def pipe_data_received(self, fd: int, data: bytes):
+        self.output.write(data)
+
+    def pipe_connection_lost(self, fd: int, exc: Optional[Exception]):
+        self._pipe_closed.set_result(None)
+
+    def process_exited(self):
+        self._exited.set_result(None)
+
+    async def wait(self):
+        """Wait for the process to exit.
+
+        Once the process exits, only wait briefly for the rest of the output,
+        since daemonized children might keep the pipe open.
+
+        """
+        await self._exited
+        await asyncio.wait([self._pipe_closed], timeout=OUTPUT_DRAIN_TIMEOUT)
+
+
+async def kill_and_wait(pid: int):
+    """Kill a process and wait for it to terminate.
+
+    If supported, a pidfd is used to get notified as soon as the process
+    exits, otherwise the process is polled for termination.
+
+    """
+    try:
+        pidfd = pidfd_open(pid)
+    except ProcessLookupError:
+        return
+    if pidfd is None:
+        await _kill_and_poll(pid)
+    else:
+        try:
+            await _kill_and_wait_pidfd(pid, pidfd)
+        finally:
+            os.close(pidfd)
+
+
+async def _kill_and_wait_pidfd(pid: int, pidfd: int):
+    """Kill a process through a pidfd and wait for it to terminate."""
+    for sig, timeout in KILL_SIGNALS:
+        try:
+            signal.pidfd_send_signal(pidfd, sig)
+        except ProcessLookupError:
+            return
+        if await _wait_pidfd(pidfd, timeout):
+            return
+    raise ProcessKillFail(pid)
+
+
+async def _kill_and_poll(pid: int):
+    """Kill a process and poll until it terminates."""
+    for sig, wait in KILL_SIGNALS:
+        while wait > 0:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                return
+            wait -= 0.2
+            await asyncio.sleep(0.2)
+    raise ProcessKillFail(pid)
+
+
+async def _wait_pidfd(pidfd: int, timeout: float) -> bool:
+    """Wait for the process referenced by the pidfd to exit.
+
+    Return whether the process exited within the timeout.
+
+    """
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+
+    def set_exited():
+        if not exited.done():
+            exited.set_result(None)
+
+    loop.add_reader(pidfd, set_exited)
+    try:
+        await asyncio.wait_for(exited, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(pidfd)
+    return True
+
+
+async def _run_in_executor(func: Callable[..., _T], *args) -> _T:
+    """Run a blocking function in the default executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args))
+
+
+@asynccontextmanager
+async def _in_executor(context: ContextManager[_T]) -> AsyncIterator[_T]:
+    """Enter and exit a blocking context manager in the default executor."""
+    value = await _run_in_executor(context.__enter__)
+    try:
+        yield value
+    except BaseException as error:
+        if not await _run_in_executor(
+            context.__exit__, type(error), error, error.__traceback__
+        ):
+            raise
+    else:
+        await _run_in_executor(context.__exit__, None, None, None)
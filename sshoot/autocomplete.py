@@ -1,9 +1,65 @@
-"""Shell completion helpers."""
+"""Shell completion helpers.
 
-from argparse import Namespace
-from typing import Optional
+Besides completers for argcomplete, this provides a fast path for
+completing profile names from an index file, which avoids building the
+argument parser and loading the configuration.
 
-from .manager import Manager
+"""
+
+from bisect import bisect_left
+import marshal
+import os
+from pathlib import Path
+import string
+import threading
+import time
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+from .runtime import (
+    DEFAULT_CONFIG_PATH,
+    file_key,
+    FileKey,
+    get_rundir,
+    is_private,
+    process_exists,
+    SESSIONS_CACHE_MIN_AGE,
+)
+
+if TYPE_CHECKING:  # pragma: nocoverage
+    from argparse import Namespace
+
+# File in the runtime directory holding the completion index
+COMPLETION_INDEX = "completion.index"
+
+# Bump when the layout of the index data changes
+INDEX_VERSION = 2
+
+# Actions taking profile names as positional arguments, mapped to whether
+# they accept multiple names, and the running state of profiles to complete
+# (None for all profiles)
+PROFILE_ACTIONS: Dict[str, Tuple[bool, Optional[bool]]] = {
+    "show": (False, None),
+    "delete": (False, None),
+    "start": (True, False),
+    "stop": (True, True),
+    "restart": (True, True),
+    "is-running": (False, None),
+    "get-command": (False, None),
+    "daemon": (True, None),
+}
+
+# Characters allowed in the command line for the fast path. Others might
+# need quoting or expansion, which is left to argcomplete.
+_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + "-_.+@%,")
+_SAFE_LINE_CHARS = _SAFE_CHARS | frozenset("/= \t")
 
 
 def complete_argument(argument, completer):
@@ -14,7 +70,7 @@ def complete_argument(argument, completer):
 
 def profile_completer(
     prefix: str,
-    parsed_args: Namespace,
+    parsed_args: "Namespace",
     running: Optional[bool] = None,
     **kwargs,
 ):
@@ -25,11 +81,212 @@ def profile_completer(
           filter is applied).
 
     """
+    from .manager import Manager
+
     manager = Manager(config_path=parsed_args.config)
     manager.load_config()
-    for name in manager.get_profiles():
-        if not name.startswith(prefix):
-            continue
-        if running is None or manager.is_running(name) == running:
-            # Either no filter is set or it matches the profile status
+    # refresh the index, so that next completions can use the fast path
+    manager.update_completion_index()
+    if running is None:
+        names = list(manager.get_profiles())
+    else:
+        names = [
+            name
+            for name, status in manager.get_statuses().items()
+            if status == running
+        ]
+    for name in names:
+        if name.startswith(prefix):
             yield name
+
+
+class CompletionIndex:
+    """Index of profile names and running sessions, for fast completion.
+
+    The index records the version of the profiles file and of the sessions
+    directory it was built from, and it's not used if either has changed.
+
+    """
+
+    def __init__(self, path: Path, sessions_path: Path):
+        self.path = path
+        self.sessions_path = sessions_path
+
+    def update(
+        self,
+        profiles_key: FileKey,
+        names: Iterable[str],
+        get_sessions: Callable[[], Dict[str, List[int]]],
+    ):
+        """Write the index for profiles from the given profiles file version.
+
+        Running sessions are returned by the `get_sessions` function, as a
+        dict mapping names to PIDs of their shards.
+        Failures are ignored since the index is only used to speed up
+        completion.
+
+        """
+        sessions_key = file_key(self.sessions_path)
+        if (
+            sessions_key is not None
+            and time.time_ns() - sessions_key[3] < SESSIONS_CACHE_MIN_AGE * 1e9
+        ):
+            # recent changes might not be detected by the timestamp, so the
+            # sessions scan can't be reused
+            sessions_key = None
+        data = marshal.dumps(
+            (
+                INDEX_VERSION,
+                profiles_key,
+                sessions_key,
+                sorted(names),
+                get_sessions(),
+            )
+        )
+        tmp_file = self.path.with_name(
+            f".{self.path.name}.{os.getpid()}.{threading.get_ident()}"
+        )
+        try:
+            tmp_file.write_bytes(data)
+            tmp_file.replace(self.path)
+        except OSError:
+            tmp_file.unlink(missing_ok=True)
+
+    def complete(
+        self,
+        profiles_file: Path,
+        prefix: str,
+        running: Optional[bool] = None,
+    ) -> Optional[List[str]]:
+        """Return sorted profile names starting with the prefix.
+
+        If `running` is not None, only profiles with the matching running
+        state are returned. None is returned if the index is not valid.
+
+        """
+        try:
+            with self.path.open("rb") as fh:
+                # the runtime directory has a predictable path, so only trust
+                # indexes that can't have been written by other users
+                if not is_private(os.fstat(fh.fileno())):
+                    return None
+                data = marshal.loads(fh.read())
+            version, profiles_key, sessions_key, names, sessions = data
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if version != INDEX_VERSION or profiles_key != file_key(profiles_file):
+            return None
+        if running is not None and (
+            sessions_key is None
+            or sessions_key != file_key(self.sessions_path)
+        ):
+            return None
+
+        matches = []
+        for name in names[bisect_left(names, prefix) :]:
+            if not name.startswith(prefix):
+                break
+            matches.append(name)
+        if running is not None:
+            matches = [
+                name
+                for name in matches
+                if (
+                    name in sessions
+                    and all(map(process_exists, sessions[name]))
+                )
+                == running
+            ]
+        return matches
+
+
+def fast_complete() -> bool:
+    """Complete profile names from the index, for an argcomplete request.
+
+    Only completion of profile names for actions is handled, and only if
+    the index is valid. Return whether completions were output, otherwise
+    completion should be performed by argcomplete.
+
+    """
+    environ = os.environ
+    ifs = environ.get("_ARGCOMPLETE_IFS", "\013")
+    if (
+        environ.get("_ARGCOMPLETE") != "1"
+        or environ.get("_ARGCOMPLETE_SHELL", "bash") != "bash"
+        or "_ARGCOMPLETE_DFS" in environ
+        or "_ARGCOMPLETE_STDOUT_FILENAME" in environ
+        or len(ifs) != 1
+    ):
+        return False
+    try:
+        line = environ["COMP_LINE"][: int(environ["COMP_POINT"])]
+    except (KeyError, ValueError):
+        return False
+    request = _parse_line(line)
+    if request is None:
+        return False
+
+    config_path, running, prefix = request
+    rundir = get_rundir("sshoot")
+    index = CompletionIndex(rundir / COMPLETION_INDEX, rundir / "sessions")
+    names = index.complete(
+        config_path / "profiles.yaml", prefix, running=running
+    )
+    if names is None or not all(_SAFE_CHARS.issuperset(n) for n in names):
+        return False
+    if len(names) == 1 and environ.get("_ARGCOMPLETE_SUPPRESS_SPACE") == "1":
+        names[0] += " "
+    try:
+        os.write(8, ifs.join(names).encode())
+    except OSError:
+        return False
+    return True
+
+
+def _parse_line(line: str) -> Optional[Tuple[Path, Optional[bool], str]]:
+    """Parse a command line for completion of a profile name.
+
+    Return the configuration path, the running state of profiles to
+    complete and the prefix to complete. None is returned if the line is not
+    for a profile name, or it's not simple enough to parse here.
+
+    """
+    if not _SAFE_LINE_CHARS.issuperset(line):
+        return None
+    words = line.split()
+    prefix = "" if line[-1:].isspace() else words.pop()
+    if prefix.startswith("-") or "=" in prefix:
+        return None
+
+    config_path = DEFAULT_CONFIG_PATH
+    action = None
+    args = iter(words[1:])
+    for word in args:
+        if word in ("-C", "--config"):
+            value = next(args, None)
+            if value is None:
+                return None
+            config_path = Path(value)
+        elif word.startswith("--config="):
+            config_path = Path(word[len("--config=") :])
+        elif word == "--trace-format":
+            if next(args, None) is None:
+                return None
+        elif word == "--trace":
+            continue
+        elif word.startswith("-"):
+            return None
+        else:
+            action = word
+            break
+
+    if action not in PROFILE_ACTIONS:
+        return None
+    multiple, running = PROFILE_ACTIONS[action]
+    names = list(args)
+    if any(name.startswith("-") for name in names):
+        # options might take values, leave it to argcomplete
+        return None
+    if names and not multiple:
+        return None
+    return config_path, running, prefix
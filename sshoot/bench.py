@@ -0,0 +1,198 @@
+"""Benchmark of tunnel performance, against a bundled echo and sink server.
+
+The server is run on a host reachable through the tunnel. Clients send a
+command byte when connecting: connections for the echo command get back
+all data they send, while for the sink command data is discarded, and the
+number of received bytes is sent back when the client stops sending.
+
+"""
+
+import dataclasses
+import math
+import socket
+import socketserver
+import struct
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from .i18n import _
+
+# Default port for the benchmark server
+DEFAULT_PORT = 5201
+
+# Commands sent by clients when connecting
+ECHO = b"E"
+SINK = b"S"
+
+# Format of the byte count reply for sink connections
+_COUNT_FORMAT = "!Q"
+
+# Size of data chunks for bulk transfers
+_CHUNK_SIZE = 64 * 1024
+
+# Percentiles reported for latencies
+PERCENTILES = (50, 90, 99)
+
+
+@dataclasses.dataclass
+class BenchResult:
+    """Result of a benchmark run, with latencies in seconds."""
+
+    connect: List[float]
+    rtt: List[float]
+    sent_bytes: int
+    duration: float
+
+    @property
+    def throughput(self) -> float:
+        """Bulk throughput in bytes per second."""
+        return self.sent_bytes / self.duration if self.duration else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return results as a dict, with latencies in milliseconds."""
+        return {
+            "connect-ms": _percentiles_ms(self.connect),
+            "rtt-ms": _percentiles_ms(self.rtt),
+            "bytes": self.sent_bytes,
+            "duration": self.duration,
+            "throughput": self.throughput,
+        }
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    """Return a percentile of non-empty values, with the nearest-rank
+    method."""
+    ordered = sorted(values)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+
+def run_bench(
+    host: str,
+    port: int = DEFAULT_PORT,
+    connects: int = 10,
+    requests: int = 100,
+    size: int = 64,
+    duration: float = 5.0,
+    timeout: float = 10.0,
+) -> BenchResult:
+    """Run a benchmark against the server at the address.
+
+    TCP connect latency is measured over `connects` connections, round-trip
+    time over `requests` echoed requests of `size` bytes, and throughput by
+    sending data for `duration` seconds.
+
+    """
+    address = (host, port)
+    connect = []
+    for _attempt in range(connects):
+        start = time.perf_counter()
+        with socket.create_connection(address, timeout=timeout):
+            connect.append(time.perf_counter() - start)
+
+    rtt = []
+    with _connect(address, ECHO, timeout) as sock:
+        payload = b"x" * size
+        for _request in range(requests):
+            start = time.perf_counter()
+            sock.sendall(payload)
+            _recv_exactly(sock, size)
+            rtt.append(time.perf_counter() - start)
+
+    with _connect(address, SINK, timeout) as sock:
+        chunk = b"\0" * _CHUNK_SIZE
+        start = time.perf_counter()
+        deadline = start + duration
+        while time.perf_counter() < deadline:
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+        # the reply is sent once all data is received
+        (sent_bytes,) = struct.unpack(
+            _COUNT_FORMAT,
+            _recv_exactly(sock, struct.calcsize(_COUNT_FORMAT)),
+        )
+        elapsed = time.perf_counter() - start
+
+    return BenchResult(
+        connect=connect, rtt=rtt, sent_bytes=sent_bytes, duration=elapsed
+    )
+
+
+class BenchHandler(socketserver.BaseRequestHandler):
+    """Handle echo and sink connections."""
+
+    request: socket.socket
+
+    def handle(self):
+        command = self.request.recv(1)
+        if command == ECHO:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while data := self.request.recv(_CHUNK_SIZE):
+                self.request.sendall(data)
+        elif command == SINK:
+            count = 0
+            while data := self.request.recv(_CHUNK_SIZE):
+                count += len(data)
+            self.request.sendall(struct.pack(_COUNT_FORMAT, count))
+
+
+class BenchServer(socketserver.ThreadingTCPServer):
+    """Server for benchmark connections."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve_bench(
+    port: int = DEFAULT_PORT,
+    address: str = "",
+    ready: Optional[Callable[[BenchServer], None]] = None,
+):
+    """Serve benchmark connections, until interrupted.
+
+    By default, the server listens on all addresses. If passed, the `ready`
+    callback is called with the server once it's listening.
+
+    """
+    with BenchServer((address, port), BenchHandler) as server:
+        if ready:
+            ready(server)
+        server.serve_forever()
+
+
+def _connect(
+    address: Tuple[str, int], command: bytes, timeout: float
+) -> socket.socket:
+    """Return a connection to the server for a command."""
+    sock = socket.create_connection(address, timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(command)
+    return sock
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    """Receive the specified number of bytes from a socket."""
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError(_("Connection closed by server"))
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _percentiles_ms(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    """Return percentiles of latencies in milliseconds, None if there are
+    no values."""
+    return {
+        f"p{percent}": percentile(values, percent) * 1000 if values else None
+        for percent in PERCENTILES
+    }
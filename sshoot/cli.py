@@ -0,0 +1,28 @@
+"""Entry point for the sshoot command.
+
+Requests needing low latency, such as shell completion and prompt status,
+are answered here when possible, without loading the full command-line
+interface.
+
+"""
+
+import os
+import sys
+
+
+def sshoot() -> int:
+    """Run the sshoot command."""
+    if "_ARGCOMPLETE" in os.environ:
+        from .autocomplete import fast_complete
+
+        if fast_complete():
+            return 0
+    elif "--prompt" in sys.argv:
+        from .prompt import fast_prompt
+
+        if fast_prompt(sys.argv[1:]):
+            return 0
+
+    from .main import sshoot as script
+
+    return script()
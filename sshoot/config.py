@@ -1,42 +1,82 @@
 """Handle configuration files."""
 
+import dataclasses
+import marshal
+import os
 from pathlib import Path
 from typing import (
     Any,
     Dict,
     IO,
     Optional,
+    Tuple,
 )
 
-import yaml
-
+from . import trace
 from .profile import Profile
+from .runtime import (
+    file_key,
+    FileKey,
+    is_private,
+)
+
+# Bump when the layout of the snapshot data changes
+SNAPSHOT_VERSION = 1
 
 
 def yaml_dump(data: Dict, fh: Optional[IO] = None):
     """Dump data in YAML format with sane defaults for readability."""
-    return yaml.safe_dump(
-        data, fh, default_flow_style=False, allow_unicode=True
+    import yaml
+
+    dumper, _ = _yaml_classes()
+    return yaml.dump(
+        data,
+        fh,
+        Dumper=dumper,
+        default_flow_style=False,
+        allow_unicode=True,
     )
 
 
 class Config:
     """Handle configuration file loading/saving."""
 
-    CONFIG_KEYS = frozenset(["executable", "extra-options"])
+    CONFIG_KEYS = frozenset(
+        [
+            "executable",
+            "extra-options",
+            "normalize-subnets",
+            "on-conflict",
+            "session-logs",
+            "ssh-multiplex",
+        ]
+    )
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, snapshot_file: Optional[Path] = None):
         self._config_file = path / "config.yaml"
         self._profiles_file = path / "profiles.yaml"
+        self._snapshot_file = snapshot_file
+        self._loaded_key: Optional[Tuple[FileKey, FileKey]] = None
         self._reset()
 
     def load(self):
-        """Load configuration from file."""
+        """Load configuration from file.
+
+        If a snapshot file is set and it matches the current configuration
+        files, data is loaded from it, otherwise YAML files are parsed and the
+        snapshot is refreshed.
+
+        """
         self._reset()
-        self._config = self._load_yaml_file(self._config_file)
-        profiles = self._load_yaml_file(self._profiles_file)
-        for name, conf in profiles.items():
-            self._profiles[name] = Profile.from_config(conf)
+        key = self._loaded_key = self._files_key()
+        if self._load_snapshot(key):
+            return
+        with trace.span("parse_yaml"):
+            self._config = self._load_yaml_file(self._config_file)
+            profiles = self._load_yaml_file(self._profiles_file)
+            for name, conf in profiles.items():
+                self._profiles[name] = Profile.from_config(conf)
+        self._save_snapshot(key, profiles=self._profiles)
 
     def save(self):
         """Save profiles configuration to file."""
@@ -44,6 +84,16 @@ class Config:
             name: profile.config() for name, profile in self._profiles.items()
         }
         self._profiles_file.write_text(yaml_dump(config))
+        self._loaded_key = self._files_key()
+        # match the order profiles are loaded from the file
+        self._save_snapshot(
+            self._loaded_key,
+            profiles={name: self._profiles[name] for name in sorted(config)},
+        )
+
+    def changed(self) -> bool:
+        """Return whether config files changed since last loaded or saved."""
+        return self._files_key() != self._loaded_key
 
     def add_profile(self, name: str, profile: Profile):
         """Add a profile to the configuration."""
@@ -55,11 +105,25 @@ class Config:
         """Add the given profile to the configuration."""
         del self._profiles[name]
 
+    def get_profile(self, name: str) -> Profile:
+        """Return the profile with the given name.
+
+        Unlike accessing the profile through `profiles`, this doesn't copy
+        the mapping.
+
+        """
+        return self._profiles[name]
+
     @property
     def profiles(self) -> Dict[str, Profile]:
         """Return a dict with profiles, using names as key."""
         return self._profiles.copy()
 
+    @property
+    def profiles_key(self) -> FileKey:
+        """Return the key for the profiles file version last loaded or saved."""
+        return self._loaded_key[1] if self._loaded_key else None
+
     @property
     def config(self) -> Dict[str, Any]:
         """Return a dict with the configuration."""
@@ -79,4 +143,109 @@ class Config:
         if not path.exists():
             return {}
 
-        return yaml.safe_load(path.read_text()) or {}
+        import yaml
+
+        _, loader = _yaml_classes()
+        return yaml.load(path.read_text(), Loader=loader) or {}
+
+    def _files_key(self) -> Tuple[FileKey, FileKey]:
+        """Return a key identifying the current version of config files."""
+        return (
+            file_key(self._config_file),
+            file_key(self._profiles_file),
+        )
+
+    def _load_snapshot(self, key: Tuple[FileKey, FileKey]) -> bool:
+        """Load config from the snapshot, if it matches the given key.
+
+        Return whether the snapshot was loaded.
+
+        """
+        if self._snapshot_file is None:
+            return False
+        try:
+            with self._snapshot_file.open("rb") as fh:
+                # marshal is not safe against malicious data, so only trust
+                # snapshots that can't have been written by other users
+                if not is_private(os.fstat(fh.fileno())):
+                    return False
+                data = marshal.loads(fh.read())
+            version, fields, snapshot_key, config, profiles = data
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        if (
+            version != SNAPSHOT_VERSION
+            or fields != _profile_fields()
+            or snapshot_key != key
+        ):
+            return False
+        self._config = config
+        self._profiles = {
+            name: Profile(*values) for name, values in profiles.items()
+        }
+        return True
+
+    def _save_snapshot(
+        self, key: Tuple[FileKey, FileKey], profiles: Dict[str, Profile]
+    ):
+        """Save config and the given profiles to the snapshot file, if set.
+
+        Failures are ignored since the snapshot is only used to speed up
+        loading.
+
+        """
+        if self._snapshot_file is None:
+            return
+        fields = _profile_fields()
+        profiles_data = {
+            name: tuple(getattr(profile, field) for field in fields)
+            for name, profile in profiles.items()
+        }
+        try:
+            data = marshal.dumps(
+                (SNAPSHOT_VERSION, fields, key, self._config, profiles_data)
+            )
+        except ValueError:
+            # config contains types that can't be marshalled
+            return
+        tmp_file = self._snapshot_file.with_name(
+            f".{self._snapshot_file.name}.{os.getpid()}"
+        )
+        try:
+            fd = os.open(
+                tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with open(fd, "wb") as fh:
+                fh.write(data)
+            tmp_file.replace(self._snapshot_file)
+        except OSError:
+            try:
+                tmp_file.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+
+def _profile_fields() -> Tuple[str, ...]:
+    """Return names for Profile fields, in definition order."""
+    return tuple(field.name for field in dataclasses.fields(Profile))
+
+
+def _yaml_classes() -> Tuple[Any, Any]:
+    """Return the YAML dumper and loader classes.
+
+    The yaml module is only imported when needed, since it's slow to import
+    and not used when loading config from a snapshot.
+
+    """
+    # Use libyaml bindings if available, as they're much faster
+    try:
+        from yaml import (
+            CSafeDumper as YamlDumper,
+            CSafeLoader as YamlLoader,
+        )
+    except ImportError:  # pragma: nocoverage
+        from yaml import (  # type: ignore[assignment]
+            SafeDumper as YamlDumper,
+            SafeLoader as YamlLoader,
+        )
+    return YamlDumper, YamlLoader
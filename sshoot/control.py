@@ -0,0 +1,163 @@
+"""Control socket to query a resident sshoot process.
+
+The protocol is a single JSON request per connection, terminated by a
+newline, answered by a single JSON response.
+
+"""
+
+import json
+import os
+from pathlib import Path
+import socket
+import struct
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional,
+)
+
+# Name of the control socket in the rundir
+CONTROL_SOCKET = "control.sock"
+
+# Actions that can be served through the control socket
+CONTROL_ACTIONS = frozenset(
+    ["list", "show", "is-running", "get-command", "which"]
+)
+
+# Timeout for control socket operations
+CONTROL_TIMEOUT = 1.0
+
+# Maximum size of a request or response
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+ControlHandler = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+class ControlUnavailable(Exception):
+    """The control socket can't be used."""
+
+
+def control_request(
+    rundir: Path, message: Dict[str, Any], timeout: float = CONTROL_TIMEOUT
+) -> Dict[str, Any]:
+    """Send a request through the control socket and return the response.
+
+    :class:`ControlUnavailable` is raised if there's no server listening on
+    the socket, or it's not owned by the current user.
+
+    """
+    path = rundir / CONTROL_SOCKET
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        if path.stat().st_uid != os.getuid():
+            raise ControlUnavailable("Control socket not owned by user")
+        sock.connect(str(path))
+        _check_peer(sock)
+        sock.sendall(_encode(message))
+        return _decode(_receive(sock))
+    except (OSError, ValueError) as error:
+        raise ControlUnavailable(str(error))
+    finally:
+        sock.close()
+
+
+class ControlServer:
+    """Serve requests on the control socket.
+
+    The server is meant to be driven by an external selector loop: the
+    socket is non-blocking, and :meth:`handle` should be called when it's
+    readable.
+
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        handler: ControlHandler,
+        timeout: float = CONTROL_TIMEOUT,
+    ):
+        self.path = path
+        self.handler = handler
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+
+    def open(self):
+        """Start listening on the socket."""
+        self.path.unlink(missing_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(self.path))
+        self.path.chmod(0o600)
+        sock.listen()
+        sock.setblocking(False)
+        self._sock = sock
+
+    def close(self):
+        """Stop listening and remove the socket."""
+        if self._sock is None:
+            return
+        self._sock.close()
+        self._sock = None
+        self.path.unlink(missing_ok=True)
+
+    def fileno(self) -> int:
+        assert self._sock is not None
+        return self._sock.fileno()
+
+    def handle(self):
+        """Accept a connection and serve its request."""
+        assert self._sock is not None
+        try:
+            conn, _ = self._sock.accept()
+        except BlockingIOError:
+            return
+        with conn:
+            conn.settimeout(self.timeout)
+            try:
+                _check_peer(conn)
+                request = _decode(_receive(conn))
+                conn.sendall(_encode(self.handler(request)))
+            except (OSError, ValueError):
+                # client went away or sent a bad request
+                pass
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    """Encode a message."""
+    return json.dumps(message).encode() + b"\n"
+
+
+def _decode(data: bytes) -> Dict[str, Any]:
+    """Decode a message."""
+    message = json.loads(data)
+    if not isinstance(message, dict):
+        raise ValueError("Invalid message")
+    return message
+
+
+def _receive(sock: socket.socket) -> bytes:
+    """Read a newline-terminated message from a socket."""
+    chunks = []
+    size = 0
+    while True:
+        chunk = sock.recv(64 * 1024)
+        if not chunk:
+            raise ValueError("Incomplete message")
+        chunks.append(chunk)
+        size += len(chunk)
+        if chunk.endswith(b"\n"):
+            return b"".join(chunks)
+        if size > MAX_MESSAGE_SIZE:
+            raise ValueError("Message too large")
+
+
+def _check_peer(sock: socket.socket):
+    """Check that the other end of the socket runs as the same user."""
+    peercred = getattr(socket, "SO_PEERCRED", None)
+    if peercred is None:  # pragma: nocoverage
+        return
+    creds = sock.getsockopt(socket.SOL_SOCKET, peercred, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    if uid != os.getuid():
+        raise PermissionError("Peer not owned by user")
@@ -3,7 +3,24 @@
 import argparse
 import gettext
 from pathlib import Path
-from typing import Callable
+from typing import (
+    Callable,
+    Optional,
+)
+
+_gettext: Optional[Callable[[str], str]] = None
+
+
+def _(message: str) -> str:
+    """Translate a message.
+
+    Translations are set up on first use, as it's relatively slow.
+
+    """
+    global _gettext
+    if _gettext is None:
+        _gettext = _setup_i18n()
+    return _gettext(message)
 
 
 def _setup_i18n():
@@ -17,6 +34,3 @@ def _get_i18n_func(domain: str):
     localedir = Path(__file__).parent / "locale"
     g = gettext.translation(domain, localedir=localedir, fallback=True)
     return g.gettext
-
-
-_: Callable[[str], str] = _setup_i18n()
@@ -0,0 +1,93 @@
+"""Record latency of profile operations."""
+
+from contextlib import contextmanager
+import fcntl
+import json
+from pathlib import Path
+import threading
+from typing import (
+    Any,
+    Dict,
+    IO,
+    Iterator,
+    Tuple,
+)
+
+# Upper bounds for latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Histogram = Dict[str, Any]
+
+
+class LatencyRecorder:
+    """Record operation latencies as histograms in a file.
+
+    Histograms are shared by all processes using the same file, so that
+    operations run from separate commands are accounted for. Bucket counts
+    are not cumulative.
+
+    """
+
+    def __init__(
+        self, path: Path, buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        self.path = path
+        self.buckets = buckets
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, duration: float):
+        """Record the duration of an operation.
+
+        Errors writing the file are ignored, since latencies are only
+        informative.
+
+        """
+        try:
+            with self._lock, self._locked_file() as fh:
+                data = self._read_data(fh)
+                histogram = data.setdefault(
+                    operation,
+                    {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0},
+                )
+                for index, bound in enumerate(self.buckets):
+                    if duration <= bound:
+                        histogram["buckets"][index] += 1
+                        break
+                histogram["sum"] += duration
+                histogram["count"] += 1
+                fh.seek(0)
+                fh.truncate()
+                json.dump(data, fh)
+        except OSError:
+            pass
+
+    def histograms(self) -> Dict[str, Histogram]:
+        """Return recorded histograms for each operation."""
+        try:
+            with self.path.open() as fh:
+                return self._read_data(fh)
+        except OSError:
+            return {}
+
+    @contextmanager
+    def _locked_file(self) -> Iterator[IO[str]]:
+        """Open the file for update, with an exclusive lock."""
+        with self.path.open("a+") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            fh.seek(0)
+            yield fh
+
+    def _read_data(self, fh: IO[str]) -> Dict[str, Histogram]:
+        """Read histograms from file, discarding invalid data."""
+        try:
+            data = json.loads(fh.read() or "{}")
+        except ValueError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return {
+            operation: histogram
+            for operation, histogram in data.items()
+            if isinstance(histogram, dict)
+            and len(histogram.get("buckets", ())) == len(self.buckets)
+        }
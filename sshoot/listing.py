@@ -1,11 +1,13 @@
 """Helpers for listing output."""
 
 from collections import OrderedDict
-from csv import DictWriter
 from io import StringIO
 import json
+import time
 from typing import (
+    Any,
     cast,
+    Dict,
     Iterable,
     List,
     Optional,
@@ -18,10 +20,12 @@ from prettytable import (
     PrettyTable,
 )
 
+from . import trace
 from .config import yaml_dump
 from .i18n import _
 from .manager import Manager
 from .profile import Profile
+from .stats import SessionStats
 
 # Map names to profile fields
 _FIELDS_MAP = OrderedDict(
@@ -34,6 +38,13 @@ _FIELDS_MAP = OrderedDict(
         (_("Exclude subnets"), "exclude_subnets"),
         (_("Seed hosts"), "seed_hosts"),
         (_("Extra options"), "extra_opts"),
+        (_("Shards"), "shards"),
+        (_("Latency control"), "latency_control"),
+        (_("Latency buffer"), "latency_buffer_size"),
+        (_("Method"), "method"),
+        (_("SSH cipher"), "ssh_cipher"),
+        (_("SSH compression"), "ssh_compression"),
+        (_("SSH keepalive"), "ssh_server_alive_interval"),
     ]
 )
 
@@ -76,7 +87,8 @@ class ProfileListing:
         if formatter is None:
             raise InvalidFormat(_format)
         profiles_iter = self.manager.get_profiles().items()
-        return formatter(profiles_iter, verbose=verbose)
+        with trace.span("render", format=_format):
+            return formatter(profiles_iter, verbose=verbose)
 
     def _format_table(
         self, profiles_iter: ProfileIterator, verbose: bool = False
@@ -99,8 +111,9 @@ class ProfileListing:
         table.right_padding_width = 1
         table.hrules = HEADER
 
+        statuses = self.manager.get_statuses()
         for name, profile in profiles_iter:
-            row = ["*" if self.manager.is_running(name) else "", name]
+            row = ["*" if statuses.get(name) else "", name]
             row.extend(
                 _format_value(getattr(profile, column)) for column in columns
             )
@@ -111,6 +124,8 @@ class ProfileListing:
         self, profiles_iter: ProfileIterator, verbose: bool = False
     ) -> str:
         """Format profiles data as CSV."""
+        from csv import DictWriter
+
         titles = [NAME_FIELD, STATUS_FIELD]
         titles.extend(_FIELDS_MAP)
 
@@ -118,10 +133,11 @@ class ProfileListing:
         writer = DictWriter(buf, fieldnames=titles)
         writer.writeheader()
 
+        statuses = self.manager.get_statuses()
         for name, profile in profiles_iter:
             row = {
                 NAME_FIELD: name,
-                STATUS_FIELD: _profile_status(self.manager, name),
+                STATUS_FIELD: _status_label(statuses.get(name, False)),
             }
             row.update(
                 {
@@ -160,15 +176,143 @@ def profile_details(manager: Manager, name: str) -> str:
     )
     table.align["key"] = table.align["value"] = "l"
     table.add_row((f"{NAME_FIELD}:", name))
-    table.add_row((f"{STATUS_FIELD}:", _profile_status(manager, name)))
-    for name, field in _FIELDS_MAP.items():
-        table.add_row((f"{name}:", _format_value(getattr(profile, field))))
-    return cast(str, table.get_string())
+    table.add_row(
+        (f"{STATUS_FIELD}:", _status_label(manager.is_running(name)))
+    )
+    with trace.span("render", format="details"):
+        for name, field in _FIELDS_MAP.items():
+            table.add_row((f"{name}:", _format_value(getattr(profile, field))))
+        return cast(str, table.get_string())
+
+
+def supervisor_status(state: Dict[str, Any]) -> str:
+    """Return a table with the status of supervised sessions."""
+    table = PrettyTable(
+        [
+            NAME_FIELD,
+            _("State"),
+            _("PID"),
+            _("Restarts"),
+            _("Next retry"),
+            _("Error"),
+        ]
+    )
+    table.align = "l"
+    table.vertical_char = " "
+    table.junction_char = table.horizontal_char
+    table.padding_width = 0
+    table.left_padding_width = 0
+    table.right_padding_width = 1
+    table.hrules = HEADER
+    now = time.time()
+    for name, session in sorted(state["sessions"].items()):
+        retry_at = session["retry-at"]
+        retry = "" if retry_at is None else f"{max(0, retry_at - now):.0f}s"
+        table.add_row(
+            [
+                name,
+                session["state"],
+                _format_value(session["pid"]),
+                session["restarts"],
+                retry,
+                session["error"],
+            ]
+        )
+    return cast(str, table.get_string()) + "\n"
+
+
+def session_stats(
+    stats: Dict[str, SessionStats],
+    previous: Optional[Dict[str, SessionStats]] = None,
+    elapsed: float = 0.0,
+) -> str:
+    """Return a table with resource usage for sessions.
+
+    If previous stats are passed, CPU usage and I/O rates over the elapsed
+    time are included. Sessions are sorted by CPU usage.
+
+    """
+    table = PrettyTable(
+        [
+            NAME_FIELD,
+            _("PID"),
+            _("Procs"),
+            _("CPU%"),
+            _("CPU time"),
+            _("RSS"),
+            _("Read"),
+            _("Write"),
+            _("Read/s"),
+            _("Write/s"),
+        ]
+    )
+    table.align = "r"
+    table.align[NAME_FIELD] = "l"
+    table.vertical_char = " "
+    table.junction_char = table.horizontal_char
+    table.padding_width = 0
+    table.left_padding_width = 0
+    table.right_padding_width = 1
+    table.hrules = HEADER
+
+    rows = []
+    for name, session in stats.items():
+        before = (previous or {}).get(name)
+        if before is None or before.pid != session.pid or elapsed <= 0:
+            before = None
+        cpu_percent = None
+        read_rate = write_rate = None
+        if before is not None:
+            cpu_percent = (session.cpu_time - before.cpu_time) / elapsed * 100
+            read_rate = _rate(session.read_bytes, before.read_bytes, elapsed)
+            write_rate = _rate(
+                session.write_bytes, before.write_bytes, elapsed
+            )
+        row = [
+            name,
+            session.pid,
+            len(session.processes),
+            "" if cpu_percent is None else f"{cpu_percent:.1f}",
+            f"{session.cpu_time:.2f}",
+            _format_size(session.rss),
+            _format_size(session.read_bytes),
+            _format_size(session.write_bytes),
+            _format_size(read_rate),
+            _format_size(write_rate),
+        ]
+        rows.append((-(cpu_percent or 0.0), name, row))
+    for _cpu, _name, row in sorted(rows):
+        table.add_row(row)
+    return cast(str, table.get_string()) + "\n"
+
+
+def _rate(
+    value: Optional[int], previous: Optional[int], elapsed: float
+) -> Optional[float]:
+    """Return the rate of change of a counter, if available."""
+    if value is None or previous is None:
+        return None
+    return (value - previous) / elapsed
+
+
+def _format_size(size: Optional[float]) -> str:
+    """Format a size in bytes with a binary unit suffix."""
+    if size is None:
+        return ""
+    for suffix in ("", "K", "M", "G"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        suffix = "T"
+    if not suffix:
+        return str(int(size))
+    return f"{size:.1f}{suffix}"
 
 
-def _profile_status(manager: Manager, name: str) -> str:
+def _status_label(running: bool) -> str:
     """Return a string with the status of a profile."""
-    return _("ACTIVE") if manager.is_running(name) else _("STOPPED")
+    return _("ACTIVE") if running else _("STOPPED")
 
 
 def _format_value(value) -> str:
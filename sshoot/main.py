@@ -2,46 +2,141 @@
 
 from argparse import (
     ArgumentParser,
+    ArgumentTypeError,
     Namespace,
 )
 from functools import partial
+from io import StringIO
+import json
+import os
+from pathlib import Path
 import shlex
-from typing import Set
+import signal
+import time
+from typing import (
+    Any,
+    cast,
+    Dict,
+    List,
+    Optional,
+    Set,
+    TYPE_CHECKING,
+)
 
-from argcomplete import autocomplete
 from toolrack.script import (
     ErrorExitMessage,
     Script,
 )
 
-from . import __version__
+from . import (
+    __version__,
+    IMPORT_TIME,
+    trace,
+)
 from .autocomplete import (
     complete_argument,
     profile_completer,
 )
-from .i18n import _
-from .listing import (
-    profile_details,
-    ProfileListing,
+from .control import (
+    CONTROL_ACTIONS,
+    control_request,
+    CONTROL_SOCKET,
+    ControlServer,
+    ControlUnavailable,
 )
+from .i18n import _
 from .manager import (
-    DEFAULT_CONFIG_PATH,
+    DEFAULT_MAX_WORKERS,
     Manager,
     ManagerProfileError,
+    ResidentManager,
+)
+from .profile import (
+    METHODS,
+    PRESETS,
 )
+from .runtime import (
+    DEFAULT_CONFIG_PATH,
+    get_rundir,
+)
+
+if TYPE_CHECKING:  # pragma: nocoverage
+    from .subnets import Conflict
+
+
+class ExtraArgsParser(ArgumentParser):
+    """Parser that collects arguments after "--" in the "args" attribute.
+
+    This allows actions to have a variable number of positional arguments
+    followed by arguments to pass through. Parsers without an "args"
+    argument handle "--" as usual.
+
+    """
+
+    def parse_known_args(self, args=None, namespace=None):
+        if not any(action.dest == "args" for action in self._actions):
+            return super().parse_known_args(args=args, namespace=namespace)
+
+        extra_args: List[str] = []
+        if "--" in args:
+            index = args.index("--")
+            args, extra_args = args[:index], args[index + 1 :]
+        namespace, unknown = super().parse_known_args(
+            args=args, namespace=namespace
+        )
+        namespace.args = extra_args
+        return namespace, unknown
+
+
+# Formats for profiles listing, as supported by ProfileListing, which is
+# only imported when listing
+LISTING_FORMATS = ("csv", "json", "table", "yaml")
+
+# Environment variable enabling tracing, set to the trace output format
+TRACE_ENV = "SSHOOT_TRACE"
+
+# The start of the package import, if not accounted in a trace yet
+_import_time: Optional[float] = IMPORT_TIME
 
 
 class Sshoot(Script):
     """Manage multiple sshuttle VPN sessions."""
 
+    def __call__(self, args: Optional[List[str]] = None) -> int:
+        # tracing is enabled early to time parser creation, and disabled
+        # after argument parsing if not requested
+        global _import_time
+        call_time = time.perf_counter()
+        tracer = trace.enable("sshoot", start=_import_time or call_time)
+        if _import_time is not None:
+            tracer.root.children.append(
+                trace.Span("import", _import_time, end=call_time)
+            )
+            _import_time = None
+        try:
+            return super().__call__(args=args)
+        finally:
+            trace.disable()
+
     def main(self, args: Namespace):
+        trace_format = self._trace_format(args)
+        if trace_format is None:
+            trace.disable()
+            return self._main(args)
         try:
-            manager = Manager(config_path=args.config)
-            manager.load_config()
-        except OSError as error:
-            raise ErrorExitMessage(error, code=3)
-        action = args.action.replace("-", "_")
-        method = getattr(self, "action_" + action)
+            with trace.span(args.action):
+                return self._main(args)
+        finally:
+            root = trace.finish()
+            if root is not None:
+                formatter = (
+                    trace.format_json
+                    if trace_format == "json"
+                    else trace.format_tree
+                )
+                self._stderr.write(formatter(root))
+
+    def _main(self, args: Namespace):
         action_args = Namespace(
             **{
                 key: value
@@ -49,17 +144,111 @@ class Sshoot(Script):
                 if key not in self.global_args
             }
         )
+        if args.action in CONTROL_ACTIONS:
+            try:
+                with trace.span("control_request"):
+                    response = control_request(
+                        get_rundir("sshoot"),
+                        {
+                            # the resident process keeps a manager per
+                            # config, so relative paths must be resolved
+                            "config": str(Path(args.config).resolve()),
+                            "action": args.action,
+                            "args": action_args.__dict__,
+                        },
+                    )
+            except ControlUnavailable:
+                # no resident process, run the action directly
+                pass
+            else:
+                return self._control_response(response)
+
         try:
-            return method(manager, action_args)
-        except ManagerProfileError as error:
-            raise ErrorExitMessage(error, code=2)
+            manager = Manager(config_path=args.config)
+            manager.load_config()
+        except OSError as error:
+            raise ErrorExitMessage(error, code=3)
+        return self._run_action(manager, args.action, action_args)
 
     def print(self, *args, **kwargs):
         """Print out message."""
         print(*args, **kwargs, file=self._stdout)
 
+    def _warn(self, message: str):
+        """Print out a warning message."""
+        print(message, file=self._stderr)
+
+    def _trace_format(self, args: Namespace) -> Optional[str]:
+        """Return the format for the trace output, None if not tracing."""
+        if args.trace:
+            return cast(str, args.trace_format)
+        value = os.environ.get(TRACE_ENV, "")
+        if not value:
+            return None
+        # any other value enables the default format
+        return value if value in trace.TRACE_FORMATS else "tree"
+
+    def _run_action(self, manager: Manager, action: str, args: Namespace):
+        """Run the method for an action."""
+        method = getattr(self, "action_" + action.replace("-", "_"))
+        try:
+            return method(manager, args)
+        except ManagerProfileError as error:
+            raise ErrorExitMessage(error, code=2)
+
+    def _control_response(self, response: Dict[str, Any]):
+        """Output the response to a control request."""
+        if "error" in response:
+            raise ErrorExitMessage(response["error"], code=response["code"])
+        self.print(response["output"], end="")
+        if "warnings" in response:
+            self._stderr.write(response["warnings"])
+        if response["exit"] is not None:
+            self.exit(response["exit"])
+
+    def _handle_control_request(
+        self,
+        rundir: Path,
+        managers: Dict[str, ResidentManager],
+        request: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """Run an action for a control request, capturing its output.
+
+        Managers are kept across requests for each config path, so
+        configuration is only reloaded when it changes.
+
+        """
+        action = request.get("action")
+        if action not in CONTROL_ACTIONS:
+            return {"error": _("Invalid action"), "code": 1}
+
+        output, warnings = StringIO(), StringIO()
+        script = Sshoot(stdout=output, stderr=warnings)
+        exit_code = None
+        try:
+            config_path = request["config"]
+            manager = managers.get(config_path)
+            if manager is None:
+                manager = managers[config_path] = ResidentManager(
+                    config_path=config_path, rundir=str(rundir)
+                )
+            manager.refresh_config()
+            script._run_action(manager, action, Namespace(**request["args"]))
+        except ErrorExitMessage as error:
+            return {"error": str(error.message), "code": error.code}
+        except OSError as error:
+            return {"error": str(error), "code": 3}
+        except SystemExit as error:
+            exit_code = error.code
+        response = {"output": output.getvalue(), "exit": exit_code}
+        if warnings.getvalue():
+            response["warnings"] = warnings.getvalue()
+        return response
+
     def action_list(self, manager: Manager, args: Namespace):
         """Print out the list of profiles as a table."""
+        from .listing import ProfileListing
+
         listing = ProfileListing(manager)
         self.print(
             listing.get_output(args.format, verbose=args.verbose), end=""
@@ -67,6 +256,8 @@ class Sshoot(Script):
 
     def action_show(self, manager: Manager, args: Namespace):
         """Show details on a profile."""
+        from .listing import profile_details
+
         self.print(profile_details(manager, args.name))
 
     def action_create(self, manager: Manager, args: Namespace):
@@ -80,27 +271,55 @@ class Sshoot(Script):
         manager.remove_profile(args.name)
 
     def action_start(self, manager: Manager, args: Namespace):
-        """Start sshuttle for the specified profile."""
-        manager.start_profile(
-            args.name,
-            extra_args=args.args,
-            disable_global_extra_options=args.disable_global_extra_options,
-        )
-        self.print(_("Profile started"))
+        """Start sshuttle for the specified profiles."""
+        options = {
+            "extra_args": args.args,
+            "disable_global_extra_options": args.disable_global_extra_options,
+        }
+        if manager.conflict_policy == "warn":
+            for conflict in manager.get_start_conflicts(args.names):
+                self._warn(
+                    _("Warning: {conflict}").format(
+                        conflict=_format_conflict(conflict)
+                    )
+                )
+        message = _("Profile started")
+        if len(args.names) == 1:
+            manager.start_profile(args.names[0], **options)
+            self.print(message)
+        else:
+            results = manager.start_profiles(
+                args.names, max_workers=args.jobs, **options
+            )
+            self._report_results(results, message)
 
     def action_stop(self, manager: Manager, args: Namespace):
-        """Stop sshuttle for the specified profile."""
-        manager.stop_profile(args.name)
-        self.print(_("Profile stopped"))
+        """Stop sshuttle for the specified profiles."""
+        names = self._get_names(manager, args)
+        message = _("Profile stopped")
+        if len(names) == 1:
+            manager.stop_profile(names[0])
+            self.print(message)
+        else:
+            results = manager.stop_profiles(names, max_workers=args.jobs)
+            self._report_results(results, message)
 
     def action_restart(self, manager: Manager, args: Namespace):
-        """Restart sshuttle for the specified profile."""
-        manager.restart_profile(
-            args.name,
-            extra_args=args.args,
-            disable_global_extra_options=args.disable_global_extra_options,
-        )
-        self.print(_("Profile restarted"))
+        """Restart sshuttle for the specified profiles."""
+        names = self._get_names(manager, args)
+        options = {
+            "extra_args": args.args,
+            "disable_global_extra_options": args.disable_global_extra_options,
+        }
+        message = _("Profile restarted")
+        if len(names) == 1:
+            manager.restart_profile(names[0], **options)
+            self.print(message)
+        else:
+            results = manager.restart_profiles(
+                names, max_workers=args.jobs, **options
+            )
+            self._report_results(results, message)
 
     def action_is_running(self, manager: Manager, args: Namespace):
         """Return whether the specified profile is running."""
@@ -110,15 +329,263 @@ class Sshoot(Script):
         self.exit(retval)
 
     def action_get_command(self, manager: Manager, args: Namespace):
-        """Print the sshuttle command for the specified profile."""
-        cmdline = manager.get_cmdline(
+        """Print sshuttle commands for the specified profile, one for each
+        shard."""
+        cmdlines = manager.get_cmdlines(
             args.name,
             disable_global_extra_options=args.disable_global_extra_options,
         )
-        self.print(" ".join(cmdline))
+        for cmdline in cmdlines:
+            self.print(" ".join(cmdline))
+        rules = manager.get_subnet_rules(args.name)
+        if rules is not None:
+            before, after = rules
+            self._warn(
+                _(
+                    "Subnet rules: {before} before normalization, {after} after"
+                ).format(before=before, after=after)
+            )
+
+    def action_check(self, manager: Manager, args: Namespace):
+        """Report conflicting routes between profiles."""
+        conflicts = manager.find_conflicts()
+        if not conflicts:
+            self.print(_("No conflicts found"))
+            return
+        for conflict in conflicts:
+            self.print(_format_conflict(conflict))
+        self.exit(1)
+
+    def action_which(self, manager: Manager, args: Namespace):
+        """Print profiles routing an address, most specific first."""
+        matches = manager.find_profiles_for(args.address)
+        if args.running:
+            statuses = manager.get_statuses()
+            matches = [
+                (name, network)
+                for name, network in matches
+                if statuses.get(name)
+            ]
+        if not matches:
+            self.exit(1)
+        width = max(len(match[0]) for match in matches)
+        for name, network in matches:
+            self.print(f"{name:<{width}}  {network}")
+
+    def action_bench(self, manager: Manager, args: Namespace):
+        """Benchmark the tunnel for a profile, printing results as JSON."""
+        from .bench import (
+            DEFAULT_PORT,
+            run_bench,
+        )
+
+        profile = manager.get_profile(args.name)
+        if args.name not in dict(manager.find_profiles_for(args.address)):
+            raise ManagerProfileError(
+                _("Address {address} is not routed by profile {name}").format(
+                    address=args.address, name=args.name
+                )
+            )
+        if not manager.is_running(args.name):
+            raise ManagerProfileError(_("Profile is not running"))
+
+        port = DEFAULT_PORT if args.port is None else args.port
+        try:
+            result = run_bench(
+                args.address,
+                port=port,
+                connects=args.connects,
+                requests=args.requests,
+                size=args.size,
+                duration=args.duration,
+            )
+        except OSError as error:
+            raise ErrorExitMessage(str(error), code=3)
+        self.print(
+            json.dumps(
+                {
+                    "profile": args.name,
+                    "config": profile.config(),
+                    "target": f"{args.address}:{port}",
+                    "time": time.time(),
+                    **result.as_dict(),
+                }
+            )
+        )
+
+    def action_bench_server(self, manager: Manager, args: Namespace):
+        """Run the server for tunnel benchmarks."""
+        from .bench import (
+            DEFAULT_PORT,
+            serve_bench,
+        )
+
+        def ready(server):
+            address, port = server.server_address[:2]
+            self.print(
+                _("Serving benchmarks on {address}:{port}").format(
+                    address=address, port=port
+                ),
+                flush=True,
+            )
+
+        port = DEFAULT_PORT if args.port is None else args.port
+        try:
+            serve_bench(port, address=args.address, ready=ready)
+        except OSError as error:
+            raise ErrorExitMessage(str(error), code=3)
+
+    def action_status(self, manager: Manager, args: Namespace):
+        """Print out running profiles."""
+        from .prompt import (
+            format_prompt,
+            running_sessions,
+        )
+
+        sessions = running_sessions(str(manager.sessions_path))
+        if args.prompt:
+            if sessions:
+                self.print(format_prompt(sessions))
+            return
+        if not sessions:
+            self.print(_("No profiles running"))
+        for name, pid in sorted(sessions.items()):
+            self.print(
+                _("{name}: running (PID {pid})").format(name=name, pid=pid)
+            )
+
+    def action_top(self, manager: Manager, args: Namespace):
+        """Show live resource usage for running sessions."""
+        from .listing import session_stats
+
+        previous = manager.get_session_stats()
+        last = time.monotonic()
+        iteration = 0
+        while not args.iterations or iteration < args.iterations:
+            time.sleep(args.delay)
+            stats = manager.get_session_stats()
+            now = time.monotonic()
+            if self._stdout.isatty():
+                # clear the screen
+                self.print("\x1b[H\x1b[2J", end="")
+            self.print(session_stats(stats, previous, now - last), end="")
+            previous, last = stats, now
+            iteration += 1
+
+    def action_metrics(self, manager: Manager, args: Namespace):
+        """Print metrics in Prometheus format, or serve them over HTTP."""
+        from .metrics import (
+            collect_metrics,
+            serve_metrics,
+        )
+
+        if args.listen is None:
+            self.print(collect_metrics(manager), end="")
+            return
+
+        resident_manager = ResidentManager(
+            config_path=str(manager.config_path), rundir=str(manager.rundir)
+        )
+        resident_manager.load_config()
+
+        def get_metrics() -> str:
+            resident_manager.refresh_config()
+            return collect_metrics(resident_manager)
+
+        def ready(server):
+            address, port = server.server_address[:2]
+            self.print(
+                _("Serving metrics on http://{address}:{port}/metrics").format(
+                    address=address, port=port
+                ),
+                flush=True,
+            )
+
+        try:
+            serve_metrics(get_metrics, args.listen, ready=ready)
+        except OSError as error:
+            raise ErrorExitMessage(str(error), code=3)
+
+    def action_daemon(self, manager: Manager, args: Namespace):
+        """Supervise sessions, restarting them if they exit."""
+        from .listing import supervisor_status
+        from .supervisor import (
+            read_state,
+            Supervisor,
+            SupervisorError,
+        )
+
+        if args.status:
+            state = read_state(manager)
+            if state is None:
+                raise ErrorExitMessage(_("Supervisor is not running"))
+            self.print(supervisor_status(state), end="")
+            return
+
+        names = args.names
+        if not names:
+            names = [
+                name
+                for name, running in manager.get_statuses().items()
+                if running
+            ]
+        for name in names:
+            # raise an error if profile is unknown
+            manager.get_profile(name)
+
+        control_server = ControlServer(
+            manager.rundir / CONTROL_SOCKET,
+            partial(self._handle_control_request, manager.rundir, {}),
+        )
+        supervisor = Supervisor(
+            manager,
+            names,
+            max_restarts=args.max_restarts,
+            control_server=control_server,
+        )
+        signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.stop())
+        try:
+            supervisor.run()
+        except KeyboardInterrupt:
+            pass
+        except SupervisorError as error:
+            raise ErrorExitMessage(str(error), code=2)
+
+    def _get_names(self, manager: Manager, args: Namespace) -> List[str]:
+        """Return profile names from arguments, or running ones for --all."""
+        if args.all:
+            if args.names:
+                raise ErrorExitMessage(
+                    _("Profile names can't be specified with --all")
+                )
+            return [
+                name
+                for name, running in manager.get_statuses().items()
+                if running
+            ]
+        if not args.names:
+            raise ErrorExitMessage(_("No profile specified"))
+        return cast(List[str], args.names)
+
+    def _report_results(
+        self, results: Dict[str, Optional[ManagerProfileError]], message: str
+    ):
+        """Print results for a bulk operation, failing if any errored."""
+        errors = []
+        for name, error in results.items():
+            if error is None:
+                self.print(f"{name}: {message}")
+            else:
+                errors.append(f"{name}: {error}")
+        if errors:
+            raise ErrorExitMessage("\n".join(errors), code=2)
 
     def get_parser(self) -> ArgumentParser:
         """Return a configured argparse.ArgumentParse instance."""
+        with trace.span("get_parser"):
+            return self._get_parser()
+
+    def _get_parser(self) -> ArgumentParser:
         parser = ArgumentParser(
             prog="sshoot",
             description=_("Manage multiple sshuttle VPN sessions"),
@@ -135,8 +602,25 @@ class Sshoot(Script):
             default=DEFAULT_CONFIG_PATH,
             help=_("configuration directory (default: %(default)s)"),
         )
+        parser.add_argument(
+            "--trace",
+            action="store_true",
+            help=_(
+                "print timings of operations to stderr (also enabled by "
+                "setting {env})"
+            ).format(env=TRACE_ENV),
+        )
+        parser.add_argument(
+            "--trace-format",
+            choices=trace.TRACE_FORMATS,
+            default=trace.TRACE_FORMATS[0],
+            help=_("format for timings output (default: %(default)s)"),
+        )
         subparsers = parser.add_subparsers(
-            metavar="ACTION", dest="action", help=_("action to perform")
+            metavar="ACTION",
+            dest="action",
+            help=_("action to perform"),
+            parser_class=ExtraArgsParser,
         )
         subparsers.required = True
 
@@ -150,7 +634,7 @@ class Sshoot(Script):
         list_parser.add_argument(
             "-f",
             "--format",
-            choices=ProfileListing.supported_formats(),
+            choices=LISTING_FORMATS,
             default="table",
             help=_("listing format (default %(default)s)"),
         )
@@ -210,6 +694,62 @@ class Sshoot(Script):
             type=shlex.split,
             help=_("extra arguments to pass to sshuttle command line"),
         )
+        create_parser.add_argument(
+            "--shards",
+            type=_positive_int,
+            default=1,
+            help=_(
+                "number of sshuttle processes to split subnets across "
+                "(default: %(default)s)"
+            ),
+        )
+        create_parser.add_argument(
+            "--preset",
+            choices=sorted(PRESETS),
+            help=_("preset of tuning options, overridden by explicit ones"),
+        )
+        create_parser.add_argument(
+            "--latency-control",
+            action="store_true",
+            default=None,
+            help=_("make sshuttle trade bandwidth for lower latency"),
+        )
+        create_parser.add_argument(
+            "--no-latency-control",
+            action="store_false",
+            dest="latency_control",
+            help=_("disable sshuttle latency control"),
+        )
+        create_parser.add_argument(
+            "--latency-buffer-size",
+            type=int,
+            help=_("size of the sshuttle latency control buffer"),
+        )
+        create_parser.add_argument(
+            "--method",
+            choices=METHODS,
+            help=_("method used by sshuttle to redirect traffic"),
+        )
+        create_parser.add_argument(
+            "--ssh-cipher", help=_("cipher for the SSH connection")
+        )
+        create_parser.add_argument(
+            "--ssh-compression",
+            action="store_true",
+            default=None,
+            help=_("compress the SSH connection"),
+        )
+        create_parser.add_argument(
+            "--no-ssh-compression",
+            action="store_false",
+            dest="ssh_compression",
+            help=_("don't compress the SSH connection"),
+        )
+        create_parser.add_argument(
+            "--ssh-server-alive-interval",
+            type=int,
+            help=_("seconds between SSH keepalive messages"),
+        )
 
         # Remove profile
         delete_parser = subparsers.add_parser(
@@ -224,14 +764,18 @@ class Sshoot(Script):
 
         # Start profile
         start_parser = subparsers.add_parser(
-            "start", help=_("start a VPN session for a profile")
+            "start", help=_("start VPN sessions for profiles")
         )
         complete_argument(
             start_parser.add_argument(
-                "name", help=_("name of the profile to start")
+                "names",
+                nargs="+",
+                metavar="name",
+                help=_("name of the profiles to start"),
             ),
             partial(profile_completer, running=False),
         )
+        self._add_jobs_argument(start_parser)
         start_parser.add_argument(
             "--no-global-extra-options",
             dest="disable_global_extra_options",
@@ -241,30 +785,53 @@ class Sshoot(Script):
         start_parser.add_argument(
             "args",
             nargs="*",
-            help=_("additional arguments passed to sshuttle command line"),
+            help=_(
+                "additional arguments passed to sshuttle command line, "
+                "after --"
+            ),
         )
 
         # Stop profile
         stop_parser = subparsers.add_parser(
-            "stop", help=_("stop a running VPN session for a profile")
+            "stop", help=_("stop running VPN sessions for profiles")
         )
         complete_argument(
             stop_parser.add_argument(
-                "name", help=_("name of the profile to stop")
+                "names",
+                nargs="*",
+                metavar="name",
+                help=_("name of the profiles to stop"),
             ),
             partial(profile_completer, running=True),
         )
+        stop_parser.add_argument(
+            "-a",
+            "--all",
+            action="store_true",
+            help=_("stop all running profiles"),
+        )
+        self._add_jobs_argument(stop_parser)
 
         # Restart profile
         restart_parser = subparsers.add_parser(
-            "restart", help=_("restart a VPN session for a profile")
+            "restart", help=_("restart VPN sessions for profiles")
         )
         complete_argument(
             restart_parser.add_argument(
-                "name", help=_("name of the profile to restart")
+                "names",
+                nargs="*",
+                metavar="name",
+                help=_("name of the profiles to restart"),
             ),
             partial(profile_completer, running=True),
         )
+        restart_parser.add_argument(
+            "-a",
+            "--all",
+            action="store_true",
+            help=_("restart all running profiles"),
+        )
+        self._add_jobs_argument(restart_parser)
         restart_parser.add_argument(
             "--no-global-extra-options",
             dest="disable_global_extra_options",
@@ -274,7 +841,10 @@ class Sshoot(Script):
         restart_parser.add_argument(
             "args",
             nargs="*",
-            help=_("additional arguments passed to sshuttle command line"),
+            help=_(
+                "additional arguments passed to sshuttle command line, "
+                "after --"
+            ),
         )
 
         # Return whether profile is running
@@ -305,6 +875,160 @@ class Sshoot(Script):
             help=_("disable global extra-options set in config.yaml"),
         )
 
+        # Check conflicts between profiles
+        subparsers.add_parser(
+            "check", help=_("report conflicting routes between profiles")
+        )
+
+        # Find profiles routing an address
+        which_parser = subparsers.add_parser(
+            "which", help=_("show profiles routing an address")
+        )
+        which_parser.add_argument("address", help=_("IP address to look up"))
+        which_parser.add_argument(
+            "--running",
+            action="store_true",
+            help=_("only show running profiles"),
+        )
+
+        # Benchmark a tunnel
+        bench_parser = subparsers.add_parser(
+            "bench",
+            help=_(
+                "measure latency and throughput through a profile, against "
+                "a server started with bench-server"
+            ),
+        )
+        complete_argument(
+            bench_parser.add_argument("name", help=_("profile name")),
+            profile_completer,
+        )
+        bench_parser.add_argument(
+            "address",
+            help=_("IP address of the server, routed by the profile"),
+        )
+        bench_parser.add_argument(
+            "--port", type=int, help=_("port of the benchmark server")
+        )
+        bench_parser.add_argument(
+            "--connects",
+            type=int,
+            default=10,
+            help=_("number of connections to time (default: %(default)s)"),
+        )
+        bench_parser.add_argument(
+            "--requests",
+            type=int,
+            default=100,
+            help=_(
+                "number of requests to time round-trips for "
+                "(default: %(default)s)"
+            ),
+        )
+        bench_parser.add_argument(
+            "--size",
+            type=int,
+            default=64,
+            help=_("size of requests in bytes (default: %(default)s)"),
+        )
+        bench_parser.add_argument(
+            "--duration",
+            type=float,
+            default=5.0,
+            help=_(
+                "seconds to send bulk data for throughput "
+                "(default: %(default)s)"
+            ),
+        )
+
+        # Serve benchmark connections
+        bench_server_parser = subparsers.add_parser(
+            "bench-server", help=_("run the server for tunnel benchmarks")
+        )
+        bench_server_parser.add_argument(
+            "--port", type=int, help=_("port to listen on")
+        )
+        bench_server_parser.add_argument(
+            "--address",
+            default="",
+            help=_("address to listen on (default: all addresses)"),
+        )
+
+        # Show running sessions
+        status_parser = subparsers.add_parser(
+            "status", help=_("show running profiles")
+        )
+        status_parser.add_argument(
+            "--prompt",
+            action="store_true",
+            help=_("print a compact summary, for use in shell prompts"),
+        )
+
+        # Show session resource usage
+        top_parser = subparsers.add_parser(
+            "top", help=_("show live resource usage for running profiles")
+        )
+        top_parser.add_argument(
+            "-d",
+            "--delay",
+            type=float,
+            default=2.0,
+            help=_("seconds between updates (default: %(default)s)"),
+        )
+        top_parser.add_argument(
+            "-n",
+            "--iterations",
+            type=int,
+            default=0,
+            help=_("number of updates before exiting (default: unlimited)"),
+        )
+
+        # Output metrics
+        metrics_parser = subparsers.add_parser(
+            "metrics", help=_("output metrics in Prometheus format")
+        )
+        metrics_parser.add_argument(
+            "--listen",
+            type=int,
+            metavar="PORT",
+            help=_("serve metrics over HTTP on the port, on localhost"),
+        )
+
+        # Supervise sessions
+        daemon_parser = subparsers.add_parser(
+            "daemon",
+            help=_(
+                "supervise profiles, restarting them if they exit, and "
+                "answer queries from other commands"
+            ),
+        )
+        complete_argument(
+            daemon_parser.add_argument(
+                "names",
+                nargs="*",
+                metavar="name",
+                help=_(
+                    "name of the profiles to supervise "
+                    "(default: running profiles)"
+                ),
+            ),
+            profile_completer,
+        )
+        daemon_parser.add_argument(
+            "--max-restarts",
+            type=int,
+            default=5,
+            help=_(
+                "maximum number of restarts per minute for a profile "
+                "(default: %(default)s)"
+            ),
+        )
+        daemon_parser.add_argument(
+            "--status",
+            action="store_true",
+            help=_("show the status of supervised profiles and exit"),
+        )
+
         # track global arguments/options so they can be stripped from action namespace
         self.global_args: Set[str] = set()
         for group in parser._action_groups:
@@ -312,9 +1036,48 @@ class Sshoot(Script):
                 action.dest for action in group._group_actions
             )
 
-        # Setup autocompletion
-        autocomplete(parser)
+        # Setup autocompletion, only loaded when completing
+        if "_ARGCOMPLETE" in os.environ:
+            from argcomplete import autocomplete
+
+            autocomplete(parser)
         return parser
 
+    def _add_jobs_argument(self, parser: ArgumentParser):
+        """Add argument for the number of concurrent profile operations."""
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=_positive_int,
+            default=DEFAULT_MAX_WORKERS,
+            help=_(
+                "maximum number of profiles to operate on concurrently "
+                "(default: %(default)s)"
+            ),
+        )
+
+
+def _positive_int(value: str) -> int:
+    """Parse a strictly positive integer argument."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise ArgumentTypeError(
+            _("must be a positive integer: {value}").format(value=value)
+        )
+    return number
+
+
+def _format_conflict(conflict: "Conflict") -> str:
+    """Return a description of a conflict between profiles."""
+    first, second = conflict.profiles
+    return _("{first} and {second} overlap on {networks}").format(
+        first=first,
+        second=second,
+        networks=", ".join(str(network) for network in conflict.networks),
+    )
+
 
 sshoot = Sshoot()
@@ -1,37 +1,85 @@
 """Handle sshuttle sessions."""
 
-from getpass import getuser
+from contextlib import contextmanager
+import dataclasses
+from functools import partial
 import os
 from pathlib import Path
-from signal import (
-    SIGKILL,
-    SIGTERM,
-)
+import select
+import selectors
+import signal
 from subprocess import (
     PIPE,
     Popen,
 )
-from tempfile import gettempdir
 import time
 from typing import (
     Any,
+    Callable,
     cast,
     Dict,
     IO,
+    Iterable,
+    Iterator,
     List,
     Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
 )
 
-from xdg.BaseDirectory import xdg_config_home
-
+from . import trace
+from .autocomplete import (
+    COMPLETION_INDEX,
+    CompletionIndex,
+)
 from .config import Config
 from .i18n import _
+from .latency import (
+    Histogram,
+    LatencyRecorder,
+)
 from .profile import (
     Profile,
     ProfileError,
 )
+from .runtime import (
+    DEFAULT_CACHE_PATH,
+    DEFAULT_CONFIG_PATH,
+    get_rundir,
+    KILL_SIGNALS,
+    pidfd_open,
+    process_exists,
+    read_pid,
+    SESSIONS_CACHE_MIN_AGE,
+)
+
+if TYPE_CHECKING:  # pragma: nocoverage
+    from .multiplex import SSHMultiplexer
+    from .stats import SessionStats
+    from .subnets import (
+        Conflict,
+        IPNetwork,
+        SubnetIndex,
+    )
+
+# Default number of profiles operated on concurrently by bulk operations
+DEFAULT_MAX_WORKERS = 8
+
+# Policies for starting profiles whose routes conflict with running ones
+CONFLICT_POLICIES = ("warn", "refuse")
 
-DEFAULT_CONFIG_PATH = Path(xdg_config_home) / "sshoot"
+# Subnets and excluded subnets are passed to sshuttle through a file in the
+# sessions directory when there are more than these, to keep command lines
+# short
+SUBNETS_FILE_THRESHOLD = 100
+SUBNETS_FILE_KINDS = ("subnets", "exclude")
+
+# Maximum size of sshuttle output kept when starting a profile
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+# Size of reads from process output pipes
+READ_SIZE = 64 * 1024
 
 
 class ManagerProfileError(Exception):
@@ -42,20 +90,45 @@ class Manager:
     """Profile manager."""
 
     def __init__(
-        self, config_path: Optional[str] = None, rundir: Optional[str] = None
+        self,
+        config_path: Optional[str] = None,
+        rundir: Optional[str] = None,
+        cache_path: Optional[str] = None,
     ):
         self.config_path = (
             Path(config_path) if config_path else DEFAULT_CONFIG_PATH
         )
         self.rundir = Path(rundir) if rundir else get_rundir("sshoot")
+        self.cache_path = (
+            Path(cache_path) if cache_path else DEFAULT_CACHE_PATH
+        )
         self.sessions_path = self.rundir / "sessions"
-        self._config = Config(self.config_path)
+        self._config = Config(
+            self.config_path, snapshot_file=self.cache_path / "config.snapshot"
+        )
+        self._latency = LatencyRecorder(self.rundir / "latency.json")
+        self._completion_index = CompletionIndex(
+            self.rundir / COMPLETION_INDEX, self.sessions_path
+        )
+        # duration of the last configuration load, in seconds
+        self.config_load_duration: Optional[float] = None
+        # index of profile subnets, built on first lookup
+        self._subnet_index: Optional["SubnetIndex"] = None
 
     def load_config(self):
         """Load configuration from file."""
-        self.config_path.mkdir(parents=True, exist_ok=True)
-        self.sessions_path.mkdir(parents=True, exist_ok=True)
-        self._config.load()
+        start = time.monotonic()
+        with trace.span("load_config"):
+            self.config_path.mkdir(parents=True, exist_ok=True)
+            self.sessions_path.mkdir(parents=True, exist_ok=True)
+            try:
+                self.cache_path.mkdir(mode=0o700, parents=True, exist_ok=True)
+            except OSError:
+                # the cache is optional
+                pass
+            self._config.load()
+        self.config_load_duration = time.monotonic() - start
+        self._subnet_index = None
 
     def create_profile(self, name: str, details: Dict[str, Any]):
         """Create a profile with provided details."""
@@ -68,6 +141,8 @@ class Manager:
         except ProfileError as error:
             raise ManagerProfileError(str(error))
         self._config.save()
+        self._subnet_index = None
+        self.update_completion_index()
 
     def remove_profile(self, name: str):
         """Remove profile with given name."""
@@ -79,6 +154,8 @@ class Manager:
             )
 
         self._config.save()
+        self._subnet_index = None
+        self.update_completion_index()
 
     def get_profiles(self) -> Dict[str, Profile]:
         """Return profiles defined in config."""
@@ -87,7 +164,7 @@ class Manager:
     def get_profile(self, name: str) -> Profile:
         """Return profile with given name."""
         try:
-            return self._config.profiles[name]
+            return self._config.get_profile(name)
         except KeyError:
             raise ManagerProfileError(
                 _("Unknown profile: {name}").format(name=name)
@@ -102,44 +179,77 @@ class Manager:
         """Start profile with given name."""
         if self.is_running(name):
             raise ManagerProfileError(_("Profile is already running"))
+        if self.conflict_policy == "refuse":
+            self.refuse_conflicts(name)
 
-        cmdline = self.get_cmdline(
+        cmdlines, subnets_files = self.get_session_cmdlines(
             name,
             extra_args=extra_args,
             disable_global_extra_options=disable_global_extra_options,
         )
-        message = _("Profile failed to start: {error}")
+        remote = self.get_multiplexed_remote(
+            name, extra_args, disable_global_extra_options
+        )
+        self.prepare_session(name, len(cmdlines), subnets_files)
+        start = time.monotonic()
         try:
-            process = Popen(cmdline, stderr=PIPE)
+            with self.ssh_master(name, remote):
+                # the first shard is started last, so that the session is
+                # only running once all shards are
+                for shard, cmdline in reversed(list(enumerate(cmdlines))):
+                    self._spawn(name, shard, cmdline)
+        except ManagerProfileError:
+            self.abort_session(name)
+            raise
+
+        self.record_latency("start", time.monotonic() - start)
+        self.update_completion_index()
+
+    def _spawn(self, name: str, shard: int, cmdline: List[str]):
+        """Run sshuttle for a shard of a profile, until it daemonizes."""
+        with self.output_buffer(name) as output:
+            try:
+                with trace.span("spawn", profile=name, shard=shard):
+                    process = Popen(cmdline, stderr=PIPE)
+            except OSError as err:
+                # To catch file not found errors
+                raise start_failed(str(err))
             # Wait until process is started (it daemonizes)
-            process.wait()
-        except OSError as err:
-            # To catch file not found errors
-            raise ManagerProfileError(message.format(error=str(err)))
-
-        stderr = cast(IO[bytes], process.stderr)
-        if process.returncode != 0:
-            error = stderr.read().decode()
-            stderr.close()
-            if not error:
-                error = "Please see the log for more details: 'grep sshuttle /var/log/syslog'"
-            raise ManagerProfileError(message.format(error=error))
-        stderr.close()
+            with trace.span("wait_daemonize", profile=name, shard=shard):
+                _wait_and_capture(process, output)
+            if process.returncode != 0:
+                raise start_failed(output.getvalue())
+
+    def stop_profile(self, name: str, release_ssh_master: bool = True):
+        """Stop profile with given name.
+
+        If `release_ssh_master` is false, the shared SSH master connection
+        for the profile remote is kept running even if no other session
+        uses it.
 
-    def stop_profile(self, name: str):
-        """Stop profile with given name."""
+        """
         self.get_profile(name)
 
         if not self.is_running(name):
             raise ManagerProfileError(_("Profile is not running"))
 
+        start = time.monotonic()
         try:
+            # record that the session is stopped on purpose
+            self.set_stopped(name)
             pid = int(self._get_pidfile(name).read_text())
-            kill_and_wait(pid)
-        except (OSError, PermissionError) as error:
+            with trace.span("kill_and_wait", profile=name, pid=pid):
+                kill_and_wait(pid)
+            self.stop_shards(name)
+        except (OSError, ProcessKillFail) as error:
             raise ManagerProfileError(
                 _("Failed to stop profile: {error}").format(error=error)
             )
+        self.remove_subnets_files(name)
+        if release_ssh_master:
+            self.release_ssh_master(name)
+        self.record_latency("stop", time.monotonic() - start)
+        self.update_completion_index()
 
     def restart_profile(
         self,
@@ -147,32 +257,276 @@ class Manager:
         extra_args: Optional[List[str]] = None,
         disable_global_extra_options: bool = False,
     ):
-        """Restart profile with given name."""
+        """Restart profile with given name.
+
+        The shared SSH master connection for the profile is kept running
+        across the restart.
+
+        """
+        if self.conflict_policy == "refuse":
+            # refuse before stopping, so that the profile is kept running
+            self.refuse_conflicts(name)
         if self.is_running(name):
-            self.stop_profile(name)
+            self.stop_profile(name, release_ssh_master=False)
         self.start_profile(
             name,
             extra_args=extra_args,
             disable_global_extra_options=disable_global_extra_options,
         )
 
+    def start_profiles(
+        self,
+        names: Iterable[str],
+        extra_args: Optional[List[str]] = None,
+        disable_global_extra_options: bool = False,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ) -> Dict[str, Optional[ManagerProfileError]]:
+        """Start multiple profiles concurrently.
+
+        Return a dict mapping profile names to the error that occurred when
+        starting them, or None if the profile was started.
+
+        """
+        names = list(names)
+        refused: Dict[str, Optional[ManagerProfileError]] = {}
+        if self.conflict_policy == "refuse":
+            # profiles started together don't see each other running, so
+            # for conflicts among them, later ones are refused
+            refused = {
+                name: _conflict_error(others)
+                for name, others in self._batch_conflicts(names).items()
+            }
+        results = self._run_concurrently(
+            partial(
+                self.start_profile,
+                extra_args=extra_args,
+                disable_global_extra_options=disable_global_extra_options,
+            ),
+            [name for name in names if name not in refused],
+            max_workers,
+        )
+        results.update(refused)
+        return {name: results[name] for name in names}
+
+    def stop_profiles(
+        self, names: Iterable[str], max_workers: int = DEFAULT_MAX_WORKERS
+    ) -> Dict[str, Optional[ManagerProfileError]]:
+        """Stop multiple profiles concurrently.
+
+        Return a dict mapping profile names to the error that occurred when
+        stopping them, or None if the profile was stopped.
+
+        """
+        return self._run_concurrently(self.stop_profile, names, max_workers)
+
+    def restart_profiles(
+        self,
+        names: Iterable[str],
+        extra_args: Optional[List[str]] = None,
+        disable_global_extra_options: bool = False,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ) -> Dict[str, Optional[ManagerProfileError]]:
+        """Restart multiple profiles concurrently.
+
+        Return a dict mapping profile names to the error that occurred when
+        restarting them, or None if the profile was restarted.
+
+        """
+        return self._run_concurrently(
+            partial(
+                self.restart_profile,
+                extra_args=extra_args,
+                disable_global_extra_options=disable_global_extra_options,
+            ),
+            names,
+            max_workers,
+        )
+
+    @property
+    def conflict_policy(self) -> str:
+        """Return the policy for starting profiles with conflicting routes."""
+        policy = self._config.config.get("on-conflict", CONFLICT_POLICIES[0])
+        if policy not in CONFLICT_POLICIES:
+            raise ManagerProfileError(
+                _("Invalid value for 'on-conflict' config: {value}").format(
+                    value=policy
+                )
+            )
+        return cast(str, policy)
+
+    def find_conflicts(self) -> List["Conflict"]:
+        """Return conflicts between routes of all profiles."""
+        from .subnets import find_conflicts
+
+        with trace.span("find_conflicts"):
+            return find_conflicts(self._config.profiles)
+
+    def get_start_conflicts(self, names: Iterable[str]) -> List["Conflict"]:
+        """Return conflicts from starting the specified profiles.
+
+        These are conflicts with running profiles, or among the profiles
+        themselves. Unknown profiles are ignored.
+
+        """
+        profiles = self._config.profiles
+        names = {name for name in names if name in profiles}
+        running = self._get_running_sessions()
+        profiles = {
+            name: profile
+            for name, profile in profiles.items()
+            if name in names or name in running
+        }
+        if len(profiles) < 2:
+            return []
+
+        from .subnets import find_conflicts
+
+        with trace.span("find_conflicts"):
+            conflicts = find_conflicts(profiles)
+        return [
+            conflict
+            for conflict in conflicts
+            if names.intersection(conflict.profiles)
+        ]
+
+    def find_profiles_for(self, address: str) -> List[Tuple[str, "IPNetwork"]]:
+        """Return profiles routing an address, and the matching subnet.
+
+        Profiles are sorted by most specific subnet first.
+
+        """
+        # only imported here, as it's slow to import
+        from .subnets import (
+            parse_address,
+            SubnetIndex,
+        )
+
+        ip = parse_address(address)
+        if ip is None:
+            raise ManagerProfileError(
+                _("Invalid address: {address}").format(address=address)
+            )
+        if self._subnet_index is None:
+            with trace.span("build_subnet_index"):
+                self._subnet_index = SubnetIndex.from_profiles(
+                    self._config.profiles
+                )
+        return self._subnet_index.lookup(ip)
+
     def is_running(self, name: str) -> bool:
         """Return whether the specified profile is running."""
+        with trace.span("is_running", profile=name):
+            return self.get_pid(name) is not None
+
+    def get_pid(self, name: str) -> Optional[int]:
+        """Return the PID of the session for a profile, if running.
+
+        For sessions with multiple shards, this is the PID of the first one.
+
+        """
+        pids = self.get_pids(name)
+        return pids[0] if pids else None
+
+    def get_pids(self, name: str) -> List[int]:
+        """Return PIDs for shards of the session for a profile, if running.
+
+        The session is only running if all of its shards are, otherwise an
+        empty list is returned.
+
+        """
         pidfile = self._get_pidfile(name)
-        try:
-            pid = int(pidfile.read_text())
-        except Exception:
-            # If anything fails, a valid PID can't be found, so the profile is
-            # not running
-            return False
+        pid = read_pid(pidfile)
+        if pid is None:
+            return []
 
-        try:
-            os.kill(pid, 0)
-        except ProcessLookupError:
+        if not process_exists(pid):
             # Delete stale pidfile
             pidfile.unlink()
-            return False
-        return True
+            return []
+        return self._get_shard_pids(name, pid)
+
+    def was_stopped(self, name: str) -> bool:
+        """Return whether the session for a profile was explicitly stopped."""
+        return self._get_stopfile(name).exists()
+
+    def set_stopped(self, name: str, stopped: bool = True):
+        """Set whether the session for a profile was explicitly stopped."""
+        stopfile = self._get_stopfile(name)
+        if stopped:
+            stopfile.touch()
+        else:
+            stopfile.unlink(missing_ok=True)
+
+    def prepare_session(
+        self, name: str, shards: int, subnets_files: Dict[Path, str]
+    ):
+        """Prepare to start the session for a profile, with a number of
+        shards.
+
+        Processes and files left over from a previous session are removed,
+        and the number of shards is recorded, since the session is only
+        running if all of them are. Subnets files for the command lines are
+        written, as returned by get_session_cmdlines().
+
+        """
+        shards_file = self._get_shards_file(name)
+        if shards_file.exists():
+            # the first shard is left running if other ones exit
+            pid = read_pid(self._get_pidfile(name))
+            if pid is not None and process_exists(pid):
+                with trace.span("kill_and_wait", profile=name, pid=pid):
+                    kill_and_wait(pid)
+        self.stop_shards(name)
+        self.remove_subnets_files(name)
+        self.set_stopped(name, False)
+        if shards > 1:
+            shards_file.write_text(f"{shards}\n")
+        for path, content in subnets_files.items():
+            tmp_file = path.with_name(f".{path.name}.{os.getpid()}")
+            tmp_file.write_text(content)
+            tmp_file.replace(path)
+
+    def abort_session(self, name: str):
+        """Clean up after the session for a profile failed to start.
+
+        Shards that were started are stopped, and subnets files removed.
+
+        """
+        self.stop_shards(name)
+        self.remove_subnets_files(name)
+
+    def get_session_stats(self) -> Dict[str, "SessionStats"]:
+        """Return resource usage stats for running sessions.
+
+        Stats for sessions with multiple shards include all of them.
+
+        """
+        from .stats import get_sessions_stats
+
+        sessions = self._scan_sessions()
+        return get_sessions_stats(
+            {name: pids[0] for name, pids in sessions.items()},
+            shard_pids={name: pids[1:] for name, pids in sessions.items()},
+        )
+
+    def get_latency_histograms(self) -> Dict[str, Histogram]:
+        """Return latency histograms for profile operations."""
+        return self._latency.histograms()
+
+    def record_latency(self, operation: str, duration: float):
+        """Record the duration of a profile operation, in seconds."""
+        self._latency.record(operation, duration)
+
+    def get_statuses(self) -> Dict[str, bool]:
+        """Return a dict with running status for all profiles.
+
+        Session pidfiles are found with a single scan of the sessions
+        directory, and stale ones are removed.
+
+        """
+        with trace.span("get_statuses"):
+            running = self._get_running_sessions()
+        return {name: name in running for name in self._config.profiles}
 
     def get_cmdline(
         self,
@@ -180,33 +534,509 @@ class Manager:
         extra_args: Optional[List[str]] = None,
         disable_global_extra_options: bool = False,
     ) -> List[str]:
-        """Return the command line for the specified profile."""
+        """Return the command line for the specified profile.
+
+        For profiles with multiple shards, this is the command line for the
+        first one.
+
+        """
+        return self.get_cmdlines(
+            name,
+            extra_args=extra_args,
+            disable_global_extra_options=disable_global_extra_options,
+        )[0]
+
+    def get_cmdlines(
+        self,
+        name: str,
+        extra_args: Optional[List[str]] = None,
+        disable_global_extra_options: bool = False,
+    ) -> List[List[str]]:
+        """Return command lines for each shard of the specified profile.
+
+        Subnets are partitioned between shards, while excluded subnets
+        apply to all of them. Options for the whole session, such as DNS
+        forwarding and hosts discovery, only apply to the first shard.
+        Large sets of subnets are passed through files in the sessions
+        directory, which are only written when the profile is started.
+
+        """
+        return self.get_session_cmdlines(
+            name,
+            extra_args=extra_args,
+            disable_global_extra_options=disable_global_extra_options,
+        )[0]
+
+    def get_session_cmdlines(
+        self,
+        name: str,
+        extra_args: Optional[List[str]] = None,
+        disable_global_extra_options: bool = False,
+    ) -> Tuple[List[List[str]], Dict[Path, str]]:
+        """Return command lines for each shard of the specified profile,
+        and the content of subnets files they reference, by path."""
         profile = self.get_profile(name)
+        if self.normalize_subnets:
+            subnets, exclude_subnets = profile.normalized_subnets()
+            profile = dataclasses.replace(
+                profile, subnets=subnets, exclude_subnets=exclude_subnets
+            )
 
         executable = self._get_executable()
-        extra_opts = ["--daemon", "--pidfile", str(self._get_pidfile(name))]
         global_extra_options = (
             self._config.config.get("extra-options", [])
             if not disable_global_extra_options
             else []
         )
-        if extra_args:
-            extra_opts.extend(extra_args)
-        return profile.cmdline(
-            executable=executable,
-            extra_opts=extra_opts,
-            global_extra_options=global_extra_options,
+        extra_opts = list(extra_args or [])
+        remote = self.get_multiplexed_remote(
+            name, extra_args, disable_global_extra_options
         )
+        ssh_cmd = None
+        if remote is not None:
+            ssh_cmd = self._get_multiplexer().ssh_cmd(remote)
+        subnets_files: Dict[Path, str] = {}
+
+        def subnets_file(
+            kind: str, subnets: List[str], shard: int = 0
+        ) -> Optional[str]:
+            # subnets are only passed through a file if there are too many
+            # for the command line
+            if len(subnets) <= SUBNETS_FILE_THRESHOLD:
+                return None
+            path = self._get_subnets_file(name, kind, shard=shard)
+            subnets_files[path] = "".join(f"{subnet}\n" for subnet in subnets)
+            return str(path)
+
+        exclude_file = subnets_file("exclude", profile.exclude_subnets or [])
+        cmdlines = [
+            _shard_profile(profile, shard, subnets).cmdline(
+                executable=executable,
+                extra_opts=[
+                    "--daemon",
+                    "--pidfile",
+                    str(self._get_pidfile(name, shard=shard)),
+                    *extra_opts,
+                ],
+                global_extra_options=global_extra_options,
+                subnets_file=subnets_file("subnets", subnets, shard=shard),
+                exclude_file=exclude_file,
+                ssh_cmd=ssh_cmd,
+            )
+            for shard, subnets in enumerate(
+                profile.shard_subnets(profile.subnets)
+            )
+        ]
+        return cmdlines, subnets_files
+
+    @property
+    def ssh_multiplex(self) -> bool:
+        """Whether sessions to the same remote share a master connection."""
+        return bool(self._config.config.get("ssh-multiplex", False))
+
+    @property
+    def normalize_subnets(self) -> bool:
+        """Whether subnets are normalized in command lines."""
+        return bool(self._config.config.get("normalize-subnets", False))
 
-    def _get_pidfile(self, name: str) -> Path:
-        """Return the path of the pidfile for the specified profile."""
-        return self.sessions_path / f"{name}.pid"
+    def get_subnet_rules(self, name: str) -> Optional[Tuple[int, int]]:
+        """Return the number of subnet rules for a profile, before and after
+        normalization.
+
+        None is returned if normalization is not enabled.
+
+        """
+        if not self.normalize_subnets:
+            return None
+        profile = self.get_profile(name)
+        with trace.span("normalize_subnets", profile=name):
+            subnets, exclude_subnets = profile.normalized_subnets()
+        return (
+            len(profile.subnets) + len(profile.exclude_subnets or ()),
+            len(subnets) + len(exclude_subnets),
+        )
+
+    def _get_pidfile(self, name: str, shard: int = 0) -> Path:
+        """Return the path of the pidfile for the specified profile shard."""
+        return self._get_shard_file(name, "pid", shard)
+
+    def _run_concurrently(
+        self,
+        operation: Callable[[str], None],
+        names: Iterable[str],
+        max_workers: int,
+    ) -> Dict[str, Optional[ManagerProfileError]]:
+        """Run an operation on multiple profiles, with bounded concurrency.
+
+        Return a dict mapping profile names to the error raised by the
+        operation, if any.
+
+        """
+        # only imported here, as it's slow to import
+        from concurrent.futures import ThreadPoolExecutor
+
+        # keep spans from worker threads under the current one
+        operation = trace.propagate(operation)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                name: executor.submit(operation, name) for name in names
+            }
+        results: Dict[str, Optional[ManagerProfileError]] = {}
+        for name, future in futures.items():
+            error = future.exception()
+            if error is not None and not isinstance(
+                error, ManagerProfileError
+            ):
+                raise error
+            results[name] = error
+        return results
+
+    def _get_running_sessions(self) -> Dict[str, int]:
+        """Return a dict mapping names of running sessions to their PID."""
+        return {name: pids[0] for name, pids in self._scan_sessions().items()}
+
+    def _scan_sessions(self) -> Dict[str, List[int]]:
+        """Return a dict mapping names of running sessions to PIDs of their
+        shards."""
+        try:
+            with os.scandir(self.sessions_path) as it:
+                entries = [
+                    entry
+                    for entry in it
+                    if entry.name.endswith((".pid", ".shards"))
+                ]
+        except FileNotFoundError:
+            return {}
+
+        # sessions with multiple shards
+        sharded = {
+            entry.name[: -len(".shards")]
+            for entry in entries
+            if entry.name.endswith(".shards")
+        }
+        sessions = {}
+        stale_pidfiles = []
+        for entry in entries:
+            if not entry.name.endswith(".pid"):
+                continue
+            pid = read_pid(Path(entry.path))
+            if pid is None:
+                continue
+            if not process_exists(pid):
+                stale_pidfiles.append(entry.path)
+                continue
+            name = entry.name[: -len(".pid")]
+            pids = (
+                self._get_shard_pids(name, pid) if name in sharded else [pid]
+            )
+            if pids:
+                sessions[name] = pids
+
+        for path in stale_pidfiles:
+            Path(path).unlink(missing_ok=True)
+        return sessions
+
+    def update_completion_index(self):
+        """Update the index used for fast completion of profile names."""
+        self._completion_index.update(
+            self._config.profiles_key,
+            self._config.profiles,
+            self._scan_sessions,
+        )
+
+    def refuse_conflicts(self, name: str):
+        """Raise an error if the profile conflicts with running ones."""
+        others = {
+            other
+            for conflict in self.get_start_conflicts([name])
+            for other in conflict.profiles
+            if other != name
+        }
+        if others:
+            raise _conflict_error(others)
+
+    def _batch_conflicts(self, names: List[str]) -> Dict[str, Set[str]]:
+        """Return profiles conflicting with earlier ones in the list.
+
+        The dict maps names to the earlier profiles they conflict with.
+
+        """
+        from .subnets import find_conflicts
+
+        profiles = self._config.profiles
+        order = {name: index for index, name in enumerate(names)}
+        conflicts: Dict[str, Set[str]] = {}
+        for conflict in find_conflicts(
+            {name: profiles[name] for name in order if name in profiles}
+        ):
+            first, second = sorted(conflict.profiles, key=order.__getitem__)
+            conflicts.setdefault(second, set()).add(first)
+        return conflicts
+
+    def _get_multiplexer(self) -> "SSHMultiplexer":
+        """Return the multiplexer for SSH master connections."""
+        from .multiplex import SSHMultiplexer
+
+        return SSHMultiplexer(self.rundir / "ssh")
+
+    def get_multiplexed_remote(
+        self,
+        name: str,
+        extra_args: Optional[List[str]] = None,
+        disable_global_extra_options: bool = False,
+    ) -> Optional[str]:
+        """Return the remote for a profile, if its session should connect
+        through a shared master connection.
+
+        Multiplexing is not used if a custom ssh command is set in options,
+        or for remotes with a password.
+
+        """
+        profile = self.get_profile(name)
+        if not (self.ssh_multiplex and profile.remote):
+            return None
+        options = [*(profile.extra_opts or []), *(extra_args or [])]
+        if not disable_global_extra_options:
+            options.extend(self._config.config.get("extra-options", []))
+        if any(
+            option in ("-e", "--ssh-cmd") or option.startswith("--ssh-cmd=")
+            for option in options
+        ):
+            return None
+
+        from .multiplex import ssh_destination
+
+        if ssh_destination(profile.remote) is None:
+            return None
+        return profile.remote
+
+    @contextmanager
+    def ssh_master(self, name: str, remote: Optional[str]) -> Iterator[None]:
+        """Run the master connection for a remote while starting a session.
+
+        The master is started with ssh options for the profile, which apply
+        to all sessions sharing it. If the session fails to start, the master
+        is stopped unless other sessions use it.
+
+        """
+        if remote is None:
+            yield
+            return
+        options = self.get_profile(name).ssh_options()
+        multiplexer = self._get_multiplexer()
+        with _multiplex_errors(), multiplexer.lock(remote):
+            with trace.span("start_ssh_master", profile=name):
+                multiplexer.start(remote, options=options)
+            try:
+                yield
+            except Exception:
+                self._stop_unused_ssh_master(multiplexer, name, remote)
+                raise
+
+    def release_ssh_master(self, name: str):
+        """Stop the master connection for a stopped session, unless other
+        sessions use it."""
+        profile = self.get_profile(name)
+        if not (self.ssh_multiplex and profile.remote):
+            return
+        multiplexer = self._get_multiplexer()
+        with _multiplex_errors(), multiplexer.lock(profile.remote):
+            self._stop_unused_ssh_master(multiplexer, name, profile.remote)
+
+    def _stop_unused_ssh_master(
+        self, multiplexer: "SSHMultiplexer", name: str, remote: str
+    ):
+        """Stop the master connection for a remote, if no session other
+        than the named one uses it."""
+        profiles = self._config.profiles
+        if any(
+            other in profiles and profiles[other].remote == remote
+            for other in self._get_running_sessions()
+            if other != name
+        ):
+            return
+        with trace.span("stop_ssh_master", profile=name):
+            multiplexer.stop(remote)
+
+    def remove_subnets_files(self, name: str):
+        """Remove subnets files for a profile."""
+        for kind in SUBNETS_FILE_KINDS:
+            self._get_subnets_file(name, kind).unlink(missing_ok=True)
+            for path in self._get_shard_files(name, kind).values():
+                path.unlink(missing_ok=True)
+
+    def _get_subnets_file(self, name: str, kind: str, shard: int = 0) -> Path:
+        """Return the path of the file with subnets of a kind for a
+        profile shard."""
+        return self._get_shard_file(name, kind, shard)
+
+    def stop_shards(self, name: str):
+        """Stop processes for shards of a profile other than the first."""
+        for shard, pidfile in self._get_shard_files(name, "pid").items():
+            pid = read_pid(pidfile)
+            if pid is not None:
+                with trace.span(
+                    "kill_and_wait", profile=name, shard=shard, pid=pid
+                ):
+                    kill_and_wait(pid)
+            pidfile.unlink(missing_ok=True)
+        self._get_shards_file(name).unlink(missing_ok=True)
+
+    def _get_shard_pids(self, name: str, pid: int) -> List[int]:
+        """Return PIDs for all shards of a session, given the PID of the
+        first one.
+
+        An empty list is returned if any of the shards is not running.
+
+        """
+        try:
+            shards = int(self._get_shards_file(name).read_text())
+        except (OSError, ValueError):
+            shards = 1
+        pids = [pid]
+        for shard in range(1, shards):
+            shard_pid = read_pid(self._get_pidfile(name, shard))
+            if shard_pid is None or not process_exists(shard_pid):
+                return []
+            pids.append(shard_pid)
+        return pids
+
+    def _get_shard_file(self, name: str, suffix: str, shard: int) -> Path:
+        """Return the path of a session file for a profile shard.
+
+        Files for the first shard have no shard number, so they're the same
+        as for profiles with a single shard.
+
+        """
+        if shard:
+            suffix = f"{suffix}.{shard}"
+        return self.sessions_path / f"{name}.{suffix}"
+
+    def _get_shard_files(self, name: str, suffix: str) -> Dict[int, Path]:
+        """Return existing session files for shards of a profile other than
+        the first, by shard number."""
+        prefix = f"{name}.{suffix}."
+        try:
+            with os.scandir(self.sessions_path) as it:
+                names = [
+                    entry.name
+                    for entry in it
+                    if entry.name.startswith(prefix)
+                    and entry.name[len(prefix) :].isdigit()
+                ]
+        except FileNotFoundError:
+            return {}
+        return {
+            int(name[len(prefix) :]): self.sessions_path / name
+            for name in names
+        }
+
+    def _get_shards_file(self, name: str) -> Path:
+        """Return the path of the file with the number of shards for a
+        session, if it has more than one."""
+        return self.sessions_path / f"{name}.shards"
+
+    def _get_stopfile(self, name: str) -> Path:
+        """Return the path of the file marking a profile as stopped."""
+        return self.sessions_path / f"{name}.stopped"
+
+    def _get_logfile(self, name: str) -> Path:
+        """Return the path of the output log for the specified profile."""
+        return self.sessions_path / f"{name}.log"
+
+    @contextmanager
+    def output_buffer(self, name: str) -> Iterator["OutputBuffer"]:
+        """Return a buffer for sshuttle output when starting a profile.
+
+        If session logs are enabled in config, output is also appended to
+        the session log file.
+
+        """
+        if self._config.config.get("session-logs"):
+            with self._get_logfile(name).open("ab") as fh:
+                yield OutputBuffer(tee=fh)
+        else:
+            yield OutputBuffer()
 
     def _get_executable(self) -> str:
         """Return the shuttle executable from the config."""
         return cast(str, self._config.config.get("executable", "sshuttle"))
 
 
+class ResidentManager(Manager):
+    """Profile manager for long-running processes.
+
+    Configuration is only reloaded when files change, and the scan of
+    session pidfiles is cached until the sessions directory changes.
+
+    """
+
+    def __init__(
+        self,
+        config_path: Optional[str] = None,
+        rundir: Optional[str] = None,
+        cache_path: Optional[str] = None,
+    ):
+        super().__init__(
+            config_path=config_path, rundir=rundir, cache_path=cache_path
+        )
+        self._sessions: Dict[str, List[int]] = {}
+        self._sessions_key: Optional[Tuple[int, int]] = None
+
+    def refresh_config(self):
+        """Reload configuration if files have changed."""
+        if self._config.changed():
+            self.load_config()
+
+    def get_pids(self, name: str) -> List[int]:
+        return self._scan_sessions().get(name, [])
+
+    def _scan_sessions(self) -> Dict[str, List[int]]:
+        try:
+            stat = self.sessions_path.stat()
+        except FileNotFoundError:
+            return {}
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if (
+            key != self._sessions_key
+            or time.time() - stat.st_mtime < SESSIONS_CACHE_MIN_AGE
+        ):
+            self._sessions = super()._scan_sessions()
+            self._sessions_key = key
+        return {
+            name: pids
+            for name, pids in self._sessions.items()
+            if all(map(process_exists, pids))
+        }
+
+
+class OutputBuffer:
+    """Bounded buffer holding the tail of a process output.
+
+    Data can optionally be copied to a file as it's written.
+
+    """
+
+    def __init__(
+        self, size: int = OUTPUT_BUFFER_SIZE, tee: Optional[IO[bytes]] = None
+    ):
+        self.size = size
+        self._tee = tee
+        self._data = bytearray()
+
+    def write(self, data: bytes):
+        """Add data to the buffer, discarding older data above the size."""
+        if self._tee is not None:
+            self._tee.write(data)
+        self._data.extend(data)
+        if len(self._data) > self.size:
+            del self._data[: -self.size]
+
+    def getvalue(self) -> str:
+        """Return the buffer content as a string."""
+        return self._data.decode(errors="replace")
+
+
 class ProcessKillFail(Exception):
     """Failed to kill a process."""
 
@@ -216,11 +1046,43 @@ class ProcessKillFail(Exception):
 
 
 def kill_and_wait(pid: int):
-    """Kill a process and wait for it to terminate."""
-    for wait, signal in ((2.0, SIGTERM), (1.0, SIGKILL)):
+    """Kill a process and wait for it to terminate.
+
+    If supported, a pidfd is used to get notified as soon as the process
+    exits, otherwise the process is polled for termination.
+
+    """
+    try:
+        pidfd = pidfd_open(pid)
+    except ProcessLookupError:
+        return
+    if pidfd is None:
+        _kill_and_poll(pid)
+    else:
+        try:
+            _kill_and_wait_pidfd(pid, pidfd)
+        finally:
+            os.close(pidfd)
+
+
+def _kill_and_wait_pidfd(pid: int, pidfd: int):
+    """Kill a process through a pidfd and wait for it to terminate."""
+    for sig, timeout in KILL_SIGNALS:
+        try:
+            signal.pidfd_send_signal(pidfd, sig)
+        except ProcessLookupError:
+            return
+        if _wait_pidfd(pidfd, timeout):
+            return
+    raise ProcessKillFail(pid)
+
+
+def _kill_and_poll(pid: int):
+    """Kill a process and poll until it terminates."""
+    for sig, wait in KILL_SIGNALS:
         while wait > 0:
             try:
-                os.kill(pid, signal)
+                os.kill(pid, sig)
             except ProcessLookupError:
                 return
             wait -= 0.2
@@ -228,6 +1090,100 @@ def kill_and_wait(pid: int):
     raise ProcessKillFail(pid)
 
 
-def get_rundir(prefix: str) -> Path:
-    """Return the directory holding runtime data."""
-    return Path(gettempdir()) / f"{prefix}-{getuser()}"
+def _wait_pidfd(pidfd: int, timeout: float) -> bool:
+    """Wait for the process referenced by the pidfd to exit.
+
+    Return whether the process exited within the timeout.
+
+    """
+    poll = select.poll()
+    poll.register(pidfd, select.POLLIN)
+    return bool(poll.poll(timeout * 1000))
+
+
+def _wait_and_capture(process: Popen, output: OutputBuffer):
+    """Wait for a process to exit, capturing its stderr in the buffer.
+
+    Output is read while the process runs, so that it never blocks writing
+    to a full pipe. Once the process exits, only output that's already
+    available is read, since daemonized children might keep the pipe open.
+
+    """
+    stderr = cast(IO[bytes], process.stderr)
+    fd = stderr.fileno()
+    pidfd = pidfd_open(process.pid)
+    # without a pidfd, periodically check if the process has exited
+    timeout = None if pidfd is not None else 0.1
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            if pidfd is not None:
+                selector.register(pidfd, selectors.EVENT_READ)
+            while process.poll() is None:
+                for key, events in selector.select(timeout):
+                    if key.fd != fd:
+                        continue
+                    data = os.read(fd, READ_SIZE)
+                    if data:
+                        output.write(data)
+                    else:
+                        selector.unregister(fd)
+
+        os.set_blocking(fd, False)
+        while True:
+            try:
+                data = os.read(fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            output.write(data)
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+        stderr.close()
+
+
+def _shard_profile(
+    profile: Profile, shard: int, subnets: List[str]
+) -> Profile:
+    """Return the profile for a shard, routing a subset of subnets."""
+    if shard == 0:
+        return dataclasses.replace(profile, subnets=subnets)
+    return dataclasses.replace(
+        profile,
+        subnets=subnets,
+        auto_hosts=False,
+        auto_nets=False,
+        dns=False,
+        seed_hosts=None,
+    )
+
+
+@contextmanager
+def _multiplex_errors() -> Iterator[None]:
+    """Raise errors from SSH master connections as profile errors."""
+    from .multiplex import SSHMultiplexError
+
+    try:
+        yield
+    except SSHMultiplexError as error:
+        raise ManagerProfileError(str(error))
+
+
+def _conflict_error(names: Iterable[str]) -> ManagerProfileError:
+    """Return an error for routes conflicting with the given profiles."""
+    return ManagerProfileError(
+        _("Routes conflict with profiles: {names}").format(
+            names=", ".join(sorted(names))
+        )
+    )
+
+
+def start_failed(error: str) -> ManagerProfileError:
+    """Return an error for a profile that failed to start."""
+    if not error:
+        error = "Please see the log for more details: 'grep sshuttle /var/log/syslog'"
+    return ManagerProfileError(
+        _("Profile failed to start: {error}").format(error=error)
+    )
@@ -0,0 +1,236 @@
+"""Metrics for profiles and sessions, in Prometheus text format."""
+
+from http.server import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+from itertools import accumulate
+import time
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .latency import (
+    Histogram,
+    LATENCY_BUCKETS,
+)
+from .manager import Manager
+from .supervisor import read_state
+
+# Content type for the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Dict[str, str]
+Sample = Tuple[Labels, float]
+
+
+def collect_metrics(manager: Manager) -> str:
+    """Return metrics for profiles and sessions."""
+    statuses = manager.get_statuses()
+    stats = manager.get_session_stats()
+    supervisor_state = read_state(manager)
+    now = time.time()
+
+    writer = MetricsWriter()
+    writer.add(
+        "sshoot_profiles",
+        "gauge",
+        "Number of defined profiles.",
+        [({}, len(statuses))],
+    )
+    writer.add(
+        "sshoot_sessions_running",
+        "gauge",
+        "Number of running sessions.",
+        [({}, sum(statuses.values()))],
+    )
+    writer.add(
+        "sshoot_profile_running",
+        "gauge",
+        "Whether the session for a profile is running.",
+        [
+            ({"profile": name}, int(running))
+            for name, running in statuses.items()
+        ],
+    )
+    writer.add(
+        "sshoot_session_uptime_seconds",
+        "gauge",
+        "Time since the session process started.",
+        [
+            ({"profile": name}, now - session.start_time)
+            for name, session in stats.items()
+        ],
+    )
+    writer.add(
+        "sshoot_session_cpu_seconds_total",
+        "counter",
+        "CPU time used by session processes.",
+        [
+            ({"profile": name}, session.cpu_time)
+            for name, session in stats.items()
+        ],
+    )
+    writer.add(
+        "sshoot_session_resident_memory_bytes",
+        "gauge",
+        "Resident memory of session processes.",
+        [({"profile": name}, session.rss) for name, session in stats.items()],
+    )
+    writer.add(
+        "sshoot_session_read_bytes_total",
+        "counter",
+        "Bytes read by session processes, including network traffic.",
+        _optional_samples(
+            (name, session.read_bytes) for name, session in stats.items()
+        ),
+    )
+    writer.add(
+        "sshoot_session_written_bytes_total",
+        "counter",
+        "Bytes written by session processes, including network traffic.",
+        _optional_samples(
+            (name, session.write_bytes) for name, session in stats.items()
+        ),
+    )
+    if supervisor_state is not None:
+        writer.add(
+            "sshoot_session_restarts_total",
+            "counter",
+            "Number of session restarts by the supervisor.",
+            [
+                ({"profile": name}, session["restarts"])
+                for name, session in supervisor_state["sessions"].items()
+            ],
+        )
+    writer.add_histogram(
+        "sshoot_operation_duration_seconds",
+        "Duration of profile operations.",
+        LATENCY_BUCKETS,
+        [
+            ({"operation": operation}, histogram)
+            for operation, histogram in sorted(
+                manager.get_latency_histograms().items()
+            )
+        ],
+    )
+    if manager.config_load_duration is not None:
+        writer.add(
+            "sshoot_config_load_duration_seconds",
+            "gauge",
+            "Duration of the last configuration load.",
+            [({}, manager.config_load_duration)],
+        )
+    return writer.output()
+
+
+class MetricsWriter:
+    """Write metrics in Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._lines: List[str] = []
+
+    def add(
+        self,
+        name: str,
+        metric_type: str,
+        description: str,
+        samples: Iterable[Sample],
+    ):
+        """Add a metric with its samples."""
+        self._add_header(name, metric_type, description)
+        for labels, value in samples:
+            self._add_sample(name, labels, value)
+
+    def add_histogram(
+        self,
+        name: str,
+        description: str,
+        buckets: Tuple[float, ...],
+        histograms: Iterable[Tuple[Labels, Histogram]],
+    ):
+        """Add a histogram metric, from non-cumulative bucket counts."""
+        self._add_header(name, "histogram", description)
+        for labels, histogram in histograms:
+            counts = accumulate(histogram["buckets"])
+            for bound, count in zip(buckets, counts):
+                self._add_sample(
+                    f"{name}_bucket", dict(labels, le=str(bound)), count
+                )
+            self._add_sample(
+                f"{name}_bucket", dict(labels, le="+Inf"), histogram["count"]
+            )
+            self._add_sample(f"{name}_sum", labels, histogram["sum"])
+            self._add_sample(f"{name}_count", labels, histogram["count"])
+
+    def output(self) -> str:
+        """Return the metrics text."""
+        return "".join(line + "\n" for line in self._lines)
+
+    def _add_header(self, name: str, metric_type: str, description: str):
+        self._lines.append(f"# HELP {name} {description}")
+        self._lines.append(f"# TYPE {name} {metric_type}")
+
+    def _add_sample(self, name: str, labels: Labels, value: float):
+        if labels:
+            formatted = ",".join(
+                f'{key}="{_escape(label)}"' for key, label in labels.items()
+            )
+            name += "{" + formatted + "}"
+        self._lines.append(f"{name} {value}")
+
+
+def serve_metrics(
+    get_metrics: Callable[[], str],
+    port: int,
+    address: str = "127.0.0.1",
+    ready: Optional[Callable[[HTTPServer], None]] = None,
+):
+    """Serve metrics over HTTP on the /metrics path, until interrupted.
+
+    If passed, the `ready` callback is called with the server once it's
+    listening.
+
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            content = get_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            # don't log requests
+            pass
+
+    with HTTPServer((address, port), Handler) as server:
+        if ready:
+            ready(server)
+        server.serve_forever()
+
+
+def _optional_samples(
+    values: Iterable[Tuple[str, Optional[float]]]
+) -> List[Sample]:
+    """Return samples for profiles, skipping unavailable values."""
+    return [
+        ({"profile": name}, value)
+        for name, value in values
+        if value is not None
+    ]
+
+
+def _escape(value: str) -> str:
+    """Escape a label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,164 @@
+"""Shared SSH master connections for sessions to the same remote.
+
+Sessions connect through the control socket of a master connection, so
+only the master performs the SSH handshake. If the master is not running,
+ssh falls back to a direct connection.
+
+"""
+
+from contextlib import contextmanager
+import fcntl
+import hashlib
+from pathlib import Path
+import shlex
+import subprocess
+from typing import (
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+)
+
+from .i18n import _
+from .runtime import is_private_dir
+
+
+class SSHMultiplexError(Exception):
+    """Master connections can't be used safely."""
+
+
+def ssh_destination(remote: str) -> Optional[List[str]]:
+    """Return ssh arguments for a remote in sshuttle format.
+
+    The remote is in the "[user@]host[:port]" form, where IPv6 addresses
+    with a port are enclosed in brackets. None is returned for remotes with
+    a password, since ssh can't be run directly for those.
+
+    """
+    user, at, host = remote.rpartition("@")
+    if ":" in user:
+        return None
+    port = ""
+    if host.startswith("["):
+        host, _, rest = host[1:].partition("]")
+        port = rest[1:]
+    elif host.count(":") == 1:
+        host, _, port = host.partition(":")
+    args = ["-p", port] if port else []
+    return args + [f"{user}@{host}" if at else host]
+
+
+class SSHMultiplexer:
+    """Manage master connections for remotes, with sockets in a directory.
+
+    Operations on the master for a remote should be performed while
+    holding its lock, which is shared by all processes.
+
+    """
+
+    def __init__(self, path: Path, executable: str = "ssh"):
+        self.path = path
+        self.executable = executable
+
+    def control_path(self, remote: str) -> Path:
+        """Return the path of the control socket for a remote.
+
+        Paths are named after a hash of the remote, to keep them within the
+        length limit for sockets.
+
+        """
+        digest = hashlib.sha1(remote.encode()).hexdigest()[:16]
+        return self.path / f"{digest}.sock"
+
+    def ssh_cmd(self, remote: str) -> str:
+        """Return the ssh command for sessions to a remote."""
+        return shlex.join(
+            [
+                self.executable,
+                "-o",
+                "ControlMaster=no",
+                "-o",
+                f"ControlPath={self.control_path(remote)}",
+            ]
+        )
+
+    @contextmanager
+    def lock(self, remote: str) -> Iterator[None]:
+        """Hold the lock for the master of a remote.
+
+        The directory for control sockets is created if needed, and checked
+        to be private, since sessions connect through sockets there.
+
+        """
+        self.path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if not is_private_dir(self.path.lstat()):
+            raise SSHMultiplexError(
+                _("Insecure directory for SSH control sockets: {path}").format(
+                    path=self.path
+                )
+            )
+        with self.control_path(remote).with_suffix(".lock").open("a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            yield
+
+    def is_running(self, remote: str) -> bool:
+        """Return whether the master for a remote is running."""
+        return self._control(remote, "check")
+
+    def start(self, remote: str, options: Sequence[str] = ()) -> bool:
+        """Start the master for a remote, unless it's already running.
+
+        Additional ssh `options` apply to the master connection, thus to all
+        sessions using it. Return whether the master is running. Errors are
+        not fatal, since sessions can still connect directly.
+
+        """
+        if self.is_running(remote):
+            return True
+        destination = ssh_destination(remote)
+        if destination is None:
+            return False
+        return self._run(
+            [
+                "-o",
+                "ControlMaster=yes",
+                "-o",
+                "ControlPersist=yes",
+                "-f",
+                "-N",
+                *options,
+                *destination,
+            ],
+            remote,
+        )
+
+    def stop(self, remote: str):
+        """Stop the master for a remote."""
+        self._control(remote, "exit")
+
+    def _control(self, remote: str, command: str) -> bool:
+        """Send a control command to the master for a remote."""
+        destination = ssh_destination(remote)
+        if destination is None:
+            return False
+        return self._run(["-O", command, *destination], remote)
+
+    def _run(self, args: List[str], remote: str) -> bool:
+        """Run ssh with the control socket for a remote.
+
+        Return whether it succeeded.
+
+        """
+        cmd = [
+            self.executable,
+            "-o",
+            f"ControlPath={self.control_path(remote)}",
+            *args,
+        ]
+        try:
+            process = subprocess.run(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            return False
+        return process.returncode == 0
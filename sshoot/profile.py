@@ -1,15 +1,42 @@
 """A sshuttle VPN profile."""
 
 import dataclasses
+import shlex
 from typing import (
     Any,
     Dict,
     List,
     Optional,
+    Tuple,
 )
 
 from .i18n import _
 
+# Methods supported by sshuttle to redirect traffic
+METHODS = ("auto", "nat", "nft", "tproxy", "pf", "ipfw", "windivert")
+
+# Named sets of tuning options for profiles
+PRESETS: Dict[str, Dict[str, Any]] = {
+    "bulk-throughput": {
+        "latency-control": False,
+        "ssh-cipher": "aes128-gcm@openssh.com",
+        "ssh-compression": False,
+        "ssh-server-alive-interval": 60,
+    },
+    "interactive-latency": {
+        "latency-control": True,
+        "latency-buffer-size": 8192,
+        "ssh-cipher": "chacha20-poly1305@openssh.com",
+        "ssh-compression": True,
+        "ssh-server-alive-interval": 15,
+    },
+}
+
+# Fields that must be positive integers, if set
+_POSITIVE_INT_FIELDS = frozenset(
+    ("latency_buffer_size", "ssh_server_alive_interval")
+)
+
 
 class ProfileError(Exception):
     """Invalid profile configuration."""
@@ -27,15 +54,41 @@ class Profile:
     exclude_subnets: Optional[List[str]] = None
     seed_hosts: Optional[List[str]] = None
     extra_opts: Optional[List[str]] = None
+    shards: int = 1
+    latency_control: Optional[bool] = None
+    latency_buffer_size: Optional[int] = None
+    method: Optional[str] = None
+    ssh_cipher: Optional[str] = None
+    ssh_compression: Optional[bool] = None
+    ssh_server_alive_interval: Optional[int] = None
 
     @classmethod
     def from_config(cls, config: Dict[str, Any]):
-        """Create a profile from a config dict."""
+        """Create a profile from a config dict.
+
+        If a "preset" is specified, its options are used for those that are
+        not set in the config.
+
+        """
         config = config.copy()
         try:
             profile = cls(config.pop("subnets"))
         except KeyError:
             raise ProfileError(_("Profile missing 'subnets' config"))
+        preset = config.pop("preset", None)
+        if preset is not None:
+            try:
+                preset_config = PRESETS[preset]
+            except KeyError:
+                raise ProfileError(
+                    _("Unknown preset: {name}").format(name=preset)
+                )
+            profile.update(preset_config)
+            config = {
+                key: value
+                for key, value in config.items()
+                if value is not None
+            }
         profile.update(config)
         return profile
 
@@ -48,6 +101,7 @@ class Profile:
                 raise ProfileError(
                     _("Invalid profile config '{key}'").format(key=key)
                 )
+            self._validate(attr, value)
             setattr(self, attr, value)
 
     def config(self) -> Dict[str, Any]:
@@ -64,9 +118,22 @@ class Profile:
         executable: str = "sshuttle",
         extra_opts: Optional[List[str]] = None,
         global_extra_options: Optional[List[str]] = None,
+        subnets_file: Optional[str] = None,
+        exclude_file: Optional[str] = None,
+        ssh_cmd: Optional[str] = None,
     ) -> List[str]:
-        """Return a sshuttle cmdline based on the profile."""
-        cmd = [executable] + self.subnets
+        """Return a sshuttle cmdline based on the profile.
+
+        If `subnets_file` or `exclude_file` are given, subnets or excluded
+        subnets are read by sshuttle from those files instead. If `ssh_cmd`
+        is given, it's used as the base ssh command, to which ssh options
+        for the profile are added.
+
+        """
+        if subnets_file:
+            cmd = [executable, f"--subnets={subnets_file}"]
+        else:
+            cmd = [executable] + self.subnets
         if self.remote:
             cmd.append(f"--remote={self.remote}")
         if self.auto_hosts:
@@ -75,11 +142,25 @@ class Profile:
             cmd.append("--auto-nets")
         if self.dns:
             cmd.append("--dns")
-        if self.exclude_subnets:
+        if exclude_file:
+            cmd.append(f"--exclude-from={exclude_file}")
+        elif self.exclude_subnets:
             cmd.extend(f"--exclude={net}" for net in self.exclude_subnets)
         if self.seed_hosts:
             seed_hosts = ",".join(self.seed_hosts)
             cmd.append(f"--seed-hosts={seed_hosts}")
+        if self.latency_control is False:
+            cmd.append("--no-latency-control")
+        if self.latency_buffer_size:
+            cmd.append(f"--latency-buffer-size={self.latency_buffer_size}")
+        if self.method:
+            cmd.append(f"--method={self.method}")
+        ssh_options = self.ssh_options()
+        if ssh_cmd or ssh_options:
+            ssh_cmd = " ".join(
+                [ssh_cmd or "ssh", *(shlex.quote(opt) for opt in ssh_options)]
+            )
+            cmd.append(f"--ssh-cmd={ssh_cmd}")
         if self.extra_opts:
             cmd.extend(self.extra_opts)
         if extra_opts:
@@ -88,6 +169,74 @@ class Profile:
             cmd.extend(global_extra_options)
         return cmd
 
+    def ssh_options(self) -> List[str]:
+        """Return ssh command line options for the profile."""
+        options = []
+        if self.ssh_cipher:
+            options.extend(["-c", self.ssh_cipher])
+        if self.ssh_compression is not None:
+            compression = "yes" if self.ssh_compression else "no"
+            options.extend(["-o", f"Compression={compression}"])
+        if self.ssh_server_alive_interval:
+            options.extend(
+                [
+                    "-o",
+                    f"ServerAliveInterval={self.ssh_server_alive_interval}",
+                ]
+            )
+        return options
+
+    def normalized_subnets(self) -> Tuple[List[str], List[str]]:
+        """Return the fewest subnets and excluded subnets routing the same
+        addresses as the profile."""
+        from .subnets import normalize_subnets
+
+        return normalize_subnets(self.subnets, self.exclude_subnets or [])
+
+    def shard_subnets(self, subnets: List[str]) -> List[List[str]]:
+        """Partition subnets into disjoint groups, one for each shard.
+
+        Overlapping subnets are kept in the same group, so that shards
+        don't redirect the same addresses. Otherwise, subnets are
+        distributed in turn, so that consecutive ones (which are often
+        similar in size) are spread across shards. There are fewer groups
+        than shards if there are not enough disjoint subnets.
+
+        """
+        if min(self.shards, len(subnets)) <= 1:
+            return [list(subnets)]
+
+        from .subnets import overlapping_groups
+
+        groups = overlapping_groups(subnets)
+        shards = min(self.shards, len(groups))
+        return [
+            [subnet for group in groups[shard::shards] for subnet in group]
+            for shard in range(shards)
+        ]
+
+    @staticmethod
+    def _validate(attr: str, value: Any):
+        """Raise an error if the value for a field is not valid."""
+        if attr == "shards" and not (type(value) is int and value >= 1):
+            raise ProfileError(
+                _("Invalid number of shards: {value}").format(value=value)
+            )
+        if value is None:
+            return
+        if attr in _POSITIVE_INT_FIELDS and not (
+            type(value) is int and value >= 1
+        ):
+            raise ProfileError(
+                _("Invalid value for '{key}': {value}").format(
+                    key=attr.replace("_", "-"), value=value
+                )
+            )
+        if attr == "method" and value not in METHODS:
+            raise ProfileError(
+                _("Invalid method: {value}").format(value=value)
+            )
+
     @classmethod
     def _fields(cls) -> Dict[str, Any]:
         return {field.name: field.default for field in dataclasses.fields(cls)}
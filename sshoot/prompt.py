@@ -0,0 +1,152 @@
+"""Compact status of running sessions, for shell prompts.
+
+This runs on every prompt render, so it must only import modules which are
+already loaded at interpreter startup.
+
+"""
+
+import os
+import sys
+
+# avoid importing typing, only needed for type checking
+TYPE_CHECKING = False
+if TYPE_CHECKING:  # pragma: nocoverage
+    from typing import (
+        Dict,
+        List,
+        Optional,
+    )
+
+
+def running_sessions(sessions_dir: str) -> "Dict[str, int]":
+    """Return a dict mapping names of running sessions to their PID.
+
+    Sessions with multiple shards are only running if all of them are.
+    Stale pidfiles are ignored, but not removed.
+
+    """
+    try:
+        with os.scandir(sessions_dir) as it:
+            names = [
+                entry.name
+                for entry in it
+                if entry.name.endswith((".pid", ".shards"))
+            ]
+    except OSError:
+        return {}
+
+    # sessions with multiple shards
+    sharded = {
+        name[: -len(".shards")] for name in names if name.endswith(".shards")
+    }
+    sessions = {}
+    for filename in names:
+        if not filename.endswith(".pid"):
+            continue
+        pid = _running_pid(os.path.join(sessions_dir, filename))
+        if pid is None:
+            continue
+        name = filename[: -len(".pid")]
+        if name in sharded and not _shards_running(sessions_dir, name):
+            continue
+        sessions[name] = pid
+    return sessions
+
+
+def format_prompt(sessions: "Dict[str, int]") -> str:
+    """Return a compact summary of running sessions."""
+    return ",".join(sorted(sessions))
+
+
+def fast_prompt(args: "List[str]") -> bool:
+    """Print the prompt status for a "status --prompt" command.
+
+    Only the configuration option is accepted besides the action, since it
+    doesn't affect sessions. Return whether the status was printed,
+    otherwise the command should be run by the full command-line interface.
+
+    """
+    args = list(args)
+    while args and args[0].startswith("-"):
+        option = args.pop(0)
+        if option in ("-C", "--config") and args:
+            args.pop(0)
+        elif not option.startswith("--config="):
+            return False
+    if args != ["status", "--prompt"]:
+        return False
+    sessions_dir = _sessions_dir()
+    if sessions_dir is None:
+        return False
+    output = format_prompt(running_sessions(sessions_dir))
+    if output:
+        sys.stdout.write(output + "\n")
+    return True
+
+
+def _sessions_dir() -> "Optional[str]":
+    """Return the sessions directory, if it can be found cheaply.
+
+    This follows runtime.get_rundir() without the imports it needs, for
+    the common case where the first candidate temporary directory is
+    usable. None is returned otherwise.
+
+    """
+    environ = os.environ
+    user = next(
+        (
+            environ[name]
+            for name in ("LOGNAME", "USER", "LNAME", "USERNAME")
+            if environ.get(name)
+        ),
+        None,
+    )
+    if user is None:
+        import pwd
+
+        user = pwd.getpwuid(os.getuid()).pw_name
+    tmpdir = next(
+        (
+            environ[name]
+            for name in ("TMPDIR", "TEMP", "TMP")
+            if environ.get(name)
+        ),
+        "/tmp",
+    )
+    tmpdir = os.path.abspath(tmpdir)
+    if not (os.path.isdir(tmpdir) and os.access(tmpdir, os.W_OK | os.X_OK)):
+        return None
+    return os.path.join(tmpdir, f"sshoot-{user}", "sessions")
+
+
+def _running_pid(path: str) -> "Optional[int]":
+    """Return the PID from a pidfile, if the process is running."""
+    try:
+        with open(path) as fh:
+            pid = int(fh.read())
+        os.kill(pid, 0)
+    except PermissionError:
+        # the process exists but belongs to another user
+        pass
+    except Exception:
+        return None
+    return pid
+
+
+def _shards_running(sessions_dir: str, name: str) -> bool:
+    """Return whether shards of a session other than the first are running.
+
+    This follows Manager.get_pids(), reading the number of shards from the
+    session file.
+
+    """
+    prefix = os.path.join(sessions_dir, name)
+    try:
+        with open(f"{prefix}.shards") as fh:
+            shards = int(fh.read())
+    except (OSError, ValueError):
+        shards = 1
+    return all(
+        _running_pid(f"{prefix}.pid.{shard}") is not None
+        for shard in range(1, shards)
+    )
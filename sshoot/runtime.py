@@ -0,0 +1,105 @@
+"""Locations of configuration and runtime files, and session processes.
+
+This module is used by latency-sensitive code paths, such as shell
+completion, so it must only have lightweight imports.
+
+"""
+
+from getpass import getuser
+import os
+from pathlib import Path
+from signal import (
+    SIGKILL,
+    SIGTERM,
+)
+from stat import S_ISDIR
+from tempfile import gettempdir
+from typing import (
+    cast,
+    Optional,
+    Tuple,
+)
+
+from xdg.BaseDirectory import (
+    xdg_cache_home,
+    xdg_config_home,
+)
+
+DEFAULT_CONFIG_PATH = Path(xdg_config_home) / "sshoot"
+DEFAULT_CACHE_PATH = Path(xdg_cache_home) / "sshoot"
+
+# Minimum age of the sessions directory for its scan to be reused, since
+# changes within the filesystem timestamp granularity can't be detected
+SESSIONS_CACHE_MIN_AGE = 1.0
+
+# Signals to send to terminate a process, with how long to wait after each
+KILL_SIGNALS = ((SIGTERM, 2.0), (SIGKILL, 1.0))
+
+# Identifies a file version as (path, inode, size, mtime)
+FileKey = Optional[Tuple[str, int, int, int]]
+
+
+def get_rundir(prefix: str) -> Path:
+    """Return the directory holding runtime data."""
+    return Path(gettempdir()) / f"{prefix}-{getuser()}"
+
+
+def is_private(stat: os.stat_result) -> bool:
+    """Return whether a file is owned by the current user, and not writable
+    by others."""
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+def is_private_dir(stat: os.stat_result) -> bool:
+    """Return whether a directory is owned by the current user, and not
+    accessible by others."""
+    return (
+        S_ISDIR(stat.st_mode)
+        and stat.st_uid == os.getuid()
+        and not stat.st_mode & 0o077
+    )
+
+
+def file_key(path: Path) -> FileKey:
+    """Return a key identifying the current version of a file."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (str(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def read_pid(pidfile: Path) -> Optional[int]:
+    """Return the PID from a pidfile, or None if it's not valid."""
+    try:
+        return int(pidfile.read_text())
+    except Exception:
+        # If anything fails, a valid PID can't be found, so the process is
+        # not running
+        return None
+
+
+def process_exists(pid: int) -> bool:
+    """Return whether a process with the given PID exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists but belongs to another user
+        pass
+    return True
+
+
+def pidfd_open(pid: int) -> Optional[int]:
+    """Return a pidfd for the process, or None if not supported."""
+    open_pidfd = getattr(os, "pidfd_open", None)
+    if open_pidfd is None:
+        return None
+    try:
+        return cast(int, open_pidfd(pid))
+    except ProcessLookupError:
+        raise
+    except OSError:
+        # pidfds not supported by the kernel
+        return None
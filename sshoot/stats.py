@@ -0,0 +1,200 @@
+"""Resource usage statistics for session processes, read from /proc."""
+
+import dataclasses
+from functools import lru_cache
+import os
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+PROC_PATH = Path("/proc")
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+@dataclasses.dataclass(frozen=True)
+class ProcessStats:
+    """Resource usage for a process."""
+
+    pid: int
+    command: str
+    # process start time, in seconds since the epoch
+    start_time: float
+    # user and system CPU time, in seconds
+    cpu_time: float
+    # resident memory, in bytes
+    rss: int
+    # bytes read and written through any file, including sockets. These are
+    # None if process I/O accounting is not accessible.
+    read_bytes: Optional[int]
+    write_bytes: Optional[int]
+
+
+@dataclasses.dataclass(frozen=True)
+class SessionStats:
+    """Resource usage for a session, including its child processes."""
+
+    pid: int
+    processes: List[ProcessStats]
+
+    @property
+    def start_time(self) -> float:
+        return self.processes[0].start_time
+
+    @property
+    def cpu_time(self) -> float:
+        return sum(process.cpu_time for process in self.processes)
+
+    @property
+    def rss(self) -> int:
+        return sum(process.rss for process in self.processes)
+
+    @property
+    def read_bytes(self) -> Optional[int]:
+        return _sum_optional(process.read_bytes for process in self.processes)
+
+    @property
+    def write_bytes(self) -> Optional[int]:
+        return _sum_optional(process.write_bytes for process in self.processes)
+
+
+def get_sessions_stats(
+    pids: Dict[str, int],
+    proc_path: Path = PROC_PATH,
+    shard_pids: Optional[Dict[str, List[int]]] = None,
+) -> Dict[str, SessionStats]:
+    """Return stats for sessions, from a dict mapping names to PIDs.
+
+    Stats include all descendants of the session process (such as the ssh
+    process for the tunnel), and of processes for other shards of the
+    session, from `shard_pids`. Sessions whose process is not found are
+    skipped.
+
+    """
+    children = get_children_map(proc_path)
+    stats = {}
+    for name, pid in pids.items():
+        processes = []
+        for root_pid in (pid, *(shard_pids or {}).get(name, ())):
+            for process_pid in _descendants(root_pid, children):
+                process_stats = read_process_stats(process_pid, proc_path)
+                if process_stats is not None:
+                    processes.append(process_stats)
+        if processes and processes[0].pid == pid:
+            stats[name] = SessionStats(pid=pid, processes=processes)
+    return stats
+
+
+def read_process_stats(
+    pid: int, proc_path: Path = PROC_PATH
+) -> Optional[ProcessStats]:
+    """Return stats for a process, None if it's not found."""
+    path = proc_path / str(pid)
+    try:
+        command, fields = _parse_stat((path / "stat").read_text())
+        status = _parse_status((path / "status").read_text())
+    except (OSError, ValueError):
+        return None
+
+    read_bytes: Optional[int]
+    write_bytes: Optional[int]
+    try:
+        io = _parse_status((path / "io").read_text())
+        read_bytes, write_bytes = int(io["rchar"]), int(io["wchar"])
+    except (OSError, KeyError, ValueError):
+        # not accessible for processes of other users (e.g. sudo)
+        read_bytes = write_bytes = None
+
+    # utime and stime are fields 14 and 15 in /proc/<pid>/stat, starttime
+    # (since boot) is field 22
+    cpu_ticks = int(fields[11]) + int(fields[12])
+    start_ticks = int(fields[19])
+    rss = int(status.get("VmRSS", "0 kB").split()[0]) * 1024
+    return ProcessStats(
+        pid=pid,
+        command=command,
+        start_time=_boot_time(proc_path) + start_ticks / _CLOCK_TICKS,
+        cpu_time=cpu_ticks / _CLOCK_TICKS,
+        rss=rss,
+        read_bytes=read_bytes,
+        write_bytes=write_bytes,
+    )
+
+
+def get_children_map(proc_path: Path = PROC_PATH) -> Dict[int, List[int]]:
+    """Return a dict mapping PIDs to their children, with a /proc scan."""
+    children: Dict[int, List[int]] = {}
+    try:
+        entries = list(os.scandir(proc_path))
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.name.isdigit():
+            continue
+        try:
+            _, fields = _parse_stat(Path(entry.path, "stat").read_text())
+        except (OSError, ValueError):
+            # process exited during the scan
+            continue
+        # ppid is field 4 in /proc/<pid>/stat
+        children.setdefault(int(fields[1]), []).append(int(entry.name))
+    return children
+
+
+@lru_cache()
+def _boot_time(proc_path: Path) -> float:
+    """Return the system boot time, in seconds since the epoch."""
+    try:
+        content = (proc_path / "stat").read_text()
+    except OSError:
+        return 0.0
+    for line in content.splitlines():
+        key, _, value = line.partition(" ")
+        if key == "btime":
+            return float(value)
+    return 0.0
+
+
+def _descendants(pid: int, children: Dict[int, List[int]]) -> List[int]:
+    """Return a list with a PID and its descendants."""
+    pids = [pid]
+    # the list grows while iterating, walking the tree breadth-first
+    for parent in pids:
+        pids.extend(sorted(children.get(parent, [])))
+    return pids
+
+
+def _parse_stat(content: str) -> Tuple[str, List[str]]:
+    """Parse /proc/<pid>/stat content.
+
+    Return the process command and the list of fields after it.
+
+    """
+    # the command is in parentheses and can contain spaces and parentheses
+    start = content.index("(")
+    end = content.rindex(")")
+    return content[start + 1 : end], content[end + 2 :].split()
+
+
+def _parse_status(content: str) -> Dict[str, str]:
+    """Parse "key: value" lines, as in /proc/<pid>/status and io."""
+    result = {}
+    for line in content.splitlines():
+        key, sep, value = line.partition(":")
+        if sep:
+            result[key] = value.strip()
+    return result
+
+
+def _sum_optional(values: Iterable[Optional[int]]) -> Optional[int]:
+    """Sum values, ignoring None ones. Return None if all values are."""
+    total = None
+    for value in values:
+        if value is not None:
+            total = (total or 0) + value
+    return total
@@ -0,0 +1,451 @@
+"""Analysis of profile subnets, for route lookups and conflicts."""
+
+import dataclasses
+import heapq
+from ipaddress import (
+    collapse_addresses,
+    ip_address,
+    ip_network,
+    IPv4Address,
+    IPv4Network,
+    IPv6Address,
+    IPv6Network,
+    summarize_address_range,
+)
+from typing import (
+    cast,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .profile import Profile
+
+IPAddress = Union[IPv4Address, IPv6Address]
+IPNetwork = Union[IPv4Network, IPv6Network]
+
+# A range of addresses as (IP version, first, last)
+AddressRange = Tuple[int, int, int]
+
+
+def parse_subnet(value: str) -> Optional[IPNetwork]:
+    """Return the network for a subnet in sshuttle format.
+
+    Port ranges are ignored. None is returned for hostnames and invalid
+    values.
+
+    """
+    address, width = value, ""
+    if value.startswith("["):
+        # IPv6 with port, like "[::1]/64:8000"
+        address, _, rest = value[1:].partition("]")
+        width = rest.partition(":")[0].lstrip("/")
+    else:
+        if value.count(":") == 1:
+            value = value.partition(":")[0]
+        address, _, width = value.partition("/")
+    if address.isdigit():
+        # sshuttle resolves numbers as IPv4 addresses, like "0/0"
+        address = str(IPv4Address(int(address) & 0xFFFFFFFF))
+    try:
+        if width:
+            return ip_network(f"{address}/{width}", strict=False)
+        return ip_network(address)
+    except ValueError:
+        return None
+
+
+class _Node:
+    """A node in the subnets trie, for a prefix of a given length.
+
+    Entries map profile names to whether the prefix is routed through the
+    profile, or excluded from it.
+
+    """
+
+    __slots__ = ("prefix", "length", "children", "entries")
+
+    def __init__(self, prefix: int, length: int):
+        self.prefix = prefix
+        self.length = length
+        self.children: List[Optional[_Node]] = [None, None]
+        self.entries: Dict[str, bool] = {}
+
+
+class SubnetIndex:
+    """A path-compressed binary trie of subnets for profiles.
+
+    Like sshuttle, the most specific subnet matching an address decides
+    whether it's routed through a profile, and excluded subnets take
+    precedence over included ones with the same prefix.
+
+    Lookups take time proportional to the prefix length, regardless of the
+    number of subnets.
+
+    """
+
+    def __init__(self):
+        self._roots = {4: _Node(0, 0), 6: _Node(0, 0)}
+
+    @classmethod
+    def from_profiles(cls, profiles: Dict[str, Profile]) -> "SubnetIndex":
+        """Return an index for subnets in profiles.
+
+        Subnets that are not networks (e.g. hostnames) are skipped.
+
+        """
+        index = cls()
+        for name, profile in profiles.items():
+            index.add_subnets(name, profile.subnets)
+            index.add_subnets(
+                name, profile.exclude_subnets or (), exclude=True
+            )
+        return index
+
+    def add_subnets(
+        self, name: str, subnets: Iterable[str], exclude: bool = False
+    ):
+        """Add subnets in sshuttle format for a profile."""
+        for subnet in subnets:
+            network = parse_subnet(subnet)
+            if network is not None:
+                self.add(name, network, exclude=exclude)
+
+    def add(self, name: str, network: IPNetwork, exclude: bool = False):
+        """Add a network for a profile."""
+        width = network.max_prefixlen
+        length = network.prefixlen
+        prefix = int(network.network_address)
+        node = self._roots[network.version]
+        while node.length < length:
+            bit = (prefix >> (width - node.length - 1)) & 1
+            child = node.children[bit]
+            if child is None:
+                child = _Node(prefix, length)
+                node.children[bit] = child
+                node = child
+                break
+            common = width - (prefix ^ child.prefix).bit_length()
+            if common >= child.length and child.length <= length:
+                node = child
+                continue
+            # split the edge to the child with a node for the common prefix
+            common = min(common, length)
+            shift = width - common
+            split = _Node(prefix >> shift << shift, common)
+            split.children[(child.prefix >> (shift - 1)) & 1] = child
+            node.children[bit] = split
+            node = split
+        # excluded subnets take precedence
+        node.entries[name] = not exclude and node.entries.get(name, True)
+
+    def lookup(self, address: IPAddress) -> List[Tuple[str, IPNetwork]]:
+        """Return profiles routing the address, and the matching subnet.
+
+        Profiles are sorted by most specific subnet first.
+
+        """
+        width = address.max_prefixlen
+        value = int(address)
+        matches: Dict[str, Tuple[bool, int]] = {}
+        node: Optional[_Node] = self._roots[address.version]
+        while node is not None:
+            if (value ^ node.prefix) >> (width - node.length):
+                break
+            for name, included in node.entries.items():
+                matches[name] = (included, node.length)
+            if node.length == width:
+                break
+            node = node.children[(value >> (width - node.length - 1)) & 1]
+
+        network_class = IPv4Network if address.version == 4 else IPv6Network
+        return [
+            (name, network_class((value, length), strict=False))
+            for name, (included, length) in sorted(
+                matches.items(), key=lambda item: (-item[1][1], item[0])
+            )
+            if included
+        ]
+
+
+@dataclasses.dataclass(frozen=True)
+class Conflict:
+    """Overlapping routes between two profiles."""
+
+    profiles: Tuple[str, str]
+    networks: Tuple[IPNetwork, ...]
+
+
+def route_ranges(profile: Profile) -> List[AddressRange]:
+    """Return sorted, disjoint address ranges routed through a profile.
+
+    Like sshuttle, the most specific subnet decides whether an address is
+    routed, with excluded subnets taking precedence over the same included
+    ones. Subnets that are not networks are skipped.
+
+    """
+
+    def networks(subnets: Iterable[str]) -> Iterator[IPNetwork]:
+        for subnet in subnets:
+            network = parse_subnet(subnet)
+            if network is not None:
+                yield network
+
+    return _routed_ranges(
+        networks(profile.subnets), networks(profile.exclude_subnets or ())
+    )
+
+
+def normalize_subnets(
+    subnets: List[str], exclude_subnets: List[str]
+) -> Tuple[List[str], List[str]]:
+    """Return equivalent subnets and excluded subnets, with fewer entries.
+
+    Adjacent and contained subnets are collapsed, and excluded subnets are
+    reduced to the parts within routed ones.
+
+    Subnets are returned unchanged if this doesn't reduce the number of
+    entries, or if any of them is not a plain network, such as hostnames
+    or subnets with ports, since their addresses are not known.
+
+    """
+    includes = [_plain_network(subnet) for subnet in subnets]
+    excludes = [_plain_network(subnet) for subnet in exclude_subnets]
+    if None in includes or None in excludes:
+        return list(subnets), list(exclude_subnets)
+
+    routed = _routed_ranges(
+        cast(List[IPNetwork], includes), cast(List[IPNetwork], excludes)
+    )
+    covering = _collapse(cast(List[IPNetwork], includes))
+    # exclude parts of the covering networks that are not routed. Since
+    # these are more specific, they take precedence.
+    holes = _range_networks(
+        _subtract_ranges(
+            [
+                (
+                    network.version,
+                    int(network.network_address),
+                    int(network.broadcast_address),
+                )
+                for network in covering
+            ],
+            routed,
+        )
+    )
+    if len(covering) + len(holes) >= len(subnets) + len(exclude_subnets):
+        return list(subnets), list(exclude_subnets)
+    return [str(network) for network in covering], [
+        str(network) for network in holes
+    ]
+
+
+def _routed_ranges(
+    includes: Iterable[IPNetwork], excludes: Iterable[IPNetwork]
+) -> List[AddressRange]:
+    """Return sorted, disjoint address ranges routed for networks."""
+    rules: Dict[AddressRange, bool] = {}
+    for networks, exclude in ((includes, False), (excludes, True)):
+        for network in networks:
+            key = (
+                network.version,
+                int(network.network_address),
+                int(network.broadcast_address),
+            )
+            rules[key] = not exclude and rules.get(key, True)
+
+    ranges: List[AddressRange] = []
+
+    def add_range(version: int, first: int, last: int, included: bool):
+        if not included or first > last:
+            return
+        last_version, last_first, last_last = (
+            ranges[-1] if ranges else (0, 0, 0)
+        )
+        if (last_version, last_last) == (version, first - 1):
+            # merge adjacent ranges
+            ranges[-1] = (version, last_first, last)
+        else:
+            ranges.append((version, first, last))
+
+    # networks either contain one another or are disjoint, so sorting by
+    # start and then by size puts containing networks first. The stack
+    # holds networks containing the current one, and `cursor` is the first
+    # address not yet assigned to a range.
+    stack: List[Tuple[int, int, bool]] = []
+    cursor = 0
+
+    def pop_rule():
+        nonlocal cursor
+        version, last, included = stack.pop()
+        add_range(version, cursor, last, included)
+        cursor = last + 1
+
+    for (version, first, last), included in sorted(
+        rules.items(), key=lambda rule: (rule[0][0], rule[0][1], -rule[0][2])
+    ):
+        while stack and (stack[-1][0] != version or stack[-1][1] < first):
+            pop_rule()
+        if stack:
+            add_range(version, cursor, first - 1, stack[-1][2])
+        stack.append((version, last, included))
+        cursor = first
+    while stack:
+        pop_rule()
+    return ranges
+
+
+def find_conflicts(profiles: Dict[str, Profile]) -> List[Conflict]:
+    """Return conflicts between profiles routing overlapping addresses.
+
+    Ranges routed by all profiles are swept in order, tracking the ones
+    still open, which takes O(n log n) time for n ranges, plus the number
+    of overlaps.
+
+    """
+    ranges = sorted(
+        (version, first, last, name)
+        for name, profile in profiles.items()
+        for version, first, last in route_ranges(profile)
+    )
+    overlaps: Dict[Tuple[str, str], List[AddressRange]] = {}
+    # open ranges, as (version, last, name), by smallest last address
+    active: List[Tuple[int, int, str]] = []
+    for version, first, last, name in ranges:
+        while active and active[0][:2] < (version, first):
+            heapq.heappop(active)
+        # ranges for the same profile are disjoint, so all open ones are
+        # for other profiles
+        for _, active_last, active_name in active:
+            pair = min(name, active_name), max(name, active_name)
+            overlaps.setdefault(pair, []).append(
+                (version, first, min(last, active_last))
+            )
+        heapq.heappush(active, (version, last, name))
+
+    return [
+        Conflict(profiles=pair, networks=_range_networks(pair_ranges))
+        for pair, pair_ranges in sorted(overlaps.items())
+    ]
+
+
+def overlapping_groups(subnets: List[str]) -> List[List[str]]:
+    """Return subnets grouped so that overlapping ones are in the same group.
+
+    Groups are in the order of their first subnet, and keep the order of
+    subnets. Subnets that are not networks, such as hostnames, are in a
+    group of their own, since their addresses are not known.
+
+    """
+    ranges = []
+    for index, subnet in enumerate(subnets):
+        network = parse_subnet(subnet)
+        if network is not None:
+            ranges.append(
+                (
+                    network.version,
+                    int(network.network_address),
+                    int(network.broadcast_address),
+                    index,
+                )
+            )
+
+    # sweep ranges in order, joining each to the cluster of the previous
+    # one if they overlap
+    clusters: List[List[int]] = []
+    cluster_end = (0, -1)
+    for version, first, last, index in sorted(ranges):
+        if clusters and (version, first) <= cluster_end:
+            clusters[-1].append(index)
+            cluster_end = max(cluster_end, (version, last))
+        else:
+            clusters.append([index])
+            cluster_end = (version, last)
+
+    # map subnets to the first subnet in their group
+    leaders = {
+        index: min(cluster) for cluster in clusters for index in cluster
+    }
+    groups: Dict[int, List[str]] = {}
+    for index, subnet in enumerate(subnets):
+        groups.setdefault(leaders.get(index, index), []).append(subnet)
+    return list(groups.values())
+
+
+def parse_address(value: str) -> Optional[IPAddress]:
+    """Return the IP address for a string, or None if it's not valid."""
+    try:
+        return ip_address(value)
+    except ValueError:
+        return None
+
+
+def _plain_network(subnet: str) -> Optional[IPNetwork]:
+    """Return the network for a subnet, if it doesn't specify ports."""
+    if subnet.startswith("[") or subnet.count(":") == 1:
+        return None
+    return parse_subnet(subnet)
+
+
+def _collapse(networks: Iterable[IPNetwork]) -> Tuple[IPNetwork, ...]:
+    """Return the fewest networks covering the given ones.
+
+    IPv4 networks are returned first, then IPv6 ones, each sorted.
+
+    """
+    ipv4: List[IPv4Network] = []
+    ipv6: List[IPv6Network] = []
+    for network in networks:
+        if isinstance(network, IPv4Network):
+            ipv4.append(network)
+        else:
+            ipv6.append(network)
+    return (*collapse_addresses(ipv4), *collapse_addresses(ipv6))
+
+
+def _range_networks(ranges: Iterable[AddressRange]) -> Tuple[IPNetwork, ...]:
+    """Return the fewest networks covering address ranges."""
+    networks: List[IPNetwork] = []
+    for version, first, last in ranges:
+        if version == 4:
+            networks.extend(
+                summarize_address_range(IPv4Address(first), IPv4Address(last))
+            )
+        else:
+            networks.extend(
+                summarize_address_range(IPv6Address(first), IPv6Address(last))
+            )
+    return _collapse(networks)
+
+
+def _subtract_ranges(
+    ranges: List[AddressRange], removed: List[AddressRange]
+) -> List[AddressRange]:
+    """Return parts of sorted, disjoint ranges not in removed ones.
+
+    Removed ranges must be sorted and disjoint too.
+
+    """
+    result = []
+    index = 0
+    for version, first, last in ranges:
+        # skip removed ranges before this one
+        while index < len(removed) and (
+            removed[index][0],
+            removed[index][2],
+        ) < (version, first):
+            index += 1
+        cursor = first
+        for removed_version, removed_first, removed_last in removed[index:]:
+            if (removed_version, removed_first) > (version, last):
+                break
+            if removed_first > cursor:
+                result.append((version, cursor, removed_first - 1))
+            cursor = max(cursor, removed_last + 1)
+        if cursor <= last:
+            result.append((version, cursor, last))
+    return result
@@ -0,0 +1,446 @@
+"""Supervise sshuttle sessions, restarting them when they exit."""
+
+from collections import deque
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
+import dataclasses
+from functools import partial
+import json
+import os
+from pathlib import Path
+from queue import SimpleQueue
+import random
+import selectors
+import time
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .control import ControlServer
+from .i18n import _
+from .manager import (
+    DEFAULT_MAX_WORKERS,
+    Manager,
+    ManagerProfileError,
+)
+from .runtime import (
+    file_key,
+    FileKey,
+    pidfd_open,
+    process_exists,
+    SESSIONS_CACHE_MIN_AGE,
+)
+
+# Session states
+STARTING = "starting"
+RUNNING = "running"
+RESTARTING = "restarting"
+THROTTLED = "throttled"
+STOPPED = "stopped"
+
+# Name of the file in the rundir holding supervisor state
+STATE_FILE = "supervisor.json"
+
+
+class SupervisorError(Exception):
+    """Supervisor operation failed."""
+
+
+@dataclasses.dataclass
+class Backoff:
+    """Exponential backoff with jitter."""
+
+    initial: float = 1.0
+    factor: float = 2.0
+    maximum: float = 60.0
+    # fraction of the delay that's randomized
+    jitter: float = 0.5
+
+    def delay(self, attempt: int) -> float:
+        """Return the delay before the specified retry attempt (from 0)."""
+        delay = min(self.maximum, self.initial * self.factor**attempt)
+        return delay * random.uniform(1 - self.jitter, 1)
+
+
+@dataclasses.dataclass
+class Session:
+    """State for a supervised session."""
+
+    name: str
+    state: str = STOPPED
+    pid: Optional[int] = None
+    # total number of restarts
+    restarts: int = 0
+    # consecutive failed starts
+    failures: int = 0
+    error: str = ""
+    started_at: Optional[float] = None
+    retry_at: Optional[float] = None
+    restart_times: Deque[float] = dataclasses.field(default_factory=deque)
+
+
+class Supervisor:
+    """Supervise sessions, restarting them if they exit unexpectedly.
+
+    Session processes are watched through pidfds in a single selector loop,
+    so exits are handled as they happen. If pidfds are not supported,
+    sessions are polled instead.
+
+    Restarts are delayed with jittered exponential backoff based on the
+    number of consecutive failures, and at most `max_restarts` are performed
+    in `restart_window` seconds for each session.
+
+    Sessions are started in worker threads, so that the loop keeps
+    handling events while they start.
+
+    Sessions stopped through the Manager are not restarted, but are watched
+    again if they're started by others, which is checked when the sessions
+    directory changes.
+
+    If a :class:`ControlServer` is passed, its requests are served in the
+    same loop.
+
+    """
+
+    def __init__(
+        self,
+        manager: Manager,
+        names: Iterable[str],
+        backoff: Optional[Backoff] = None,
+        max_restarts: int = 5,
+        restart_window: float = 60.0,
+        stable_time: float = 60.0,
+        poll_interval: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        control_server: Optional[ControlServer] = None,
+    ):
+        self.manager = manager
+        self.backoff = backoff or Backoff()
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        # how long a session must run to reset its failures count
+        self.stable_time = stable_time
+        self.poll_interval = poll_interval
+        self.control_server = control_server
+        self.sessions = {name: Session(name) for name in names}
+        self._clock = clock
+        self._selector = selectors.DefaultSelector()
+        # pidfds and polled PIDs for shards of watched sessions
+        self._pidfds: Dict[str, List[int]] = {}
+        self._polled: Dict[str, List[int]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS)
+        # completed session starts, as (name, future)
+        self._started: "SimpleQueue[Tuple[str, Future]]" = SimpleQueue()
+        self._sessions_key: FileKey = None
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_write, False)
+        self._selector.register(
+            self._wakeup_read, selectors.EVENT_READ, data=self._wakeup
+        )
+        self._stopping = False
+
+    @property
+    def state_file(self) -> Path:
+        return self.manager.rundir / STATE_FILE
+
+    def run(self):
+        """Supervise sessions until stopped."""
+        if read_state(self.manager) is not None:
+            raise SupervisorError(_("Supervisor already running"))
+        try:
+            if self.control_server:
+                self.control_server.open()
+                self._selector.register(
+                    self.control_server,
+                    selectors.EVENT_READ,
+                    data=self.control_server.handle,
+                )
+            self.start()
+            while not self._stopping:
+                self.step(self._next_timeout())
+        finally:
+            self.close()
+
+    def start(self):
+        """Start watching sessions, starting those that are not running."""
+        for session in self.sessions.values():
+            pids = self.manager.get_pids(session.name)
+            if pids:
+                self._watch(session, pids)
+            else:
+                self._start_session(session)
+        self.write_state()
+
+    def stop(self):
+        """Stop supervising sessions.
+
+        This can be safely called from a signal handler.
+
+        """
+        self._stopping = True
+        self._notify()
+
+    def close(self):
+        """Release resources and remove the state file."""
+        self._executor.shutdown()
+        for name in list(self._pidfds):
+            self._unwatch(name)
+        if self.control_server:
+            self.control_server.close()
+        self._selector.close()
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+        self.state_file.unlink(missing_ok=True)
+
+    def step(self, timeout: Optional[float] = None):
+        """Wait for session events and handle them."""
+        for key, events in self._selector.select(timeout):
+            key.data()
+        while not self._started.empty():
+            self._session_started(*self._started.get())
+        self._check_stopped()
+        for name, pids in list(self._polled.items()):
+            if not all(map(process_exists, pids)):
+                self._session_exited(self.sessions[name])
+
+        now = self._clock()
+        for session in self.sessions.values():
+            if session.state in (RESTARTING, THROTTLED) and (
+                session.retry_at is not None and session.retry_at <= now
+            ):
+                self._restart_session(session)
+        self.write_state()
+
+    def get_state(self) -> Dict[str, Any]:
+        """Return the supervisor state."""
+        now = self._clock()
+        wall_now = time.time()
+        sessions = {}
+        for session in self.sessions.values():
+            retry_at = None
+            if session.retry_at is not None:
+                retry_at = wall_now + session.retry_at - now
+            sessions[session.name] = {
+                "state": session.state,
+                "pid": session.pid,
+                "restarts": session.restarts,
+                "failures": session.failures,
+                "error": session.error,
+                "retry-at": retry_at,
+            }
+        return {"pid": os.getpid(), "sessions": sessions}
+
+    def write_state(self):
+        """Write the supervisor state to file."""
+        tmp_file = self.state_file.with_name(f".{STATE_FILE}")
+        tmp_file.write_text(json.dumps(self.get_state()))
+        tmp_file.replace(self.state_file)
+
+    def _notify(self):
+        """Wake up the loop.
+
+        This can be safely called from other threads and signal handlers.
+
+        """
+        try:
+            os.write(self._wakeup_write, b"\0")
+        except BlockingIOError:
+            # a wakeup is already pending
+            pass
+
+    def _wakeup(self):
+        """Consume wakeup notifications."""
+        os.read(self._wakeup_read, 1024)
+
+    def _next_timeout(self) -> Optional[float]:
+        """Return the time until the next scheduled event."""
+        timeouts = [
+            session.retry_at - self._clock()
+            for session in self.sessions.values()
+            if session.retry_at is not None
+        ]
+        if self._polled or self._stopped_sessions():
+            timeouts.append(self.poll_interval)
+        if not timeouts:
+            return None
+        return max(0.0, min(timeouts))
+
+    def _watch(self, session: Session, pids: List[int]):
+        """Start watching processes for shards of a session.
+
+        The session exits when any of them does.
+
+        """
+        session.state = RUNNING
+        session.pid = pids[0]
+        session.started_at = self._clock()
+        session.retry_at = None
+        pidfds = self._pidfds[session.name] = []
+        for pid in pids:
+            try:
+                pidfd = pidfd_open(pid)
+            except ProcessLookupError:
+                self._session_exited(session)
+                return
+            if pidfd is None:
+                self._unwatch(session.name)
+                self._polled[session.name] = pids
+                return
+            pidfds.append(pidfd)
+            self._selector.register(
+                pidfd,
+                selectors.EVENT_READ,
+                data=partial(self._session_exited, session),
+            )
+
+    def _unwatch(self, name: str):
+        """Stop watching processes for a session."""
+        for pidfd in self._pidfds.pop(name, ()):
+            self._selector.unregister(pidfd)
+            os.close(pidfd)
+        self._polled.pop(name, None)
+
+    def _session_exited(self, session: Session):
+        """Handle the exit of a session process."""
+        self._unwatch(session.name)
+        session.pid = None
+        if self.manager.was_stopped(session.name):
+            session.state = STOPPED
+            return
+        now = self._clock()
+        if (
+            session.started_at is not None
+            and now - session.started_at >= self.stable_time
+        ):
+            session.failures = 0
+        session.started_at = None
+        session.error = _("Session exited")
+        self._schedule_restart(session)
+
+    def _schedule_restart(self, session: Session):
+        """Schedule a session restart, with backoff and rate limiting."""
+        now = self._clock()
+        restart_times = session.restart_times
+        while restart_times and restart_times[0] <= now - self.restart_window:
+            restart_times.popleft()
+        if len(restart_times) >= self.max_restarts:
+            session.state = THROTTLED
+            session.retry_at = restart_times[0] + self.restart_window
+        else:
+            session.state = RESTARTING
+            session.retry_at = now + self.backoff.delay(session.failures)
+
+    def _restart_session(self, session: Session):
+        """Restart a session."""
+        if len(session.restart_times) >= self.max_restarts:
+            # the restart window has moved
+            self._schedule_restart(session)
+            if session.state == THROTTLED:
+                return
+        session.restarts += 1
+        session.restart_times.append(self._clock())
+        self._start_session(session)
+
+    def _start_session(self, session: Session):
+        """Start a session in a worker thread."""
+        session.state = STARTING
+        session.retry_at = None
+        future = self._executor.submit(self._start, session.name)
+        future.add_done_callback(partial(self._start_done, session.name))
+
+    def _start(self, name: str) -> Tuple[List[int], str]:
+        """Start a session, returning PIDs for its shards, or an empty list
+        and an error."""
+        try:
+            self.manager.start_profile(name)
+        except ManagerProfileError as error:
+            # the session might have been started by someone else
+            return self.manager.get_pids(name), str(error)
+        pids = self._wait_for_pids(name)
+        if not pids:
+            return [], _("Session pidfile not found")
+        return pids, ""
+
+    def _start_done(self, name: str, future: Future):
+        """Pass a completed session start to the loop."""
+        self._started.put((name, future))
+        self._notify()
+
+    def _session_started(self, name: str, future: Future):
+        """Watch a started session, scheduling a restart on failure."""
+        session = self.sessions[name]
+        pids, error = future.result()
+        if pids:
+            self._watch(session, pids)
+            return
+        session.error = error
+        session.failures += 1
+        self._schedule_restart(session)
+
+    def _check_stopped(self):
+        """Watch stopped sessions if they've been started by others.
+
+        This is only done if the sessions directory changed, since pidfiles
+        are written there when sessions start.
+
+        """
+        stopped = self._stopped_sessions()
+        if not stopped:
+            return
+        key = file_key(self.manager.sessions_path)
+        # changes within the timestamp granularity can't be detected
+        if key == self._sessions_key and (
+            key is None or time.time() - key[3] / 1e9 >= SESSIONS_CACHE_MIN_AGE
+        ):
+            return
+        self._sessions_key = key
+        for session in stopped:
+            pids = self.manager.get_pids(session.name)
+            if pids:
+                self._watch(session, pids)
+
+    def _stopped_sessions(self) -> List[Session]:
+        """Return sessions that were stopped."""
+        return [
+            session
+            for session in self.sessions.values()
+            if session.state == STOPPED
+        ]
+
+    def _wait_for_pids(
+        self, name: str, timeout: float = 5.0, interval: float = 0.05
+    ) -> List[int]:
+        """Wait for pidfiles of a session to be written, returning PIDs for
+        its shards.
+
+        sshuttle writes the pidfile from the daemonized process, so it might
+        not be there yet when the start command returns.
+
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            pids = self.manager.get_pids(name)
+            if pids or time.monotonic() >= deadline:
+                return pids
+            time.sleep(interval)
+
+
+def read_state(manager: Manager) -> Optional[Dict[str, Any]]:
+    """Return the state of the running supervisor, None if not running."""
+    try:
+        state = json.loads((manager.rundir / STATE_FILE).read_text())
+        pid = int(state["pid"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if not process_exists(pid):
+        return None
+    return dict(state)
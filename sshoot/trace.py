@@ -0,0 +1,184 @@
+"""Lightweight timing of operations, collected as a tree of spans.
+
+Tracing is disabled by default, in which case :func:`span` has negligible
+overhead.
+
+"""
+
+from contextlib import (
+    contextmanager,
+    nullcontext,
+)
+import dataclasses
+from functools import wraps
+import json
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+)
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+# Output formats for traces
+TRACE_FORMATS = ("tree", "json")
+
+_NULL_SPAN: ContextManager[None] = nullcontext()
+
+
+@dataclasses.dataclass
+class Span:
+    """A timed operation."""
+
+    name: str
+    start: float
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    children: List["Span"] = dataclasses.field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        end = time.perf_counter() if self.end is None else self.end
+        return end - self.start
+
+
+class Tracer:
+    """Collect spans in a tree.
+
+    Each thread has its own stack of active spans. Spans started in a thread
+    with no active span are children of the root span.
+
+    """
+
+    def __init__(self, name: str, start: Optional[float] = None):
+        if start is None:
+            start = time.perf_counter()
+        self.root = Span(name, start)
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Time the wrapped block as a child of the current span."""
+        parent = self.current()
+        span = Span(name, time.perf_counter(), attributes=attributes)
+        parent.children.append(span)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter()
+            stack.pop()
+
+    def current(self) -> Span:
+        """Return the current span for the thread."""
+        stack = self._stack()
+        return stack[-1] if stack else self.root
+
+    @contextmanager
+    def activate(self, span: Span) -> Iterator[Span]:
+        """Make a span the current one for the wrapped block."""
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+
+    def finish(self) -> Span:
+        """End the root span and return it."""
+        if self.root.end is None:
+            self.root.end = time.perf_counter()
+        return self.root
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable(name: str, start: Optional[float] = None) -> Tracer:
+    """Enable tracing, returning the tracer."""
+    global _tracer
+    _tracer = Tracer(name, start=start)
+    return _tracer
+
+
+def disable():
+    """Disable tracing."""
+    global _tracer
+    _tracer = None
+
+
+def finish() -> Optional[Span]:
+    """End the trace, returning its root span if tracing is enabled."""
+    if _tracer is None:
+        return None
+    return _tracer.finish()
+
+
+def span(name: str, **attributes: Any) -> ContextManager[Optional[Span]]:
+    """Time the wrapped block, if tracing is enabled."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, **attributes)
+
+
+def propagate(func: _F) -> _F:
+    """Wrap a function to run in another thread under the current span."""
+    tracer = _tracer
+    if tracer is None:
+        return func
+    parent = tracer.current()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with tracer.activate(parent):
+            return func(*args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def format_tree(root: Span) -> str:
+    """Format a span tree as text, with durations in milliseconds."""
+    lines = []
+
+    def add(span: Span, depth: int):
+        attributes = " ".join(
+            f"{key}={value}" for key, value in span.attributes.items()
+        )
+        line = f"{span.duration * 1000:10.2f} ms  {'  ' * depth}{span.name}"
+        if attributes:
+            line += f" ({attributes})"
+        lines.append(line)
+        for child in span.children:
+            add(child, depth + 1)
+
+    add(root, 0)
+    return "\n".join(lines) + "\n"
+
+
+def format_json(root: Span) -> str:
+    """Format a span tree as JSON, with times in seconds from the root."""
+
+    def to_dict(span: Span) -> Dict[str, Any]:
+        return {
+            "name": span.name,
+            "start": span.start - root.start,
+            "duration": span.duration,
+            "attributes": span.attributes,
+            "children": [to_dict(child) for child in span.children],
+        }
+
+    return json.dumps(to_dict(root), default=str) + "\n"
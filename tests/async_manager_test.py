@@ -0,0 +1,597 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import signal
+import subprocess
+import threading
+import time
+
+import pytest
+import yaml
+
+from sshoot.async_manager import (
+    _wait_pidfd,
+    AsyncManager,
+    kill_and_wait,
+)
+from sshoot.manager import (
+    Manager,
+    ManagerProfileError,
+    OUTPUT_BUFFER_SIZE,
+    ProcessKillFail,
+    SUBNETS_FILE_THRESHOLD,
+)
+from sshoot.profile import Profile
+
+
+@pytest.fixture
+def async_manager(profile_manager):
+    yield AsyncManager(manager=profile_manager)
+
+
+@pytest.fixture
+def profile(profile_manager):
+    profile_manager.create_profile("profile", {"subnets": ["10.0.0.0/24"]})
+
+
+@pytest.fixture
+def pid_file(profile, sessions_dir):
+    yield sessions_dir / "profile.pid"
+
+
+@pytest.fixture
+def process():
+    """A process that runs until killed."""
+    process = subprocess.Popen(["sleep", "60"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+class TestAsyncManager:
+    def test_manager(self, config_dir, run_dir):
+        """A Manager is created if not passed."""
+        async_manager = AsyncManager(config_path=config_dir, rundir=run_dir)
+        assert isinstance(async_manager.manager, Manager)
+        assert async_manager.manager.config_path == config_dir
+        assert async_manager.manager.rundir == run_dir
+
+    def test_load_config(self, async_manager, profiles_file):
+        """AsyncManager.load_config loads the profiles."""
+        profiles = {"profile": {"subnets": ["10.0.0.0/16"]}}
+        profiles_file.write_text(yaml.dump(profiles))
+        asyncio.run(async_manager.load_config())
+        assert async_manager.get_profiles() == {
+            "profile": Profile(["10.0.0.0/16"])
+        }
+
+    def test_create_profile(self, async_manager, profiles_file):
+        """AsyncManager.create_profile adds a profile."""
+        asyncio.run(
+            async_manager.create_profile(
+                "profile", {"subnets": ["10.0.0.0/24"]}
+            )
+        )
+        profiles = yaml.safe_load(profiles_file.read_text())
+        assert profiles == {"profile": {"subnets": ["10.0.0.0/24"]}}
+
+    def test_remove_profile(self, async_manager, profile, profiles_file):
+        """AsyncManager.remove_profile removes a profile."""
+        asyncio.run(async_manager.remove_profile("profile"))
+        assert yaml.safe_load(profiles_file.read_text()) == {}
+
+    def test_shared_config(self, profile_manager, async_manager, profile):
+        """Profiles are shared with the sync Manager."""
+        assert async_manager.get_profile("profile") is (
+            profile_manager.get_profile("profile")
+        )
+
+    def test_get_cmdline(self, async_manager, pid_file):
+        """AsyncManager.get_cmdline returns the command line for a profile."""
+        assert async_manager.get_cmdline("profile", extra_args=["-v"]) == [
+            "sshuttle",
+            "10.0.0.0/24",
+            "--daemon",
+            "--pidfile",
+            str(pid_file),
+            "-v",
+        ]
+
+    def test_start_profile(
+        self, async_manager, profile, sessions_dir, bin_succeed
+    ):
+        """AsyncManager.start_profile starts a profile."""
+        async_manager.manager._get_executable = lambda: str(bin_succeed)
+        (sessions_dir / "profile.stopped").touch()
+        asyncio.run(async_manager.start_profile("profile"))
+        cmdline = (bin_succeed.parent / "cmdline").read_text()
+        assert cmdline == (
+            f"10.0.0.0/24 --daemon --pidfile {sessions_dir}/profile.pid\n"
+        )
+        assert not async_manager.manager.was_stopped("profile")
+        histograms = async_manager.manager.get_latency_histograms()
+        assert histograms["start"]["count"] == 1
+
+    def test_start_profile_fail(self, async_manager, profile, bin_fail):
+        """An error is raised if starting a profile fails."""
+        async_manager.manager._get_executable = lambda: str(bin_fail)
+        with pytest.raises(ManagerProfileError) as err:
+            asyncio.run(async_manager.start_profile("profile"))
+        assert str(err.value) == "Profile failed to start: stderr message"
+
+    def test_start_profile_subnets_files(
+        self, mocker, async_manager, sessions_dir, bin_succeed
+    ):
+        """Subnets files are written off the event loop thread."""
+        manager = async_manager.manager
+        manager._get_executable = lambda: str(bin_succeed)
+        subnets = [f"10.{i}.0.0/16" for i in range(SUBNETS_FILE_THRESHOLD + 1)]
+        manager.create_profile("other", {"subnets": subnets})
+        prepare_session = manager.prepare_session
+        threads = []
+
+        def prepare(*args):
+            threads.append(threading.get_ident())
+            prepare_session(*args)
+
+        mocker.patch.object(manager, "prepare_session", side_effect=prepare)
+        asyncio.run(async_manager.start_profile("other"))
+        assert threading.get_ident() not in threads
+        subnets_file = sessions_dir / "other.subnets"
+        assert subnets_file.read_text().splitlines() == subnets
+
+    def test_start_profile_fail_subnets_files_removed(
+        self, async_manager, sessions_dir, bin_fail
+    ):
+        """If starting a profile fails, its subnets files are removed."""
+        manager = async_manager.manager
+        manager._get_executable = lambda: str(bin_fail)
+        subnets = [f"10.{i}.0.0/16" for i in range(SUBNETS_FILE_THRESHOLD + 1)]
+        manager.create_profile("other", {"subnets": subnets})
+        with pytest.raises(ManagerProfileError):
+            asyncio.run(async_manager.start_profile("other"))
+        assert not (sessions_dir / "other.subnets").exists()
+
+    def test_start_profile_fail_no_error_message(
+        self, async_manager, profile, bin_fail_silent
+    ):
+        """A hint to look at logs is given if no error is reported."""
+        async_manager.manager._get_executable = lambda: str(bin_fail_silent)
+        with pytest.raises(ManagerProfileError) as err:
+            asyncio.run(async_manager.start_profile("profile"))
+        assert "Please see the log for more details" in str(err.value)
+
+    def test_start_profile_fail_verbose(
+        self, async_manager, profile, bin_verbose_fail
+    ):
+        """Large output doesn't block the process, only the tail is kept."""
+        async_manager.manager._get_executable = lambda: str(bin_verbose_fail)
+        with pytest.raises(ManagerProfileError) as err:
+            asyncio.run(async_manager.start_profile("profile"))
+        message = str(err.value)
+        assert message.endswith("final error")
+        assert len(message) < OUTPUT_BUFFER_SIZE + 100
+
+    def test_start_profile_output_kept_open(
+        self, async_manager, profile, bin_daemonize
+    ):
+        """Children keeping the output pipe open don't block the start."""
+        async_manager.manager._get_executable = lambda: str(bin_daemonize)
+        start = time.monotonic()
+        asyncio.run(async_manager.start_profile("profile"))
+        assert time.monotonic() - start < 1
+
+    def test_start_profile_session_log(
+        self, async_manager, profile, config_file, sessions_dir, bin_fail
+    ):
+        """Output is written to the session log if enabled."""
+        config_file.write_text(yaml.dump({"session-logs": True}))
+        async_manager.manager.load_config()
+        async_manager.manager._get_executable = lambda: str(bin_fail)
+        with pytest.raises(ManagerProfileError):
+            asyncio.run(async_manager.start_profile("profile"))
+        log_file = sessions_dir / "profile.log"
+        assert log_file.read_text() == "stderr message"
+
+    def test_start_profile_updates_index(
+        self, mocker, async_manager, profile, bin_succeed
+    ):
+        """AsyncManager.start_profile updates the completion index."""
+        async_manager.manager._get_executable = lambda: str(bin_succeed)
+        update_index = mocker.patch.object(
+            async_manager.manager, "update_completion_index"
+        )
+        asyncio.run(async_manager.start_profile("profile"))
+        update_index.assert_called_once_with()
+
+    def test_start_profile_executable_not_found(self, async_manager, profile):
+        """Profile start raises an error if executable is not found."""
+        async_manager.manager._get_executable = lambda: "/not/here"
+        with pytest.raises(ManagerProfileError):
+            asyncio.run(async_manager.start_profile("profile"))
+
+    def test_start_profile_running(self, async_manager, pid_file):
+        """Trying to start a running profile raises an error."""
+        pid_file.write_text(f"{os.getpid()}\n")
+        with pytest.raises(ManagerProfileError) as err:
+            asyncio.run(async_manager.start_profile("profile"))
+        assert str(err.value) == "Profile is already running"
+
+    def test_start_profile_refuse_conflicts(
+        self, async_manager, profile, config_file, sessions_dir, bin_succeed
+    ):
+        """With "refuse" policy, a profile conflicting with running ones is
+        not started."""
+        manager = async_manager.manager
+        config_file.write_text(yaml.dump({"on-conflict": "refuse"}))
+        manager.load_config()
+        manager._get_executable = lambda: str(bin_succeed)
+        manager.create_profile("other", {"subnets": ["10.0.0.0/8"]})
+        (sessions_dir / "other.pid").write_text(f"{os.getpid()}\n")
+        with pytest.raises(ManagerProfileError) as err:
+            asyncio.run(async_manager.start_profile("profile"))
+        assert str(err.value) == "Routes conflict with profiles: other"
+        assert not (bin_succeed.parent / "cmdline").exists()
+
+    def test_start_many_profiles(self, async_manager, bin_succeed):
+        """Many profiles can be started concurrently."""
+        async_manager.manager._get_executable = lambda: str(bin_succeed)
+        names = [f"profile{i}" for i in range(50)]
+        for name in names:
+            async_manager.manager.create_profile(
+                name, {"subnets": ["10.0.0.0/24"]}
+            )
+
+        async def start_all():
+            await asyncio.gather(
+                *(async_manager.start_profile(name) for name in names)
+            )
+
+        asyncio.run(start_all())
+
+    def test_stop_profile(self, mocker, async_manager, pid_file):
+        """AsyncManager.stop_profile stops a running profile."""
+        mock_kill_and_wait = mocker.patch("sshoot.async_manager.kill_and_wait")
+        pid_file.write_text(f"{os.getpid()}\n")
+        asyncio.run(async_manager.stop_profile("profile"))
+        mock_kill_and_wait.assert_called_once_with(os.getpid())
+        assert async_manager.manager.was_stopped("profile")
+        histograms = async_manager.manager.get_latency_histograms()
+        assert histograms["stop"]["count"] == 1
+
+    def test_stop_profile_removes_subnets_files(
+        self, mocker, async_manager, pid_file, sessions_dir
+    ):
+        """AsyncManager.stop_profile removes files with subnets for the
+        profile."""
+        mocker.patch("sshoot.async_manager.kill_and_wait")
+        (sessions_dir / "profile.subnets").write_text("10.0.0.0/24\n")
+        pid_file.write_text(f"{os.getpid()}\n")
+        asyncio.run(async_manager.stop_profile("profile"))
+        assert not (sessions_dir / "profile.subnets").exists()
+
+    def test_stop_profile_updates_index(self, mocker, async_manager, pid_file):
+        """AsyncManager.stop_profile updates the completion index."""
+        mocker.patch("sshoot.async_manager.kill_and_wait")
+        update_index = mocker.patch.object(
+            async_manager.manager, "update_completion_index"
+        )
+        pid_file.write_text(f"{os.getpid()}\n")
+        asyncio.run(async_manager.stop_profile("profile"))
+        update_index.assert_called_once_with()
+
+    def test_stop_profile_unknown(self, async_manager):
+        """Trying to stop an unknown profile raises an error."""
+        with pytest.raises(ManagerProfileError):
+            asyncio.run(async_manager.stop_profile("unknown"))
+
+    def test_stop_profile_not_running(self, async_manager, pid_file):
+        """Trying to stop a profile that's not running raises an error."""
+        with pytest.raises(ManagerProfileError) as err:
+            asyncio.run(async_manager.stop_profile("profile"))
+        assert str(err.value) == "Profile is not running"
+
+    def test_stop_profile_fail(self, mocker, async_manager, pid_file):
+        """If the process fails to stop an error is raised."""
+        mock_kill_and_wait = mocker.patch("sshoot.async_manager.kill_and_wait")
+        mock_kill_and_wait.side_effect = ProcessKillFail(100)
+        pid_file.write_text(f"{os.getpid()}\n")
+        with pytest.raises(ManagerProfileError) as err:
+            asyncio.run(async_manager.stop_profile("profile"))
+        assert "Failed to stop profile" in str(err.value)
+
+    def test_restart_profile(
+        self, mocker, async_manager, pid_file, bin_succeed
+    ):
+        """AsyncManager.restart_profile restarts a running profile."""
+        async_manager.manager._get_executable = lambda: str(bin_succeed)
+
+        async def kill_and_wait(pid):
+            pid_file.unlink()
+
+        mock_kill_and_wait = mocker.patch(
+            "sshoot.async_manager.kill_and_wait", side_effect=kill_and_wait
+        )
+        pid_file.write_text(f"{os.getpid()}\n")
+        asyncio.run(async_manager.restart_profile("profile"))
+        mock_kill_and_wait.assert_called_once_with(os.getpid())
+        assert (bin_succeed.parent / "cmdline").exists()
+
+    def test_restart_profile_refuse_conflicts(
+        self, mocker, async_manager, pid_file, config_file, sessions_dir
+    ):
+        """With "refuse" policy, a running profile conflicting with other
+        running ones is not stopped."""
+        manager = async_manager.manager
+        config_file.write_text(yaml.dump({"on-conflict": "refuse"}))
+        manager.load_config()
+        manager.create_profile("other", {"subnets": ["10.0.0.0/8"]})
+        pid_file.write_text(f"{os.getpid()}\n")
+        (sessions_dir / "other.pid").write_text(f"{os.getpid()}\n")
+        mock_kill_and_wait = mocker.patch("sshoot.async_manager.kill_and_wait")
+        with pytest.raises(ManagerProfileError) as err:
+            asyncio.run(async_manager.restart_profile("profile"))
+        assert str(err.value) == "Routes conflict with profiles: other"
+        mock_kill_and_wait.assert_not_called()
+        assert manager.is_running("profile")
+
+    def test_restart_profile_not_running(
+        self, async_manager, profile, bin_succeed
+    ):
+        """AsyncManager.restart_profile starts a profile if not running."""
+        async_manager.manager._get_executable = lambda: str(bin_succeed)
+        asyncio.run(async_manager.restart_profile("profile"))
+        assert (bin_succeed.parent / "cmdline").exists()
+
+    def test_is_running(self, async_manager, pid_file):
+        """If the process is present, the profile is running."""
+        pid_file.write_text(f"{os.getpid()}\n")
+        assert asyncio.run(async_manager.is_running("profile"))
+
+    def test_is_running_no_pidfile(self, async_manager, profile):
+        """If the pidfile is not found, the profile is not running."""
+        assert not asyncio.run(async_manager.is_running("profile"))
+
+    def test_is_running_stale_pidfile(self, async_manager, pid_file):
+        """Stale pidfiles are removed."""
+        pid_file.write_text("-100\n")
+        assert not asyncio.run(async_manager.is_running("profile"))
+        assert not pid_file.exists()
+
+    def test_get_statuses(self, async_manager, pid_file):
+        """AsyncManager.get_statuses returns status for all profiles."""
+        pid_file.write_text(f"{os.getpid()}\n")
+        assert asyncio.run(async_manager.get_statuses()) == {"profile": True}
+
+
+@pytest.fixture
+def no_pidfd(mocker):
+    """Disable pidfd support."""
+    mocker.patch("sshoot.async_manager.pidfd_open").return_value = None
+
+
+@pytest.mark.usefixtures("no_pidfd")
+class TestKillAndWaitPolling:
+    def test_kill(self, mocker):
+        """The kill call is retried until the process is gone."""
+        mock_kill = mocker.patch("sshoot.async_manager.os.kill")
+        mock_kill.side_effect = [None, None, ProcessLookupError]
+        mock_sleep = mocker.patch(
+            "sshoot.async_manager.asyncio.sleep", mocker.AsyncMock()
+        )
+        asyncio.run(kill_and_wait(123))
+        assert mock_kill.mock_calls == [mocker.call(123, signal.SIGTERM)] * 3
+        assert mock_sleep.mock_calls == [mocker.call(0.2)] * 2
+
+    def test_raises_eventually(self, mocker):
+        """If the process doesn't die, an error is raised."""
+        mock_kill = mocker.patch("sshoot.async_manager.os.kill")
+        mocker.patch("sshoot.async_manager.asyncio.sleep", mocker.AsyncMock())
+        with pytest.raises(ProcessKillFail):
+            asyncio.run(kill_and_wait(123))
+        assert (
+            mock_kill.mock_calls
+            == [mocker.call(123, signal.SIGTERM)] * 11
+            + [mocker.call(123, signal.SIGKILL)] * 6
+        )
+
+
+@pytest.fixture
+def mock_pidfd_send_signal(mocker):
+    yield mocker.patch("sshoot.async_manager.signal.pidfd_send_signal")
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "pidfd_open"), reason="pidfd not supported"
+)
+class TestKillAndWaitPidfd:
+    def test_kill(self, process):
+        """The process is killed and the call returns when it exits."""
+        start = time.monotonic()
+        asyncio.run(kill_and_wait(process.pid))
+        assert time.monotonic() - start < 0.2
+        assert process.wait() == -signal.SIGTERM
+
+    def test_process_not_found(self, process):
+        """No error is reported if the process is not found."""
+        process.kill()
+        process.wait()
+        asyncio.run(kill_and_wait(process.pid))
+
+    def test_process_exits_before_signal(
+        self, mocker, process, mock_pidfd_send_signal
+    ):
+        """No error is reported if the process exits before the signal."""
+        mock_pidfd_send_signal.side_effect = ProcessLookupError
+        asyncio.run(kill_and_wait(process.pid))
+        mock_pidfd_send_signal.assert_called_once_with(
+            mocker.ANY, signal.SIGTERM
+        )
+
+    def test_raises_eventually(self, mocker, process, mock_pidfd_send_signal):
+        """If the process doesn't die, an error is raised."""
+        mocker.patch(
+            "sshoot.async_manager._wait_pidfd", mocker.AsyncMock()
+        ).return_value = False
+        with pytest.raises(ProcessKillFail):
+            asyncio.run(kill_and_wait(process.pid))
+        assert mock_pidfd_send_signal.mock_calls == [
+            mocker.call(mocker.ANY, signal.SIGTERM),
+            mocker.call(mocker.ANY, signal.SIGKILL),
+        ]
+
+    def test_wait_timeout(self, process):
+        """_wait_pidfd returns False if the process doesn't exit in time."""
+        pidfd = os.pidfd_open(process.pid)
+        try:
+            assert not asyncio.run(_wait_pidfd(pidfd, 0.01))
+        finally:
+            os.close(pidfd)
+
+
+@pytest.fixture
+def multiplexer(mocker):
+    """Mock SSH master operations."""
+    from sshoot.multiplex import SSHMultiplexer
+
+    yield {
+        method: mocker.patch.object(SSHMultiplexer, method, return_value=True)
+        for method in ("start", "stop")
+    }
+
+
+@pytest.fixture
+def multiplex_manager(async_manager, config_file, sessions_dir, multiplexer):
+    config_file.write_text(yaml.dump({"ssh-multiplex": True}))
+    async_manager.manager.load_config()
+    async_manager.manager.create_profile(
+        "profile", {"subnets": ["10.0.0.0/24"], "remote": "bastion"}
+    )
+    yield async_manager
+
+
+class TestAsyncManagerSSHMultiplex:
+    def test_start_profile(self, multiplex_manager, multiplexer, bin_succeed):
+        """The master for the remote is started with the session."""
+        multiplex_manager.manager._get_executable = lambda: str(bin_succeed)
+        asyncio.run(multiplex_manager.start_profile("profile"))
+        multiplexer["start"].assert_called_once_with("bastion", options=[])
+        assert "--ssh-cmd=ssh" in (bin_succeed.parent / "cmdline").read_text()
+        multiplexer["stop"].assert_not_called()
+
+    def test_start_profile_fail(
+        self, multiplex_manager, multiplexer, bin_fail
+    ):
+        """If the session fails to start, the master is stopped."""
+        multiplex_manager.manager._get_executable = lambda: str(bin_fail)
+        with pytest.raises(ManagerProfileError):
+            asyncio.run(multiplex_manager.start_profile("profile"))
+        multiplexer["stop"].assert_called_once_with("bastion")
+
+    def test_stop_profile(
+        self, mocker, multiplex_manager, multiplexer, sessions_dir
+    ):
+        """The master is stopped with the last session using it."""
+        mocker.patch("sshoot.async_manager.kill_and_wait")
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        asyncio.run(multiplex_manager.stop_profile("profile"))
+        multiplexer["stop"].assert_called_once_with("bastion")
+
+    def test_restart_profile(
+        self, mocker, multiplex_manager, multiplexer, sessions_dir, bin_succeed
+    ):
+        """The master is kept running across restarts."""
+        multiplex_manager.manager._get_executable = lambda: str(bin_succeed)
+        pid_file = sessions_dir / "profile.pid"
+
+        async def kill_and_wait(pid):
+            pid_file.unlink()
+
+        mocker.patch(
+            "sshoot.async_manager.kill_and_wait", side_effect=kill_and_wait
+        )
+        pid_file.write_text(f"{os.getpid()}\n")
+        asyncio.run(multiplex_manager.restart_profile("profile"))
+        multiplexer["stop"].assert_not_called()
+        multiplexer["start"].assert_called_once_with("bastion", options=[])
+
+    def test_start_profiles_same_remote(
+        self, multiplex_manager, multiplexer, bin_succeed
+    ):
+        """Sessions for the same remote can be started concurrently, even
+        if there are more than executor threads."""
+        multiplex_manager.manager._get_executable = lambda: str(bin_succeed)
+        names = [f"profile{i}" for i in range(4)]
+        for name in names:
+            multiplex_manager.manager.create_profile(
+                name, {"subnets": ["10.0.0.0/24"], "remote": "bastion"}
+            )
+
+        async def start_all():
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=2))
+            await asyncio.wait_for(
+                asyncio.gather(
+                    *(multiplex_manager.start_profile(name) for name in names)
+                ),
+                10.0,
+            )
+
+        asyncio.run(start_all())
+        assert multiplexer["start"].call_count == len(names)
+
+
+class TestAsyncManagerShards:
+    @pytest.fixture(autouse=True)
+    def profile(self, profile_manager):
+        profile_manager.create_profile(
+            "profile", {"subnets": ["10.0.0.0/24", "10.1.0.0/24"], "shards": 2}
+        )
+
+    def test_get_cmdlines(self, async_manager, sessions_dir):
+        """AsyncManager.get_cmdlines returns commands for each shard."""
+        cmdlines = async_manager.get_cmdlines("profile")
+        assert [cmdline[-1] for cmdline in cmdlines] == [
+            str(sessions_dir / "profile.pid"),
+            str(sessions_dir / "profile.pid.1"),
+        ]
+
+    def test_start_profile(
+        self, mocker, async_manager, sessions_dir, bin_succeed
+    ):
+        """A process is started for each shard, the first one last."""
+        async_manager.manager._get_executable = lambda: str(bin_succeed)
+        spawn = mocker.spy(async_manager, "_spawn")
+        asyncio.run(async_manager.start_profile("profile"))
+        assert [call.args[1][1] for call in spawn.mock_calls] == [
+            "10.1.0.0/24",
+            "10.0.0.0/24",
+        ]
+
+    def test_start_profile_fail(
+        self, mocker, async_manager, sessions_dir, bin_fail
+    ):
+        """If a shard fails to start, other ones are stopped."""
+        async_manager.manager._get_executable = lambda: str(bin_fail)
+        kill_and_wait = mocker.patch("sshoot.manager.kill_and_wait")
+        (sessions_dir / "profile.pid.1").write_text("123\n")
+        mocker.patch.object(
+            async_manager.manager,
+            "stop_shards",
+            wraps=async_manager.manager.stop_shards,
+        )
+        with pytest.raises(ManagerProfileError):
+            asyncio.run(async_manager.start_profile("profile"))
+        # leftover shards are stopped first, then after the failure
+        assert len(async_manager.manager.stop_shards.mock_calls) == 2
+        kill_and_wait.assert_called_once_with(123)
+
+    def test_stop_profile(self, mocker, async_manager, sessions_dir):
+        """All shards are stopped."""
+        mocker.patch("sshoot.async_manager.kill_and_wait")
+        kill_shard = mocker.patch("sshoot.manager.kill_and_wait")
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        (sessions_dir / "profile.pid.1").write_text("123\n")
+        asyncio.run(async_manager.stop_profile("profile"))
+        kill_shard.assert_called_once_with(123)
+        assert not (sessions_dir / "profile.pid.1").exists()
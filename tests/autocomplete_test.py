@@ -1,11 +1,21 @@
 from argparse import Namespace
+import os
+import time
 
 import pytest
 
 from sshoot.autocomplete import (
+    _parse_line,
     complete_argument,
+    COMPLETION_INDEX,
+    CompletionIndex,
+    fast_complete,
     profile_completer,
 )
+from sshoot.runtime import (
+    DEFAULT_CONFIG_PATH,
+    file_key,
+)
 
 
 class TestCompleteArgument:
@@ -31,7 +41,8 @@ def profiles(profile_manager):
 
 
 @pytest.fixture
-def parsed_args(config_dir):
+def parsed_args(mocker, config_dir, run_dir):
+    mocker.patch("sshoot.manager.get_rundir", return_value=run_dir)
     yield Namespace(config=config_dir)
 
 
@@ -41,6 +52,14 @@ class TestProfileCompleter:
         """The autocomplete function returns names that match the prefix."""
         assert list(profile_completer("b", parsed_args)) == ["bar", "baz"]
 
+    def test_complete_updates_index(self, parsed_args, run_dir, profiles_file):
+        """The completion index is refreshed."""
+        index_file = run_dir / COMPLETION_INDEX
+        index_file.unlink()
+        list(profile_completer("b", parsed_args))
+        index = CompletionIndex(index_file, run_dir / "sessions")
+        assert index.complete(profiles_file, "b") == ["bar", "baz"]
+
     @pytest.mark.parametrize(
         "running,completions", [(True, ["baz", "foo"]), (False, ["bar"])]
     )
@@ -48,8 +67,265 @@ class TestProfileCompleter:
         self, running, completions, mocker, profile_manager, parsed_args
     ):
         """The autocomplete function returns names based on running status."""
-        mock_manager = mocker.patch("sshoot.autocomplete.Manager")
+        mock_manager = mocker.patch("sshoot.manager.Manager")
         mock_manager.return_value = profile_manager
-        profile_manager.is_running = lambda name: name != "bar"
+        profile_manager.get_statuses = lambda: {
+            "bar": False,
+            "baz": True,
+            "foo": True,
+        }
         returned = list(profile_completer("", parsed_args, running=running))
         assert returned == completions
+
+
+def make_old(path):
+    """Set the modification time of a path in the past."""
+    past = time.time() - 10
+    os.utime(path, (past, past))
+
+
+@pytest.fixture
+def index(run_dir, sessions_dir):
+    make_old(sessions_dir)
+    yield CompletionIndex(run_dir / COMPLETION_INDEX, sessions_dir)
+
+
+@pytest.fixture
+def profiles_key(profiles_file):
+    profiles_file.write_text("profiles")
+    yield file_key(profiles_file)
+
+
+class TestCompletionIndex:
+    NAMES = ["foo", "bar", "baz", "ba"]
+
+    def test_complete(self, index, profiles_file, profiles_key):
+        """Names matching the prefix are returned, sorted."""
+        index.update(profiles_key, self.NAMES, dict)
+        assert index.complete(profiles_file, "ba") == ["ba", "bar", "baz"]
+        assert index.complete(profiles_file, "") == [
+            "ba",
+            "bar",
+            "baz",
+            "foo",
+        ]
+        assert index.complete(profiles_file, "x") == []
+
+    def test_complete_running(self, index, profiles_file, profiles_key):
+        """Names can be filtered by running state."""
+        index.update(profiles_key, self.NAMES, lambda: {"bar": [os.getpid()]})
+        assert index.complete(profiles_file, "b", running=True) == ["bar"]
+        assert index.complete(profiles_file, "b", running=False) == [
+            "ba",
+            "baz",
+        ]
+
+    def test_complete_process_not_running(
+        self, mocker, index, profiles_file, profiles_key
+    ):
+        """Sessions whose process is not found are not running."""
+        index.update(profiles_key, self.NAMES, lambda: {"bar": [123]})
+        mocker.patch("os.kill", side_effect=ProcessLookupError)
+        assert index.complete(profiles_file, "b", running=True) == []
+
+    def test_complete_shard_not_running(
+        self, mocker, index, profiles_file, profiles_key
+    ):
+        """Sessions are not running if any of their shards is not found."""
+        index.update(
+            profiles_key, self.NAMES, lambda: {"bar": [os.getpid(), 123]}
+        )
+        mocker.patch(
+            "sshoot.autocomplete.process_exists",
+            side_effect=lambda pid: pid != 123,
+        )
+        assert index.complete(profiles_file, "b", running=True) == []
+        assert index.complete(profiles_file, "b", running=False) == [
+            "ba",
+            "bar",
+            "baz",
+        ]
+
+    def test_complete_profiles_changed(
+        self, index, profiles_file, profiles_key
+    ):
+        """The index is not valid if the profiles file changed."""
+        index.update(profiles_key, self.NAMES, dict)
+        profiles_file.write_text("other profiles")
+        assert index.complete(profiles_file, "") is None
+
+    def test_complete_sessions_changed(
+        self, index, profiles_file, profiles_key, sessions_dir
+    ):
+        """The running state is not valid if sessions changed."""
+        index.update(profiles_key, self.NAMES, dict)
+        (sessions_dir / "foo.pid").write_text("123")
+        assert index.complete(profiles_file, "", running=True) is None
+        # names are still valid
+        assert index.complete(profiles_file, "f") == ["foo"]
+
+    def test_complete_sessions_recent(
+        self, index, profiles_file, profiles_key, sessions_dir
+    ):
+        """The running state is not valid if sessions changed recently."""
+        os.utime(sessions_dir)
+        index.update(profiles_key, self.NAMES, dict)
+        assert index.complete(profiles_file, "", running=True) is None
+
+    def test_complete_no_index(self, index, profiles_file):
+        """If the index is not found, None is returned."""
+        assert index.complete(profiles_file, "") is None
+
+    def test_complete_invalid(self, index, profiles_file):
+        """If the index is not valid, None is returned."""
+        index.path.write_text("invalid")
+        assert index.complete(profiles_file, "") is None
+
+    def test_complete_writable_by_others(
+        self, index, profiles_file, profiles_key
+    ):
+        """An index writable by other users is not trusted."""
+        index.update(profiles_key, self.NAMES, dict)
+        index.path.chmod(0o666)
+        assert index.complete(profiles_file, "") is None
+
+    def test_complete_other_owner(
+        self, mocker, index, profiles_file, profiles_key
+    ):
+        """An index owned by another user is not trusted."""
+        index.update(profiles_key, self.NAMES, dict)
+        mocker.patch("os.getuid", return_value=os.getuid() + 1)
+        assert index.complete(profiles_file, "") is None
+
+    def test_update_error(self, index, profiles_key):
+        """Errors writing the index are ignored."""
+        index.path.mkdir()
+        index.update(profiles_key, self.NAMES, dict)
+        assert index.path.is_dir()
+        assert not list(index.path.parent.glob(f".{COMPLETION_INDEX}.*"))
+
+
+class TestParseLine:
+    @pytest.mark.parametrize(
+        "line,result",
+        [
+            ("sshoot show ", (DEFAULT_CONFIG_PATH, None, "")),
+            ("sshoot show f", (DEFAULT_CONFIG_PATH, None, "f")),
+            ("sshoot start f", (DEFAULT_CONFIG_PATH, False, "f")),
+            ("sshoot stop foo b", (DEFAULT_CONFIG_PATH, True, "b")),
+            ("sshoot -C /conf show f", ("/conf", None, "f")),
+            ("sshoot --config=/conf show f", ("/conf", None, "f")),
+            (
+                "sshoot --trace --trace-format json show f",
+                (DEFAULT_CONFIG_PATH, None, "f"),
+            ),
+        ],
+    )
+    def test_parse(self, line, result):
+        """The config path, running filter and prefix are returned."""
+        config_path, running, prefix = result
+        assert _parse_line(line) == (
+            type(DEFAULT_CONFIG_PATH)(config_path),
+            running,
+            prefix,
+        )
+
+    @pytest.mark.parametrize(
+        "line",
+        [
+            "sshoot ",
+            "sshoot sh",
+            "sshoot list ",
+            "sshoot show -",
+            "sshoot show foo ",
+            "sshoot start -j 4 ",
+            "sshoot start 'f",
+            "sshoot show a=b",
+            "sshoot -C",
+            "sshoot -C ",
+            "sshoot --trace-format ",
+            "sshoot -x show ",
+        ],
+    )
+    def test_not_handled(self, line):
+        """None is returned for lines not handled by the fast path."""
+        assert _parse_line(line) is None
+
+
+class TestFastComplete:
+    @pytest.fixture
+    def environ(self, monkeypatch, mocker, run_dir):
+        mocker.patch("sshoot.autocomplete.get_rundir", return_value=run_dir)
+        for name in list(os.environ):
+            if name.startswith("_ARGCOMPLETE"):
+                monkeypatch.delenv(name)
+        monkeypatch.setenv("_ARGCOMPLETE", "1")
+        monkeypatch.setenv("COMP_LINE", "sshoot show b")
+        monkeypatch.setenv("COMP_POINT", "13")
+        yield monkeypatch
+
+    @pytest.fixture
+    def write(self, mocker):
+        yield mocker.patch("os.write")
+
+    @pytest.fixture(autouse=True)
+    def profiles(self, environ, index, config_dir, profiles_file):
+        profiles_file.write_text("profiles")
+        index.update(file_key(profiles_file), ["bar", "baz", "foo"], dict)
+        environ.setenv("COMP_LINE", f"sshoot -C {config_dir} show b")
+        environ.setenv(
+            "COMP_POINT", str(len(f"sshoot -C {config_dir} show b"))
+        )
+
+    def test_complete(self, write):
+        """Completions are written to the output file descriptor."""
+        assert fast_complete()
+        write.assert_called_once_with(8, b"bar\x0bbaz")
+
+    def test_complete_ifs(self, environ, write):
+        """The separator can be set."""
+        environ.setenv("_ARGCOMPLETE_IFS", " ")
+        assert fast_complete()
+        write.assert_called_once_with(8, b"bar baz")
+
+    def test_complete_single(self, environ, config_dir, write):
+        """A space is appended to a single completion, if requested."""
+        environ.setenv("COMP_LINE", f"sshoot -C {config_dir} show f")
+        environ.setenv("_ARGCOMPLETE_SUPPRESS_SPACE", "1")
+        assert fast_complete()
+        write.assert_called_once_with(8, b"foo ")
+
+    @pytest.mark.parametrize(
+        "name,value",
+        [
+            ("_ARGCOMPLETE", "2"),
+            ("_ARGCOMPLETE_SHELL", "zsh"),
+            ("_ARGCOMPLETE_DFS", "x"),
+            ("_ARGCOMPLETE_STDOUT_FILENAME", "/tmp/out"),
+            ("_ARGCOMPLETE_IFS", "xx"),
+            ("COMP_POINT", "invalid"),
+            ("COMP_LINE", "sshoot list "),
+        ],
+    )
+    def test_not_handled(self, environ, write, name, value):
+        """Requests not handled by the fast path are left to argcomplete."""
+        environ.setenv(name, value)
+        assert not fast_complete()
+        write.assert_not_called()
+
+    def test_index_not_valid(self, index, write):
+        """If the index is not valid, completion is not handled."""
+        index.path.unlink()
+        assert not fast_complete()
+        write.assert_not_called()
+
+    def test_unsafe_names(self, index, profiles_file, write):
+        """Completion of names needing quoting is left to argcomplete."""
+        index.update(file_key(profiles_file), ["b&r"], dict)
+        assert not fast_complete()
+        write.assert_not_called()
+
+    def test_write_error(self, write):
+        """If completions can't be written, completion is not handled."""
+        write.side_effect = OSError()
+        assert not fast_complete()
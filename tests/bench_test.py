@@ -0,0 +1,114 @@
+import socket
+import struct
+import threading
+
+import pytest
+
+from sshoot.bench import (
+    BenchResult,
+    ECHO,
+    percentile,
+    run_bench,
+    serve_bench,
+    SINK,
+)
+
+
+@pytest.fixture
+def bench_server():
+    servers = []
+    ready = threading.Event()
+
+    def on_ready(server):
+        servers.append(server)
+        ready.set()
+
+    thread = threading.Thread(
+        target=serve_bench,
+        args=(0,),
+        kwargs={"address": "127.0.0.1", "ready": on_ready},
+    )
+    thread.start()
+    ready.wait(5)
+    server = servers[0]
+    yield server.server_address[1]
+    server.shutdown()
+    thread.join()
+
+
+@pytest.mark.parametrize(
+    "percent,value", [(0, 1.0), (50, 2.0), (90, 4.0), (99, 4.0), (100, 4.0)]
+)
+def test_percentile(percent, value):
+    """Percentiles are computed with the nearest-rank method."""
+    assert percentile([4.0, 1.0, 3.0, 2.0], percent) == value
+
+
+class TestBenchResult:
+    def test_as_dict(self):
+        """Results are converted to a dict, with latencies in ms."""
+        result = BenchResult(
+            connect=[0.001, 0.002], rtt=[0.003], sent_bytes=1000, duration=2.0
+        )
+        assert result.as_dict() == {
+            "connect-ms": {"p50": 1.0, "p90": 2.0, "p99": 2.0},
+            "rtt-ms": {"p50": 3.0, "p90": 3.0, "p99": 3.0},
+            "bytes": 1000,
+            "duration": 2.0,
+            "throughput": 500.0,
+        }
+
+    def test_as_dict_no_values(self):
+        """Latencies are None if not measured."""
+        result = BenchResult(connect=[], rtt=[], sent_bytes=0, duration=0.0)
+        data = result.as_dict()
+        assert data["connect-ms"] == {"p50": None, "p90": None, "p99": None}
+        assert data["throughput"] == 0.0
+
+
+class TestServer:
+    def test_echo(self, bench_server):
+        """Data sent to echo connections is sent back."""
+        with socket.create_connection(("127.0.0.1", bench_server)) as sock:
+            sock.sendall(ECHO + b"hello")
+            assert sock.recv(5) == b"hello"
+
+    def test_sink(self, bench_server):
+        """The amount of data sent to sink connections is replied."""
+        with socket.create_connection(("127.0.0.1", bench_server)) as sock:
+            sock.sendall(SINK + b"x" * 1000)
+            sock.shutdown(socket.SHUT_WR)
+            assert struct.unpack("!Q", sock.recv(8)) == (1000,)
+
+    def test_unknown_command(self, bench_server):
+        """Connections with unknown commands are closed."""
+        with socket.create_connection(("127.0.0.1", bench_server)) as sock:
+            sock.sendall(b"X")
+            assert sock.recv(1) == b""
+
+
+class TestRunBench:
+    def test_run(self, bench_server):
+        """Latencies and throughput are measured against the server."""
+        result = run_bench(
+            "127.0.0.1",
+            port=bench_server,
+            connects=3,
+            requests=5,
+            size=100,
+            duration=0.1,
+        )
+        assert len(result.connect) == 3
+        assert len(result.rtt) == 5
+        assert result.sent_bytes > 0
+        assert result.duration >= 0.1
+
+    def test_connection_closed(self, mocker, bench_server):
+        """An error is raised if the server closes the connection."""
+        sock, server_sock = socket.socketpair()
+        server_sock.shutdown(socket.SHUT_WR)
+        mocker.patch("sshoot.bench._connect", return_value=sock)
+        with pytest.raises(ConnectionError) as error:
+            run_bench("127.0.0.1", port=bench_server, connects=0, requests=1)
+        assert str(error.value) == "Connection closed by server"
+        server_sock.close()
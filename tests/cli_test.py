@@ -0,0 +1,56 @@
+import pytest
+
+from sshoot import cli
+
+
+@pytest.fixture
+def script(mocker):
+    yield mocker.patch("sshoot.main.sshoot", return_value=0)
+
+
+@pytest.fixture
+def fast_complete(mocker):
+    yield mocker.patch("sshoot.autocomplete.fast_complete")
+
+
+@pytest.fixture
+def fast_prompt(mocker):
+    yield mocker.patch("sshoot.prompt.fast_prompt")
+
+
+class TestSshoot:
+    def test_run(self, script, fast_complete):
+        """The command-line script is run."""
+        assert cli.sshoot() == 0
+        script.assert_called_once_with()
+        fast_complete.assert_not_called()
+
+    def test_fast_complete(self, monkeypatch, script, fast_complete):
+        """Completion is handled without running the script, if possible."""
+        monkeypatch.setenv("_ARGCOMPLETE", "1")
+        fast_complete.return_value = True
+        assert cli.sshoot() == 0
+        script.assert_not_called()
+
+    def test_complete(self, monkeypatch, script, fast_complete):
+        """If the fast path can't complete, the script is run."""
+        monkeypatch.setenv("_ARGCOMPLETE", "1")
+        fast_complete.return_value = False
+        assert cli.sshoot() == 0
+        script.assert_called_once_with()
+
+    def test_fast_prompt(self, mocker, script, fast_prompt):
+        """The prompt status is printed without running the script."""
+        mocker.patch("sys.argv", ["sshoot", "status", "--prompt"])
+        fast_prompt.return_value = True
+        assert cli.sshoot() == 0
+        fast_prompt.assert_called_once_with(["status", "--prompt"])
+        script.assert_not_called()
+
+    def test_prompt(self, mocker, script, fast_prompt):
+        """If the fast path can't print the prompt status, the script is
+        run."""
+        mocker.patch("sys.argv", ["sshoot", "--trace", "status", "--prompt"])
+        fast_prompt.return_value = False
+        assert cli.sshoot() == 0
+        script.assert_called_once_with()
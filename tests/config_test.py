@@ -1,10 +1,16 @@
 from io import StringIO
+import marshal
+import os
+from pathlib import Path
 from textwrap import dedent
 
 import pytest
 import yaml
 
-from sshoot.config import yaml_dump
+from sshoot.config import (
+    Config,
+    yaml_dump,
+)
 from sshoot.profile import Profile
 
 
@@ -25,6 +31,49 @@ class TestYamlDump:
         assert yaml.safe_load(stream=fh) == data
 
 
+@pytest.mark.skipif(
+    not yaml.__with_libyaml__, reason="libyaml bindings not available"
+)
+class TestLibYaml:
+    PROFILES = {
+        "profile": Profile(
+            ["10.0.0.0/24", "192.168.1.0/24"],
+            remote="user@hôst.example.com",
+            dns=True,
+            exclude_subnets=["10.0.0.128/25"],
+            extra_opts=["--ssh-cmd", "ssh -o 'Foo: bar'", "1.0", "yes", ""],
+        ),
+        "other-prófile": Profile(["fd00::/8"], seed_hosts=["a", "b"]),
+    }
+
+    def test_same_output(self, mocker, config, profiles_file):
+        """Files saved with libyaml and pure-Python dumpers are identical."""
+        for name, profile in self.PROFILES.items():
+            config.add_profile(name, profile)
+        config.save()
+        c_content = profiles_file.read_bytes()
+        mocker.patch(
+            "sshoot.config._yaml_classes",
+            return_value=(yaml.SafeDumper, yaml.SafeLoader),
+        )
+        config.save()
+        assert profiles_file.read_bytes() == c_content
+
+    def test_same_load(self, mocker, config_dir, config, profiles_file):
+        """Files loaded with libyaml and pure-Python loaders are identical."""
+        for name, profile in self.PROFILES.items():
+            config.add_profile(name, profile)
+        config.save()
+        config.load()
+        mocker.patch(
+            "sshoot.config._yaml_classes",
+            return_value=(yaml.SafeDumper, yaml.SafeLoader),
+        )
+        other_config = Config(config_dir)
+        other_config.load()
+        assert other_config.profiles == config.profiles
+
+
 class TestConfig:
     def test_add_profile(self, config):
         """Profiles can be added to the config."""
@@ -58,6 +107,17 @@ class TestConfig:
         with pytest.raises(KeyError):
             config.remove_profile("profile")
 
+    def test_get_profile(self, config):
+        """A single profile can be returned."""
+        profile = Profile(["10.0.0.0/24"])
+        config.add_profile("profile", profile)
+        assert config.get_profile("profile") is profile
+
+    def test_get_profile_not_present(self, config):
+        """An exception is raised if the profile name is not known."""
+        with pytest.raises(KeyError):
+            config.get_profile("profile")
+
     def test_load_from_file(self, config, profiles_file):
         """The config is loaded from file."""
         profiles = {"profile": {"subnets": ["10.0.0.0/24"], "auto-nets": True}}
@@ -128,3 +188,160 @@ class TestConfig:
         )
         content = profiles_file.read_text()
         assert content == config
+
+    def test_changed(self, config, profiles_file):
+        """Config.changed returns whether config files changed."""
+        assert config.changed()
+        config.load()
+        assert not config.changed()
+        profiles_file.write_text("profile: {subnets: [10.0.0.0/8]}\n")
+        assert config.changed()
+
+    def test_changed_after_save(self, config):
+        """Saving the config doesn't mark it as changed."""
+        config.load()
+        config.add_profile("profile", Profile(["10.0.0.0/24"]))
+        config.save()
+        assert not config.changed()
+
+
+@pytest.fixture
+def snapshot_file(tmpdir):
+    """A Path for the config snapshot file."""
+    yield Path(tmpdir / "config.snapshot")
+
+
+@pytest.fixture
+def snapshot_config(config_dir, snapshot_file):
+    """A Config object using a snapshot file."""
+    yield Config(config_dir, snapshot_file=snapshot_file)
+
+
+class TestConfigSnapshot:
+    def test_load_writes_snapshot(
+        self, snapshot_config, profiles_file, snapshot_file
+    ):
+        """Loading config from YAML files writes the snapshot."""
+        profiles = {"profile": {"subnets": ["10.0.0.0/24"]}}
+        profiles_file.write_text(yaml.dump(profiles))
+        snapshot_config.load()
+        assert snapshot_file.exists()
+
+    def test_load_from_snapshot(
+        self, mocker, config_dir, snapshot_config, profiles_file, config_file
+    ):
+        """If the snapshot is current, YAML files are not parsed."""
+        profiles = {"profile": {"subnets": ["10.0.0.0/24"], "dns": True}}
+        profiles_file.write_text(yaml.dump(profiles))
+        config_file.write_text(yaml.dump({"executable": "/bin/sshuttle"}))
+        snapshot_config.load()
+        config = Config(
+            config_dir, snapshot_file=snapshot_config._snapshot_file
+        )
+        mock_load = mocker.patch.object(config, "_load_yaml_file")
+        config.load()
+        mock_load.assert_not_called()
+        assert config.profiles == {
+            "profile": Profile(["10.0.0.0/24"], dns=True)
+        }
+        assert config.config == {"executable": "/bin/sshuttle"}
+
+    def test_load_stale_snapshot(self, mocker, snapshot_config, profiles_file):
+        """If config files change, they're loaded again."""
+        profiles_file.write_text(
+            yaml.dump({"profile1": {"subnets": ["10.0.0.0/24"]}})
+        )
+        snapshot_config.load()
+        profiles_file.write_text(
+            yaml.dump({"profile2": {"subnets": ["10.1.0.0/24"]}})
+        )
+        snapshot_config.load()
+        assert list(snapshot_config.profiles) == ["profile2"]
+
+    def test_load_snapshot_other_config(
+        self, tmpdir, snapshot_config, profiles_file, snapshot_file
+    ):
+        """A snapshot for a different config path is not used."""
+        profiles_file.write_text(
+            yaml.dump({"profile": {"subnets": ["10.0.0.0/24"]}})
+        )
+        snapshot_config.load()
+        other_dir = Path(tmpdir / "other")
+        other_dir.mkdir()
+        config = Config(other_dir, snapshot_file=snapshot_file)
+        config.load()
+        assert config.profiles == {}
+
+    @pytest.mark.parametrize(
+        "content", [b"", b"garbage", marshal.dumps((0, (), None, {}, {}))]
+    )
+    def test_load_invalid_snapshot(
+        self, snapshot_config, profiles_file, snapshot_file, content
+    ):
+        """An invalid snapshot is ignored and replaced."""
+        profiles_file.write_text(
+            yaml.dump({"profile": {"subnets": ["10.0.0.0/24"]}})
+        )
+        snapshot_file.write_bytes(content)
+        snapshot_config.load()
+        assert list(snapshot_config.profiles) == ["profile"]
+        assert snapshot_file.read_bytes() != content
+
+    def test_save_updates_snapshot(
+        self, mocker, config_dir, snapshot_config, snapshot_file
+    ):
+        """Saving profiles updates the snapshot."""
+        snapshot_config.load()
+        snapshot_config.add_profile("profile", Profile(["10.0.0.0/24"]))
+        snapshot_config.save()
+        config = Config(config_dir, snapshot_file=snapshot_file)
+        mock_load = mocker.patch.object(config, "_load_yaml_file")
+        config.load()
+        mock_load.assert_not_called()
+        assert config.profiles == {"profile": Profile(["10.0.0.0/24"])}
+
+    def test_snapshot_private(self, snapshot_config, snapshot_file):
+        """The snapshot is only readable by the user."""
+        snapshot_config.load()
+        assert snapshot_file.stat().st_mode & 0o777 == 0o600
+
+    def test_load_snapshot_writable_by_others(
+        self, mocker, config_dir, snapshot_config, snapshot_file
+    ):
+        """A snapshot writable by other users is not trusted."""
+        snapshot_config.load()
+        snapshot_file.chmod(0o666)
+        config = Config(config_dir, snapshot_file=snapshot_file)
+        mock_load_yaml = mocker.patch.object(
+            config, "_load_yaml_file", return_value={}
+        )
+        config.load()
+        assert mock_load_yaml.called
+
+    def test_load_snapshot_other_owner(
+        self, mocker, config_dir, snapshot_config, snapshot_file
+    ):
+        """A snapshot owned by another user is not trusted."""
+        snapshot_config.load()
+        mocker.patch("os.getuid", return_value=os.getuid() + 1)
+        config = Config(config_dir, snapshot_file=snapshot_file)
+        mock_load_yaml = mocker.patch.object(
+            config, "_load_yaml_file", return_value={}
+        )
+        config.load()
+        assert mock_load_yaml.called
+
+    def test_snapshot_not_serializable(
+        self, snapshot_config, config_file, snapshot_file
+    ):
+        """The snapshot is not written if config can't be serialized."""
+        config_file.write_text("executable: 2020-01-01 10:00:00\n")
+        snapshot_config.load()
+        assert not snapshot_file.exists()
+
+    def test_snapshot_write_error(self, config_dir, tmpdir):
+        """Errors writing the snapshot are ignored."""
+        snapshot_file = Path(tmpdir / "not-here" / "config.snapshot")
+        config = Config(config_dir, snapshot_file=snapshot_file)
+        config.load()
+        assert not snapshot_file.exists()
@@ -1,4 +1,5 @@
 from pathlib import Path
+from textwrap import dedent
 
 import pytest
 
@@ -32,6 +33,14 @@ def config(config_dir):
     yield Config(config_dir)
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    """A directory for cache files, used by default."""
+    path = Path(tmpdir / "cache")
+    monkeypatch.setattr("sshoot.manager.DEFAULT_CACHE_PATH", path)
+    yield path
+
+
 @pytest.fixture
 def run_dir(tmpdir):
     path = Path(tmpdir / "run")
@@ -49,3 +58,75 @@ def sessions_dir(run_dir):
 @pytest.fixture
 def profile_manager(config_dir, run_dir):
     yield Manager(config_path=config_dir, rundir=run_dir)
+
+
+def fake_executable(base_path, exit_code, error_message="stderr message"):
+    """Create a fake executable logging command line parameters."""
+    executable = Path(base_path) / "executable"
+    executable.write_text(
+        dedent(
+            f"""\
+            #!/bin/sh
+            echo $@ > {base_path}/cmdline
+            echo -n {error_message} >&2
+            exit {exit_code}
+            """
+        )
+    )
+    executable.chmod(0o755)
+    return executable
+
+
+@pytest.fixture
+def bin_succeed(tmpdir):
+    yield fake_executable(tmpdir, 0)
+
+
+@pytest.fixture
+def bin_fail(tmpdir):
+    yield fake_executable(tmpdir, 1)
+
+
+@pytest.fixture
+def bin_fail_silent(tmpdir):
+    yield fake_executable(tmpdir, 1, error_message="")
+
+
+@pytest.fixture
+def bin_verbose_fail(tmpdir):
+    """An executable writing more than a pipe buffer to stderr, then failing."""
+    executable = Path(tmpdir) / "executable"
+    executable.write_text(
+        dedent(
+            """\
+            #!/bin/sh
+            i=0
+            while [ $i -lt 2000 ]; do
+              echo "line $i: some verbose output from the process" >&2
+              i=$((i + 1))
+            done
+            echo -n "final error" >&2
+            exit 1
+            """
+        )
+    )
+    executable.chmod(0o755)
+    yield executable
+
+
+@pytest.fixture
+def bin_daemonize(tmpdir):
+    """An executable leaving a child holding stderr open, and succeeding."""
+    executable = Path(tmpdir) / "executable"
+    executable.write_text(
+        dedent(
+            """\
+            #!/bin/sh
+            echo starting >&2
+            sleep 5 &
+            exit 0
+            """
+        )
+    )
+    executable.chmod(0o755)
+    yield executable
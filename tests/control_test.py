@@ -0,0 +1,167 @@
+import os
+import select
+import socket
+import threading
+
+import pytest
+
+from sshoot.control import (
+    _check_peer,
+    control_request,
+    CONTROL_SOCKET,
+    ControlServer,
+    ControlUnavailable,
+    MAX_MESSAGE_SIZE,
+)
+
+
+@pytest.fixture
+def requests():
+    yield []
+
+
+@pytest.fixture
+def server(run_dir, requests):
+    def handler(request):
+        requests.append(request)
+        return {"output": request["value"] * 2}
+
+    server = ControlServer(run_dir / CONTROL_SOCKET, handler)
+    server.open()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def serve(server):
+    """Serve a single request in a thread."""
+
+    def serve_one():
+        select.select([server], [], [], 5)
+        server.handle()
+
+    thread = threading.Thread(target=serve_one)
+    thread.start()
+    yield
+    thread.join()
+
+
+class TestControlRequest:
+    def test_request(self, run_dir, serve, requests):
+        """A request is sent to the server and its response returned."""
+        response = control_request(run_dir, {"value": "foo"})
+        assert response == {"output": "foofoo"}
+        assert requests == [{"value": "foo"}]
+
+    def test_no_socket(self, run_dir):
+        """If the socket doesn't exist, the control socket is unavailable."""
+        with pytest.raises(ControlUnavailable):
+            control_request(run_dir, {"value": "foo"})
+
+    def test_not_listening(self, run_dir):
+        """If no server is listening, the control socket is unavailable."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(run_dir / CONTROL_SOCKET))
+        sock.close()
+        with pytest.raises(ControlUnavailable):
+            control_request(run_dir, {"value": "foo"})
+
+    def test_other_user(self, mocker, run_dir, server):
+        """If the socket is owned by another user, it's not used."""
+        mocker.patch("os.getuid", return_value=os.getuid() + 1)
+        with pytest.raises(ControlUnavailable):
+            control_request(run_dir, {"value": "foo"})
+
+    def test_invalid_response(self, run_dir):
+        """If the server sends an invalid response, an error is raised."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(run_dir / CONTROL_SOCKET))
+        sock.listen()
+
+        def reply():
+            conn, _ = sock.accept()
+            with conn:
+                conn.recv(1024)
+                conn.sendall(b"[]\n")
+
+        thread = threading.Thread(target=reply)
+        thread.start()
+        try:
+            with pytest.raises(ControlUnavailable):
+                control_request(run_dir, {"value": "foo"})
+        finally:
+            thread.join()
+            sock.close()
+
+
+class TestControlServer:
+    def test_open_socket_permissions(self, server):
+        """The socket is only accessible by the user."""
+        assert server.path.stat().st_mode & 0o777 == 0o600
+
+    def test_open_replaces_stale_socket(self, run_dir):
+        """A stale socket file is replaced."""
+        path = run_dir / CONTROL_SOCKET
+        path.write_text("stale")
+        server = ControlServer(path, lambda request: {})
+        server.open()
+        try:
+            assert path.is_socket()
+        finally:
+            server.close()
+
+    def test_close(self, server):
+        """Closing the server removes the socket."""
+        server.close()
+        server.close()
+        assert not server.path.exists()
+
+    def test_handle_no_connection(self, server, requests):
+        """If there's no pending connection, nothing is done."""
+        server.handle()
+        assert requests == []
+
+    def test_handle_incomplete_request(self, server, requests):
+        """Incomplete requests are ignored."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(str(server.path))
+        sock.sendall(b'{"value": ')
+        sock.shutdown(socket.SHUT_WR)
+        server.handle()
+        assert sock.recv(1024) == b""
+        sock.close()
+        assert requests == []
+
+    def test_handle_request_too_large(self, server, requests):
+        """Requests exceeding the maximum size are refused."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(str(server.path))
+
+        def send():
+            try:
+                sock.sendall(b" " * (MAX_MESSAGE_SIZE + 1024 * 1024))
+            except OSError:
+                pass
+
+        thread = threading.Thread(target=send)
+        thread.start()
+        server.handle()
+        thread.join()
+        sock.close()
+        assert requests == []
+
+
+class TestCheckPeer:
+    def test_same_user(self):
+        """Peers running as the same user are accepted."""
+        sock1, sock2 = socket.socketpair()
+        with sock1, sock2:
+            _check_peer(sock1)
+
+    def test_other_user(self, mocker):
+        """Peers running as another user are refused."""
+        mocker.patch("os.getuid", return_value=os.getuid() + 1)
+        sock1, sock2 = socket.socketpair()
+        with sock1, sock2:
+            with pytest.raises(PermissionError):
+                _check_peer(sock1)
@@ -0,0 +1,74 @@
+import json
+import threading
+
+import pytest
+
+from sshoot.latency import LatencyRecorder
+
+
+@pytest.fixture
+def latency_file(tmp_path):
+    yield tmp_path / "latency.json"
+
+
+@pytest.fixture
+def recorder(latency_file):
+    yield LatencyRecorder(latency_file, buckets=(0.1, 1.0))
+
+
+class TestLatencyRecorder:
+    def test_record(self, recorder):
+        """Durations are recorded in histogram buckets."""
+        recorder.record("start", 0.05)
+        recorder.record("start", 0.5)
+        recorder.record("start", 5.0)
+        recorder.record("stop", 0.1)
+        assert recorder.histograms() == {
+            "start": {"buckets": [1, 1], "sum": 5.55, "count": 3},
+            "stop": {"buckets": [1, 0], "sum": 0.1, "count": 1},
+        }
+
+    def test_shared_file(self, latency_file, recorder):
+        """Histograms are shared by recorders using the same file."""
+        recorder.record("start", 0.05)
+        other = LatencyRecorder(latency_file, buckets=(0.1, 1.0))
+        other.record("start", 0.05)
+        assert recorder.histograms()["start"]["count"] == 2
+
+    def test_concurrent(self, recorder):
+        """Concurrent records are all accounted for."""
+        threads = [
+            threading.Thread(target=recorder.record, args=("start", 0.5))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert recorder.histograms()["start"]["count"] == 10
+
+    def test_no_file(self, recorder):
+        """If the file doesn't exist, there are no histograms."""
+        assert recorder.histograms() == {}
+
+    @pytest.mark.parametrize(
+        "content",
+        [
+            "not json",
+            "[]",
+            json.dumps({"start": []}),
+            json.dumps({"start": {"buckets": [1], "sum": 1, "count": 1}}),
+        ],
+    )
+    def test_invalid_data(self, latency_file, recorder, content):
+        """Invalid data is discarded."""
+        latency_file.write_text(content)
+        assert recorder.histograms() == {}
+        recorder.record("start", 0.05)
+        assert recorder.histograms()["start"]["count"] == 1
+
+    def test_write_error(self, tmp_path):
+        """Errors writing the file are ignored."""
+        recorder = LatencyRecorder(tmp_path / "missing" / "latency.json")
+        recorder.record("start", 0.05)
+        assert recorder.histograms() == {}
@@ -9,6 +9,11 @@ from sshoot.listing import (
     InvalidFormat,
     profile_details,
     ProfileListing,
+    session_stats,
+)
+from sshoot.stats import (
+    ProcessStats,
+    SessionStats,
 )
 
 
@@ -16,6 +21,10 @@ from sshoot.listing import (
 def active_profiles(profile_manager):
     active_profiles = []
     profile_manager.is_running = lambda name: name in active_profiles
+    profile_manager.get_statuses = lambda: {
+        name: name in active_profiles
+        for name in profile_manager.get_profiles()
+    }
     yield active_profiles
 
 
@@ -89,6 +98,13 @@ class TestProfileListing:
                 "Exclude subnets",
                 "Seed hosts",
                 "Extra options",
+                "Shards",
+                "Latency control",
+                "Latency buffer",
+                "Method",
+                "SSH cipher",
+                "SSH compression",
+                "SSH keepalive",
             ],
             [
                 "profile1",
@@ -101,6 +117,13 @@ class TestProfileListing:
                 "",
                 "",
                 "",
+                "1",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
             ],
             [
                 "profile2",
@@ -113,6 +136,13 @@ class TestProfileListing:
                 "",
                 "",
                 "",
+                "1",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
             ],
         ]
 
@@ -165,3 +195,97 @@ class TestProfileDetails:
         output = profile_details(profile_manager, "profile")
         print(output)
         assert "Status:           ACTIVE" in output
+
+
+def make_session_stats(pid, cpu_time, io_bytes, rss=1024):
+    return SessionStats(
+        pid=pid,
+        processes=[
+            ProcessStats(
+                pid=pid,
+                command="sshuttle",
+                start_time=0.0,
+                cpu_time=cpu_time,
+                rss=rss,
+                read_bytes=io_bytes,
+                write_bytes=None if io_bytes is None else io_bytes * 2,
+            )
+        ],
+    )
+
+
+class TestSessionStats:
+    def test_totals(self):
+        """Without previous stats, only totals are shown."""
+        output = session_stats(
+            {"profile1": make_session_stats(10, 1.5, 3 * 1024**2)}
+        )
+        assert output.splitlines()[2].split() == [
+            "profile1",
+            "10",
+            "1",
+            "1.50",
+            "1.0K",
+            "3.0M",
+            "6.0M",
+        ]
+
+    def test_rates(self):
+        """With previous stats, CPU usage and I/O rates are shown."""
+        previous = {"profile1": make_session_stats(10, 1.0, 1024)}
+        stats = {"profile1": make_session_stats(10, 1.5, 3 * 1024)}
+        output = session_stats(stats, previous, 2.0)
+        assert output.splitlines()[2].split() == [
+            "profile1",
+            "10",
+            "1",
+            "25.0",
+            "1.50",
+            "1.0K",
+            "3.0K",
+            "6.0K",
+            "1.0K",
+            "2.0K",
+        ]
+
+    def test_rates_restarted(self):
+        """If the session was restarted, rates are not shown."""
+        previous = {"profile1": make_session_stats(10, 1.0, 1024)}
+        stats = {"profile1": make_session_stats(20, 0.1, 1024)}
+        output = session_stats(stats, previous, 2.0)
+        assert len(output.splitlines()[2].split()) == 7
+
+    def test_io_not_available(self):
+        """If I/O stats are not available, they're not shown."""
+        previous = {"profile1": make_session_stats(10, 1.0, None)}
+        stats = {"profile1": make_session_stats(10, 1.5, None)}
+        output = session_stats(stats, previous, 1.0)
+        assert output.splitlines()[2].split() == [
+            "profile1",
+            "10",
+            "1",
+            "50.0",
+            "1.50",
+            "1.0K",
+        ]
+
+    def test_sorted_by_cpu(self):
+        """Sessions are sorted by CPU usage."""
+        previous = {
+            "profile1": make_session_stats(10, 1.0, 0),
+            "profile2": make_session_stats(20, 1.0, 0),
+        }
+        stats = {
+            "profile1": make_session_stats(10, 1.1, 0),
+            "profile2": make_session_stats(20, 1.9, 0, rss=5 * 1024**4),
+        }
+        lines = session_stats(stats, previous, 1.0).splitlines()
+        assert lines[2].split()[:6] == [
+            "profile2",
+            "20",
+            "1",
+            "90.0",
+            "1.90",
+            "5.0T",
+        ]
+        assert lines[3].split()[0] == "profile1"
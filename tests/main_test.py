@@ -1,9 +1,23 @@
+from functools import partial
 from io import StringIO
+from ipaddress import ip_network
+import json
+import os
+import signal
 
 import pytest
 
-from sshoot import main
+from sshoot import (
+    main,
+    trace,
+)
+from sshoot.bench import BenchResult
+from sshoot.control import ControlUnavailable
+from sshoot.listing import ProfileListing
 from sshoot.manager import ManagerProfileError
+from sshoot.profile import Profile
+from sshoot.subnets import Conflict
+from sshoot.supervisor import SupervisorError
 
 
 @pytest.fixture
@@ -21,6 +35,14 @@ def manager(mocker):
     yield mocker.MagicMock()
 
 
+@pytest.fixture(autouse=True)
+def control_request(mocker):
+    """Control requests fail, as if no resident process was running."""
+    yield mocker.patch.object(
+        main, "control_request", side_effect=ControlUnavailable("no server")
+    )
+
+
 @pytest.fixture
 def script(mocker, stdout, stderr, manager):
     mocker.patch.object(main, "Manager").return_value = manager
@@ -71,15 +93,93 @@ class TestSshoot:
                 "exclude_subnets": None,
                 "seed_hosts": None,
                 "extra_opts": None,
+                "shards": 1,
+                "preset": None,
+                "latency_control": None,
+                "latency_buffer_size": None,
+                "method": None,
+                "ssh_cipher": None,
+                "ssh_compression": None,
+                "ssh_server_alive_interval": None,
             },
         )
 
+    def test_create_shards(self, script, manager):
+        """The number of shards for a profile can be set."""
+        script(["create", "profile1", "--shards", "4", "10.0.0.0/8"])
+        details = manager.create_profile.call_args[0][1]
+        assert details["shards"] == 4
+
+    def test_create_tuning(self, script, manager):
+        """Tuning options for a profile can be set."""
+        script(
+            [
+                "create",
+                "profile1",
+                "--preset",
+                "bulk-throughput",
+                "--no-latency-control",
+                "--latency-buffer-size",
+                "4096",
+                "--method",
+                "nft",
+                "--ssh-cipher",
+                "aes256-ctr",
+                "--ssh-compression",
+                "--ssh-server-alive-interval",
+                "30",
+                "10.0.0.0/8",
+            ]
+        )
+        details = manager.create_profile.call_args[0][1]
+        assert details["preset"] == "bulk-throughput"
+        assert details["latency_control"] is False
+        assert details["latency_buffer_size"] == 4096
+        assert details["method"] == "nft"
+        assert details["ssh_cipher"] == "aes256-ctr"
+        assert details["ssh_compression"] is True
+        assert details["ssh_server_alive_interval"] == 30
+
+    def test_create_tuning_flags(self, script, manager):
+        """Boolean tuning options can be set in both directions."""
+        script(
+            [
+                "create",
+                "profile1",
+                "--latency-control",
+                "--no-ssh-compression",
+                "10.0.0.0/8",
+            ]
+        )
+        details = manager.create_profile.call_args[0][1]
+        assert details["latency_control"] is True
+        assert details["ssh_compression"] is False
+
     def test_show(self, script, manager, stdout):
         """Profile details can be viewed."""
         script(["show", "profile1"])
         manager.get_profile.assert_called_once_with("profile1")
         assert "Name:             profile1" in stdout.getvalue()
 
+    def test_show_double_dash(self, script, manager, stdout):
+        """Positional arguments can follow "--" for actions without extra
+        arguments."""
+        script(["show", "--", "profile1"])
+        manager.get_profile.assert_called_once_with("profile1")
+
+    def test_list_formats(self):
+        """Listing formats match those supported by the listing."""
+        assert list(main.LISTING_FORMATS) == (
+            ProfileListing.supported_formats()
+        )
+
+    def test_autocomplete(self, mocker, monkeypatch, script):
+        """Autocompletion is set up when completing arguments."""
+        monkeypatch.setenv("_ARGCOMPLETE", "1")
+        autocomplete = mocker.patch("argcomplete.autocomplete")
+        parser = script.get_parser()
+        autocomplete.assert_called_once_with(parser)
+
     def test_list(self, script, stdout):
         """Profile list can be viewed."""
         script(["list", "--format", "json"])
@@ -90,6 +190,27 @@ class TestSshoot:
         script(["delete", "profile1"])
         manager.remove_profile.assert_called_once_with("profile1")
 
+    def test_start_warn_conflicts(self, stdout, stderr, script, manager):
+        """Warnings are printed for conflicts when starting profiles."""
+        manager.conflict_policy = "warn"
+        manager.get_start_conflicts.return_value = [
+            Conflict(("profile1", "profile2"), (ip_network("10.0.0.0/24"),))
+        ]
+        script(["start", "profile1"])
+        manager.get_start_conflicts.assert_called_once_with(["profile1"])
+        manager.start_profile.assert_called_once()
+        assert stderr.getvalue() == (
+            "Warning: profile1 and profile2 overlap on 10.0.0.0/24\n"
+        )
+        assert stdout.getvalue() == "Profile started\n"
+
+    def test_start_refuse_conflicts(self, stderr, script, manager):
+        """Conflicts are not looked up for warnings with "refuse" policy."""
+        manager.conflict_policy = "refuse"
+        script(["start", "profile1"])
+        manager.get_start_conflicts.assert_not_called()
+        assert stderr.getvalue() == ""
+
     def test_start(self, stdout, script, manager):
         """A profile can be started."""
         script(
@@ -108,12 +229,136 @@ class TestSshoot:
         )
         assert stdout.getvalue() == "Profile started\n"
 
+    def test_start_multiple(self, stdout, script, manager):
+        """Multiple profiles can be started concurrently."""
+        manager.start_profiles.return_value = {
+            "profile1": None,
+            "profile2": None,
+        }
+        script(["start", "-j", "2", "profile1", "profile2", "--", "--syslog"])
+        manager.start_profiles.assert_called_once_with(
+            ["profile1", "profile2"],
+            max_workers=2,
+            extra_args=["--syslog"],
+            disable_global_extra_options=False,
+        )
+        assert stdout.getvalue() == (
+            "profile1: Profile started\nprofile2: Profile started\n"
+        )
+
+    @pytest.mark.parametrize("jobs", ["0", "-1", "foo"])
+    def test_start_invalid_jobs(self, mocker, script, manager, jobs):
+        """The number of jobs must be a positive integer."""
+        mock_error = mocker.patch("argparse.ArgumentParser.error")
+        mock_error.side_effect = SystemExit(2)
+        with pytest.raises(SystemExit):
+            script(["start", "-j", jobs, "profile1", "profile2"])
+        mock_error.assert_called_once_with(
+            f"argument -j/--jobs: must be a positive integer: {jobs}"
+        )
+        manager.start_profiles.assert_not_called()
+
+    def test_start_multiple_errors(
+        self, stdout, stderr, sys_exit, script, manager
+    ):
+        """Errors for each profile are reported."""
+        manager.start_profiles.return_value = {
+            "profile1": None,
+            "profile2": ManagerProfileError("Profile is already running"),
+            "profile3": ManagerProfileError("Unknown profile: profile3"),
+        }
+        script(["start", "profile1", "profile2", "profile3"])
+        sys_exit.assert_called_once_with(2)
+        assert stdout.getvalue() == "profile1: Profile started\n"
+        assert stderr.getvalue() == (
+            "profile2: Profile is already running\n"
+            "profile3: Unknown profile: profile3\n"
+        )
+
+    def test_start_unknown_extra_args(self, mocker, script, sys_exit):
+        """Arguments after "--" are rejected for actions not taking them."""
+        mock_error = mocker.patch("argparse.ArgumentParser.error")
+        mock_error.side_effect = SystemExit(2)
+        with pytest.raises(SystemExit):
+            script(["show", "profile1", "--", "--syslog"])
+        mock_error.assert_called_once_with("unrecognized arguments: --syslog")
+
+    def test_start_no_extra_args(self, stdout, script, manager):
+        """Arguments before "--" are names of profiles to start."""
+        manager.start_profiles.return_value = {
+            "profile1": None,
+            "profile2": None,
+        }
+        script(["start", "-j", "2", "profile1", "profile2"])
+        manager.start_profiles.assert_called_once_with(
+            ["profile1", "profile2"],
+            max_workers=2,
+            extra_args=[],
+            disable_global_extra_options=False,
+        )
+
+    def test_args_from_argv(self, mocker, stdout, script, manager):
+        """Arguments are taken from the command line by default."""
+        mocker.patch(
+            "sys.argv", ["sshoot", "start", "profile1", "--", "--syslog"]
+        )
+        script()
+        manager.start_profile.assert_called_once_with(
+            "profile1",
+            extra_args=["--syslog"],
+            disable_global_extra_options=False,
+        )
+
     def test_stop(self, stdout, script, manager):
         """A profile can be stopped."""
         script(["stop", "profile1"])
         manager.stop_profile.assert_called_once_with("profile1")
         assert stdout.getvalue() == "Profile stopped\n"
 
+    def test_stop_multiple(self, stdout, script, manager):
+        """Multiple profiles can be stopped concurrently."""
+        manager.stop_profiles.return_value = {
+            "profile1": None,
+            "profile2": None,
+        }
+        script(["stop", "profile1", "profile2"])
+        manager.stop_profiles.assert_called_once_with(
+            ["profile1", "profile2"], max_workers=8
+        )
+        assert stdout.getvalue() == (
+            "profile1: Profile stopped\nprofile2: Profile stopped\n"
+        )
+
+    def test_stop_all(self, stdout, script, manager):
+        """All running profiles can be stopped."""
+        manager.get_statuses.return_value = {
+            "profile1": True,
+            "profile2": False,
+            "profile3": True,
+        }
+        manager.stop_profiles.return_value = {
+            "profile1": None,
+            "profile3": None,
+        }
+        script(["stop", "--all"])
+        manager.stop_profiles.assert_called_once_with(
+            ["profile1", "profile3"], max_workers=8
+        )
+
+    def test_stop_all_with_names(self, stderr, sys_exit, script, manager):
+        """Profile names can't be passed along with --all."""
+        script(["stop", "--all", "profile1"])
+        sys_exit.assert_called_once_with(1)
+        assert stderr.getvalue() == (
+            "Profile names can't be specified with --all\n"
+        )
+
+    def test_stop_no_names(self, stderr, sys_exit, script, manager):
+        """At least a profile name must be passed without --all."""
+        script(["stop"])
+        sys_exit.assert_called_once_with(1)
+        assert stderr.getvalue() == "No profile specified\n"
+
     def test_restart(self, stdout, script, manager):
         """A profile can be restarted."""
         script(["restart", "profile1", "--", "--syslog"])
@@ -124,6 +369,199 @@ class TestSshoot:
         )
         assert stdout.getvalue() == "Profile restarted\n"
 
+    def test_restart_all(self, stdout, script, manager):
+        """All running profiles can be restarted."""
+        manager.get_statuses.return_value = {
+            "profile1": True,
+            "profile2": True,
+        }
+        manager.restart_profiles.return_value = {
+            "profile1": None,
+            "profile2": None,
+        }
+        script(["restart", "--all", "--", "--syslog"])
+        manager.restart_profiles.assert_called_once_with(
+            ["profile1", "profile2"],
+            max_workers=8,
+            extra_args=["--syslog"],
+            disable_global_extra_options=False,
+        )
+        assert stdout.getvalue() == (
+            "profile1: Profile restarted\nprofile2: Profile restarted\n"
+        )
+
+    def test_top(self, mocker, stdout, script, manager):
+        """Resource usage for sessions is shown periodically."""
+        sleep = mocker.patch("time.sleep")
+        manager.get_session_stats.return_value = {}
+        script(["top", "-n", "2", "-d", "0.5"])
+        assert sleep.mock_calls == [mocker.call(0.5), mocker.call(0.5)]
+        assert manager.get_session_stats.call_count == 3
+        assert stdout.getvalue().count("CPU%") == 2
+
+    def test_top_clear_screen(self, mocker, stdout, script, manager):
+        """The screen is cleared between updates on a terminal."""
+        mocker.patch("time.sleep")
+        stdout.isatty = lambda: True
+        manager.get_session_stats.return_value = {}
+        script(["top", "-n", "1"])
+        assert stdout.getvalue().startswith("\x1b[H\x1b[2J")
+
+    def test_metrics(self, mocker, stdout, script, manager):
+        """Metrics are printed out."""
+        collect_metrics = mocker.patch(
+            "sshoot.metrics.collect_metrics", return_value="metric 1\n"
+        )
+        script(["metrics"])
+        collect_metrics.assert_called_once_with(manager)
+        assert stdout.getvalue() == "metric 1\n"
+
+    def test_metrics_listen(
+        self, mocker, stdout, script, manager, config_dir, run_dir
+    ):
+        """Metrics can be served over HTTP."""
+        manager.config_path = config_dir
+        manager.rundir = run_dir
+        collect_metrics = mocker.patch(
+            "sshoot.metrics.collect_metrics", return_value="metric 1\n"
+        )
+        server = mocker.MagicMock(server_address=("127.0.0.1", 9999))
+
+        def serve_metrics(get_metrics, port, ready):
+            ready(server)
+            assert get_metrics() == "metric 1\n"
+
+        serve = mocker.patch(
+            "sshoot.metrics.serve_metrics", side_effect=serve_metrics
+        )
+        script(["metrics", "--listen", "9999"])
+        assert serve.call_args[0][1] == 9999
+        resident_manager = collect_metrics.call_args[0][0]
+        assert resident_manager.config_path == config_dir
+        assert resident_manager.rundir == run_dir
+        assert stdout.getvalue() == (
+            "Serving metrics on http://127.0.0.1:9999/metrics\n"
+        )
+
+    def test_metrics_listen_error(
+        self, mocker, stderr, sys_exit, script, manager, config_dir, run_dir
+    ):
+        """An error is returned if the port can't be bound."""
+        manager.config_path = config_dir
+        manager.rundir = run_dir
+        mocker.patch(
+            "sshoot.metrics.serve_metrics",
+            side_effect=OSError("Address in use"),
+        )
+        script(["metrics", "--listen", "9999"])
+        sys_exit.assert_called_once_with(3)
+        assert stderr.getvalue() == "Address in use\n"
+
+    def test_daemon(self, mocker, script, manager):
+        """Profiles can be supervised."""
+        supervisor = mocker.patch("sshoot.supervisor.Supervisor")
+        script(["daemon", "profile1", "profile2", "--max-restarts", "3"])
+        supervisor.assert_called_once_with(
+            manager,
+            ["profile1", "profile2"],
+            max_restarts=3,
+            control_server=mocker.ANY,
+        )
+        supervisor.return_value.run.assert_called_once_with()
+
+    def test_daemon_running_profiles(self, mocker, script, manager):
+        """By default, running profiles are supervised."""
+        supervisor = mocker.patch("sshoot.supervisor.Supervisor")
+        manager.get_statuses.return_value = {
+            "profile1": True,
+            "profile2": False,
+        }
+        script(["daemon"])
+        supervisor.assert_called_once_with(
+            manager, ["profile1"], max_restarts=5, control_server=mocker.ANY
+        )
+
+    def test_daemon_no_profiles(self, mocker, script, manager):
+        """The daemon runs even with no profiles to supervise."""
+        supervisor = mocker.patch("sshoot.supervisor.Supervisor")
+        manager.get_statuses.return_value = {}
+        script(["daemon"])
+        supervisor.assert_called_once_with(
+            manager, [], max_restarts=5, control_server=mocker.ANY
+        )
+        supervisor.return_value.run.assert_called_once_with()
+
+    def test_daemon_sigterm(self, mocker, script, manager):
+        """The supervisor is stopped on SIGTERM."""
+        supervisor = mocker.patch("sshoot.supervisor.Supervisor")
+        mock_signal = mocker.patch("signal.signal")
+        script(["daemon", "profile1"])
+        signum, handler = mock_signal.call_args[0]
+        assert signum == signal.SIGTERM
+        handler(signum, None)
+        supervisor.return_value.stop.assert_called_once_with()
+
+    def test_daemon_interrupted(self, mocker, sys_exit, script, manager):
+        """The supervisor exits cleanly on keyboard interrupt."""
+        supervisor = mocker.patch("sshoot.supervisor.Supervisor")
+        supervisor.return_value.run.side_effect = KeyboardInterrupt
+        script(["daemon", "profile1"])
+        sys_exit.assert_not_called()
+
+    def test_daemon_already_running(
+        self, mocker, stderr, sys_exit, script, manager
+    ):
+        """An error is returned if a supervisor is already running."""
+        supervisor = mocker.patch("sshoot.supervisor.Supervisor")
+        supervisor.return_value.run.side_effect = SupervisorError("running")
+        script(["daemon", "profile1"])
+        sys_exit.assert_called_once_with(2)
+        assert stderr.getvalue() == "running\n"
+
+    def test_daemon_status(self, mocker, stdout, script, manager):
+        """The status of supervised profiles can be shown."""
+        mocker.patch("time.time", return_value=1000.0)
+        mocker.patch(
+            "sshoot.supervisor.read_state",
+            return_value={
+                "pid": 1234,
+                "sessions": {
+                    "profile1": {
+                        "state": "running",
+                        "pid": 5678,
+                        "restarts": 1,
+                        "failures": 0,
+                        "error": "",
+                        "retry-at": None,
+                    },
+                    "profile2": {
+                        "state": "restarting",
+                        "pid": None,
+                        "restarts": 2,
+                        "failures": 2,
+                        "error": "failed",
+                        "retry-at": 1003.2,
+                    },
+                },
+            },
+        )
+        script(["daemon", "--status"])
+        output = stdout.getvalue()
+        assert "profile1  running     5678  1" in output
+        assert (
+            "profile2  restarting        2         3s          failed"
+            in output
+        )
+
+    def test_daemon_status_not_running(
+        self, mocker, stderr, sys_exit, script, manager
+    ):
+        """An error is returned if the supervisor is not running."""
+        mocker.patch("sshoot.supervisor.read_state", return_value=None)
+        script(["daemon", "--status"])
+        sys_exit.assert_called_once_with(1)
+        assert stderr.getvalue() == "Supervisor is not running\n"
+
     @pytest.mark.parametrize("running,exit_value", [(True, 0), (False, 1)])
     def test_is_running(
         self, mocker, sys_exit, script, manager, running, exit_value
@@ -135,9 +573,447 @@ class TestSshoot:
 
     def test_get_command(self, stdout, script, manager):
         """It's possible to get the sshuttle commandline."""
-        manager.get_cmdline.return_value = ["sshuttle", "-r", "example.net"]
+        manager.get_cmdlines.return_value = [["sshuttle", "-r", "example.net"]]
+        manager.get_subnet_rules.return_value = None
         script(["get-command", "profile1"])
-        manager.get_cmdline.assert_called_once_with(
+        manager.get_cmdlines.assert_called_once_with(
             "profile1", disable_global_extra_options=False
         )
         assert stdout.getvalue() == "sshuttle -r example.net\n"
+
+    def test_get_command_shards(self, stdout, script, manager):
+        """Commands for each shard are printed on separate lines."""
+        manager.get_cmdlines.return_value = [
+            ["sshuttle", "10.0.0.0/8"],
+            ["sshuttle", "192.168.0.0/16"],
+        ]
+        manager.get_subnet_rules.return_value = None
+        script(["get-command", "profile1"])
+        assert stdout.getvalue() == (
+            "sshuttle 10.0.0.0/8\nsshuttle 192.168.0.0/16\n"
+        )
+
+    def test_get_command_normalized(self, stdout, stderr, script, manager):
+        """The number of subnet rules is reported if subnets are
+        normalized."""
+        manager.get_cmdlines.return_value = [["sshuttle", "10.0.0.0/8"]]
+        manager.get_subnet_rules.return_value = (3, 1)
+        script(["get-command", "profile1"])
+        assert stdout.getvalue() == "sshuttle 10.0.0.0/8\n"
+        assert stderr.getvalue() == (
+            "Subnet rules: 3 before normalization, 1 after\n"
+        )
+
+    def test_check(self, stdout, script, manager):
+        """Conflicts between profiles are reported."""
+        manager.find_conflicts.return_value = [
+            Conflict(
+                ("profile1", "profile2"),
+                (ip_network("10.0.0.0/24"), ip_network("fe80::/64")),
+            ),
+            Conflict(("profile1", "profile3"), (ip_network("10.1.0.0/16"),)),
+        ]
+        with pytest.raises(SystemExit) as error:
+            script(["check"])
+        assert error.value.code == 1
+        assert stdout.getvalue() == (
+            "profile1 and profile2 overlap on 10.0.0.0/24, fe80::/64\n"
+            "profile1 and profile3 overlap on 10.1.0.0/16\n"
+        )
+
+    def test_check_no_conflicts(self, stdout, script, manager):
+        """A message is printed if no conflicts are found."""
+        manager.find_conflicts.return_value = []
+        script(["check"])
+        assert stdout.getvalue() == "No conflicts found\n"
+
+    def test_which(self, stdout, script, manager):
+        """Profiles routing an address are printed out."""
+        manager.find_profiles_for.return_value = [
+            ("profile", ip_network("10.1.0.0/16")),
+            ("profile10", ip_network("10.0.0.0/8")),
+        ]
+        script(["which", "10.1.2.3"])
+        manager.find_profiles_for.assert_called_once_with("10.1.2.3")
+        assert stdout.getvalue() == (
+            "profile    10.1.0.0/16\nprofile10  10.0.0.0/8\n"
+        )
+
+    def test_which_running(self, stdout, script, manager):
+        """Only running profiles can be printed out."""
+        manager.find_profiles_for.return_value = [
+            ("profile1", ip_network("10.1.0.0/16")),
+            ("profile2", ip_network("10.0.0.0/8")),
+        ]
+        manager.get_statuses.return_value = {
+            "profile1": False,
+            "profile2": True,
+        }
+        script(["which", "--running", "10.1.2.3"])
+        assert stdout.getvalue() == "profile2  10.0.0.0/8\n"
+
+    def test_which_not_found(self, stdout, sys_exit, script, manager):
+        """If no profile routes the address, an error code is returned."""
+        manager.find_profiles_for.return_value = []
+        sys_exit.side_effect = SystemExit
+        with pytest.raises(SystemExit):
+            script(["which", "10.1.2.3"])
+        sys_exit.assert_called_once_with(1)
+        assert stdout.getvalue() == ""
+
+    def test_which_invalid(self, stderr, sys_exit, script, manager):
+        """An error is returned if the address is not valid."""
+        manager.find_profiles_for.side_effect = ManagerProfileError(
+            "Invalid address: foo"
+        )
+        script(["which", "foo"])
+        sys_exit.assert_called_once_with(2)
+        assert stderr.getvalue() == "Invalid address: foo\n"
+
+    @pytest.fixture
+    def bench_manager(self, manager):
+        manager.get_profile.return_value = Profile(["10.0.0.0/8"], shards=2)
+        manager.find_profiles_for.return_value = [
+            ("profile1", ip_network("10.0.0.0/8"))
+        ]
+        manager.is_running.return_value = True
+        yield manager
+
+    def test_bench(self, mocker, stdout, script, bench_manager):
+        """Benchmark results are printed out as JSON."""
+        run_bench = mocker.patch(
+            "sshoot.bench.run_bench",
+            return_value=BenchResult(
+                connect=[0.001], rtt=[0.002], sent_bytes=100, duration=1.0
+            ),
+        )
+        script(["bench", "profile1", "10.1.2.3", "--duration", "2"])
+        run_bench.assert_called_once_with(
+            "10.1.2.3",
+            port=5201,
+            connects=10,
+            requests=100,
+            size=64,
+            duration=2.0,
+        )
+        result = json.loads(stdout.getvalue())
+        assert result["profile"] == "profile1"
+        assert result["config"] == {"subnets": ["10.0.0.0/8"], "shards": 2}
+        assert result["target"] == "10.1.2.3:5201"
+        assert result["rtt-ms"]["p50"] == 2.0
+        assert result["throughput"] == 100.0
+        assert "time" in result
+
+    def test_bench_not_routed(self, stderr, sys_exit, script, bench_manager):
+        """An error is returned if the profile doesn't route the address."""
+        bench_manager.find_profiles_for.return_value = []
+        script(["bench", "profile1", "192.168.1.1"])
+        sys_exit.assert_called_once_with(2)
+        assert stderr.getvalue() == (
+            "Address 192.168.1.1 is not routed by profile profile1\n"
+        )
+
+    def test_bench_not_running(self, stderr, sys_exit, script, bench_manager):
+        """An error is returned if the profile is not running."""
+        bench_manager.is_running.return_value = False
+        script(["bench", "profile1", "10.1.2.3"])
+        sys_exit.assert_called_once_with(2)
+        assert stderr.getvalue() == "Profile is not running\n"
+
+    def test_bench_error(
+        self, mocker, stderr, sys_exit, script, bench_manager
+    ):
+        """An error is returned if the benchmark fails."""
+        mocker.patch(
+            "sshoot.bench.run_bench",
+            side_effect=ConnectionRefusedError("Connection refused"),
+        )
+        script(["bench", "profile1", "10.1.2.3", "--port", "9999"])
+        sys_exit.assert_called_once_with(3)
+        assert stderr.getvalue() == "Connection refused\n"
+
+    def test_bench_server(self, mocker, stdout, script):
+        """The benchmark server can be run."""
+        server = mocker.MagicMock(server_address=("0.0.0.0", 5201))
+
+        def serve_bench(port, address, ready):
+            ready(server)
+
+        serve = mocker.patch(
+            "sshoot.bench.serve_bench", side_effect=serve_bench
+        )
+        script(["bench-server"])
+        serve.assert_called_once_with(5201, address="", ready=mocker.ANY)
+        assert stdout.getvalue() == "Serving benchmarks on 0.0.0.0:5201\n"
+
+    def test_bench_server_error(self, mocker, stderr, sys_exit, script):
+        """An error is returned if the port can't be bound."""
+        serve = mocker.patch(
+            "sshoot.bench.serve_bench",
+            side_effect=OSError("Address in use"),
+        )
+        script(["bench-server", "--port", "9999", "--address", "127.0.0.1"])
+        serve.assert_called_once_with(
+            9999, address="127.0.0.1", ready=mocker.ANY
+        )
+        sys_exit.assert_called_once_with(3)
+        assert stderr.getvalue() == "Address in use\n"
+
+    def test_status(self, stdout, script, manager, sessions_dir):
+        """Running profiles are listed with their PID."""
+        manager.sessions_path = sessions_dir
+        (sessions_dir / "profile2.pid").write_text(str(os.getpid()))
+        (sessions_dir / "profile1.pid").write_text("1")
+        script(["status"])
+        assert stdout.getvalue() == (
+            "profile1: running (PID 1)\n"
+            f"profile2: running (PID {os.getpid()})\n"
+        )
+
+    def test_status_not_running(self, stdout, script, manager, sessions_dir):
+        """A message is printed if no profile is running."""
+        manager.sessions_path = sessions_dir
+        script(["status"])
+        assert stdout.getvalue() == "No profiles running\n"
+
+    def test_status_prompt(self, stdout, script, manager, sessions_dir):
+        """A compact status for prompts can be printed."""
+        manager.sessions_path = sessions_dir
+        (sessions_dir / "profile2.pid").write_text(str(os.getpid()))
+        (sessions_dir / "profile1.pid").write_text("1")
+        script(["status", "--prompt"])
+        assert stdout.getvalue() == "profile1,profile2\n"
+
+    def test_status_prompt_not_running(
+        self, stdout, script, manager, sessions_dir
+    ):
+        """Nothing is printed for prompts if no profile is running."""
+        manager.sessions_path = sessions_dir
+        script(["status", "--prompt"])
+        assert stdout.getvalue() == ""
+
+
+class TestTrace:
+    def test_no_trace(self, script, stderr):
+        """Timings are not printed by default."""
+        script(["list", "--format", "json"])
+        assert stderr.getvalue() == ""
+        assert trace._tracer is None
+
+    def test_trace(self, script, stderr):
+        """With --trace, a tree of timings is printed to stderr."""
+        script(["--trace", "list", "--format", "json"])
+        lines = stderr.getvalue().splitlines()
+        assert [line.split("ms", 1)[1].rstrip() for line in lines] == [
+            "  sshoot",
+            "    get_parser",
+            "    list",
+            "      control_request",
+            "      render (format=json)",
+        ]
+        assert trace._tracer is None
+
+    def test_trace_import(self, mocker, script, stderr):
+        """Timings include package import, on the first call."""
+        mocker.patch.object(main, "_import_time", 1.0)
+        script(["--trace", "list"])
+        script(["--trace", "list"])
+        assert stderr.getvalue().count(" import\n") == 1
+
+    def test_trace_json(self, script, stderr):
+        """Timings can be printed as JSON."""
+        script(["--trace", "--trace-format", "json", "list"])
+        root = json.loads(stderr.getvalue())
+        assert root["name"] == "sshoot"
+        assert [child["name"] for child in root["children"]] == [
+            "get_parser",
+            "list",
+        ]
+
+    @pytest.mark.parametrize(
+        "value,prefix", [("json", "{"), ("tree", " "), ("1", " ")]
+    )
+    def test_trace_env(self, monkeypatch, script, stderr, value, prefix):
+        """Tracing can be enabled from the environment."""
+        monkeypatch.setenv("SSHOOT_TRACE", value)
+        script(["list"])
+        assert stderr.getvalue().startswith(prefix)
+
+    def test_trace_error(self, script, manager, stderr, sys_exit):
+        """Timings are printed also if the action fails."""
+        manager.get_profile.side_effect = ManagerProfileError("not found")
+        script(["--trace", "show", "profile1"])
+        sys_exit.assert_called_once_with(2)
+        output = stderr.getvalue()
+        assert " show\n" in output
+        assert output.endswith("not found\n")
+
+
+class TestControl:
+    def test_request(self, mocker, control_request, stdout, script, manager):
+        """Queries are answered through the control socket if available."""
+        mocker.patch.object(main, "get_rundir", return_value="/run/sshoot")
+        control_request.side_effect = None
+        control_request.return_value = {"output": "details\n", "exit": None}
+        script(["-C", "/config", "show", "profile1"])
+        control_request.assert_called_once_with(
+            "/run/sshoot",
+            {
+                "config": "/config",
+                "action": "show",
+                "args": {"name": "profile1"},
+            },
+        )
+        assert stdout.getvalue() == "details\n"
+        manager.load_config.assert_not_called()
+
+    def test_request_config_resolved(
+        self, monkeypatch, tmp_path, control_request, script
+    ):
+        """The config path is sent as absolute path in requests."""
+        monkeypatch.chdir(tmp_path)
+        control_request.side_effect = None
+        control_request.return_value = {"output": "", "exit": None}
+        script(["-C", "config", "show", "profile1"])
+        request = control_request.call_args[0][1]
+        assert request["config"] == str(tmp_path / "config")
+
+    def test_request_exit(self, control_request, sys_exit, script):
+        """The exit code from the control response is returned."""
+        control_request.side_effect = None
+        control_request.return_value = {"output": "", "exit": 1}
+        script(["is-running", "profile1"])
+        sys_exit.assert_called_once_with(1)
+
+    def test_request_warnings(self, control_request, stdout, stderr, script):
+        """Warnings from the control response are printed to stderr."""
+        control_request.side_effect = None
+        control_request.return_value = {
+            "output": "sshuttle 10.0.0.0/8\n",
+            "warnings": "warning\n",
+            "exit": None,
+        }
+        script(["get-command", "profile1"])
+        assert stdout.getvalue() == "sshuttle 10.0.0.0/8\n"
+        assert stderr.getvalue() == "warning\n"
+
+    def test_request_error(self, control_request, stderr, sys_exit, script):
+        """Errors from the control response are reported."""
+        control_request.side_effect = None
+        control_request.return_value = {"error": "not found", "code": 2}
+        script(["show", "profile1"])
+        sys_exit.assert_called_once_with(2)
+        assert stderr.getvalue() == "not found\n"
+
+    def test_request_not_for_changes(self, control_request, script, manager):
+        """Actions that change state don't go through the control socket."""
+        script(["delete", "profile1"])
+        control_request.assert_not_called()
+        manager.remove_profile.assert_called_once_with("profile1")
+
+    def test_fallback(self, control_request, stdout, script, manager):
+        """If the control socket is not available, actions run directly."""
+        script(["show", "profile1"])
+        control_request.assert_called_once()
+        manager.get_profile.assert_called_once_with("profile1")
+
+
+@pytest.fixture
+def handle_request(config_dir, run_dir, profiles_file):
+    profiles_file.write_text(
+        "profile1:\n  remote: example.net\n  subnets: [10.0.0.0/8]\n"
+    )
+    script = main.Sshoot()
+    script.get_parser()
+    yield partial(script._handle_control_request, run_dir, {})
+
+
+class TestHandleControlRequest:
+    def test_output(self, config_dir, handle_request):
+        """The output of the action is returned."""
+        response = handle_request(
+            {
+                "config": str(config_dir),
+                "action": "get-command",
+                "args": {
+                    "name": "profile1",
+                    "disable_global_extra_options": False,
+                },
+            }
+        )
+        assert response["exit"] is None
+        assert response["output"].startswith(
+            "sshuttle 10.0.0.0/8 --remote=example.net"
+        )
+
+    def test_warnings(self, config_dir, config_file, handle_request):
+        """Warnings from the action are returned."""
+        config_file.write_text("normalize-subnets: true\n")
+        response = handle_request(
+            {
+                "config": str(config_dir),
+                "action": "get-command",
+                "args": {
+                    "name": "profile1",
+                    "disable_global_extra_options": False,
+                },
+            }
+        )
+        assert response["warnings"] == (
+            "Subnet rules: 1 before normalization, 1 after\n"
+        )
+
+    def test_exit(self, config_dir, handle_request):
+        """The exit code of the action is returned."""
+        response = handle_request(
+            {
+                "config": str(config_dir),
+                "action": "is-running",
+                "args": {"name": "profile1"},
+            }
+        )
+        assert response == {"output": "", "exit": 1}
+
+    def test_error(self, config_dir, handle_request):
+        """Errors from the action are returned."""
+        response = handle_request(
+            {
+                "config": str(config_dir),
+                "action": "show",
+                "args": {"name": "unknown"},
+            }
+        )
+        assert response == {"error": "Unknown profile: unknown", "code": 2}
+
+    def test_config_error(self, tmp_path, handle_request):
+        """Errors loading configuration are returned."""
+        config_file = tmp_path / "file"
+        config_file.touch()
+        response = handle_request(
+            {
+                "config": str(config_file),
+                "action": "list",
+                "args": {"format": "csv", "verbose": False},
+            }
+        )
+        assert response["code"] == 3
+
+    def test_invalid_action(self, config_dir, handle_request):
+        """Only actions allowed through the control socket are run."""
+        response = handle_request(
+            {"config": str(config_dir), "action": "delete", "args": {}}
+        )
+        assert response == {"error": "Invalid action", "code": 1}
+
+    def test_config_reloaded(self, config_dir, profiles_file, handle_request):
+        """Configuration is reloaded when it changes."""
+        request = {
+            "config": str(config_dir),
+            "action": "list",
+            "args": {"format": "csv", "verbose": False},
+        }
+        handle_request(request)
+        profiles_file.write_text("profile2:\n  subnets: [10.0.0.0/8]\n")
+        response = handle_request(request)
+        assert "profile2" in response["output"]
+        assert "profile1" not in response["output"]
@@ -1,54 +1,33 @@
-from getpass import getuser
+from io import BytesIO
+from ipaddress import ip_network
 import os
 from pathlib import Path
 import signal
-from tempfile import gettempdir
-from textwrap import dedent
+import subprocess
+import threading
+import time
 
 import pytest
 import yaml
 
+from sshoot import trace
 from sshoot.manager import (
+    _wait_pidfd,
     DEFAULT_CONFIG_PATH,
-    get_rundir,
     kill_and_wait,
     Manager,
     ManagerProfileError,
+    OUTPUT_BUFFER_SIZE,
+    OutputBuffer,
     ProcessKillFail,
+    ResidentManager,
+    SUBNETS_FILE_THRESHOLD,
 )
 from sshoot.profile import Profile
-
-
-def fake_executable(base_path, exit_code, error_message="stderr message"):
-    """Create a fake executable logging command line parameters."""
-    executable = Path(base_path) / "executable"
-    executable.write_text(
-        dedent(
-            f"""\
-            #!/bin/sh
-            echo $@ > {base_path}/cmdline
-            echo -n {error_message} >&2
-            exit {exit_code}
-            """
-        )
-    )
-    executable.chmod(0o755)
-    return executable
-
-
-@pytest.fixture
-def bin_succeed(tmpdir):
-    yield fake_executable(tmpdir, 0)
-
-
-@pytest.fixture
-def bin_fail(tmpdir):
-    yield fake_executable(tmpdir, 1)
-
-
-@pytest.fixture
-def bin_fail_silent(tmpdir):
-    yield fake_executable(tmpdir, 1, error_message="")
+from sshoot.subnets import (
+    Conflict,
+    SubnetIndex,
+)
 
 
 @pytest.fixture
@@ -83,6 +62,24 @@ class TestManager:
         assert config_dir.is_dir()
         assert sessions_dir.is_dir()
 
+    def test_load_config_snapshot_in_cache(self, profile_manager, cache_dir):
+        """The config snapshot is kept in the private cache directory."""
+        profile_manager.load_config()
+        assert (cache_dir / "config.snapshot").exists()
+        assert cache_dir.stat().st_mode & 0o777 == 0o700
+
+    def test_load_config_cache_error(self, profile_manager, cache_dir):
+        """Errors creating the cache directory are ignored."""
+        cache_dir.write_text("not a directory")
+        profile_manager.load_config()
+        assert profile_manager.get_profiles() == {}
+
+    def test_load_config_duration(self, profile_manager):
+        """Manager.load_config records how long loading took."""
+        assert profile_manager.config_load_duration is None
+        profile_manager.load_config()
+        assert profile_manager.config_load_duration > 0
+
     def test_load_profiles(self, profile_manager, profiles_file):
         """Manager.load_config loads the profiles."""
         profiles = {"profile": {"subnets": ["10.0.0.0/16"]}}
@@ -96,6 +93,14 @@ class TestManager:
         profiles = yaml.safe_load(profiles_file.read_text())
         assert profiles == {"profile": {"subnets": ["10.0.0.0/24"]}}
 
+    def test_create_profile_updates_index(
+        self, profile_manager, profiles_file
+    ):
+        """Manager.create_profile updates the completion index."""
+        profile_manager.create_profile("profile", {"subnets": ["10.0.0.0/24"]})
+        index = profile_manager._completion_index
+        assert index.complete(profiles_file, "") == ["profile"]
+
     def test_create_profile_in_use(self, profile_manager):
         """Manager.create_profile raises an error if profile name is in use."""
         profile_manager.create_profile("profile", {"subnets": ["10.0.0.0/24"]})
@@ -128,6 +133,14 @@ class TestManager:
         config = yaml.safe_load(profiles_file.read_text())
         assert config == {}
 
+    def test_remove_profile_updates_index(
+        self, profile_manager, profile, profiles_file
+    ):
+        """Manager.remove_profile updates the completion index."""
+        profile_manager.remove_profile("profile")
+        index = profile_manager._completion_index
+        assert index.complete(profiles_file, "") == []
+
     def test_remove_profile_unknown(self, profile_manager):
         """Manager.remove_profile raises an error if name is unknown."""
         with pytest.raises(ManagerProfileError):
@@ -170,6 +183,31 @@ class TestManager:
             f"10.0.0.0/24 --daemon --pidfile {sessions_dir}/profile.pid\n"
         )
 
+    def test_start_profile_refuse_conflicts(
+        self, mocker, profile_manager, profile, config_file, sessions_dir
+    ):
+        """With "refuse" policy, a profile conflicting with running ones is
+        not started."""
+        config_file.write_text(yaml.dump({"on-conflict": "refuse"}))
+        profile_manager.load_config()
+        profile_manager.create_profile("other", {"subnets": ["10.0.0.0/8"]})
+        (sessions_dir / "other.pid").write_text(f"{os.getpid()}\n")
+        popen = mocker.patch("sshoot.manager.Popen")
+        with pytest.raises(ManagerProfileError) as error:
+            profile_manager.start_profile("profile")
+        assert str(error.value) == "Routes conflict with profiles: other"
+        popen.assert_not_called()
+
+    def test_start_profile_warn_conflicts(
+        self, profile_manager, profile, sessions_dir, bin_succeed
+    ):
+        """By default, profiles conflicting with running ones are started."""
+        profile_manager._get_executable = lambda: str(bin_succeed)
+        profile_manager.create_profile("other", {"subnets": ["10.0.0.0/8"]})
+        (sessions_dir / "other.pid").write_text(f"{os.getpid()}\n")
+        profile_manager.start_profile("profile")
+        assert (bin_succeed.parent / "cmdline").exists()
+
     def test_start_profile_extra_args(
         self, profile_manager, profile, sessions_dir, bin_succeed
     ):
@@ -184,6 +222,35 @@ class TestManager:
             f"10.0.0.0/24 --daemon --pidfile {sessions_dir}/profile.pid --extra1 --extra2\n"
         )
 
+    def test_start_profile_records_latency(
+        self, profile_manager, profile, bin_succeed
+    ):
+        """The latency of starting a profile is recorded."""
+        profile_manager._get_executable = lambda: str(bin_succeed)
+        profile_manager.start_profile("profile")
+        histograms = profile_manager.get_latency_histograms()
+        assert histograms["start"]["count"] == 1
+
+    def test_start_profile_updates_index(
+        self, mocker, profile_manager, profile, bin_succeed
+    ):
+        """Manager.start_profile updates the completion index."""
+        profile_manager._get_executable = lambda: str(bin_succeed)
+        update_index = mocker.patch.object(
+            profile_manager, "update_completion_index"
+        )
+        profile_manager.start_profile("profile")
+        update_index.assert_called_once_with()
+
+    def test_start_profile_fail_no_latency(
+        self, profile_manager, profile, bin_fail
+    ):
+        """The latency of failed starts is not recorded."""
+        profile_manager._get_executable = lambda: str(bin_fail)
+        with pytest.raises(ManagerProfileError):
+            profile_manager.start_profile("profile")
+        assert profile_manager.get_latency_histograms() == {}
+
     def test_start_profile_fail(self, profile_manager, profile, bin_fail):
         """An error is raised if starting a profile fails."""
         profile_manager._get_executable = lambda: str(bin_fail)
@@ -203,6 +270,42 @@ class TestManager:
             == "Profile failed to start: Please see the log for more details: 'grep sshuttle /var/log/syslog'"
         )
 
+    def test_start_profile_fail_verbose(
+        self, profile_manager, profile, bin_verbose_fail
+    ):
+        """Large output doesn't block the process, only the tail is kept."""
+        profile_manager._get_executable = lambda: str(bin_verbose_fail)
+        with pytest.raises(ManagerProfileError) as err:
+            profile_manager.start_profile("profile")
+        message = str(err.value)
+        assert message.endswith("final error")
+        assert len(message) < OUTPUT_BUFFER_SIZE + 100
+
+    @pytest.mark.parametrize("pidfd", [True, False])
+    def test_start_profile_output_kept_open(
+        self, mocker, profile_manager, profile, bin_daemonize, pidfd
+    ):
+        """Children keeping the output pipe open don't block the start."""
+        if not pidfd:
+            mocker.patch("sshoot.manager.pidfd_open").return_value = None
+        profile_manager._get_executable = lambda: str(bin_daemonize)
+        start = time.monotonic()
+        profile_manager.start_profile("profile")
+        assert time.monotonic() - start < 1
+
+    def test_start_profile_session_log(
+        self, profile_manager, profile, config_file, sessions_dir, bin_fail
+    ):
+        """Output is written to the session log if enabled."""
+        config_file.write_text(yaml.dump({"session-logs": True}))
+        profile_manager.load_config()
+        profile_manager._get_executable = lambda: str(bin_fail)
+        for _ in range(2):
+            with pytest.raises(ManagerProfileError):
+                profile_manager.start_profile("profile")
+        log_file = sessions_dir / "profile.log"
+        assert log_file.read_text() == "stderr message" * 2
+
     def test_start_profile_executable_not_found(
         self, profile_manager, profile
     ):
@@ -229,6 +332,45 @@ class TestManager:
         profile_manager.is_running = lambda name: True
         profile_manager.stop_profile("profile")
         mock_kill_and_wait.assert_called_once_with(100)
+        assert profile_manager.was_stopped("profile")
+        histograms = profile_manager.get_latency_histograms()
+        assert histograms["stop"]["count"] == 1
+
+    def test_stop_profile_removes_subnets_files(
+        self, mocker, profile_manager, pid_file, sessions_dir
+    ):
+        """Manager.stop_profile removes files with subnets for the
+        profile."""
+        mocker.patch("sshoot.manager.kill_and_wait")
+        (sessions_dir / "profile.subnets").write_text("10.0.0.0/24\n")
+        (sessions_dir / "profile.exclude").write_text("10.0.0.0/28\n")
+        pid_file.write_text("100\n")
+        profile_manager.is_running = lambda name: True
+        profile_manager.stop_profile("profile")
+        assert not (sessions_dir / "profile.subnets").exists()
+        assert not (sessions_dir / "profile.exclude").exists()
+
+    def test_stop_profile_updates_index(
+        self, mocker, profile_manager, pid_file
+    ):
+        """Manager.stop_profile updates the completion index."""
+        mocker.patch("sshoot.manager.kill_and_wait")
+        update_index = mocker.patch.object(
+            profile_manager, "update_completion_index"
+        )
+        pid_file.write_text("100\n")
+        profile_manager.is_running = lambda name: True
+        profile_manager.stop_profile("profile")
+        update_index.assert_called_once_with()
+
+    def test_start_profile_clears_stopped(
+        self, profile_manager, profile, sessions_dir, bin_succeed
+    ):
+        """Manager.start_profile clears the stopped marker for a profile."""
+        profile_manager._get_executable = lambda: str(bin_succeed)
+        (sessions_dir / "profile.stopped").touch()
+        profile_manager.start_profile("profile")
+        assert not profile_manager.was_stopped("profile")
 
     def test_stop_profile_unknown(self, profile_manager):
         """Trying to stop an unknown profile raises an error."""
@@ -283,6 +425,145 @@ class TestManager:
             f"10.0.0.0/24 --daemon --pidfile {sessions_dir}/profile.pid\n"
         )
 
+    def test_restart_profile_refuse_conflicts(
+        self, mocker, profile_manager, pid_file, config_file, sessions_dir
+    ):
+        """With "refuse" policy, a running profile conflicting with other
+        running ones is not stopped."""
+        config_file.write_text(yaml.dump({"on-conflict": "refuse"}))
+        profile_manager.load_config()
+        profile_manager.create_profile("other", {"subnets": ["10.0.0.0/8"]})
+        pid_file.write_text(f"{os.getpid()}\n")
+        (sessions_dir / "other.pid").write_text(f"{os.getpid()}\n")
+        mock_kill_and_wait = mocker.patch("sshoot.manager.kill_and_wait")
+        with pytest.raises(ManagerProfileError) as error:
+            profile_manager.restart_profile("profile")
+        assert str(error.value) == "Routes conflict with profiles: other"
+        mock_kill_and_wait.assert_not_called()
+        assert profile_manager.is_running("profile")
+
+    def test_stop_profile_kill_fail(self, mocker, profile_manager, pid_file):
+        """If the process can't be killed, an error is raised."""
+        pid_file.write_text("100\n")
+        mock_kill_and_wait = mocker.patch("sshoot.manager.kill_and_wait")
+        mock_kill_and_wait.side_effect = ProcessKillFail(100)
+        profile_manager.is_running = lambda name: True
+        with pytest.raises(ManagerProfileError) as err:
+            profile_manager.stop_profile("profile")
+        assert str(err.value) == (
+            "Failed to stop profile: Failed to kill process 100"
+        )
+
+    def test_start_profiles(
+        self, profile_manager, profile, sessions_dir, bin_succeed
+    ):
+        """Manager.start_profiles starts multiple profiles."""
+        profile_manager._get_executable = lambda: str(bin_succeed)
+        profile_manager.create_profile("other", {"subnets": ["10.1.0.0/24"]})
+        results = profile_manager.start_profiles(
+            ["profile", "other", "unknown"], extra_args=["--extra"]
+        )
+        assert list(results) == ["profile", "other", "unknown"]
+        assert results["profile"] is None
+        assert results["other"] is None
+        assert str(results["unknown"]) == "Unknown profile: unknown"
+
+    def test_start_profiles_refuse_conflicts(
+        self, profile_manager, profile, config_file, bin_succeed
+    ):
+        """With "refuse" policy, profiles conflicting with earlier ones in
+        the batch are not started."""
+        config_file.write_text(yaml.dump({"on-conflict": "refuse"}))
+        profile_manager.load_config()
+        profile_manager._get_executable = lambda: str(bin_succeed)
+        profile_manager.create_profile("other", {"subnets": ["10.0.0.0/8"]})
+        profile_manager.create_profile("third", {"subnets": ["10.2.0.0/24"]})
+        results = profile_manager.start_profiles(["other", "profile", "third"])
+        assert list(results) == ["other", "profile", "third"]
+        assert results["other"] is None
+        assert (
+            str(results["profile"]) == "Routes conflict with profiles: other"
+        )
+        assert str(results["third"]) == "Routes conflict with profiles: other"
+
+    def test_start_profiles_concurrent(self, mocker, profile_manager):
+        """Manager.start_profiles runs up to max_workers starts at once."""
+        lock = threading.Lock()
+        active = []
+        max_active = []
+
+        def start_profile(name, **kwargs):
+            with lock:
+                active.append(name)
+                max_active.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(name)
+
+        profile_manager.start_profile = start_profile
+        names = [f"profile{i}" for i in range(6)]
+        results = profile_manager.start_profiles(names, max_workers=3)
+        assert results == dict.fromkeys(names)
+        assert max(max_active) == 3
+
+    def test_start_profiles_traced(
+        self, profile_manager, profile, bin_succeed
+    ):
+        """Spans for starting profiles are nested in the current one."""
+        profile_manager._get_executable = lambda: str(bin_succeed)
+        tracer = trace.enable("root")
+        try:
+            with trace.span("start") as span:
+                profile_manager.start_profiles(["profile"])
+        finally:
+            trace.disable()
+        assert [child.name for child in span.children] == [
+            "is_running",
+            "spawn",
+            "wait_daemonize",
+        ]
+        assert tracer.root.children == [span]
+
+    def test_start_profiles_unexpected_error(self, profile_manager):
+        """Unexpected errors in bulk operations are raised."""
+
+        def start_profile(name, **kwargs):
+            raise RuntimeError("boom")
+
+        profile_manager.start_profile = start_profile
+        with pytest.raises(RuntimeError):
+            profile_manager.start_profiles(["profile"])
+
+    def test_stop_profiles(self, mocker, profile_manager):
+        """Manager.stop_profiles stops multiple profiles."""
+        mock_stop = mocker.patch.object(profile_manager, "stop_profile")
+        mock_stop.side_effect = [None, ManagerProfileError("fail")]
+        results = profile_manager.stop_profiles(["profile1", "profile2"])
+        assert list(results) == ["profile1", "profile2"]
+        assert results["profile1"] is None
+        assert str(results["profile2"]) == "fail"
+
+    def test_restart_profiles(self, mocker, profile_manager):
+        """Manager.restart_profiles restarts multiple profiles."""
+        mock_restart = mocker.patch.object(profile_manager, "restart_profile")
+        results = profile_manager.restart_profiles(
+            ["profile1", "profile2"],
+            extra_args=["--extra"],
+            disable_global_extra_options=True,
+        )
+        assert results == {"profile1": None, "profile2": None}
+        mock_restart.assert_has_calls(
+            [
+                mocker.call(
+                    name,
+                    extra_args=["--extra"],
+                    disable_global_extra_options=True,
+                )
+                for name in ("profile1", "profile2")
+            ],
+            any_order=True,
+        )
+
     def test_get_pidfile(self, profile_manager, pid_file):
         """Manager._get_pidfile returns the pidfile path for a session."""
         assert profile_manager._get_pidfile("profile") == pid_file
@@ -292,6 +573,21 @@ class TestManager:
         pid_file.write_text(f"{os.getpid()}\n")
         assert profile_manager.is_running("profile")
 
+    def test_get_pid(self, profile_manager, pid_file):
+        """Manager.get_pid returns the PID of a running session."""
+        pid_file.write_text(f"{os.getpid()}\n")
+        assert profile_manager.get_pid("profile") == os.getpid()
+
+    def test_get_pid_not_running(self, profile_manager, pid_file):
+        """Manager.get_pid returns None if the session is not running."""
+        assert profile_manager.get_pid("profile") is None
+
+    def test_was_stopped(self, profile_manager, profile, sessions_dir):
+        """Manager.was_stopped returns whether a profile was stopped."""
+        assert not profile_manager.was_stopped("profile")
+        (sessions_dir / "profile.stopped").touch()
+        assert profile_manager.was_stopped("profile")
+
     def test_is_running_no_pidfile(self, profile_manager):
         """If the pidfile is not found, the profile is not running."""
         assert not profile_manager.is_running("not-here")
@@ -313,6 +609,177 @@ class TestManager:
         # The stale pidfile is deleted.
         assert not pid_file.exists()
 
+    def test_is_running_other_user_process(
+        self, mocker, profile_manager, pid_file
+    ):
+        """A process owned by another user is running."""
+        mocker.patch("sshoot.manager.os.kill").side_effect = PermissionError
+        pid_file.write_text("1\n")
+        assert profile_manager.is_running("profile")
+
+    def test_get_statuses(self, profile_manager, sessions_dir):
+        """Manager.get_statuses returns running status for all profiles."""
+        for name in ("profile1", "profile2", "profile3"):
+            profile_manager.create_profile(name, {"subnets": ["10.0.0.0/24"]})
+        (sessions_dir / "profile1.pid").write_text(f"{os.getpid()}\n")
+        (sessions_dir / "profile2.pid").write_text("garbage")
+        assert profile_manager.get_statuses() == {
+            "profile1": True,
+            "profile2": False,
+            "profile3": False,
+        }
+
+    def test_get_statuses_stale_pidfiles(
+        self, profile_manager, profile, pid_file
+    ):
+        """Manager.get_statuses removes stale pidfiles."""
+        pid_file.write_text("-100\n")
+        assert profile_manager.get_statuses() == {"profile": False}
+        assert not pid_file.exists()
+
+    def test_get_statuses_ignore_other_files(
+        self, profile_manager, profile, sessions_dir
+    ):
+        """Manager.get_statuses ignores files which are not pidfiles."""
+        (sessions_dir / "profile").write_text(f"{os.getpid()}\n")
+        assert profile_manager.get_statuses() == {"profile": False}
+
+    def test_get_statuses_no_sessions_dir(self, profile_manager, profile):
+        """If the sessions directory doesn't exist, nothing is running."""
+        assert profile_manager.get_statuses() == {"profile": False}
+
+    def test_get_statuses_single_scan(
+        self, mocker, profile_manager, sessions_dir
+    ):
+        """Manager.get_statuses only reads pidfiles that are present."""
+        for i in range(50):
+            profile_manager.create_profile(
+                f"profile{i}", {"subnets": ["10.0.0.0/24"]}
+            )
+        (sessions_dir / "profile1.pid").write_text(f"{os.getpid()}\n")
+        mock_read_text = mocker.spy(Path, "read_text")
+        statuses = profile_manager.get_statuses()
+        assert mock_read_text.call_count == 1
+        assert [name for name, running in statuses.items() if running] == [
+            "profile1"
+        ]
+
+    def test_conflict_policy_default(self, profile_manager):
+        """Conflicts only cause warnings by default."""
+        assert profile_manager.conflict_policy == "warn"
+
+    def test_conflict_policy(self, profile_manager, config_file):
+        """The policy for conflicts can be set in config."""
+        config_file.write_text(yaml.dump({"on-conflict": "refuse"}))
+        profile_manager.load_config()
+        assert profile_manager.conflict_policy == "refuse"
+
+    def test_conflict_policy_invalid(self, profile_manager, config_file):
+        """An error is raised if the policy for conflicts is invalid."""
+        config_file.write_text(yaml.dump({"on-conflict": "ignore"}))
+        profile_manager.load_config()
+        with pytest.raises(ManagerProfileError) as error:
+            profile_manager.conflict_policy
+        assert (
+            str(error.value)
+            == "Invalid value for 'on-conflict' config: ignore"
+        )
+
+    def test_find_conflicts(self, profile_manager, profile):
+        """Manager.find_conflicts returns conflicts between all profiles."""
+        profile_manager.create_profile("other", {"subnets": ["10.0.0.0/8"]})
+        profile_manager.create_profile("third", {"subnets": ["10.1.0.0/16"]})
+        assert profile_manager.find_conflicts() == [
+            Conflict(("other", "profile"), (ip_network("10.0.0.0/24"),)),
+            Conflict(("other", "third"), (ip_network("10.1.0.0/16"),)),
+        ]
+
+    def test_get_start_conflicts(self, profile_manager, profile, sessions_dir):
+        """Manager.get_start_conflicts returns conflicts of profiles with
+        running ones and among each other."""
+        for name, subnet in (
+            ("running1", "10.0.0.0/8"),
+            ("running2", "10.0.0.0/16"),
+            ("stopped", "10.0.0.0/8"),
+            ("other", "10.0.0.128/25"),
+        ):
+            profile_manager.create_profile(name, {"subnets": [subnet]})
+        for name in ("running1", "running2"):
+            (sessions_dir / f"{name}.pid").write_text(f"{os.getpid()}\n")
+        conflicts = profile_manager.get_start_conflicts(
+            ["profile", "other", "unknown"]
+        )
+        assert [conflict.profiles for conflict in conflicts] == [
+            ("other", "profile"),
+            ("other", "running1"),
+            ("other", "running2"),
+            ("profile", "running1"),
+            ("profile", "running2"),
+        ]
+
+    def test_get_start_conflicts_none_running(self, profile_manager, profile):
+        """There are no conflicts for a single profile if none is running."""
+        profile_manager.create_profile("other", {"subnets": ["10.0.0.0/8"]})
+        assert profile_manager.get_start_conflicts(["profile"]) == []
+
+    def test_find_profiles_for(self, profile_manager):
+        """Manager.find_profiles_for returns profiles routing an address."""
+        profile_manager.create_profile(
+            "profile1",
+            {"subnets": ["10.0.0.0/8"], "exclude-subnets": ["10.1.0.0/16"]},
+        )
+        profile_manager.create_profile(
+            "profile2", {"subnets": ["10.1.2.0/24", "example.com"]}
+        )
+        assert profile_manager.find_profiles_for("10.1.2.3") == [
+            ("profile2", ip_network("10.1.2.0/24"))
+        ]
+        assert profile_manager.find_profiles_for("10.2.0.1") == [
+            ("profile1", ip_network("10.0.0.0/8"))
+        ]
+        assert profile_manager.find_profiles_for("192.168.1.1") == []
+
+    def test_find_profiles_for_invalid(self, profile_manager):
+        """An error is raised if the address is not valid."""
+        with pytest.raises(ManagerProfileError) as error:
+            profile_manager.find_profiles_for("example.com")
+        assert str(error.value) == "Invalid address: example.com"
+
+    def test_find_profiles_for_cached(self, mocker, profile_manager, profile):
+        """The subnet index is only built once."""
+        from_profiles = mocker.spy(SubnetIndex, "from_profiles")
+        profile_manager.find_profiles_for("10.0.0.1")
+        profile_manager.find_profiles_for("10.0.0.2")
+        assert from_profiles.call_count == 1
+
+    def test_find_profiles_for_profiles_changed(
+        self, profile_manager, profiles_file, profile
+    ):
+        """The subnet index is rebuilt when profiles change."""
+        assert profile_manager.find_profiles_for("10.0.0.1") == [
+            ("profile", ip_network("10.0.0.0/24"))
+        ]
+        profile_manager.create_profile("other", {"subnets": ["10.0.0.0/8"]})
+        assert [
+            name for name, _ in profile_manager.find_profiles_for("10.0.0.1")
+        ] == ["profile", "other"]
+        profile_manager.remove_profile("profile")
+        assert [
+            name for name, _ in profile_manager.find_profiles_for("10.0.0.1")
+        ] == ["other"]
+        profiles_file.write_text("new: {subnets: [10.0.0.1/32]}\n")
+        profile_manager.load_config()
+        assert [
+            name for name, _ in profile_manager.find_profiles_for("10.0.0.1")
+        ] == ["new"]
+
+    def test_get_session_stats(self, profile_manager, sessions_dir):
+        """Manager.get_session_stats returns stats for running sessions."""
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        stats = profile_manager.get_session_stats()
+        assert list(stats) == ["profile"]
+        assert stats["profile"].pid == os.getpid()
+
     def test_get_cmdline(self, profile_manager, pid_file):
         """Manager.get_cmdline returns the command line for the profile."""
         assert profile_manager.get_cmdline("profile") == [
@@ -323,6 +790,21 @@ class TestManager:
             str(pid_file),
         ]
 
+    def test_get_cmdline_tuning(self, profile_manager, pid_file):
+        """Manager.get_cmdline includes tuning options for the profile."""
+        profile_manager.get_profile("profile").update(
+            {"latency-control": False, "ssh-server-alive-interval": 10}
+        )
+        assert profile_manager.get_cmdline("profile") == [
+            "sshuttle",
+            "10.0.0.0/24",
+            "--no-latency-control",
+            "--ssh-cmd=ssh -o ServerAliveInterval=10",
+            "--daemon",
+            "--pidfile",
+            str(pid_file),
+        ]
+
     def test_get_cmdline_extra_args(self, profile_manager, pid_file):
         """Manager.get_cmdline adds passed extra arguments to command line."""
         cmdline = profile_manager.get_cmdline(
@@ -349,6 +831,685 @@ class TestManager:
             str(pid_file),
         ]
 
+    def test_get_cmdline_normalize_subnets(
+        self, profile_manager, config_file, pid_file
+    ):
+        """Manager.get_cmdline normalizes subnets if enabled in config."""
+        config_file.write_text(yaml.dump({"normalize-subnets": True}))
+        profile_manager.load_config()
+        profile_manager.create_profile(
+            "other",
+            {
+                "subnets": ["10.0.0.0/25", "10.0.0.128/25"],
+                "exclude_subnets": ["192.168.0.0/16"],
+            },
+        )
+        assert profile_manager.get_cmdline("other")[:2] == [
+            "sshuttle",
+            "10.0.0.0/24",
+        ]
+
+    def test_get_subnet_rules(self, profile_manager, config_file):
+        """Manager.get_subnet_rules returns the number of subnet rules before
+        and after normalization."""
+        config_file.write_text(yaml.dump({"normalize-subnets": True}))
+        profile_manager.load_config()
+        profile_manager.create_profile(
+            "other",
+            {
+                "subnets": ["10.0.0.0/25", "10.0.0.128/25"],
+                "exclude_subnets": ["192.168.0.0/16"],
+            },
+        )
+        assert profile_manager.get_subnet_rules("other") == (3, 1)
+
+    def test_get_subnet_rules_disabled(self, profile_manager, profile):
+        """Manager.get_subnet_rules returns None if normalization is not
+        enabled."""
+        assert not profile_manager.normalize_subnets
+        assert profile_manager.get_subnet_rules("profile") is None
+
+    def test_get_cmdline_subnets_files(
+        self, profile_manager, pid_file, sessions_dir
+    ):
+        """Manager.get_cmdline passes subnets through files if there are
+        too many, without writing them."""
+        subnets = [f"10.{i}.0.0/16" for i in range(SUBNETS_FILE_THRESHOLD + 1)]
+        profile_manager.create_profile(
+            "other",
+            {"subnets": subnets, "exclude_subnets": ["10.0.0.0/24"]},
+        )
+        subnets_file = sessions_dir / "other.subnets"
+        assert profile_manager.get_cmdline("other")[:3] == [
+            "sshuttle",
+            f"--subnets={subnets_file}",
+            "--exclude=10.0.0.0/24",
+        ]
+        assert not subnets_file.exists()
+        _, subnets_files = profile_manager.get_session_cmdlines("other")
+        assert list(subnets_files) == [subnets_file]
+        assert subnets_files[subnets_file].splitlines() == subnets
+
+    def test_get_cmdline_exclude_file(
+        self, profile_manager, pid_file, sessions_dir
+    ):
+        """Manager.get_cmdline passes excluded subnets through files if
+        there are too many."""
+        exclude_subnets = [
+            f"10.{i}.0.0/16" for i in range(SUBNETS_FILE_THRESHOLD + 1)
+        ]
+        profile_manager.create_profile(
+            "other",
+            {"subnets": ["10.0.0.0/8"], "exclude_subnets": exclude_subnets},
+        )
+        exclude_file = sessions_dir / "other.exclude"
+        assert profile_manager.get_cmdline("other")[:3] == [
+            "sshuttle",
+            "10.0.0.0/8",
+            f"--exclude-from={exclude_file}",
+        ]
+        _, subnets_files = profile_manager.get_session_cmdlines("other")
+        assert subnets_files[exclude_file].splitlines() == exclude_subnets
+
+    def test_start_profile_subnets_files(
+        self, profile_manager, sessions_dir, bin_succeed
+    ):
+        """Manager.start_profile writes subnets files."""
+        profile_manager._get_executable = lambda: str(bin_succeed)
+        subnets = [f"10.{i}.0.0/16" for i in range(SUBNETS_FILE_THRESHOLD + 1)]
+        profile_manager.create_profile("other", {"subnets": subnets})
+        profile_manager.start_profile("other")
+        subnets_file = sessions_dir / "other.subnets"
+        assert subnets_file.read_text().splitlines() == subnets
+        assert not list(sessions_dir.glob(".other.subnets.*"))
+
+    def test_start_profile_subnets_files_removed(
+        self, profile_manager, profile, sessions_dir, bin_succeed
+    ):
+        """Manager.start_profile removes subnets files no longer needed."""
+        profile_manager._get_executable = lambda: str(bin_succeed)
+        (sessions_dir / "profile.subnets").write_text("10.0.0.0/24\n")
+        profile_manager.start_profile("profile")
+        assert not (sessions_dir / "profile.subnets").exists()
+
+    def test_start_profile_fail_subnets_files_removed(
+        self, profile_manager, sessions_dir, bin_fail
+    ):
+        """If starting a profile fails, its subnets files are removed."""
+        profile_manager._get_executable = lambda: str(bin_fail)
+        subnets = [f"10.{i}.0.0/16" for i in range(SUBNETS_FILE_THRESHOLD + 1)]
+        profile_manager.create_profile("other", {"subnets": subnets})
+        with pytest.raises(ManagerProfileError):
+            profile_manager.start_profile("other")
+        assert not (sessions_dir / "other.subnets").exists()
+
+    def test_get_cmdline_subnets_files_normalized(
+        self, profile_manager, config_file, sessions_dir
+    ):
+        """Subnets are only written to files if there are too many after
+        normalization."""
+        config_file.write_text(yaml.dump({"normalize-subnets": True}))
+        profile_manager.load_config()
+        profile_manager.create_profile(
+            "other",
+            {
+                "subnets": [
+                    f"10.0.{i}.0/24" for i in range(SUBNETS_FILE_THRESHOLD + 1)
+                ]
+            },
+        )
+        assert profile_manager.get_cmdline("other")[1] == "10.0.0.0/18"
+        assert not (sessions_dir / "other.subnets").exists()
+
+
+@pytest.fixture
+def multiplexer(mocker):
+    """Mock SSH master operations."""
+    from sshoot.multiplex import SSHMultiplexer
+
+    yield {
+        method: mocker.patch.object(SSHMultiplexer, method, return_value=True)
+        for method in ("start", "stop")
+    }
+
+
+@pytest.fixture
+def multiplex_manager(profile_manager, config_file, sessions_dir, multiplexer):
+    config_file.write_text(yaml.dump({"ssh-multiplex": True}))
+    profile_manager.load_config()
+    profile_manager.create_profile(
+        "profile", {"subnets": ["10.0.0.0/24"], "remote": "bastion"}
+    )
+    profile_manager.create_profile(
+        "other", {"subnets": ["10.1.0.0/24"], "remote": "bastion"}
+    )
+    yield profile_manager
+
+
+class TestManagerSSHMultiplex:
+    def test_get_cmdline(self, multiplex_manager, run_dir):
+        """Sessions connect through the master for their remote."""
+        cmdline = multiplex_manager.get_cmdline("profile")
+        ssh_cmd = multiplex_manager._get_multiplexer().ssh_cmd("bastion")
+        assert f"--ssh-cmd={ssh_cmd}" in cmdline
+        assert str(run_dir / "ssh") in ssh_cmd
+
+    def test_get_cmdline_disabled(self, profile_manager, profile):
+        """Multiplexing is disabled by default."""
+        profile_manager.create_profile(
+            "other", {"subnets": ["10.1.0.0/24"], "remote": "bastion"}
+        )
+        assert not profile_manager.ssh_multiplex
+        cmdline = profile_manager.get_cmdline("other")
+        assert not any(arg.startswith("--ssh-cmd") for arg in cmdline)
+
+    @pytest.mark.parametrize(
+        "details",
+        [
+            {"remote": ""},
+            {"remote": "user:secret@bastion"},
+            {"extra_opts": ["--ssh-cmd", "ssh -i key"]},
+            {"extra_opts": ["--ssh-cmd=ssh -i key"]},
+            {"extra_opts": ["-e", "ssh -i key"]},
+        ],
+    )
+    def test_get_cmdline_not_multiplexed(self, multiplex_manager, details):
+        """Sessions without a remote, for remotes with a password, or with
+        a custom ssh command don't use multiplexing."""
+        multiplex_manager.get_profile("profile").update(details)
+        cmdline = multiplex_manager.get_cmdline("profile")
+        assert not any(arg.startswith("--ssh-cmd=ssh -o") for arg in cmdline)
+
+    def test_get_cmdline_global_ssh_cmd(self, multiplex_manager, config_file):
+        """A custom ssh command in global extra options disables
+        multiplexing, unless global options are disabled."""
+        config_file.write_text(
+            yaml.dump(
+                {"ssh-multiplex": True, "extra-options": ["-e", "ssh -i key"]}
+            )
+        )
+        multiplex_manager.load_config()
+        cmdline = multiplex_manager.get_cmdline("profile")
+        assert not any(arg.startswith("--ssh-cmd") for arg in cmdline)
+        cmdline = multiplex_manager.get_cmdline(
+            "profile", disable_global_extra_options=True
+        )
+        assert any(arg.startswith("--ssh-cmd") for arg in cmdline)
+
+    def test_get_cmdline_extra_args_ssh_cmd(self, multiplex_manager):
+        """A custom ssh command in extra arguments disables multiplexing."""
+        cmdline = multiplex_manager.get_cmdline(
+            "profile", extra_args=["--ssh-cmd", "ssh -i key"]
+        )
+        assert cmdline[-2:] == ["--ssh-cmd", "ssh -i key"]
+        assert len([arg for arg in cmdline if "--ssh-cmd" in arg]) == 1
+
+    def test_start_profile(
+        self, multiplex_manager, multiplexer, sessions_dir, bin_succeed
+    ):
+        """The master for the remote is started with the session."""
+        multiplex_manager._get_executable = lambda: str(bin_succeed)
+        multiplex_manager.start_profile("profile")
+        multiplexer["start"].assert_called_once_with("bastion", options=[])
+        assert "--ssh-cmd=ssh" in (bin_succeed.parent / "cmdline").read_text()
+        multiplexer["stop"].assert_not_called()
+
+    def test_start_profile_insecure_dir(
+        self, multiplex_manager, multiplexer, run_dir, bin_succeed
+    ):
+        """Sessions are not started if the directory for control sockets
+        is accessible by others."""
+        multiplex_manager._get_executable = lambda: str(bin_succeed)
+        (run_dir / "ssh").mkdir(mode=0o777)
+        (run_dir / "ssh").chmod(0o777)
+        with pytest.raises(ManagerProfileError) as error:
+            multiplex_manager.start_profile("profile")
+        assert str(error.value) == (
+            f"Insecure directory for SSH control sockets: {run_dir / 'ssh'}"
+        )
+        multiplexer["start"].assert_not_called()
+        assert not (bin_succeed.parent / "cmdline").exists()
+
+    def test_get_cmdline_ssh_options(self, multiplex_manager):
+        """ssh options for the profile are added to the ssh command."""
+        multiplex_manager.get_profile("profile").ssh_compression = True
+        cmdline = multiplex_manager.get_cmdline("profile")
+        ssh_cmd = multiplex_manager._get_multiplexer().ssh_cmd("bastion")
+        assert f"--ssh-cmd={ssh_cmd} -o Compression=yes" in cmdline
+
+    def test_start_profile_ssh_options(
+        self, multiplex_manager, multiplexer, bin_succeed
+    ):
+        """The master is started with ssh options for the profile."""
+        multiplex_manager._get_executable = lambda: str(bin_succeed)
+        multiplex_manager.get_profile("profile").ssh_cipher = "aes256-ctr"
+        multiplex_manager.start_profile("profile")
+        multiplexer["start"].assert_called_once_with(
+            "bastion", options=["-c", "aes256-ctr"]
+        )
+
+    def test_start_profile_not_multiplexed(
+        self, multiplex_manager, multiplexer, bin_succeed
+    ):
+        """The master is not started if multiplexing is not used."""
+        multiplex_manager._get_executable = lambda: str(bin_succeed)
+        multiplex_manager.get_profile("profile").remote = ""
+        multiplex_manager.start_profile("profile")
+        multiplexer["start"].assert_not_called()
+
+    def test_start_profile_fail(
+        self, multiplex_manager, multiplexer, bin_fail
+    ):
+        """If the session fails to start, the master is stopped."""
+        multiplex_manager._get_executable = lambda: str(bin_fail)
+        with pytest.raises(ManagerProfileError):
+            multiplex_manager.start_profile("profile")
+        multiplexer["stop"].assert_called_once_with("bastion")
+
+    def test_start_profile_fail_master_in_use(
+        self, multiplex_manager, multiplexer, sessions_dir, bin_fail
+    ):
+        """If the session fails to start, the master is kept if other
+        sessions use it."""
+        (sessions_dir / "other.pid").write_text(f"{os.getpid()}\n")
+        multiplex_manager._get_executable = lambda: str(bin_fail)
+        with pytest.raises(ManagerProfileError):
+            multiplex_manager.start_profile("profile")
+        multiplexer["stop"].assert_not_called()
+
+    def test_stop_profile(
+        self, mocker, multiplex_manager, multiplexer, sessions_dir
+    ):
+        """The master is stopped with the last session using it."""
+        mocker.patch("sshoot.manager.kill_and_wait")
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        multiplex_manager.stop_profile("profile")
+        multiplexer["stop"].assert_called_once_with("bastion")
+
+    def test_stop_profile_master_in_use(
+        self, mocker, multiplex_manager, multiplexer, sessions_dir
+    ):
+        """The master is kept if other sessions use it."""
+        mocker.patch("sshoot.manager.kill_and_wait")
+        multiplex_manager.create_profile(
+            "third", {"subnets": ["10.2.0.0/24"], "remote": "other"}
+        )
+        for name in ("profile", "other", "third"):
+            (sessions_dir / f"{name}.pid").write_text(f"{os.getpid()}\n")
+        multiplex_manager.stop_profile("profile")
+        multiplexer["stop"].assert_not_called()
+        multiplex_manager.stop_profile("third")
+        multiplexer["stop"].assert_called_once_with("other")
+
+    def test_stop_profile_not_multiplexed(
+        self, mocker, multiplex_manager, multiplexer, sessions_dir
+    ):
+        """No master is stopped for profiles without a remote."""
+        mocker.patch("sshoot.manager.kill_and_wait")
+        multiplex_manager.get_profile("profile").remote = ""
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        multiplex_manager.stop_profile("profile")
+        multiplexer["stop"].assert_not_called()
+
+    def test_restart_profile(
+        self, mocker, multiplex_manager, multiplexer, sessions_dir, bin_succeed
+    ):
+        """The master is kept running across restarts."""
+        multiplex_manager._get_executable = lambda: str(bin_succeed)
+        pid_file = sessions_dir / "profile.pid"
+        mocker.patch(
+            "sshoot.manager.kill_and_wait",
+            side_effect=lambda pid: pid_file.unlink(),
+        )
+        pid_file.write_text(f"{os.getpid()}\n")
+        multiplex_manager.restart_profile("profile")
+        multiplexer["stop"].assert_not_called()
+        multiplexer["start"].assert_called_once_with("bastion", options=[])
+
+
+@pytest.fixture
+def bin_log(tmp_path):
+    """Fake executable appending its command line to a file.
+
+    It fails for command lines including "fail".
+
+    """
+    executable = tmp_path / "bin-log"
+    executable.write_text(
+        f"""#!/bin/sh
+echo $@ >> {tmp_path}/cmdlines
+case "$*" in *fail*) exit 1;; esac
+"""
+    )
+    executable.chmod(0o755)
+    yield executable
+
+
+@pytest.fixture
+def shards_manager(profile_manager, sessions_dir, bin_log):
+    profile_manager.load_config()
+    profile_manager._get_executable = lambda: str(bin_log)
+    profile_manager.create_profile(
+        "profile",
+        {
+            "subnets": ["10.0.0.0/24", "10.1.0.0/24", "10.2.0.0/24"],
+            "exclude_subnets": ["10.0.0.0/28"],
+            "shards": 2,
+        },
+    )
+    yield profile_manager
+
+
+class TestManagerShards:
+    def test_get_cmdlines(self, shards_manager, sessions_dir):
+        """Subnets are partitioned between shards, each with its pidfile."""
+        assert shards_manager.get_cmdlines("profile") == [
+            [
+                shards_manager._get_executable(),
+                "10.0.0.0/24",
+                "10.2.0.0/24",
+                "--exclude=10.0.0.0/28",
+                "--daemon",
+                "--pidfile",
+                str(sessions_dir / "profile.pid"),
+            ],
+            [
+                shards_manager._get_executable(),
+                "10.1.0.0/24",
+                "--exclude=10.0.0.0/28",
+                "--daemon",
+                "--pidfile",
+                str(sessions_dir / "profile.pid.1"),
+            ],
+        ]
+
+    def test_get_cmdlines_session_options(self, shards_manager):
+        """Options for the whole session only apply to the first shard."""
+        shards_manager.get_profile("profile").update(
+            {
+                "auto_hosts": True,
+                "auto_nets": True,
+                "dns": True,
+                "seed_hosts": ["foo", "bar"],
+                "remote": "bastion",
+            }
+        )
+        options = [
+            "--auto-hosts",
+            "--auto-nets",
+            "--dns",
+            "--seed-hosts=foo,bar",
+        ]
+        first, second = shards_manager.get_cmdlines("profile")
+        assert all(option in first for option in options)
+        assert not any(option in second for option in options)
+        assert "--remote=bastion" in second
+
+    def test_get_cmdline(self, shards_manager):
+        """Manager.get_cmdline returns the command for the first shard."""
+        assert shards_manager.get_cmdline("profile")[1:3] == [
+            "10.0.0.0/24",
+            "10.2.0.0/24",
+        ]
+
+    def test_get_cmdlines_subnets_files(self, shards_manager, sessions_dir):
+        """Subnets files are passed to each shard."""
+        subnets = [
+            f"10.{i}.0.0/16" for i in range(SUBNETS_FILE_THRESHOLD * 2 + 2)
+        ]
+        exclude_subnets = [
+            f"10.{i}.0.0/24" for i in range(SUBNETS_FILE_THRESHOLD + 1)
+        ]
+        shards_manager.get_profile("profile").update(
+            {"subnets": subnets, "exclude_subnets": exclude_subnets}
+        )
+        cmdlines, subnets_files = shards_manager.get_session_cmdlines(
+            "profile"
+        )
+        assert [cmdline[1:3] for cmdline in cmdlines] == [
+            [
+                f"--subnets={sessions_dir}/profile.subnets",
+                f"--exclude-from={sessions_dir}/profile.exclude",
+            ],
+            [
+                f"--subnets={sessions_dir}/profile.subnets.1",
+                f"--exclude-from={sessions_dir}/profile.exclude",
+            ],
+        ]
+        assert subnets_files[sessions_dir / "profile.subnets.1"].split() == (
+            subnets[1::2]
+        )
+
+    def test_start_profile(self, shards_manager, sessions_dir, tmp_path):
+        """A process is started for each shard, the first one last."""
+        shards_manager.start_profile("profile")
+        cmdlines = (tmp_path / "cmdlines").read_text().splitlines()
+        assert [cmdline.split()[0] for cmdline in cmdlines] == [
+            "10.1.0.0/24",
+            "10.0.0.0/24",
+        ]
+
+    def test_start_profile_fail(
+        self, mocker, shards_manager, sessions_dir, tmp_path
+    ):
+        """If a shard fails to start, other ones are stopped."""
+        kill_and_wait = mocker.patch("sshoot.manager.kill_and_wait")
+
+        def start_shard(cmdline, **kwargs):
+            if "fail" not in cmdline:
+                (sessions_dir / "profile.pid.1").write_text("123\n")
+            return subprocess.Popen(cmdline, **kwargs)
+
+        mocker.patch("sshoot.manager.Popen", side_effect=start_shard)
+        shards_manager.get_profile("profile").subnets = [
+            "fail",
+            "10.1.0.0/24",
+        ]
+        with pytest.raises(ManagerProfileError):
+            shards_manager.start_profile("profile")
+        kill_and_wait.assert_called_once_with(123)
+        assert not (sessions_dir / "profile.pid.1").exists()
+
+    def test_start_profile_leftover_shards(
+        self, mocker, shards_manager, sessions_dir
+    ):
+        """Shards left over from a session that exited are stopped."""
+        kill_and_wait = mocker.patch("sshoot.manager.kill_and_wait")
+        (sessions_dir / "profile.pid.1").write_text("123\n")
+        (sessions_dir / "profile.pid.2").write_text("invalid\n")
+        (sessions_dir / "profile.pid.other").write_text("456\n")
+        shards_manager.start_profile("profile")
+        kill_and_wait.assert_called_once_with(123)
+        assert not (sessions_dir / "profile.pid.2").exists()
+        assert (sessions_dir / "profile.pid.other").exists()
+
+    def test_stop_profile(self, mocker, shards_manager, sessions_dir):
+        """All shards are stopped."""
+        kill_and_wait = mocker.patch("sshoot.manager.kill_and_wait")
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        (sessions_dir / "profile.pid.1").write_text("123\n")
+        (sessions_dir / "profile.subnets.1").write_text("10.1.0.0/24\n")
+        shards_manager.stop_profile("profile")
+        assert kill_and_wait.mock_calls == [
+            mocker.call(os.getpid()),
+            mocker.call(123),
+        ]
+        assert not (sessions_dir / "profile.pid.1").exists()
+        assert not (sessions_dir / "profile.subnets.1").exists()
+
+    def test_is_running(self, mocker, shards_manager, sessions_dir):
+        """The session is running only if all shards are."""
+        mocker.patch(
+            "sshoot.manager.process_exists", side_effect=lambda pid: pid < 200
+        )
+        (sessions_dir / "profile.shards").write_text("2\n")
+        (sessions_dir / "profile.pid").write_text("100\n")
+        assert not shards_manager.is_running("profile")
+        assert shards_manager.get_statuses() == {"profile": False}
+        (sessions_dir / "profile.pid.1").write_text("200\n")
+        assert not shards_manager.is_running("profile")
+        assert shards_manager.get_statuses() == {"profile": False}
+        (sessions_dir / "profile.pid.1").write_text("101\n")
+        assert shards_manager.is_running("profile")
+        assert shards_manager.get_statuses() == {"profile": True}
+        assert shards_manager.get_pids("profile") == [100, 101]
+        assert shards_manager.get_pid("profile") == 100
+
+    def test_is_running_first_shard(self, shards_manager, sessions_dir):
+        """The session is not running if the first shard is not."""
+        (sessions_dir / "profile.shards").write_text("2\n")
+        (sessions_dir / "profile.pid.1").write_text(f"{os.getpid()}\n")
+        assert not shards_manager.is_running("profile")
+        assert shards_manager.get_statuses() == {"profile": False}
+
+    def test_is_running_invalid_shards_file(
+        self, shards_manager, sessions_dir
+    ):
+        """If the number of shards is not valid, only the first one is
+        checked."""
+        (sessions_dir / "profile.shards").write_text("invalid\n")
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        assert shards_manager.is_running("profile")
+
+    def test_start_profile_records_shards(
+        self, mocker, shards_manager, sessions_dir
+    ):
+        """The number of shards is recorded when starting, and removed when
+        stopping."""
+        shards_manager.start_profile("profile")
+        assert (sessions_dir / "profile.shards").read_text() == "2\n"
+        mocker.patch("sshoot.manager.kill_and_wait")
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        (sessions_dir / "profile.pid.1").write_text(f"{os.getpid()}\n")
+        shards_manager.stop_profile("profile")
+        assert not (sessions_dir / "profile.shards").exists()
+
+    def test_start_profile_partial_session(
+        self, mocker, shards_manager, sessions_dir
+    ):
+        """The first shard is stopped if left running by a session whose
+        other shards exited."""
+        kill_and_wait = mocker.patch("sshoot.manager.kill_and_wait")
+        mocker.patch(
+            "sshoot.manager.process_exists", side_effect=lambda pid: pid < 200
+        )
+        (sessions_dir / "profile.shards").write_text("2\n")
+        (sessions_dir / "profile.pid").write_text("100\n")
+        shards_manager.start_profile("profile")
+        kill_and_wait.assert_called_once_with(100)
+
+    def test_get_session_stats(self, mocker, shards_manager, sessions_dir):
+        """Session stats include all shards."""
+        get_sessions_stats = mocker.patch("sshoot.stats.get_sessions_stats")
+        (sessions_dir / "profile.shards").write_text("2\n")
+        (sessions_dir / "profile.pid").write_text("100\n")
+        (sessions_dir / "profile.pid.1").write_text("101\n")
+        mocker.patch("sshoot.manager.process_exists", return_value=True)
+        shards_manager.get_session_stats()
+        get_sessions_stats.assert_called_once_with(
+            {"profile": 100}, shard_pids={"profile": [101]}
+        )
+
+
+@pytest.fixture
+def resident_manager(config_dir, run_dir, sessions_dir):
+    manager = ResidentManager(config_path=config_dir, rundir=run_dir)
+    manager.load_config()
+    yield manager
+
+
+@pytest.fixture
+def old_sessions_dir(sessions_dir):
+    """Set the sessions dir modification time in the past."""
+
+    def set_old():
+        stat = sessions_dir.stat()
+        os.utime(sessions_dir, (stat.st_atime, stat.st_mtime - 10))
+
+    set_old()
+    yield set_old
+
+
+class TestResidentManager:
+    def test_refresh_config(self, resident_manager, profiles_file):
+        """Config is reloaded when files change."""
+        profiles_file.write_text("profile: {subnets: [10.0.0.0/8]}\n")
+        resident_manager.refresh_config()
+        assert list(resident_manager.get_profiles()) == ["profile"]
+
+    def test_refresh_config_unchanged(self, mocker, resident_manager):
+        """Config is not reloaded if files haven't changed."""
+        load_config = mocker.patch.object(resident_manager, "load_config")
+        resident_manager.refresh_config()
+        load_config.assert_not_called()
+
+    def test_get_pid(self, resident_manager, sessions_dir):
+        """ResidentManager.get_pid returns the PID of a running session."""
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        assert resident_manager.get_pid("profile") == os.getpid()
+        assert resident_manager.get_pid("other") is None
+
+    def test_sessions_cached(
+        self, mocker, resident_manager, sessions_dir, old_sessions_dir
+    ):
+        """The sessions scan is cached if the directory is unchanged."""
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        old_sessions_dir()
+        scandir = mocker.spy(os, "scandir")
+        assert resident_manager.get_pid("profile") == os.getpid()
+        assert resident_manager.get_pid("profile") == os.getpid()
+        assert scandir.call_count == 1
+
+    def test_sessions_cache_recent_change(
+        self, mocker, resident_manager, sessions_dir
+    ):
+        """The sessions scan is not cached if the directory just changed."""
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        scandir = mocker.spy(os, "scandir")
+        resident_manager.get_pid("profile")
+        resident_manager.get_pid("profile")
+        assert scandir.call_count == 2
+
+    def test_sessions_cache_invalidated(
+        self, resident_manager, sessions_dir, old_sessions_dir
+    ):
+        """The sessions scan is refreshed when the directory changes."""
+        assert resident_manager.get_pid("profile") is None
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        old_sessions_dir()
+        assert resident_manager.get_pid("profile") == os.getpid()
+
+    def test_sessions_cached_process_exited(
+        self, mocker, resident_manager, sessions_dir, old_sessions_dir
+    ):
+        """Cached sessions whose process exited are not running."""
+        (sessions_dir / "profile.pid").write_text(f"{os.getpid()}\n")
+        old_sessions_dir()
+        assert resident_manager.get_statuses() == {}
+        assert resident_manager.get_pid("profile") == os.getpid()
+        mocker.patch("sshoot.manager.process_exists", return_value=False)
+        assert resident_manager.get_pid("profile") is None
+
+    def test_sessions_cached_shard_exited(
+        self, mocker, resident_manager, sessions_dir, old_sessions_dir
+    ):
+        """Cached sessions are not running if any shard exited."""
+        (sessions_dir / "profile.shards").write_text("2\n")
+        (sessions_dir / "profile.pid").write_text("100\n")
+        (sessions_dir / "profile.pid.1").write_text("101\n")
+        old_sessions_dir()
+        mocker.patch("sshoot.manager.process_exists", return_value=True)
+        assert resident_manager.get_pids("profile") == [100, 101]
+        mocker.patch(
+            "sshoot.manager.process_exists", side_effect=lambda pid: pid == 100
+        )
+        assert resident_manager.get_pid("profile") is None
+
+    def test_no_sessions_dir(self, resident_manager, sessions_dir):
+        """If the sessions directory doesn't exist, no session is running."""
+        sessions_dir.rmdir()
+        assert resident_manager.get_pid("profile") is None
+
 
 @pytest.fixture
 def mock_kill(mocker):
@@ -360,6 +1521,45 @@ def mock_sleep(mocker):
     yield mocker.patch("sshoot.manager.time.sleep")
 
 
+@pytest.fixture
+def no_pidfd(mocker):
+    """Disable pidfd support."""
+    mocker.patch("sshoot.manager.pidfd_open").return_value = None
+
+
+@pytest.mark.usefixtures("no_pidfd")
+class TestOutputBuffer:
+    def test_write(self):
+        """Data written to the buffer is returned as string."""
+        output = OutputBuffer()
+        output.write(b"foo ")
+        output.write(b"bar")
+        assert output.getvalue() == "foo bar"
+
+    def test_size(self):
+        """Only the tail of output is kept if it exceeds the size."""
+        output = OutputBuffer(size=5)
+        output.write(b"foo ")
+        output.write(b"bar")
+        output.write(b"baz")
+        assert output.getvalue() == "arbaz"
+
+    def test_invalid_characters(self):
+        """Partial characters are replaced."""
+        output = OutputBuffer(size=5)
+        output.write("éabcd".encode())
+        assert output.getvalue() == "\ufffdabcd"
+
+    def test_tee(self):
+        """Data is written to the tee file as well."""
+        fh = BytesIO()
+        output = OutputBuffer(size=5, tee=fh)
+        output.write(b"foo ")
+        output.write(b"bar")
+        assert fh.getvalue() == b"foo bar"
+
+
+@pytest.mark.usefixtures("no_pidfd")
 class TestKillAndWait:
     def test_return_if_process_dead(self, mock_kill, mock_sleep):
         """No error is reported if the process is not found."""
@@ -406,8 +1606,72 @@ class TestKillAndWait:
         mock_sleep.assert_not_called()
 
 
-class TestGetRundir:
-    def test_rundir_path(self):
-        """get_rundir returns a user-specific tempdir path."""
-        rundir_path = Path(gettempdir()) / f"foo-{getuser()}"
-        assert get_rundir("foo") == rundir_path
+@pytest.fixture
+def process():
+    """A process that runs until killed."""
+    process = subprocess.Popen(["sleep", "60"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def mock_pidfd_send_signal(mocker):
+    yield mocker.patch("sshoot.manager.signal.pidfd_send_signal")
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "pidfd_open"), reason="pidfd not supported"
+)
+class TestKillAndWaitPidfd:
+    def test_kill(self, process):
+        """The process is killed and the call returns when it exits."""
+        start = time.monotonic()
+        kill_and_wait(process.pid)
+        assert time.monotonic() - start < 0.2
+        assert process.wait() == -signal.SIGTERM
+
+    def test_process_not_found(self, mocker, process):
+        """No error is reported if the process is not found."""
+        process.kill()
+        process.wait()
+        kill_and_wait(process.pid)
+
+    def test_process_exits_before_signal(
+        self, mocker, process, mock_pidfd_send_signal
+    ):
+        """No error is reported if the process exits before the signal."""
+        mock_pidfd_send_signal.side_effect = ProcessLookupError
+        kill_and_wait(process.pid)
+        mock_pidfd_send_signal.assert_called_once_with(
+            mocker.ANY, signal.SIGTERM
+        )
+
+    def test_term_and_kill(self, mocker, process, mock_pidfd_send_signal):
+        """If the process doesn't exit on SIGTERM, it's killed."""
+        mock_wait = mocker.patch("sshoot.manager._wait_pidfd")
+        mock_wait.side_effect = [False, True]
+        kill_and_wait(process.pid)
+        assert mock_pidfd_send_signal.mock_calls == [
+            mocker.call(mocker.ANY, signal.SIGTERM),
+            mocker.call(mocker.ANY, signal.SIGKILL),
+        ]
+        assert mock_wait.mock_calls == [
+            mocker.call(mocker.ANY, 2.0),
+            mocker.call(mocker.ANY, 1.0),
+        ]
+
+    def test_raises_eventually(self, mocker, process, mock_pidfd_send_signal):
+        """If the process doesn't die, an error is raised."""
+        mocker.patch("sshoot.manager._wait_pidfd").return_value = False
+        with pytest.raises(ProcessKillFail) as error:
+            kill_and_wait(process.pid)
+        assert error.value.pid == process.pid
+
+    def test_wait_timeout(self, process):
+        """_wait_pidfd returns False if the process doesn't exit in time."""
+        pidfd = os.pidfd_open(process.pid)
+        try:
+            assert not _wait_pidfd(pidfd, 0.01)
+        finally:
+            os.close(pidfd)
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from sshoot.metrics import (
+    collect_metrics,
+    MetricsWriter,
+    serve_metrics,
+)
+from sshoot.supervisor import STATE_FILE
+
+
+@pytest.fixture
+def manager(profile_manager, sessions_dir):
+    profile_manager.load_config()
+    profile_manager.create_profile("profile1", {"subnets": ["10.0.0.0/8"]})
+    profile_manager.create_profile("profile2", {"subnets": ["10.0.0.0/8"]})
+    yield profile_manager
+
+
+class TestCollectMetrics:
+    def test_profiles(self, manager):
+        """Metrics include profiles and running sessions."""
+        output = collect_metrics(manager)
+        assert "sshoot_profiles 2\n" in output
+        assert "sshoot_sessions_running 0\n" in output
+        assert 'sshoot_profile_running{profile="profile1"} 0\n' in output
+        assert "sshoot_config_load_duration_seconds " in output
+
+    def test_sessions(self, manager, sessions_dir):
+        """Metrics include resource usage for running sessions."""
+        (sessions_dir / "profile1.pid").write_text(f"{os.getpid()}\n")
+        output = collect_metrics(manager)
+        assert "sshoot_sessions_running 1\n" in output
+        assert 'sshoot_profile_running{profile="profile1"} 1\n' in output
+        for name in (
+            "sshoot_session_uptime_seconds",
+            "sshoot_session_cpu_seconds_total",
+            "sshoot_session_resident_memory_bytes",
+            "sshoot_session_read_bytes_total",
+            "sshoot_session_written_bytes_total",
+        ):
+            assert f'{name}{{profile="profile1"}} ' in output
+            assert f'{name}{{profile="profile2"}}' not in output
+
+    def test_restarts(self, manager, run_dir):
+        """Restart counts from the supervisor are included."""
+        (run_dir / STATE_FILE).write_text(
+            json.dumps(
+                {"pid": os.getpid(), "sessions": {"profile1": {"restarts": 3}}}
+            )
+        )
+        output = collect_metrics(manager)
+        assert 'sshoot_session_restarts_total{profile="profile1"} 3\n' in (
+            output
+        )
+
+    def test_no_supervisor(self, manager):
+        """Restart counts are not included without a supervisor."""
+        assert "sshoot_session_restarts_total" not in collect_metrics(manager)
+
+    def test_latency(self, manager):
+        """Latency histograms for operations are included."""
+        manager.record_latency("start", 0.3)
+        output = collect_metrics(manager)
+        assert (
+            'sshoot_operation_duration_seconds_bucket{operation="start",'
+            'le="0.25"} 0\n'
+        ) in output
+        assert (
+            'sshoot_operation_duration_seconds_bucket{operation="start",'
+            'le="0.5"} 1\n'
+        ) in output
+        assert (
+            'sshoot_operation_duration_seconds_count{operation="start"} 1\n'
+        ) in output
+
+    def test_no_config_load(self, profile_manager):
+        """The config load duration is not included if not loaded."""
+        output = collect_metrics(profile_manager)
+        assert "sshoot_config_load_duration_seconds" not in output
+
+
+class TestMetricsWriter:
+    def test_add(self):
+        """Metrics are formatted with help and type."""
+        writer = MetricsWriter()
+        writer.add("metric", "gauge", "A metric.", [({}, 1), ({"a": "b"}, 2)])
+        assert writer.output() == (
+            "# HELP metric A metric.\n"
+            "# TYPE metric gauge\n"
+            "metric 1\n"
+            'metric{a="b"} 2\n'
+        )
+
+    def test_escape_labels(self):
+        """Label values are escaped."""
+        writer = MetricsWriter()
+        writer.add("metric", "gauge", "A metric.", [({"a": 'x"\\\n'}, 1)])
+        assert 'metric{a="x\\"\\\\\\n"} 1\n' in writer.output()
+
+    def test_add_histogram(self):
+        """Histogram buckets are cumulative."""
+        writer = MetricsWriter()
+        writer.add_histogram(
+            "metric",
+            "A histogram.",
+            (0.1, 1.0),
+            [({"op": "a"}, {"buckets": [1, 2], "sum": 2.5, "count": 4})],
+        )
+        assert writer.output() == (
+            "# HELP metric A histogram.\n"
+            "# TYPE metric histogram\n"
+            'metric_bucket{op="a",le="0.1"} 1\n'
+            'metric_bucket{op="a",le="1.0"} 3\n'
+            'metric_bucket{op="a",le="+Inf"} 4\n'
+            'metric_sum{op="a"} 2.5\n'
+            'metric_count{op="a"} 4\n'
+        )
+
+
+@pytest.fixture
+def metrics_server():
+    servers = []
+    ready = threading.Event()
+
+    def on_ready(server):
+        servers.append(server)
+        ready.set()
+
+    thread = threading.Thread(
+        target=serve_metrics,
+        args=(lambda: "metric 1\n", 0),
+        kwargs={"ready": on_ready},
+    )
+    thread.start()
+    ready.wait(5)
+    server = servers[0]
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    thread.join()
+
+
+class TestServeMetrics:
+    def test_metrics(self, metrics_server):
+        """Metrics are served on the /metrics path."""
+        with urllib.request.urlopen(f"{metrics_server}/metrics") as response:
+            assert response.read() == b"metric 1\n"
+            assert response.headers["Content-Type"].startswith(
+                "text/plain; version=0.0.4"
+            )
+
+    def test_not_found(self, metrics_server):
+        """Other paths are not found."""
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{metrics_server}/other")
+        assert error.value.code == 404
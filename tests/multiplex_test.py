@@ -0,0 +1,193 @@
+import os
+import subprocess
+import threading
+
+import pytest
+
+from sshoot.multiplex import (
+    ssh_destination,
+    SSHMultiplexer,
+    SSHMultiplexError,
+)
+
+
+@pytest.mark.parametrize(
+    "remote,destination",
+    [
+        ("example.com", ["example.com"]),
+        ("user@example.com", ["user@example.com"]),
+        ("user@example.com:2222", ["-p", "2222", "user@example.com"]),
+        ("fe80::1", ["fe80::1"]),
+        ("user@[fe80::1]:2222", ["-p", "2222", "user@fe80::1"]),
+        ("[fe80::1]", ["fe80::1"]),
+    ],
+)
+def test_ssh_destination(remote, destination):
+    """Remotes in sshuttle format are converted to ssh arguments."""
+    assert ssh_destination(remote) == destination
+
+
+def test_ssh_destination_password():
+    """Remotes with a password are not converted."""
+    assert ssh_destination("user:secret@example.com") is None
+
+
+@pytest.fixture
+def multiplexer(tmp_path):
+    yield SSHMultiplexer(tmp_path / "ssh")
+
+
+@pytest.fixture
+def run(mocker):
+    """Mock ssh runs, as if they all succeeded."""
+    yield mocker.patch(
+        "subprocess.run",
+        return_value=subprocess.CompletedProcess([], 0),
+    )
+
+
+def ssh_args(run):
+    """Return arguments for ssh runs, without the control path."""
+    return [call.args[0][3:] for call in run.mock_calls]
+
+
+class TestSSHMultiplexer:
+    def test_control_path(self, multiplexer, tmp_path):
+        """Control sockets are in the directory, named after the remote."""
+        path = multiplexer.control_path("user@example.com")
+        assert path.parent == tmp_path / "ssh"
+        assert path.suffix == ".sock"
+        assert multiplexer.control_path("user@example.com") == path
+        assert multiplexer.control_path("other@example.com") != path
+
+    def test_ssh_cmd(self, multiplexer):
+        """The ssh command for sessions uses the control socket."""
+        path = multiplexer.control_path("example.com")
+        assert multiplexer.ssh_cmd("example.com") == (
+            f"ssh -o ControlMaster=no -o ControlPath={path}"
+        )
+
+    def test_ssh_cmd_quoted(self, tmp_path):
+        """Paths in the ssh command are quoted."""
+        multiplexer = SSHMultiplexer(tmp_path / "s s")
+        path = multiplexer.control_path("example.com")
+        assert multiplexer.ssh_cmd("example.com").endswith(
+            f"'ControlPath={path}'"
+        )
+
+    def test_start(self, multiplexer, run):
+        """The master is started in background if not running."""
+        run.side_effect = [
+            subprocess.CompletedProcess([], 255),
+            subprocess.CompletedProcess([], 0),
+        ]
+        assert multiplexer.start("user@example.com:2222")
+        path = multiplexer.control_path("user@example.com:2222")
+        assert run.mock_calls[0].args[0][:3] == [
+            "ssh",
+            "-o",
+            f"ControlPath={path}",
+        ]
+        assert ssh_args(run) == [
+            ["-O", "check", "-p", "2222", "user@example.com"],
+            [
+                "-o",
+                "ControlMaster=yes",
+                "-o",
+                "ControlPersist=yes",
+                "-f",
+                "-N",
+                "-p",
+                "2222",
+                "user@example.com",
+            ],
+        ]
+
+    def test_start_options(self, multiplexer, run):
+        """ssh options are passed to the master."""
+        run.side_effect = [
+            subprocess.CompletedProcess([], 255),
+            subprocess.CompletedProcess([], 0),
+        ]
+        assert multiplexer.start("example.com", options=["-C"])
+        assert ssh_args(run)[1][-3:] == ["-N", "-C", "example.com"]
+
+    def test_start_running(self, multiplexer, run):
+        """The master is not started again if running."""
+        assert multiplexer.start("example.com")
+        assert ssh_args(run) == [["-O", "check", "example.com"]]
+
+    def test_start_fail(self, multiplexer, run):
+        """Failures starting the master are reported."""
+        run.return_value = subprocess.CompletedProcess([], 255)
+        assert not multiplexer.start("example.com")
+
+    def test_start_no_ssh(self, multiplexer, run):
+        """If ssh is not found, the master is not started."""
+        run.side_effect = FileNotFoundError()
+        assert not multiplexer.start("example.com")
+
+    def test_start_password(self, multiplexer, run):
+        """Masters are not started for remotes with a password."""
+        assert not multiplexer.start("user:secret@example.com")
+        run.assert_not_called()
+
+    def test_is_running(self, multiplexer, run):
+        """The master status is checked through the control socket."""
+        assert multiplexer.is_running("example.com")
+        run.return_value = subprocess.CompletedProcess([], 255)
+        assert not multiplexer.is_running("example.com")
+
+    def test_stop(self, multiplexer, run):
+        """The master is told to exit through the control socket."""
+        multiplexer.stop("example.com")
+        assert ssh_args(run) == [["-O", "exit", "example.com"]]
+
+    def test_lock(self, multiplexer):
+        """The lock for a remote is exclusive."""
+        acquired = threading.Event()
+
+        def lock():
+            with multiplexer.lock("example.com"):
+                acquired.set()
+
+        with multiplexer.lock("example.com"):
+            thread = threading.Thread(target=lock)
+            thread.start()
+            assert not acquired.wait(0.1)
+        thread.join()
+        assert acquired.is_set()
+
+    def test_lock_creates_private_dir(self, multiplexer):
+        """The directory for control sockets is created as private."""
+        with multiplexer.lock("example.com"):
+            assert multiplexer.path.stat().st_mode & 0o777 == 0o700
+
+    def test_lock_dir_accessible_by_others(self, multiplexer):
+        """The lock fails if the directory is accessible by others."""
+        multiplexer.path.mkdir(mode=0o755)
+        multiplexer.path.chmod(0o755)
+        with pytest.raises(SSHMultiplexError) as error:
+            with multiplexer.lock("example.com"):
+                pass
+        assert str(error.value) == (
+            "Insecure directory for SSH control sockets: "
+            f"{multiplexer.path}"
+        )
+
+    def test_lock_dir_other_owner(self, mocker, multiplexer):
+        """The lock fails if the directory is owned by another user."""
+        multiplexer.path.mkdir(mode=0o700)
+        mocker.patch("os.getuid", return_value=os.getuid() + 1)
+        with pytest.raises(SSHMultiplexError):
+            with multiplexer.lock("example.com"):
+                pass
+
+    def test_lock_dir_symlink(self, multiplexer, tmp_path):
+        """The lock fails if the directory is a symlink."""
+        target = tmp_path / "target"
+        target.mkdir(mode=0o700)
+        multiplexer.path.symlink_to(target)
+        with pytest.raises(SSHMultiplexError):
+            with multiplexer.lock("example.com"):
+                pass
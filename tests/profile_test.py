@@ -1,6 +1,7 @@
 import pytest
 
 from sshoot.profile import (
+    PRESETS,
     Profile,
     ProfileError,
 )
@@ -64,6 +65,27 @@ class TestProfile:
             "--daemon",
         ]
 
+    def test_normalized_subnets(self, profile):
+        """Profile.normalized_subnets() returns the fewest equivalent
+        rules."""
+        profile.subnets = ["10.0.0.0/25", "10.0.0.128/25", "10.0.1.0/24"]
+        profile.exclude_subnets = ["192.168.0.0/16", "10.0.0.0/30"]
+        assert profile.normalized_subnets() == (
+            ["10.0.0.0/23"],
+            ["10.0.0.0/30"],
+        )
+
+    def test_cmdline_subnets_files(self, profile):
+        """Profile.cmdline() can reference files with subnets."""
+        profile.exclude_subnets = ["10.10.1.0/24"]
+        assert profile.cmdline(
+            subnets_file="/run/subnets", exclude_file="/run/exclude"
+        ) == [
+            "sshuttle",
+            "--subnets=/run/subnets",
+            "--exclude-from=/run/exclude",
+        ]
+
     def test_cmdline_with_extra_opts(self, profile):
         """Profile.cmdline() includes extra options."""
         profile.cmdline(extra_opts=["--verbose", "--daemon"]), [
@@ -125,3 +147,147 @@ class TestProfile:
         with pytest.raises(ProfileError) as error:
             profile.update({"unknown": "key"})
         assert str(error.value) == "Invalid profile config 'unknown'"
+
+    def test_shard_subnets(self, profile):
+        """Subnets are distributed in turn between shards."""
+        profile.shards = 2
+        assert profile.shard_subnets(["a", "b", "c", "d", "e"]) == [
+            ["a", "c", "e"],
+            ["b", "d"],
+        ]
+
+    def test_shard_subnets_single(self, profile):
+        """All subnets are in one group with a single shard."""
+        assert profile.shard_subnets(["a", "b"]) == [["a", "b"]]
+
+    def test_shard_subnets_fewer_subnets(self, profile):
+        """There are no empty groups if there are fewer subnets than
+        shards."""
+        profile.shards = 4
+        assert profile.shard_subnets(["a", "b"]) == [["a"], ["b"]]
+        assert profile.shard_subnets([]) == [[]]
+
+    def test_shard_subnets_overlapping(self, profile):
+        """Overlapping subnets are in the same group."""
+        profile.shards = 2
+        assert profile.shard_subnets(["10.0.0.0/8", "10.1.0.0/16"]) == [
+            ["10.0.0.0/8", "10.1.0.0/16"]
+        ]
+        assert profile.shard_subnets(
+            ["10.1.0.0/16", "192.168.0.0/16", "10.0.0.0/8", "172.16.0.0/12"]
+        ) == [
+            ["10.1.0.0/16", "10.0.0.0/8", "172.16.0.0/12"],
+            ["192.168.0.0/16"],
+        ]
+
+    @pytest.mark.parametrize("shards", [0, -1, "2", 1.5, True])
+    def test_update_invalid_shards(self, profile, shards):
+        """An error is raised for an invalid number of shards."""
+        with pytest.raises(ProfileError) as error:
+            profile.update({"shards": shards})
+        assert str(error.value) == f"Invalid number of shards: {shards}"
+
+    def test_cmdline_tuning(self, profile):
+        """Profile.cmdline() includes tuning options."""
+        profile.latency_control = False
+        profile.latency_buffer_size = 4096
+        profile.method = "nft"
+        assert profile.cmdline() == [
+            "sshuttle",
+            "1.1.1.0/24",
+            "10.10.0.0/16",
+            "--no-latency-control",
+            "--latency-buffer-size=4096",
+            "--method=nft",
+        ]
+
+    def test_cmdline_latency_control(self, profile):
+        """Enabling latency control is the sshuttle default."""
+        profile.latency_control = True
+        assert profile.cmdline() == ["sshuttle", "1.1.1.0/24", "10.10.0.0/16"]
+
+    def test_cmdline_ssh_options(self, profile):
+        """Profile.cmdline() includes ssh options in the ssh command."""
+        profile.ssh_cipher = "aes128-gcm@openssh.com"
+        profile.ssh_compression = False
+        profile.ssh_server_alive_interval = 30
+        assert profile.cmdline()[-1] == (
+            "--ssh-cmd=ssh -c aes128-gcm@openssh.com -o Compression=no "
+            "-o ServerAliveInterval=30"
+        )
+
+    def test_cmdline_ssh_cmd(self, profile):
+        """Profile.cmdline() adds ssh options to the specified command."""
+        profile.ssh_compression = True
+        assert profile.cmdline(ssh_cmd="ssh -o ControlMaster=no")[-1] == (
+            "--ssh-cmd=ssh -o ControlMaster=no -o Compression=yes"
+        )
+
+    def test_cmdline_ssh_cmd_no_options(self, profile):
+        """Profile.cmdline() uses the specified ssh command as is."""
+        assert profile.cmdline(ssh_cmd="ssh -v")[-1] == "--ssh-cmd=ssh -v"
+
+    def test_ssh_options_none(self, profile):
+        """There are no ssh options by default."""
+        assert profile.ssh_options() == []
+
+    def test_from_config_tuning(self, profile):
+        """Tuning options are serialized in the config."""
+        profile.latency_control = False
+        profile.method = "tproxy"
+        profile.ssh_compression = True
+        config = profile.config()
+        assert config["latency-control"] is False
+        assert config["method"] == "tproxy"
+        assert config["ssh-compression"] is True
+        assert Profile.from_config(config) == profile
+
+    def test_from_config_preset(self):
+        """Options from a preset are used for ones not in the config."""
+        profile = Profile.from_config(
+            {
+                "subnets": ["10.0.0.0/8"],
+                "preset": "interactive-latency",
+                "ssh-compression": False,
+                "ssh-cipher": None,
+            }
+        )
+        assert profile.latency_control
+        assert profile.latency_buffer_size == 8192
+        assert profile.ssh_cipher == "chacha20-poly1305@openssh.com"
+        assert profile.ssh_compression is False
+        assert "preset" not in profile.config()
+
+    @pytest.mark.parametrize("preset", PRESETS)
+    def test_presets(self, preset):
+        """Presets are valid profile configs."""
+        profile = Profile.from_config({"subnets": [], "preset": preset})
+        assert profile.config() == {"subnets": [], **PRESETS[preset]}
+
+    def test_from_config_unknown_preset(self):
+        """An error is raised for unknown presets."""
+        with pytest.raises(ProfileError) as error:
+            Profile.from_config({"subnets": [], "preset": "unknown"})
+        assert str(error.value) == "Unknown preset: unknown"
+
+    @pytest.mark.parametrize(
+        "key", ["latency-buffer-size", "ssh-server-alive-interval"]
+    )
+    @pytest.mark.parametrize("value", [0, -1, "2", 1.5, True])
+    def test_update_invalid_positive_int(self, profile, key, value):
+        """An error is raised for invalid sizes and intervals."""
+        with pytest.raises(ProfileError) as error:
+            profile.update({key: value})
+        assert str(error.value) == f"Invalid value for '{key}': {value}"
+
+    def test_update_unset_tuning(self, profile):
+        """Tuning options can be unset."""
+        profile.update({"latency-buffer-size": None, "method": None})
+        assert profile.latency_buffer_size is None
+        assert profile.method is None
+
+    def test_update_invalid_method(self, profile):
+        """An error is raised for unknown methods."""
+        with pytest.raises(ProfileError) as error:
+            profile.update({"method": "unknown"})
+        assert str(error.value) == "Invalid method: unknown"
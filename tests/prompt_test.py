@@ -0,0 +1,171 @@
+import os
+import pwd
+
+import pytest
+
+from sshoot import prompt
+
+
+@pytest.fixture
+def environ(monkeypatch, tmp_path):
+    """Environment with a separate temporary dir."""
+    for name in ("LOGNAME", "USER", "LNAME", "USERNAME", "TEMP", "TMP"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("USER", "user")
+    monkeypatch.setenv("TMPDIR", str(tmp_path))
+    yield monkeypatch
+
+
+@pytest.fixture
+def sessions_dir(environ, tmp_path):
+    path = tmp_path / "sshoot-user" / "sessions"
+    path.mkdir(parents=True)
+    yield path
+
+
+class TestRunningSessions:
+    def test_running(self, sessions_dir):
+        """Sessions with a running process are returned."""
+        (sessions_dir / "profile1.pid").write_text(str(os.getpid()))
+        (sessions_dir / "profile2.pid").write_text("1")
+        (sessions_dir / "profile2.log").write_text("output")
+        assert prompt.running_sessions(str(sessions_dir)) == {
+            "profile1": os.getpid(),
+            "profile2": 1,
+        }
+
+    def test_other_user(self, mocker, sessions_dir):
+        """Sessions for processes of other users are returned."""
+        mocker.patch("os.kill", side_effect=PermissionError)
+        (sessions_dir / "profile.pid").write_text("1")
+        assert prompt.running_sessions(str(sessions_dir)) == {"profile": 1}
+
+    def test_stale(self, mocker, sessions_dir):
+        """Sessions with no running process or invalid pidfiles are not
+        returned, and pidfiles are not removed."""
+        mocker.patch("os.kill", side_effect=ProcessLookupError)
+        (sessions_dir / "profile1.pid").write_text("123")
+        (sessions_dir / "profile2.pid").write_text("invalid")
+        assert prompt.running_sessions(str(sessions_dir)) == {}
+        assert (sessions_dir / "profile1.pid").exists()
+
+    def test_shards(self, sessions_dir):
+        """Sessions with multiple shards are running if all shards are."""
+        (sessions_dir / "profile.pid").write_text(str(os.getpid()))
+        (sessions_dir / "profile.pid.1").write_text("1")
+        (sessions_dir / "profile.shards").write_text("2")
+        assert prompt.running_sessions(str(sessions_dir)) == {
+            "profile": os.getpid()
+        }
+
+    def test_shard_not_running(self, sessions_dir):
+        """Sessions with a shard not running are not returned."""
+        (sessions_dir / "profile.pid").write_text(str(os.getpid()))
+        (sessions_dir / "profile.shards").write_text("2")
+        assert prompt.running_sessions(str(sessions_dir)) == {}
+
+    def test_shards_invalid(self, sessions_dir):
+        """If the number of shards is invalid, only the first is checked."""
+        (sessions_dir / "profile.pid").write_text(str(os.getpid()))
+        (sessions_dir / "profile.shards").write_text("invalid")
+        assert prompt.running_sessions(str(sessions_dir)) == {
+            "profile": os.getpid()
+        }
+
+    def test_no_dir(self, tmp_path):
+        """If the sessions directory doesn't exist, no session is running."""
+        assert prompt.running_sessions(str(tmp_path / "sessions")) == {}
+
+
+class TestFormatPrompt:
+    def test_format(self):
+        """Running profiles are sorted by name."""
+        assert prompt.format_prompt({"b": 1, "a": 2}) == "a,b"
+
+    def test_empty(self):
+        """The summary is empty if no profile is running."""
+        assert prompt.format_prompt({}) == ""
+
+
+class TestFastPrompt:
+    @pytest.mark.parametrize(
+        "args",
+        [
+            ["status", "--prompt"],
+            ["-C", "config", "status", "--prompt"],
+            ["--config", "config", "status", "--prompt"],
+            ["--config=config", "status", "--prompt"],
+        ],
+    )
+    def test_prompt(self, capsys, sessions_dir, args):
+        """Running profiles are printed out."""
+        (sessions_dir / "profile2.pid").write_text(str(os.getpid()))
+        (sessions_dir / "profile1.pid").write_text(str(os.getpid()))
+        assert prompt.fast_prompt(args)
+        assert capsys.readouterr().out == "profile1,profile2\n"
+
+    def test_not_running(self, capsys, environ):
+        """Nothing is printed if no profile is running."""
+        assert prompt.fast_prompt(["status", "--prompt"])
+        assert capsys.readouterr().out == ""
+
+    @pytest.mark.parametrize(
+        "args",
+        [
+            ["status"],
+            ["list", "--prompt"],
+            ["status", "--prompt", "other"],
+            ["--trace", "status", "--prompt"],
+            ["-C"],
+        ],
+    )
+    def test_other_command(self, capsys, sessions_dir, args):
+        """Other commands are not handled."""
+        assert not prompt.fast_prompt(args)
+        assert capsys.readouterr().out == ""
+
+    def test_no_sessions_dir(self, capsys, environ, tmp_path):
+        """If the sessions dir can't be found, the command is not handled."""
+        environ.setenv("TMPDIR", str(tmp_path / "other"))
+        assert not prompt.fast_prompt(["status", "--prompt"])
+
+
+class TestSessionsDir:
+    def test_tmpdir(self, environ, tmp_path):
+        """The sessions dir is in the temporary directory."""
+        assert prompt._sessions_dir() == str(
+            tmp_path / "sshoot-user" / "sessions"
+        )
+
+    def test_user(self, environ, tmp_path):
+        """The user name is taken from the first set variable."""
+        environ.setenv("LOGNAME", "other")
+        assert prompt._sessions_dir() == str(
+            tmp_path / "sshoot-other" / "sessions"
+        )
+
+    def test_default_tmpdir(self, environ, mocker):
+        """The default temporary directory is used if none is set."""
+        environ.delenv("TMPDIR")
+        mocker.patch("os.access", return_value=True)
+        assert prompt._sessions_dir() == "/tmp/sshoot-user/sessions"
+
+    def test_no_user(self, environ, tmp_path):
+        """If the user is not set in the environment, it's looked up."""
+        environ.delenv("USER")
+        user = pwd.getpwuid(os.getuid()).pw_name
+        assert prompt._sessions_dir() == str(
+            tmp_path / f"sshoot-{user}" / "sessions"
+        )
+
+    def test_tmpdir_not_found(self, environ, tmp_path):
+        """None is returned if the temporary directory doesn't exist."""
+        environ.setenv("TMPDIR", str(tmp_path / "other"))
+        assert prompt._sessions_dir() is None
+
+    def test_matches_rundir(self, environ, mocker):
+        """The sessions dir is in the runtime directory."""
+        from sshoot.runtime import get_rundir
+
+        mocker.patch("tempfile.tempdir", None)
+        assert prompt._sessions_dir() == str(get_rundir("sshoot") / "sessions")
@@ -0,0 +1,91 @@
+import errno
+from getpass import getuser
+import os
+from pathlib import Path
+from tempfile import gettempdir
+
+import pytest
+
+from sshoot.runtime import (
+    file_key,
+    get_rundir,
+    pidfd_open,
+    process_exists,
+    read_pid,
+)
+
+
+class TestGetRundir:
+    def test_rundir_path(self):
+        """get_rundir returns a user-specific tempdir path."""
+        rundir_path = Path(gettempdir()) / f"foo-{getuser()}"
+        assert get_rundir("foo") == rundir_path
+
+
+class TestFileKey:
+    def test_key(self, tmp_path):
+        """The key changes when the file changes."""
+        path = tmp_path / "file"
+        path.write_text("foo")
+        key = file_key(path)
+        assert key[0] == str(path)
+        assert file_key(path) == key
+        path.write_text("foobar")
+        assert file_key(path) != key
+
+    def test_not_found(self, tmp_path):
+        """If the file doesn't exist, the key is None."""
+        assert file_key(tmp_path / "file") is None
+
+
+class TestReadPid:
+    def test_read(self, tmp_path):
+        """The PID is read from the pidfile."""
+        pidfile = tmp_path / "file.pid"
+        pidfile.write_text("123\n")
+        assert read_pid(pidfile) == 123
+
+    def test_invalid(self, tmp_path):
+        """If the pidfile is not valid, None is returned."""
+        pidfile = tmp_path / "file.pid"
+        pidfile.write_text("foo")
+        assert read_pid(pidfile) is None
+        assert read_pid(tmp_path / "other.pid") is None
+
+
+class TestProcessExists:
+    def test_exists(self):
+        """True is returned for a running process."""
+        assert process_exists(os.getpid())
+
+    def test_other_user(self, mocker):
+        """True is returned for processes of other users."""
+        mocker.patch("os.kill", side_effect=PermissionError)
+        assert process_exists(1)
+
+    def test_not_exists(self, mocker):
+        """False is returned if the process doesn't exist."""
+        mocker.patch("os.kill", side_effect=ProcessLookupError)
+        assert not process_exists(123)
+
+
+class TestPidfdOpen:
+    def test_not_available(self, mocker):
+        """If pidfd_open is not available, None is returned."""
+        mocker.patch.object(os, "pidfd_open", None)
+        assert pidfd_open(os.getpid()) is None
+
+    def test_not_supported(self, mocker):
+        """If pidfds are not supported by the kernel, None is returned."""
+        mocker.patch.object(os, "pidfd_open", create=True).side_effect = (
+            OSError(errno.ENOSYS, "not implemented")
+        )
+        assert pidfd_open(os.getpid()) is None
+
+    def test_process_not_found(self, mocker):
+        """If the process doesn't exist, an error is raised."""
+        mocker.patch.object(os, "pidfd_open", create=True).side_effect = (
+            ProcessLookupError
+        )
+        with pytest.raises(ProcessLookupError):
+            pidfd_open(123)
@@ -0,0 +1,152 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Packages whose import time counts towards the startup budget
+OWN_PACKAGES = frozenset(
+    (
+        "argcomplete",
+        "prettytable",
+        "sshoot",
+        "toolrack",
+        "wcwidth",
+        "xdg",
+        "yaml",
+    )
+)
+
+# Modules only needed by specific actions, which must not be imported
+# otherwise
+HEAVY_MODULES = frozenset(
+    (
+        "argcomplete",
+        "concurrent.futures",
+        "csv",
+        "http.server",
+        "prettytable",
+        "sshoot.bench",
+        "sshoot.listing",
+        "sshoot.metrics",
+        "sshoot.multiplex",
+        "sshoot.subnets",
+        "sshoot.supervisor",
+        "yaml",
+    )
+)
+
+# Maximum time in milliseconds spent importing sshoot and its dependencies
+# for each command, and heavy modules that the command loads
+STARTUP_BUDGETS = {
+    "is-running": (25, set()),
+    "get-command": (25, set()),
+    "start": (25, set()),
+    "show": (80, {"prettytable", "sshoot.listing"}),
+    "list": (80, {"prettytable", "sshoot.listing"}),
+}
+
+COMMANDS = {
+    "is-running": ["is-running", "profile"],
+    "get-command": ["get-command", "profile"],
+    "start": ["start", "unknown"],
+    "show": ["show", "profile"],
+    "list": ["list"],
+}
+
+# Maximum time in milliseconds for importing modules needed for the prompt
+# status, and the only modules it can import besides those loaded at
+# interpreter startup
+PROMPT_BUDGET = 10
+PROMPT_MODULES = frozenset(("pwd", "sshoot", "sshoot.cli", "sshoot.prompt"))
+
+# Number of runs, to discard outliers from the timing
+RUNS = 3
+
+
+@pytest.fixture
+def environ(tmp_path):
+    """Environment for running commands with a separate temporary dir."""
+    config_dir = tmp_path / "config"
+    config_dir.mkdir()
+    (config_dir / "profiles.yaml").write_text(
+        "profile:\n  subnets: [10.0.0.0/24]\n  remote: example.com\n"
+    )
+    (tmp_path / "tmp").mkdir()
+    env = dict(
+        os.environ,
+        TMPDIR=str(tmp_path / "tmp"),
+        SSHOOT_CONFIG_DIR=str(config_dir),
+    )
+    # let the first run write bytecode, not to time compiling
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    yield env
+
+
+def run_command(args, env, entry_point="sshoot.main"):
+    """Run sshoot, returning import times in microseconds by module."""
+    code = (
+        "import os, sys\n"
+        "config_dir = os.environ['SSHOOT_CONFIG_DIR']\n"
+        "sys.argv[1:] = ['-C', config_dir, *sys.argv[1:]]\n"
+        f"from {entry_point} import sshoot\n"
+        "sshoot()\n"
+    )
+    return import_times(code, args, env)
+
+
+def import_times(code, args, env):
+    """Run Python code, returning import times in microseconds by module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, *args],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, _, module = line[len("import time:") :].split("|")
+        if self_time.strip().isdigit():
+            times[module.strip()] = int(self_time)
+    return times
+
+
+@pytest.mark.parametrize("command", list(STARTUP_BUDGETS))
+def test_startup_budget(environ, command):
+    """Commands only import what they need, within a time budget."""
+    budget, heavy_modules = STARTUP_BUDGETS[command]
+    # the first run creates the config snapshot, so that YAML parsing is
+    # not needed afterwards, and compiles bytecode
+    run_command(COMMANDS[command], environ)
+    durations = []
+    for _ in range(RUNS):
+        times = run_command(COMMANDS[command], environ)
+        assert "sshoot.main" in times
+        assert HEAVY_MODULES.intersection(times) == heavy_modules
+        durations.append(
+            sum(
+                duration
+                for module, duration in times.items()
+                if module.split(".")[0] in OWN_PACKAGES
+            )
+        )
+    assert min(durations) / 1000 < budget
+
+
+def test_prompt_budget(environ):
+    """The prompt status only imports what's strictly needed."""
+    startup_modules = set(import_times("pass", [], environ))
+    run_command(["status", "--prompt"], environ, entry_point="sshoot.cli")
+    durations = []
+    for _ in range(RUNS):
+        times = run_command(
+            ["status", "--prompt"], environ, entry_point="sshoot.cli"
+        )
+        assert "sshoot.prompt" in times
+        assert set(times) - startup_modules <= PROMPT_MODULES
+        durations.append(
+            sum(times.get(module, 0) for module in PROMPT_MODULES)
+        )
+    assert min(durations) / 1000 < PROMPT_BUDGET
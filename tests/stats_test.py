@@ -0,0 +1,213 @@
+import os
+import time
+
+import pytest
+
+from sshoot.stats import (
+    _boot_time,
+    _CLOCK_TICKS,
+    _descendants,
+    _parse_stat,
+    get_children_map,
+    get_sessions_stats,
+    ProcessStats,
+    read_process_stats,
+    SessionStats,
+)
+
+
+@pytest.fixture
+def proc_dir(tmp_path):
+    path = tmp_path / "proc"
+    path.mkdir()
+    (path / "self").mkdir()
+    (path / "stat").write_text("cpu  1 2 3\nbtime 1000\nprocesses 10\n")
+    yield path
+
+
+def fake_process(
+    proc_dir,
+    pid,
+    ppid=1,
+    command="sshuttle",
+    utime=100,
+    stime=50,
+    rss_kb=2048,
+    io=True,
+):
+    """Create /proc entries for a fake process."""
+    path = proc_dir / str(pid)
+    path.mkdir()
+    fields = ["S", str(ppid)] + ["0"] * 9 + [str(utime), str(stime)]
+    fields += ["0"] * 6 + [str(_CLOCK_TICKS * 20)] + ["0"] * 20
+    (path / "stat").write_text(f"{pid} ({command}) {' '.join(fields)}\n")
+    (path / "status").write_text(
+        f"Name:\t{command}\nPPid:\t{ppid}\nVmRSS:\t {rss_kb} kB\n"
+    )
+    if io:
+        (path / "io").write_text(
+            "rchar: 1000\nwchar: 2000\nread_bytes: 0\nwrite_bytes: 0\n"
+        )
+
+
+def process_stats(pid, command="sshuttle", io=True):
+    return ProcessStats(
+        pid=pid,
+        command=command,
+        start_time=1020.0,
+        cpu_time=150 / _CLOCK_TICKS,
+        rss=2048 * 1024,
+        read_bytes=1000 if io else None,
+        write_bytes=2000 if io else None,
+    )
+
+
+class TestSessionStats:
+    def test_totals(self):
+        """Totals are summed over session processes."""
+        stats = SessionStats(
+            pid=10,
+            processes=[
+                process_stats(10),
+                process_stats(11, command="ssh"),
+                process_stats(12, command="sudo", io=False),
+            ],
+        )
+        assert stats.start_time == 1020.0
+        assert stats.cpu_time == pytest.approx(450 / _CLOCK_TICKS)
+        assert stats.rss == 3 * 2048 * 1024
+        assert stats.read_bytes == 2000
+        assert stats.write_bytes == 4000
+
+    def test_totals_io_not_available(self):
+        """If I/O stats are not available for any process, they're None."""
+        stats = SessionStats(pid=10, processes=[process_stats(10, io=False)])
+        assert stats.read_bytes is None
+        assert stats.write_bytes is None
+
+
+class TestReadProcessStats:
+    def test_read(self, proc_dir):
+        """Stats for a process are read from /proc."""
+        fake_process(proc_dir, 10)
+        assert read_process_stats(10, proc_dir) == process_stats(10)
+
+    def test_command_with_parenthesis(self, proc_dir):
+        """The process command can include spaces and parenthesis."""
+        fake_process(proc_dir, 10, command="foo) (bar")
+        assert read_process_stats(10, proc_dir).command == "foo) (bar"
+
+    def test_no_io(self, proc_dir):
+        """I/O stats are None if not accessible."""
+        fake_process(proc_dir, 10, io=False)
+        assert read_process_stats(10, proc_dir) == process_stats(10, io=False)
+
+    def test_no_rss(self, proc_dir):
+        """Processes without memory (e.g. zombies) have no RSS."""
+        fake_process(proc_dir, 10)
+        (proc_dir / "10" / "status").write_text("Name:\tsshuttle\n")
+        assert read_process_stats(10, proc_dir).rss == 0
+
+    def test_not_found(self, proc_dir):
+        """If the process is not found, None is returned."""
+        assert read_process_stats(10, proc_dir) is None
+
+    def test_no_boot_time(self, tmp_path):
+        """If the boot time is not found, start time is relative to boot."""
+        fake_process(tmp_path, 10)
+        assert read_process_stats(10, tmp_path).start_time == 20.0
+        (tmp_path / "stat").write_text("cpu  1 2 3\n")
+        _boot_time.cache_clear()
+        assert read_process_stats(10, tmp_path).start_time == 20.0
+
+    def test_current_process(self):
+        """Stats for a real process are read."""
+        stats = read_process_stats(os.getpid())
+        assert stats.pid == os.getpid()
+        assert 0 < time.time() - stats.start_time < 3600
+        assert stats.cpu_time > 0
+        assert stats.rss > 0
+        assert stats.read_bytes > 0
+
+
+class TestGetChildrenMap:
+    def test_children(self, proc_dir):
+        """A map of processes children is returned."""
+        fake_process(proc_dir, 10)
+        fake_process(proc_dir, 11, ppid=10)
+        fake_process(proc_dir, 12, ppid=10)
+        assert get_children_map(proc_dir) == {1: [10], 10: [11, 12]}
+
+    def test_process_exited(self, proc_dir):
+        """Processes that exit during the scan are skipped."""
+        fake_process(proc_dir, 10)
+        (proc_dir / "11").mkdir()
+        assert get_children_map(proc_dir) == {1: [10]}
+
+    def test_no_proc(self, tmp_path):
+        """If /proc is not available, an empty map is returned."""
+        assert get_children_map(tmp_path / "proc") == {}
+
+
+class TestGetSessionsStats:
+    def test_stats(self, proc_dir):
+        """Stats for sessions include child processes."""
+        fake_process(proc_dir, 10)
+        fake_process(proc_dir, 11, ppid=10, command="ssh")
+        fake_process(proc_dir, 12, ppid=11, command="ssh-child")
+        fake_process(proc_dir, 20)
+        stats = get_sessions_stats({"session1": 10, "session2": 20}, proc_dir)
+        assert stats == {
+            "session1": SessionStats(
+                pid=10,
+                processes=[
+                    process_stats(10),
+                    process_stats(11, command="ssh"),
+                    process_stats(12, command="ssh-child"),
+                ],
+            ),
+            "session2": SessionStats(pid=20, processes=[process_stats(20)]),
+        }
+
+    def test_shards(self, proc_dir):
+        """Stats include processes for other shards of sessions."""
+        fake_process(proc_dir, 10)
+        fake_process(proc_dir, 11, ppid=10, command="ssh")
+        fake_process(proc_dir, 20)
+        fake_process(proc_dir, 21, ppid=20, command="ssh")
+        stats = get_sessions_stats(
+            {"session": 10}, proc_dir, shard_pids={"session": [20, 30]}
+        )
+        assert stats == {
+            "session": SessionStats(
+                pid=10,
+                processes=[
+                    process_stats(10),
+                    process_stats(11, command="ssh"),
+                    process_stats(20),
+                    process_stats(21, command="ssh"),
+                ],
+            ),
+        }
+
+    def test_process_not_found(self, proc_dir):
+        """Sessions whose process is not found are skipped."""
+        assert get_sessions_stats({"session": 10}, proc_dir) == {}
+
+
+class TestDescendants:
+    def test_descendants(self):
+        """A PID is returned with its descendants, breadth-first."""
+        children = {1: [3, 2], 2: [5], 3: [4]}
+        assert _descendants(1, children) == [1, 2, 3, 5, 4]
+
+
+class TestParseStat:
+    def test_parse(self):
+        """The command and fields after it are returned."""
+        assert _parse_stat("10 (cmd) S 1 2\n") == ("cmd", ["S", "1", "2"])
+
+    def test_invalid(self):
+        """An error is raised if the content is invalid."""
+        with pytest.raises(ValueError):
+            _parse_stat("invalid")
@@ -0,0 +1,412 @@
+from ipaddress import (
+    ip_address,
+    ip_network,
+)
+
+import pytest
+
+from sshoot.profile import Profile
+from sshoot.subnets import (
+    Conflict,
+    find_conflicts,
+    normalize_subnets,
+    overlapping_groups,
+    parse_address,
+    parse_subnet,
+    route_ranges,
+    SubnetIndex,
+)
+
+
+@pytest.mark.parametrize(
+    "value,network",
+    [
+        ("10.0.0.0/8", "10.0.0.0/8"),
+        ("10.1.2.3/8", "10.0.0.0/8"),
+        ("10.1.2.3", "10.1.2.3/32"),
+        ("0/0", "0.0.0.0/0"),
+        ("10.0.0.0/8:8000-9000", "10.0.0.0/8"),
+        ("fe80::/10", "fe80::/10"),
+        ("::1", "::1/128"),
+        ("[fe80::1]/64:8000", "fe80::/64"),
+        ("[fe80::1]:8000", "fe80::1/128"),
+    ],
+)
+def test_parse_subnet(value, network):
+    """Subnets in sshuttle format are parsed as networks."""
+    assert parse_subnet(value) == ip_network(network)
+
+
+@pytest.mark.parametrize("value", ["example.com", "10.0.0.0/33", ""])
+def test_parse_subnet_invalid(value):
+    """Hostnames and invalid subnets are not parsed."""
+    assert parse_subnet(value) is None
+
+
+def test_parse_address():
+    """IP addresses are parsed."""
+    assert parse_address("10.1.2.3") == ip_address("10.1.2.3")
+    assert parse_address("::1") == ip_address("::1")
+    assert parse_address("example.com") is None
+
+
+@pytest.fixture
+def index():
+    yield SubnetIndex()
+
+
+def lookup(index, address):
+    """Return matches for an address, with networks as strings."""
+    return [
+        (name, str(network))
+        for name, network in index.lookup(ip_address(address))
+    ]
+
+
+class TestSubnetIndex:
+    def test_lookup(self, index):
+        """Profiles with a subnet including the address are returned."""
+        index.add_subnets("profile", ["10.0.0.0/8", "192.168.1.0/24"])
+        assert lookup(index, "10.1.2.3") == [("profile", "10.0.0.0/8")]
+        assert lookup(index, "192.168.1.1") == [("profile", "192.168.1.0/24")]
+        assert lookup(index, "192.168.2.1") == []
+        assert lookup(index, "::1") == []
+
+    def test_lookup_empty(self, index):
+        """No profile is returned by an empty index."""
+        assert lookup(index, "10.1.2.3") == []
+
+    def test_lookup_most_specific_first(self, index):
+        """Profiles are sorted by most specific subnet, then name."""
+        index.add_subnets("b", ["10.0.0.0/8"])
+        index.add_subnets("c", ["10.1.0.0/16"])
+        index.add_subnets("a", ["10.0.0.0/8"])
+        assert lookup(index, "10.1.2.3") == [
+            ("c", "10.1.0.0/16"),
+            ("a", "10.0.0.0/8"),
+            ("b", "10.0.0.0/8"),
+        ]
+
+    def test_lookup_most_specific_for_profile(self, index):
+        """The most specific subnet for each profile is returned."""
+        index.add_subnets("profile", ["10.1.2.0/24", "0/0", "10.0.0.0/8"])
+        assert lookup(index, "10.1.2.3") == [("profile", "10.1.2.0/24")]
+        assert lookup(index, "10.1.3.1") == [("profile", "10.0.0.0/8")]
+        assert lookup(index, "192.168.1.1") == [("profile", "0.0.0.0/0")]
+
+    def test_lookup_exclude(self, index):
+        """Excluded subnets are not routed through a profile."""
+        index.add_subnets("profile", ["10.0.0.0/8"])
+        index.add_subnets("profile", ["10.1.0.0/16"], exclude=True)
+        assert lookup(index, "10.1.2.3") == []
+        assert lookup(index, "10.2.0.1") == [("profile", "10.0.0.0/8")]
+
+    def test_lookup_exclude_other_profile(self, index):
+        """Excluded subnets only apply to their profile."""
+        index.add_subnets("profile1", ["10.0.0.0/8"])
+        index.add_subnets("profile2", ["10.0.0.0/8"])
+        index.add_subnets("profile1", ["10.1.0.0/16"], exclude=True)
+        assert lookup(index, "10.1.2.3") == [("profile2", "10.0.0.0/8")]
+
+    def test_lookup_include_in_exclude(self, index):
+        """More specific subnets in excluded ones are routed."""
+        index.add_subnets("profile", ["10.1.2.0/24"])
+        index.add_subnets("profile", ["10.0.0.0/8"], exclude=True)
+        assert lookup(index, "10.1.2.3") == [("profile", "10.1.2.0/24")]
+        assert lookup(index, "10.1.3.1") == []
+
+    @pytest.mark.parametrize("exclude_first", [True, False])
+    def test_lookup_exclude_same_subnet(self, index, exclude_first):
+        """Excluded subnets take precedence over the same included ones."""
+        subnets = [(["10.0.0.0/8"], False), (["10.0.0.0/8"], True)]
+        if exclude_first:
+            subnets.reverse()
+        for subnet, exclude in subnets:
+            index.add_subnets("profile", subnet, exclude=exclude)
+        assert lookup(index, "10.1.2.3") == []
+
+    def test_lookup_split(self, index):
+        """Subnets sharing a prefix are found after splitting nodes."""
+        index.add_subnets("a", ["10.1.2.0/24"])
+        index.add_subnets("b", ["10.1.3.0/24"])
+        index.add_subnets("c", ["10.1.0.0/16"])
+        index.add_subnets("d", ["10.1.2.128/25"])
+        assert lookup(index, "10.1.2.200") == [
+            ("d", "10.1.2.128/25"),
+            ("a", "10.1.2.0/24"),
+            ("c", "10.1.0.0/16"),
+        ]
+        assert lookup(index, "10.1.3.1") == [
+            ("b", "10.1.3.0/24"),
+            ("c", "10.1.0.0/16"),
+        ]
+        assert lookup(index, "10.1.4.1") == [("c", "10.1.0.0/16")]
+        assert lookup(index, "10.2.0.1") == []
+
+    def test_lookup_host(self, index):
+        """Single hosts can be looked up."""
+        index.add_subnets("profile", ["10.1.2.3", "10.1.2.4"])
+        assert lookup(index, "10.1.2.3") == [("profile", "10.1.2.3/32")]
+        assert lookup(index, "10.1.2.5") == []
+
+    def test_lookup_ipv6(self, index):
+        """IPv6 subnets can be looked up."""
+        index.add_subnets("profile", ["fe80::/10", "::1", "10.0.0.0/8"])
+        assert lookup(index, "fe80::1") == [("profile", "fe80::/10")]
+        assert lookup(index, "::1") == [("profile", "::1/128")]
+        assert lookup(index, "::2") == []
+
+    def test_add_subnets_skip_hostnames(self, index):
+        """Subnets which are not networks are skipped."""
+        index.add_subnets("profile", ["example.com", "10.0.0.0/8"])
+        assert lookup(index, "10.1.2.3") == [("profile", "10.0.0.0/8")]
+
+    def test_from_profiles(self):
+        """An index can be built from profiles."""
+        index = SubnetIndex.from_profiles(
+            {
+                "profile1": Profile(
+                    subnets=["10.0.0.0/8"], exclude_subnets=["10.1.0.0/16"]
+                ),
+                "profile2": Profile(subnets=["10.0.0.0/8"]),
+            }
+        )
+        assert lookup(index, "10.1.2.3") == [("profile2", "10.0.0.0/8")]
+        assert lookup(index, "10.2.0.1") == [
+            ("profile1", "10.0.0.0/8"),
+            ("profile2", "10.0.0.0/8"),
+        ]
+
+
+def ranges(*networks):
+    """Return address ranges for networks."""
+    return [
+        (
+            network.version,
+            int(network.network_address),
+            int(network.broadcast_address),
+        )
+        for network in map(ip_network, networks)
+    ]
+
+
+class TestRouteRanges:
+    def test_ranges(self):
+        """Ranges for subnets are sorted."""
+        profile = Profile(
+            subnets=["192.168.1.0/24", "fe80::/10", "10.0.0.0/8"]
+        )
+        assert route_ranges(profile) == ranges(
+            "10.0.0.0/8", "192.168.1.0/24", "fe80::/10"
+        )
+
+    def test_merge(self):
+        """Adjacent and nested subnets are merged."""
+        profile = Profile(
+            subnets=["10.0.1.0/24", "10.0.0.0/24", "10.0.0.128/25"]
+        )
+        assert route_ranges(profile) == ranges("10.0.0.0/23")
+
+    def test_exclude(self):
+        """Excluded subnets are not included in ranges."""
+        profile = Profile(
+            subnets=["10.0.0.0/24"], exclude_subnets=["10.0.0.64/26"]
+        )
+        assert route_ranges(profile) == ranges("10.0.0.0/26", "10.0.0.128/25")
+
+    def test_exclude_nested(self):
+        """More specific subnets in excluded ones are included."""
+        profile = Profile(
+            subnets=["10.0.0.0/8", "10.1.2.0/24"],
+            exclude_subnets=["10.1.0.0/16"],
+        )
+        assert route_ranges(profile) == [
+            (4, int(ip_address("10.0.0.0")), int(ip_address("10.0.255.255"))),
+            (4, int(ip_address("10.1.2.0")), int(ip_address("10.1.2.255"))),
+            (
+                4,
+                int(ip_address("10.2.0.0")),
+                int(ip_address("10.255.255.255")),
+            ),
+        ]
+
+    def test_exclude_same(self):
+        """Excluded subnets take precedence over the same included ones."""
+        profile = Profile(
+            subnets=["10.0.0.0/8"], exclude_subnets=["10.0.0.0/8"]
+        )
+        assert route_ranges(profile) == []
+
+    def test_exclude_only(self):
+        """Excluded subnets not in included ones have no effect."""
+        profile = Profile(
+            subnets=["10.0.0.0/24"], exclude_subnets=["192.168.0.0/16"]
+        )
+        assert route_ranges(profile) == ranges("10.0.0.0/24")
+
+    def test_skip_hostnames(self):
+        """Subnets which are not networks are skipped."""
+        profile = Profile(subnets=["example.com", "10.0.0.0/24"])
+        assert route_ranges(profile) == ranges("10.0.0.0/24")
+
+
+class TestFindConflicts:
+    def test_no_conflicts(self):
+        """Profiles with disjoint subnets don't conflict."""
+        profiles = {
+            "profile1": Profile(subnets=["10.0.0.0/24"]),
+            "profile2": Profile(subnets=["10.0.1.0/24", "fe80::/10"]),
+        }
+        assert find_conflicts(profiles) == []
+
+    def test_conflicts(self):
+        """Overlapping subnets between pairs of profiles are returned."""
+        profiles = {
+            "c": Profile(subnets=["10.0.0.0/8", "fe80::/10"]),
+            "b": Profile(subnets=["10.1.0.0/16", "fe80::/64"]),
+            "a": Profile(subnets=["10.1.2.0/24", "192.168.0.0/16"]),
+        }
+        assert find_conflicts(profiles) == [
+            Conflict(("a", "b"), (ip_network("10.1.2.0/24"),)),
+            Conflict(("a", "c"), (ip_network("10.1.2.0/24"),)),
+            Conflict(
+                ("b", "c"),
+                (ip_network("10.1.0.0/16"), ip_network("fe80::/64")),
+            ),
+        ]
+
+    def test_conflicts_merged(self):
+        """Overlapping ranges are reported as the fewest networks."""
+        profiles = {
+            "profile1": Profile(subnets=["10.0.0.0/24", "10.0.1.0/24"]),
+            "profile2": Profile(subnets=["10.0.0.0/16"]),
+        }
+        assert find_conflicts(profiles) == [
+            Conflict(("profile1", "profile2"), (ip_network("10.0.0.0/23"),))
+        ]
+
+    def test_conflicts_excluded(self):
+        """Excluded subnets don't conflict."""
+        profiles = {
+            "profile1": Profile(
+                subnets=["10.0.0.0/8"], exclude_subnets=["10.1.0.0/16"]
+            ),
+            "profile2": Profile(subnets=["10.1.0.0/16"]),
+            "profile3": Profile(subnets=["10.1.2.0/24", "10.2.0.0/24"]),
+        }
+        assert find_conflicts(profiles) == [
+            Conflict(("profile1", "profile3"), (ip_network("10.2.0.0/24"),)),
+            Conflict(("profile2", "profile3"), (ip_network("10.1.2.0/24"),)),
+        ]
+
+
+class TestNormalizeSubnets:
+    def test_collapse(self):
+        """Adjacent and contained subnets are collapsed."""
+        assert normalize_subnets(
+            ["10.0.1.0/24", "10.0.0.0/25", "10.0.0.128/25", "10.0.0.5"], []
+        ) == (["10.0.0.0/23"], [])
+
+    def test_exclude_outside(self):
+        """Excluded subnets outside routed ones are dropped."""
+        assert normalize_subnets(
+            ["10.0.0.0/25", "10.0.0.128/25"],
+            ["192.168.0.0/16", "10.0.0.0/30"],
+        ) == (["10.0.0.0/24"], ["10.0.0.0/30"])
+
+    def test_exclude_collapse(self):
+        """Adjacent excluded subnets are collapsed."""
+        assert normalize_subnets(
+            ["10.0.0.0/8"], ["10.1.0.0/17", "10.1.128.0/17"]
+        ) == (["10.0.0.0/8"], ["10.1.0.0/16"])
+
+    def test_include_in_exclude(self):
+        """Routes for subnets in excluded ones are preserved."""
+        assert normalize_subnets(
+            ["10.0.0.0/8", "10.1.128.0/17", "10.2.0.0/16"], ["10.1.0.0/16"]
+        ) == (["10.0.0.0/8"], ["10.1.0.0/17"])
+
+    def test_no_reduction(self):
+        """Subnets are unchanged if normalizing doesn't reduce rules."""
+        subnets = ["10.0.0.0/8", "10.1.2.0/24"]
+        exclude_subnets = ["10.1.0.0/16"]
+        assert normalize_subnets(subnets, exclude_subnets) == (
+            subnets,
+            exclude_subnets,
+        )
+
+    def test_ipv6(self):
+        """IPv6 subnets are normalized, after IPv4 ones."""
+        assert normalize_subnets(
+            ["fe80::/65", "fe80::8000:0:0:0/65", "10.0.0.0/8", "10.0.0.0/16"],
+            [],
+        ) == (["10.0.0.0/8", "fe80::/64"], [])
+
+    @pytest.mark.parametrize(
+        "subnet", ["example.com", "10.0.0.0/8:8000", "[fe80::1]/64:8000"]
+    )
+    def test_not_networks(self, subnet):
+        """Subnets are unchanged if some are not plain networks."""
+        subnets = ["10.0.0.0/25", "10.0.0.128/25"]
+        assert normalize_subnets(subnets, [subnet]) == (subnets, [subnet])
+        assert normalize_subnets([subnet, *subnets], []) == (
+            [subnet, *subnets],
+            [],
+        )
+
+    @pytest.mark.parametrize(
+        "subnets,exclude_subnets",
+        [
+            (["10.0.0.0/16", "10.0.0.0/24"], ["10.0.0.0/24", "10.0.0.0/16"]),
+            (["10.0.0.0/8", "10.1.0.0/16"], ["10.1.0.0/16", "10.1.0.0/24"]),
+            (
+                ["0/0", "10.1.0.0/24", "10.1.1.0/24", "10.1.1.128/25"],
+                ["10.0.0.0/8", "10.1.1.0/24", "192.168.1.0/24"],
+            ),
+            (["10.0.0.0/24", "10.0.1.0/24"], ["10.0.0.0/23"]),
+        ],
+    )
+    def test_same_routes(self, subnets, exclude_subnets):
+        """Normalized subnets route the same addresses."""
+        normalized = normalize_subnets(subnets, exclude_subnets)
+        assert route_ranges(
+            Profile(subnets=normalized[0], exclude_subnets=normalized[1])
+        ) == route_ranges(
+            Profile(subnets=subnets, exclude_subnets=exclude_subnets)
+        )
+
+
+class TestOverlappingGroups:
+    def test_disjoint(self):
+        """Disjoint subnets are in separate groups."""
+        assert overlapping_groups(["10.0.0.0/24", "10.0.1.0/24"]) == [
+            ["10.0.0.0/24"],
+            ["10.0.1.0/24"],
+        ]
+
+    def test_contained(self):
+        """Subnets are grouped with the ones containing them, in order."""
+        assert overlapping_groups(
+            ["10.1.0.0/16", "192.168.0.0/16", "10.0.0.0/8", "10.2.0.0/16"]
+        ) == [["10.1.0.0/16", "10.0.0.0/8", "10.2.0.0/16"], ["192.168.0.0/16"]]
+
+    def test_ip_versions(self):
+        """Networks of different IP versions don't overlap."""
+        assert overlapping_groups(["0.0.0.0/0", "::/0", "10.0.0.0/8"]) == [
+            ["0.0.0.0/0", "10.0.0.0/8"],
+            ["::/0"],
+        ]
+
+    def test_ports(self):
+        """Subnets with ports are grouped by their addresses."""
+        assert overlapping_groups(["10.0.0.0/8:80", "10.1.0.0/16"]) == [
+            ["10.0.0.0/8:80", "10.1.0.0/16"]
+        ]
+
+    def test_hostnames(self):
+        """Subnets that are not networks are in separate groups."""
+        assert overlapping_groups(["host", "host", "10.0.0.0/8"]) == [
+            ["host"],
+            ["host"],
+            ["10.0.0.0/8"],
+        ]
@@ -0,0 +1,521 @@
+import json
+import os
+import subprocess
+import threading
+import time
+
+import pytest
+
+from sshoot.control import (
+    control_request,
+    CONTROL_SOCKET,
+    ControlServer,
+    ControlUnavailable,
+)
+from sshoot.manager import ManagerProfileError
+from sshoot.supervisor import (
+    Backoff,
+    read_state,
+    RESTARTING,
+    RUNNING,
+    STARTING,
+    STATE_FILE,
+    STOPPED,
+    Supervisor,
+    SupervisorError,
+    THROTTLED,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeManager:
+    """A manager starting sleep processes as sessions."""
+
+    def __init__(self, rundir):
+        self.rundir = rundir
+        self.sessions_path = rundir / "sessions"
+        self.sessions_path.mkdir()
+        self.processes = {}
+        self.stopped = set()
+        self.start_errors = {}
+        self.started = []
+        self.shard_pids = {}
+
+    def start_profile(self, name):
+        self.started.append(name)
+        error = self.start_errors.get(name)
+        if error:
+            raise error
+        self.stopped.discard(name)
+        self.processes[name] = process = subprocess.Popen(["sleep", "10"])
+        (self.sessions_path / f"{name}.pid").write_text(str(process.pid))
+
+    def get_pid(self, name):
+        process = self.processes.get(name)
+        if process is None or process.poll() is not None:
+            return None
+        return process.pid
+
+    def get_pids(self, name):
+        pid = self.get_pid(name)
+        return [] if pid is None else [pid, *self.shard_pids.get(name, ())]
+
+    def was_stopped(self, name):
+        return name in self.stopped
+
+    def kill(self, name, stop=False):
+        if stop:
+            self.stopped.add(name)
+        process = self.processes.pop(name)
+        process.kill()
+        process.wait()
+        (self.sessions_path / f"{name}.pid").unlink()
+
+    def cleanup(self):
+        for process in self.processes.values():
+            process.kill()
+            process.wait()
+
+
+def wait_started(supervisor, timeout=5.0):
+    """Run the supervisor loop until no session is starting."""
+    deadline = time.monotonic() + timeout
+    while any(
+        session.state == STARTING for session in supervisor.sessions.values()
+    ):
+        assert time.monotonic() < deadline
+        supervisor.step(0.1)
+
+
+@pytest.fixture
+def clock():
+    yield FakeClock()
+
+
+@pytest.fixture
+def manager(run_dir):
+    manager = FakeManager(run_dir)
+    yield manager
+    manager.cleanup()
+
+
+@pytest.fixture
+def backoff(mocker):
+    backoff = Backoff(initial=1.0, factor=2.0, maximum=10.0, jitter=0.5)
+    mocker.patch("random.uniform", lambda low, high: high)
+    yield backoff
+
+
+@pytest.fixture
+def supervisor(manager, clock, backoff):
+    supervisor = Supervisor(
+        manager,
+        ["profile"],
+        backoff=backoff,
+        max_restarts=3,
+        restart_window=60.0,
+        stable_time=30.0,
+        clock=clock,
+    )
+    yield supervisor
+    supervisor.close()
+
+
+@pytest.fixture
+def process():
+    """A process that runs until killed."""
+    process = subprocess.Popen(["sleep", "60"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def no_pidfd(mocker):
+    mocker.patch("sshoot.supervisor.pidfd_open", return_value=None)
+
+
+class TestBackoff:
+    def test_delay(self, backoff):
+        """The delay grows exponentially up to the maximum."""
+        assert [backoff.delay(attempt) for attempt in range(5)] == [
+            1.0,
+            2.0,
+            4.0,
+            8.0,
+            10.0,
+        ]
+
+    def test_jitter(self, mocker):
+        """The delay is randomized in the jitter range."""
+        uniform = mocker.patch("random.uniform", return_value=0.8)
+        assert Backoff(initial=2.0, jitter=0.3).delay(0) == 1.6
+        uniform.assert_called_once_with(0.7, 1)
+
+
+class TestSupervisor:
+    def test_start(self, manager, supervisor):
+        """Sessions that are not running are started."""
+        supervisor.start()
+        wait_started(supervisor)
+        session = supervisor.sessions["profile"]
+        assert session.state == RUNNING
+        assert session.pid == manager.get_pid("profile")
+
+    def test_start_already_running(self, manager, supervisor):
+        """Running sessions are watched without being started."""
+        manager.start_profile("profile")
+        supervisor.start()
+        wait_started(supervisor)
+        assert manager.started == ["profile"]
+        assert supervisor.sessions["profile"].state == RUNNING
+
+    def test_start_writes_state(self, supervisor, run_dir):
+        """The state is written to file."""
+        supervisor.start()
+        wait_started(supervisor)
+        state = json.loads((run_dir / STATE_FILE).read_text())
+        assert state["pid"] == os.getpid()
+        assert state["sessions"]["profile"]["state"] == RUNNING
+
+    def test_restart_on_exit(self, manager, clock, supervisor):
+        """Sessions exiting unexpectedly are restarted after a delay."""
+        supervisor.start()
+        wait_started(supervisor)
+        manager.kill("profile")
+        supervisor.step(1.0)
+        session = supervisor.sessions["profile"]
+        assert session.state == RESTARTING
+        assert session.retry_at == clock.now + 1.0
+        clock.now += 1.0
+        supervisor.step(0)
+        wait_started(supervisor)
+        assert session.state == RUNNING
+        assert session.restarts == 1
+        assert manager.started == ["profile", "profile"]
+
+    def test_no_restart_if_stopped(self, manager, supervisor):
+        """Sessions that are explicitly stopped are not restarted."""
+        supervisor.start()
+        wait_started(supervisor)
+        manager.kill("profile", stop=True)
+        supervisor.step(1.0)
+        session = supervisor.sessions["profile"]
+        assert session.state == STOPPED
+        assert session.retry_at is None
+
+    def test_start_in_background(self, mocker, manager, supervisor):
+        """Sessions are started without blocking the loop."""
+        started = threading.Event()
+        start_profile = manager.start_profile
+
+        def wait_and_start(name):
+            started.wait(5.0)
+            start_profile(name)
+
+        mocker.patch.object(manager, "start_profile", wait_and_start)
+        supervisor.start()
+        supervisor.step(0)
+        session = supervisor.sessions["profile"]
+        assert session.state == STARTING
+        started.set()
+        wait_started(supervisor)
+        assert session.state == RUNNING
+
+    def test_start_error(self, manager, supervisor):
+        """Unexpected errors starting sessions are raised in the loop."""
+        manager.start_errors["profile"] = OSError("failed")
+        supervisor.start()
+        with pytest.raises(OSError):
+            wait_started(supervisor)
+
+    def test_stopped_started_again(self, manager, supervisor):
+        """Stopped sessions are watched again if started by others."""
+        supervisor.start()
+        wait_started(supervisor)
+        manager.kill("profile", stop=True)
+        supervisor.step(1.0)
+        session = supervisor.sessions["profile"]
+        assert session.state == STOPPED
+        assert supervisor._next_timeout() == 1.0
+        manager.start_profile("profile")
+        supervisor.step(0)
+        assert session.state == RUNNING
+        assert session.pid == manager.get_pid("profile")
+        assert session.restarts == 0
+
+    def test_stopped_sessions_unchanged(self, mocker, manager, supervisor):
+        """Stopped sessions are not checked if the sessions directory
+        doesn't change."""
+        supervisor.start()
+        wait_started(supervisor)
+        manager.kill("profile", stop=True)
+        supervisor.step(1.0)
+        mocker.patch("time.time", return_value=time.time() + 10)
+        supervisor.step(0)
+        get_pid = mocker.spy(manager, "get_pid")
+        supervisor.step(0)
+        get_pid.assert_not_called()
+
+    @pytest.mark.parametrize("pidfd", [True, False])
+    def test_restart_on_shard_exit(
+        self, mocker, manager, clock, supervisor, process, pidfd
+    ):
+        """Sessions are restarted if any of their shards exits."""
+        if not pidfd:
+            mocker.patch("sshoot.supervisor.pidfd_open", return_value=None)
+        manager.shard_pids["profile"] = [process.pid]
+        supervisor.start()
+        wait_started(supervisor)
+        session = supervisor.sessions["profile"]
+        assert session.state == RUNNING
+        process.kill()
+        process.wait()
+        supervisor.step(1.0)
+        assert session.state == RESTARTING
+
+    def test_shard_exits_before_watch(self, manager, supervisor, process):
+        """If a shard exits before being watched, the session is
+        restarted."""
+        process.kill()
+        process.wait()
+        manager.shard_pids["profile"] = [process.pid]
+        supervisor.start()
+        wait_started(supervisor)
+        assert supervisor.sessions["profile"].state == RESTARTING
+        assert supervisor._pidfds == {}
+
+    def test_restart_polling(self, no_pidfd, manager, clock, supervisor):
+        """Sessions are polled if pidfds are not supported."""
+        supervisor.start()
+        wait_started(supervisor)
+        assert supervisor._next_timeout() == 1.0
+        manager.kill("profile")
+        supervisor.step(0)
+        wait_started(supervisor)
+        assert supervisor.sessions["profile"].state == RESTARTING
+        clock.now += 1.0
+        supervisor.step(0)
+        wait_started(supervisor)
+        assert supervisor.sessions["profile"].state == RUNNING
+
+    def test_start_failure_backoff(self, manager, clock, supervisor):
+        """Failed starts are retried with increasing delays."""
+        manager.start_errors["profile"] = ManagerProfileError("failed")
+        supervisor.start()
+        wait_started(supervisor)
+        session = supervisor.sessions["profile"]
+        assert session.state == RESTARTING
+        assert session.error == "failed"
+        assert session.retry_at == clock.now + 2.0
+        clock.now += 2.0
+        supervisor.step(0)
+        wait_started(supervisor)
+        assert session.failures == 2
+        assert session.retry_at == clock.now + 4.0
+
+    def test_start_failure_running(self, manager, supervisor):
+        """If start fails because the session is running, it's watched."""
+        manager.start_profile("profile")
+        manager.start_errors["profile"] = ManagerProfileError("running")
+        supervisor.sessions["profile"].state = RESTARTING
+        supervisor._start_session(supervisor.sessions["profile"])
+        wait_started(supervisor)
+        assert supervisor.sessions["profile"].state == RUNNING
+
+    def test_start_no_pidfile(self, mocker, manager, clock, supervisor):
+        """If the pidfile is not written after start, it's a failure."""
+        mocker.patch.object(supervisor, "_wait_for_pids", return_value=[])
+        supervisor.start()
+        wait_started(supervisor)
+        session = supervisor.sessions["profile"]
+        assert session.state == RESTARTING
+        assert session.error == "Session pidfile not found"
+
+    def test_process_exits_before_watch(self, mocker, manager, supervisor):
+        """If the process exits before being watched, it's restarted."""
+        mocker.patch(
+            "sshoot.supervisor.pidfd_open", side_effect=ProcessLookupError
+        )
+        supervisor.start()
+        wait_started(supervisor)
+        assert supervisor.sessions["profile"].state == RESTARTING
+
+    def test_failures_reset_when_stable(self, manager, clock, supervisor):
+        """Failures are reset if the session ran long enough."""
+        supervisor.start()
+        wait_started(supervisor)
+        session = supervisor.sessions["profile"]
+        session.failures = 3
+        clock.now += 30.0
+        manager.kill("profile")
+        supervisor.step(1.0)
+        assert session.failures == 0
+        assert session.retry_at == clock.now + 1.0
+
+    def test_throttle(self, manager, clock, supervisor):
+        """Restarts are limited in the restart window."""
+        supervisor.start()
+        wait_started(supervisor)
+        session = supervisor.sessions["profile"]
+        for _ in range(3):
+            manager.kill("profile")
+            supervisor.step(1.0)
+            clock.now += 1.0
+            supervisor.step(0)
+            wait_started(supervisor)
+            assert session.state == RUNNING
+        first_restart = session.restart_times[0]
+        manager.kill("profile")
+        supervisor.step(1.0)
+        assert session.state == THROTTLED
+        assert session.retry_at == first_restart + 60.0
+        clock.now = session.retry_at
+        supervisor.step(0)
+        wait_started(supervisor)
+        assert session.state == RUNNING
+        assert session.restarts == 4
+
+    def test_throttle_window_moved(self, manager, clock, supervisor):
+        """A scheduled restart is throttled if the limit is reached."""
+        supervisor.start()
+        wait_started(supervisor)
+        session = supervisor.sessions["profile"]
+        manager.kill("profile")
+        supervisor.step(1.0)
+        session.restart_times.extend([clock.now] * 3)
+        clock.now += 1.0
+        supervisor.step(0)
+        wait_started(supervisor)
+        assert session.state == THROTTLED
+
+    def test_next_timeout(self, manager, clock, supervisor):
+        """The next timeout is the time to the nearest restart."""
+        supervisor.start()
+        wait_started(supervisor)
+        assert supervisor._next_timeout() is None
+        manager.kill("profile")
+        supervisor.step(1.0)
+        clock.now += 0.5
+        assert supervisor._next_timeout() == 0.5
+        clock.now += 1.0
+        assert supervisor._next_timeout() == 0.0
+
+    def test_get_state(self, mocker, manager, clock, supervisor):
+        """The state includes the wall clock time of the next restart."""
+        mocker.patch("time.time", return_value=5000.0)
+        supervisor.start()
+        wait_started(supervisor)
+        manager.kill("profile")
+        supervisor.step(1.0)
+        assert supervisor.get_state() == {
+            "pid": os.getpid(),
+            "sessions": {
+                "profile": {
+                    "state": RESTARTING,
+                    "pid": None,
+                    "restarts": 0,
+                    "failures": 0,
+                    "error": "Session exited",
+                    "retry-at": 5001.0,
+                }
+            },
+        }
+
+    def test_stop(self, manager, run_dir):
+        """Supervisor.run returns when stopped, removing the state file."""
+        supervisor = Supervisor(manager, ["profile"])
+        supervisor.stop()
+        supervisor.run()
+        assert not (run_dir / STATE_FILE).exists()
+        # sessions are left running
+        assert manager.get_pid("profile") is not None
+
+    def test_stop_while_running(self, manager, run_dir):
+        """Supervisor.run returns when stopped from another thread."""
+        supervisor = Supervisor(manager, ["profile"])
+        timer = threading.Timer(0.1, supervisor.stop)
+        timer.start()
+        supervisor.run()
+        timer.join()
+        assert not (run_dir / STATE_FILE).exists()
+
+    def test_control_server(self, mocker, manager, run_dir):
+        """Requests on the control server are served in the loop."""
+        control_server = ControlServer(
+            run_dir / CONTROL_SOCKET, lambda request: {"value": "bar"}
+        )
+        supervisor = Supervisor(manager, [], control_server=control_server)
+
+        def query():
+            for _ in range(50):
+                try:
+                    response = control_request(run_dir, {"value": "foo"})
+                except ControlUnavailable:
+                    time.sleep(0.05)
+                else:
+                    break
+            supervisor.stop()
+            return response
+
+        thread = threading.Thread(target=lambda: responses.append(query()))
+        responses = []
+        thread.start()
+        supervisor.run()
+        thread.join()
+        assert responses == [{"value": "bar"}]
+        assert not (run_dir / CONTROL_SOCKET).exists()
+
+    def test_stop_wakeup_pending(self, mocker, supervisor):
+        """Supervisor.stop doesn't fail if a wakeup is pending."""
+        mocker.patch("os.write", side_effect=BlockingIOError)
+        supervisor.stop()
+        assert supervisor._stopping
+
+    def test_run_already_running(self, manager, supervisor, run_dir):
+        """Supervisor.run fails if another supervisor is running."""
+        (run_dir / STATE_FILE).write_text(json.dumps({"pid": os.getppid()}))
+        with pytest.raises(SupervisorError):
+            supervisor.run()
+
+    def test_wait_for_pids(self, mocker, manager, supervisor):
+        """Supervisor._wait_for_pids waits for pidfiles to be written."""
+        mocker.patch("time.sleep")
+        pids = iter([[], [], [1234, 1235]])
+        mocker.patch.object(manager, "get_pids", lambda name: next(pids))
+        assert supervisor._wait_for_pids("profile") == [1234, 1235]
+
+    def test_wait_for_pids_timeout(self, mocker, manager, supervisor):
+        """Supervisor._wait_for_pids returns an empty list on timeout."""
+        assert supervisor._wait_for_pids("profile", timeout=0.1) == []
+
+
+class TestReadState:
+    def test_read_state(self, manager, run_dir):
+        """The state of the running supervisor is returned."""
+        state = {"pid": os.getpid(), "sessions": {}}
+        (run_dir / STATE_FILE).write_text(json.dumps(state))
+        assert read_state(manager) == state
+
+    def test_read_state_no_file(self, manager):
+        """If the state file is missing, None is returned."""
+        assert read_state(manager) is None
+
+    @pytest.mark.parametrize("content", ["", "[]", '{"pid": "foo"}'])
+    def test_read_state_invalid(self, manager, run_dir, content):
+        """If the state file is invalid, None is returned."""
+        (run_dir / STATE_FILE).write_text(content)
+        assert read_state(manager) is None
+
+    def test_read_state_not_running(self, mocker, manager, run_dir):
+        """If the supervisor process is not running, None is returned."""
+        mocker.patch("sshoot.supervisor.process_exists", return_value=False)
+        (run_dir / STATE_FILE).write_text(json.dumps({"pid": 1234}))
+        assert read_state(manager) is None
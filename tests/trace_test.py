@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+import pytest
+
+from sshoot import trace
+
+
+@pytest.fixture
+def tracer():
+    yield trace.enable("root", start=1.0)
+    trace.disable()
+
+
+class TestSpan:
+    def test_duration(self):
+        """The duration of a span is the time between start and end."""
+        assert trace.Span("span", 1.0, end=3.5).duration == 2.5
+
+    def test_duration_running(self, mocker):
+        """The duration of a running span is up to the current time."""
+        mocker.patch.object(trace.time, "perf_counter", return_value=5.0)
+        assert trace.Span("span", 1.0).duration == 4.0
+
+
+class TestTracer:
+    def test_span(self):
+        """Spans are nested in the current span."""
+        tracer = trace.Tracer("root")
+        with tracer.span("outer", key="value") as outer:
+            with tracer.span("inner") as inner:
+                assert tracer.current() is inner
+            assert tracer.current() is outer
+        assert tracer.current() is tracer.root
+        assert tracer.root.children == [outer]
+        assert outer.children == [inner]
+        assert outer.attributes == {"key": "value"}
+        assert outer.start <= inner.start <= inner.end <= outer.end
+
+    def test_span_error(self):
+        """Spans are ended if the wrapped block raises an error."""
+        tracer = trace.Tracer("root")
+        with pytest.raises(RuntimeError):
+            with tracer.span("span") as span:
+                raise RuntimeError()
+        assert span.end is not None
+        assert tracer.current() is tracer.root
+
+    def test_span_thread(self):
+        """Spans in other threads are children of the root span."""
+        tracer = trace.Tracer("root")
+        with tracer.span("span"):
+            with ThreadPoolExecutor() as executor:
+                executor.submit(tracer.span("thread").__enter__).result()
+        assert [span.name for span in tracer.root.children] == [
+            "span",
+            "thread",
+        ]
+
+    def test_finish(self, mocker):
+        """Finishing the trace ends the root span."""
+        mocker.patch.object(trace.time, "perf_counter", return_value=5.0)
+        tracer = trace.Tracer("root", start=1.0)
+        assert tracer.finish().duration == 4.0
+        # further calls don't change the end
+        trace.time.perf_counter.return_value = 10.0
+        assert tracer.finish().duration == 4.0
+
+
+class TestTracing:
+    def test_disabled(self):
+        """When tracing is disabled, spans are not collected."""
+        with trace.span("span") as span:
+            assert span is None
+        assert trace.finish() is None
+
+    def test_enabled(self, tracer):
+        """When tracing is enabled, spans are collected in the tracer."""
+        with trace.span("span", key="value"):
+            pass
+        [span] = tracer.root.children
+        assert span.name == "span"
+        assert span.attributes == {"key": "value"}
+        assert trace.finish() is tracer.root
+
+    def test_propagate(self, tracer):
+        """Functions run in other threads can be nested in a span."""
+
+        def func(value):
+            with trace.span("func"):
+                return value * 2
+
+        with trace.span("span") as span:
+            wrapped = trace.propagate(func)
+            with ThreadPoolExecutor() as executor:
+                assert executor.submit(wrapped, 3).result() == 6
+        assert [child.name for child in span.children] == ["func"]
+
+    def test_propagate_disabled(self):
+        """When tracing is disabled, functions are not wrapped."""
+        assert trace.propagate(len) is len
+
+
+class TestFormat:
+    @pytest.fixture
+    def root(self):
+        root = trace.Span("root", 1.0, end=2.0)
+        span = trace.Span("span", 1.25, end=1.75, attributes={"key": "value"})
+        span.children.append(trace.Span("inner", 1.5, end=1.5))
+        root.children.append(span)
+        yield root
+
+    def test_format_tree(self, root):
+        """Spans are formatted as an indented tree."""
+        assert trace.format_tree(root) == (
+            "   1000.00 ms  root\n"
+            "    500.00 ms    span (key=value)\n"
+            "      0.00 ms      inner\n"
+        )
+
+    def test_format_json(self, root):
+        """Spans are formatted as JSON, with start times from the root."""
+        assert json.loads(trace.format_json(root)) == {
+            "name": "root",
+            "start": 0.0,
+            "duration": 1.0,
+            "attributes": {},
+            "children": [
+                {
+                    "name": "span",
+                    "start": 0.25,
+                    "duration": 0.5,
+                    "attributes": {"key": "value"},
+                    "children": [
+                        {
+                            "name": "inner",
+                            "start": 0.5,
+                            "duration": 0.0,
+                            "attributes": {},
+                            "children": [],
+                        }
+                    ],
+                }
+            ],
+        }